@@ -1,16 +1,24 @@
 import os
 import sys
+import signal
 import logging
 import threading
 import argparse
 import datetime
+import time
+import traceback
+import uuid
+import zipfile
 import jwt
 from functools import wraps
 from flask import Flask, send_from_directory, jsonify, request, Response, make_response
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
 from database.db import Database
-from utils.email import EmailBatchProcessor
+from utils.email import EmailBatchProcessor, import_report, save_stream, parse_cache
 from ws_server.handler import WebSocketHandler
+from ws_server.event_bus import event_bus
+from utils.auth_cache import auth_cache
 import asyncio
 import concurrent.futures
 
@@ -28,6 +36,10 @@ logger = logging.getLogger('FireMail')
 # 确保数据目录存在
 data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 os.makedirs(data_dir, exist_ok=True)
+# 上传的邮件归档在导入完成前保存在这里
+import_dir = os.path.join(data_dir, 'imports')
+# 管理员可以从这些服务器目录批量导入邮件文件，多个目录用系统路径分隔符分隔
+IMPORT_ROOTS = [os.path.realpath(p) for p in os.environ.get('IMPORT_ROOTS', import_dir).split(os.pathsep) if p]
 
 # 初始化Flask应用
 app = Flask(__name__)
@@ -48,22 +60,28 @@ def handle_options(path):
 # JWT密钥
 JWT_SECRET = os.environ.get('JWT_SECRET_KEY', 'huohuo_email_secret_key')
 
+# 批量导入接口等待导入完成的最长时间，超时后返回任务ID，导入在后台继续执行
+IMPORT_WAIT = int(os.environ.get('IMPORT_WAIT', '30'))
+
 # 打印所有环境变量，帮助调试
 print("\n========= 环境变量 =========")
 for key, value in os.environ.items():
-    if key in ['JWT_SECRET_KEY', 'HOST', 'FLASK_PORT', 'WS_PORT', 'API_URL', 'WS_URL']:
+    if key in ['JWT_SECRET_KEY', 'HOST', 'FLASK_PORT', 'WS_PORT', 'API_URL', 'WS_URL', 'EMBEDDED_WORKER', 'WORKER_PROCESSES']:
         print(f"{key}: {value}")
 print("===========================\n")
 
 # 初始化数据库
 db = Database()
+# 其他进程删除用户或修改密码时，本进程的认证缓存在读取间隔内失效
+auth_cache.watch(lambda: db.get_change_counter('auth'))
 
 # 确保注册功能默认开启，只通过数据库控制
 allow_register = db.is_registration_allowed()
 logger.info(f"系统启动: 注册功能状态 = {allow_register}")
 
-# 初始化邮件处理器
+# 初始化邮件处理器，检查进度和新邮件通知通过事件总线推送到WebSocket
 email_processor = EmailBatchProcessor(db)
+email_processor.set_event_bus(event_bus)
 
 # 初始化WebSocket处理器
 ws_handler = WebSocketHandler()
@@ -87,8 +105,9 @@ def token_required(f):
             return jsonify({'error': '未认证，请先登录'}), 401
 
         try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            current_user = db.get_user_by_id(data['user_id'])
+            # 解码结果和用户信息都有缓存，用户变更时由数据库层失效
+            data = auth_cache.decode_token(token, JWT_SECRET)
+            current_user = auth_cache.get_user(data['user_id'], db.get_user_by_id)
             if not current_user:
                 return jsonify({'error': '无效的用户令牌'}), 401
         except jwt.ExpiredSignatureError:
@@ -114,6 +133,27 @@ def admin_required(f):
 
     return decorated
 
+def conditional_json(scope, build):
+    """按作用域的变更计数生成弱ETag，客户端缓存未过期时返回304而不读取数据
+
+    Args:
+        scope: 变更计数的作用域，见Database.get_change_counter
+        build: 生成响应数据的函数，只在需要返回完整数据时调用
+    """
+    version = db.get_change_counter(scope)
+    if version is None:
+        return jsonify(build())
+
+    etag = f"{scope}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify(build()))
+    response.set_etag(etag, weak=True)
+    # 每次使用前都向服务器验证，内容未变化时只返回304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # 认证相关API
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -402,11 +442,14 @@ def get_all_emails(current_user):
     """获取当前用户的所有邮箱"""
     # 普通用户只能获取自己的邮箱，管理员可以获取所有邮箱
     if current_user['is_admin']:
-        emails = db.get_all_emails()
+        scope, user_id = 'emails', None
     else:
-        emails = db.get_all_emails(current_user['id'])
+        scope, user_id = f"user:{current_user['id']}", current_user['id']
 
-    return jsonify([dict(email) for email in emails])
+    return conditional_json(
+        scope,
+        lambda: [dict(email) for email in db.get_all_emails(user_id)]
+    )
 
 @app.route('/api/emails', methods=['POST'])
 @token_required
@@ -524,23 +567,12 @@ def check_email(current_user, email_id):
                 'status': 'processing'
             }), 409
 
-        # 创建进度回调
+        # 创建进度回调，WebSocket推送由邮件处理器通过事件总线完成
         def progress_callback(progress, message):
             logger.info(f"邮箱 ID {email_id} 处理进度: {progress}%, 消息: {message}")
-            # 通过WebSocket发送进度更新
-            try:
-                # 使用日志记录进度，不尝试调用异步方法
-                logger.info(f"向用户 {current_user['id']} 发送邮箱检查进度: {progress}%, {message}")
-                # 这里应使用同步方式发送消息，但WSHandler.broadcast_to_user是异步方法
-            except Exception as e:
-                logger.error(f"发送进度更新失败: {str(e)}")
-
-        # 提交任务到线程池
-        future = email_processor.manual_thread_pool.submit(
-            email_processor._check_email_task,
-            email_info,
-            progress_callback
-        )
+
+        # 提交任务到持久化队列
+        future = email_processor.submit_check(email_info, progress_callback)
 
         # 等待任务完成
         result = future.result(timeout=300)  # 设置超时时间为5分钟
@@ -564,6 +596,41 @@ def check_email(current_user, email_id):
             'message': f'检查邮箱失败: {str(e)}'
         }), 500
 
+@app.route('/api/emails/<int:email_id>/search', methods=['POST'])
+@token_required
+def search_email(current_user, email_id):
+    """在邮件服务器上定向搜索指定发件人或主题的邮件，只拉取最新的匹配邮件并保存
+
+    请求体: sender、subject（服务器端子串匹配）、since（ISO格式时间，只搜索这个日期之后的邮件）、
+    limit（最多拉取的邮件数，默认10，最大50）。作为后台任务执行，返回202和任务ID，
+    结果通过 /api/jobs/<job_id> 查询。
+    """
+    email_info = db.get_email_by_id(email_id, None if current_user['is_admin'] else current_user['id'])
+    if not email_info:
+        return jsonify({'error': f'邮箱 ID {email_id} 不存在或您没有权限'}), 404
+
+    data = request.json or {}
+    for key in ('sender', 'subject', 'since'):
+        if data.get(key) is not None and not isinstance(data[key], str):
+            return jsonify({'error': f'{key}必须是字符串'}), 400
+    if not data.get('sender') and not data.get('subject'):
+        return jsonify({'error': 'sender和subject至少提供一个'}), 400
+    if data.get('since'):
+        try:
+            datetime.datetime.fromisoformat(data['since'].replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({'error': 'since必须是ISO格式的时间'}), 400
+    limit = data.get('limit', 10)
+    if not isinstance(limit, int) or limit < 1:
+        return jsonify({'error': 'limit必须是正整数'}), 400
+
+    job_id = email_processor.enqueue_search(
+        email_info, data.get('sender'), data.get('subject'), data.get('since'), min(limit, 50)
+    )
+    if job_id is None:
+        return jsonify({'error': '创建搜索任务失败'}), 500
+    return jsonify({'success': True, 'message': '正在服务器上搜索邮件', 'job_id': job_id}), 202
+
 @app.route('/api/emails/batch_check', methods=['POST'])
 @token_required
 def batch_check_emails(current_user):
@@ -637,8 +704,70 @@ def get_mail_records(current_user, email_id):
     if not email_info:
         return jsonify({'error': f'邮箱 ID {email_id} 不存在或您没有权限'}), 404
 
-    mail_records = db.get_mail_records(email_id)
-    return jsonify([dict(record) for record in mail_records])
+    return conditional_json(
+        f"mailbox:{email_id}",
+        lambda: [dict(record) for record in db.get_mail_records(email_id)]
+    )
+
+@app.route('/api/emails/<int:email_id>/codes', methods=['GET'])
+@token_required
+def get_mail_codes(current_user, email_id):
+    """查询邮箱最新的验证码或操作链接
+
+    查询参数: kind（code或link，默认code）、since（Unix时间戳或ISO时间）、
+    sender（发件人地址或 @域名）、limit（默认1，最大50）
+    """
+    email_info = db.get_email_by_id(email_id, None if current_user['is_admin'] else current_user['id'])
+    if not email_info:
+        return jsonify({'error': f'邮箱 ID {email_id} 不存在或您没有权限'}), 404
+
+    kind = request.args.get('kind', 'code')
+    if kind not in ('code', 'link'):
+        return jsonify({'error': 'kind必须是code或link'}), 400
+    since = request.args.get('since')
+    if since:
+        try:
+            since = float(since)
+        except ValueError:
+            try:
+                since = datetime.datetime.fromisoformat(since).timestamp()
+            except ValueError:
+                return jsonify({'error': 'since必须是Unix时间戳或ISO格式的时间'}), 400
+    else:
+        since = None
+    limit = request.args.get('limit', 1, type=int)
+    if not limit or limit < 1:
+        return jsonify({'error': 'limit必须是正整数'}), 400
+    sender = request.args.get('sender')
+
+    return conditional_json(
+        f"mailbox:{email_id}",
+        lambda: {'email_id': email_id, 'codes': db.get_mail_codes(email_id, kind, since, sender, min(limit, 50))}
+    )
+
+@app.route('/api/emails/<int:email_id>/wait', methods=['GET'])
+@token_required
+def wait_for_mail(current_user, email_id):
+    """等待邮箱收到匹配的新邮件（长轮询）
+
+    查询参数: sender、subject（不区分大小写的子串）、timeout（秒，默认30，最大300）、
+    since（Unix时间戳，先查找这个时间之后已保存的邮件）。
+    ASGI模式下由asgi.py在事件循环中直接处理，这里只在开发服务器中使用，等待期间占用一个请求线程。
+    """
+    email_info = db.get_email_by_id(email_id, None if current_user['is_admin'] else current_user['id'])
+    if not email_info:
+        return jsonify({'error': f'邮箱 ID {email_id} 不存在或您没有权限'}), 404
+    params, error = ws_handler.mail_waiters.parse_params(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        mail = ws_handler.mail_waiters.wait_threadsafe(dict(email_info), **params)
+    except (OverflowError, RuntimeError) as e:
+        return jsonify({'error': str(e)}), 503
+    if mail is None:
+        return jsonify({'matched': False, 'email_id': email_id})
+    return jsonify({'matched': True, 'email_id': email_id, 'mail': mail})
 
 @app.route('/api/mail_records/<int:mail_id>/attachments', methods=['GET'])
 @token_required
@@ -698,35 +827,97 @@ def download_attachment(current_user, attachment_id):
         logger.error(f"下载附件失败: {str(e)}")
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
 
+@app.route('/api/mail_records/<int:mail_id>/source', methods=['GET'])
+@token_required
+def get_mail_source(current_user, mail_id):
+    """查看邮件的原始内容，download=1时作为.eml文件下载"""
+    try:
+        mail_record = db.get_mail_record_by_id(mail_id)
+        if not mail_record:
+            return jsonify({'error': '邮件不存在'}), 404
+
+        email_info = db.get_email_by_id(mail_record['email_id'], None if current_user['is_admin'] else current_user['id'])
+        if not email_info:
+            return jsonify({'error': '无权访问此邮件'}), 403
+
+        raw = db.get_raw_message(mail_id)
+        if raw is None:
+            return jsonify({'error': '没有保存此邮件的原始内容'}), 404
+
+        response = make_response(raw)
+        if request.args.get('download') in ('1', 'true'):
+            response.headers['Content-Type'] = 'message/rfc822'
+            response.headers['Content-Disposition'] = f'attachment; filename="mail-{mail_id}.eml"'
+        else:
+            # 原始内容的编码不确定，按纯文本显示，不让浏览器解释其中的HTML
+            response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+            response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+    except Exception as e:
+        logger.error(f"获取邮件原始内容失败: {str(e)}")
+        return jsonify({'error': f'服务器错误: {str(e)}'}), 500
+
 @app.route('/api/emails/<int:email_id>/upload_email_file', methods=['POST'])
 @token_required
 def upload_email_file(current_user, email_id):
-    """上传邮件文件并解析"""
+    """上传邮件文件并解析
+
+    .mbox归档和.zip压缩包按块写入磁盘后作为后台任务导入，返回202和任务ID；其他格式为单封邮件，直接解析保存。
+    zip中的 .eml/.emlx/.txt/.msg 文件由多个进程并行解析。
+    大文件可以不使用表单，直接以请求体上传（Content-Type: application/octet-stream），文件名放在filename参数中。
+    """
     try:
         # 验证用户是否有权限操作该邮箱
         email_info = db.get_email_by_id(email_id, None if current_user['is_admin'] else current_user['id'])
         if not email_info:
             return jsonify({'error': f'邮箱 ID {email_id} 不存在或您没有权限'}), 404
 
-        # 检查是否有文件上传
-        if 'file' not in request.files:
-            return jsonify({'error': '没有上传文件'}), 400
+        if request.mimetype == 'multipart/form-data':
+            # 检查是否有文件上传
+            if 'file' not in request.files:
+                return jsonify({'error': '没有上传文件'}), 400
+            file = request.files['file']
+            filename, stream = file.filename, file.stream
+        else:
+            filename, stream = request.args.get('filename', ''), request.stream
 
-        file = request.files['file']
-        if file.filename == '':
+        if not filename:
             return jsonify({'error': '没有选择文件'}), 400
 
         # 检查文件扩展名
-        allowed_extensions = ['.eml', '.txt', '.msg', '.mbox', '.emlx']
-        file_ext = os.path.splitext(file.filename)[1].lower()
+        allowed_extensions = ['.eml', '.txt', '.msg', '.mbox', '.emlx', '.zip']
+        file_ext = os.path.splitext(filename)[1].lower()
         if file_ext not in allowed_extensions:
             return jsonify({'error': f'不支持的文件格式，仅支持 {", ".join(allowed_extensions)}'}), 400
 
+        if file_ext in ('.mbox', '.zip'):
+            # 归档保存在数据目录中，进程重启后导入任务仍能从断点继续
+            os.makedirs(import_dir, exist_ok=True)
+            archive_path = os.path.join(import_dir, f"{uuid.uuid4().hex}{file_ext}")
+            size = save_stream(stream, archive_path)
+            if file_ext == '.mbox':
+                job_id = email_processor.enqueue_mbox_import(current_user['id'], email_id, archive_path, filename)
+            elif not zipfile.is_zipfile(archive_path):
+                os.remove(archive_path)
+                return jsonify({'error': '无效的zip文件'}), 400
+            else:
+                job_id = email_processor.enqueue_archive_import(current_user['id'], email_id, 'zip', archive_path, filename)
+            if job_id is None:
+                os.remove(archive_path)
+                return jsonify({'error': '创建导入任务失败'}), 500
+            logger.info(f"邮箱 ID {email_id} 上传归档 {filename} ({size} 字节)，导入任务 {job_id}")
+            return jsonify({
+                'success': True,
+                'message': '邮件归档已上传，正在后台导入',
+                'job_id': job_id,
+                'size': size
+            }), 202
+
         # 保存文件到临时目录
         temp_dir = os.path.join(os.getcwd(), 'temp')
         os.makedirs(temp_dir, exist_ok=True)
-        temp_file_path = os.path.join(temp_dir, f"{int(time.time())}_{file.filename}")
-        file.save(temp_file_path)
+        temp_file_path = os.path.join(temp_dir, f"{int(time.time())}_{secure_filename(filename) or 'upload' + file_ext}")
+        save_stream(stream, temp_file_path)
 
         try:
             # 导入邮件处理模块
@@ -744,9 +935,10 @@ def upload_email_file(current_user, email_id):
                 subject=mail_record.get('subject', '(无主题)'),
                 sender=mail_record.get('sender', '(未知发件人)'),
                 content=mail_record.get('content', '(无内容)'),
-                received_time=mail_record.get('received_time', datetime.now()),
+                received_time=mail_record.get('received_time', datetime.datetime.now()),
                 folder='IMPORTED',
-                has_attachments=1 if mail_record.get('has_attachments', False) else 0
+                has_attachments=1 if mail_record.get('has_attachments', False) else 0,
+                raw=mail_record.get('raw')
             )
 
             if success and mail_id and mail_record.get('has_attachments', False):
@@ -780,70 +972,140 @@ def upload_email_file(current_user, email_id):
         traceback.print_exc()
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
 
+@app.route('/api/emails/<int:email_id>/import_directory', methods=['POST'])
+@token_required
+@admin_required
+def import_email_directory(current_user, email_id):
+    """从服务器目录批量导入邮件文件，目录必须位于IMPORT_ROOTS中
+
+    目录中的 .eml/.emlx/.txt/.msg 文件（包括子目录）由多个进程并行解析，作为后台任务导入，返回202和任务ID。
+    """
+    try:
+        if not db.get_email_by_id(email_id):
+            return jsonify({'error': f'邮箱 ID {email_id} 不存在'}), 404
+
+        path = (request.json or {}).get('path')
+        if not path:
+            return jsonify({'error': '请提供目录路径'}), 400
+
+        directory = os.path.realpath(path)
+        if not any(os.path.commonpath([directory, root]) == root for root in IMPORT_ROOTS):
+            return jsonify({'error': '该目录不在允许导入的目录中'}), 403
+        if not os.path.isdir(directory):
+            return jsonify({'error': '目录不存在'}), 404
+
+        job_id = email_processor.enqueue_archive_import(current_user['id'], email_id, 'dir', directory)
+        if job_id is None:
+            return jsonify({'error': '创建导入任务失败'}), 500
+        logger.info(f"邮箱 ID {email_id} 从目录 {directory} 导入邮件文件，导入任务 {job_id}")
+        return jsonify({
+            'success': True,
+            'message': '正在后台导入目录中的邮件文件',
+            'job_id': job_id
+        }), 202
+    except Exception as e:
+        logger.error(f"从目录导入邮件文件失败: {str(e)}")
+        return jsonify({'error': f'服务器错误: {str(e)}'}), 500
+
+@app.route('/api/admin/reparse', methods=['POST'])
+@token_required
+@admin_required
+def reparse_mail_records(current_user):
+    """用当前的解析器重新解析已保存原始内容的邮件，更新邮件记录和附件
+
+    可以按邮箱（email_ids）、文件夹（folder）和接收时间（since、until）筛选，都不提供时重新解析所有邮件。
+    作为后台任务执行，返回202和任务ID。
+    """
+    data = request.json or {}
+    filters = {}
+    email_ids = data.get('email_ids')
+    if email_ids is not None:
+        if not isinstance(email_ids, list) or not all(isinstance(i, int) for i in email_ids):
+            return jsonify({'error': 'email_ids必须是整数列表'}), 400
+        filters['email_ids'] = email_ids
+    for key in ('folder', 'since', 'until'):
+        value = data.get(key)
+        if value is not None:
+            if not isinstance(value, str):
+                return jsonify({'error': f'{key}必须是字符串'}), 400
+            filters[key] = value
+
+    if db.raw_store is None:
+        return jsonify({'error': '未开启原始邮件存储（RAW_ARCHIVE）'}), 400
+
+    job_id = email_processor.enqueue_reparse(current_user['id'], filters)
+    if job_id is None:
+        return jsonify({'error': '创建重新解析任务失败'}), 500
+    logger.info(f"管理员 {current_user['username']} 创建重新解析任务 {job_id}，筛选条件: {filters}")
+    return jsonify({
+        'success': True,
+        'message': '正在后台重新解析邮件',
+        'job_id': job_id,
+        'total': db.count_raw_messages(filters)
+    }), 202
+
 @app.route('/api/emails/import', methods=['POST'])
 @token_required
 def import_emails(current_user):
-    """批量导入邮箱"""
+    """批量导入邮箱
+
+    导入在后台任务中执行：解析校验后一次性写入，可选先测试账号凭据（verify）。
+    在IMPORT_WAIT秒内完成时直接返回导入结果，否则返回202和任务ID，
+    可通过 /api/jobs/<job_id> 查询，WebSocket客户端会收到import_progress和import_result消息。
+    """
     data = request.json.get('data')
     mail_type = request.json.get('mail_type', 'outlook')
+    verify = bool(request.json.get('verify', False))
+    concurrency = request.json.get('concurrency')
 
     if not data:
         return jsonify({'error': '导入数据不能为空'}), 400
+    if mail_type not in email_processor.handlers:
+        return jsonify({'error': f'不支持的邮箱类型: {mail_type}'}), 400
+    if concurrency is not None and not isinstance(concurrency, int):
+        return jsonify({'error': 'concurrency必须是整数'}), 400
 
-    # 解析导入的数据
-    lines = data.strip().split('\n')
-    total = len(lines)
-    success_count = 0
-    failed_details = []
+    future = email_processor.submit_import(current_user['id'], data, mail_type, verify, concurrency)
+    job_id = getattr(future, 'job_id', None)
+    if job_id is None:
+        return jsonify({'error': '创建导入任务失败'}), 500
 
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if not line:
-            continue
+    try:
+        result = future.result(timeout=IMPORT_WAIT)
+    except concurrent.futures.TimeoutError:
+        return jsonify({
+            'job_id': job_id,
+            'status': 'running',
+            'message': '导入任务正在后台执行'
+        }), 202
 
-        try:
-            parts = line.split('----')
-            if len(parts) != 4:
-                failed_details.append({
-                    'line': i + 1,
-                    'content': line,
-                    'reason': '格式错误，需要4个字段'
-                })
-                continue
-
-            email, password, client_id, refresh_token = parts
-            if not all([email, password, client_id, refresh_token]):
-                failed_details.append({
-                    'line': i + 1,
-                    'content': line,
-                    'reason': '有空白字段'
-                })
-                continue
-
-            success = db.add_email(current_user['id'], email, password, client_id, refresh_token, mail_type)
-            if success:
-                success_count += 1
-            else:
-                failed_details.append({
-                    'line': i + 1,
-                    'content': line,
-                    'reason': '邮箱地址已存在'
-                })
-        except Exception as e:
-            logger.error(f"导入邮箱出错: {str(e)}")
-            failed_details.append({
-                'line': i + 1,
-                'content': line,
-                'reason': f'导入异常: {str(e)}'
-            })
+    report = import_report(result, job_id)
+    if 'error' in report:
+        return jsonify(report), 500
+    return jsonify(report)
 
-    # 返回导入结果
-    return jsonify({
-        'total': total,
-        'success': success_count,
-        'failed': len(failed_details),
-        'failed_details': failed_details
-    })
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@token_required
+def get_job_status(current_user, job_id):
+    """查询后台任务的状态和进度，导入任务结束后包含导入结果"""
+    job = db.get_job(job_id)
+    if not job or (job['user_id'] != current_user['id'] and not current_user['is_admin']):
+        return jsonify({'error': '任务不存在'}), 404
+
+    response = {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'] or 0,
+        'message': job['message'],
+        'error': job['error']
+    }
+    if job['status'] in ('done', 'failed', 'cancelled'):
+        if job['kind'] == 'import':
+            response['result'] = import_report(job.get('result'))
+        elif job['kind'] in ('mbox_import', 'archive_import', 'reparse', 'search'):
+            response['result'] = job.get('result')
+    return jsonify(response)
 
 # 系统配置管理
 @app.route('/api/admin/config/registration', methods=['POST'])
@@ -861,6 +1123,30 @@ def toggle_registration(current_user):
     else:
         return jsonify({'error': '更新注册配置失败'}), 500
 
+@app.route('/api/admin/ws_stats', methods=['GET'])
+@token_required
+@admin_required
+def get_ws_stats(current_user):
+    """获取WebSocket服务器运行统计（连接数、事件循环延迟、事件总线计数）"""
+    return jsonify(ws_handler.get_stats())
+
+@app.route('/api/admin/check_stats', methods=['GET'])
+@token_required
+@admin_required
+def get_check_stats(current_user):
+    """获取本进程实时检查STATUS预检的统计，skip_ratio为邮箱没有变化而跳过同步的比例"""
+    checker = email_processor.status_checker
+    if checker is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(checker.get_stats(), enabled=True))
+
+@app.route('/api/admin/cache_stats', methods=['GET'])
+@token_required
+@admin_required
+def get_cache_stats(current_user):
+    """获取认证缓存和邮件解析缓存的命中统计"""
+    return jsonify({'auth': auth_cache.get_stats(), 'parse': parse_cache.get_stats()})
+
 # 前端静态文件服务
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -1132,6 +1418,9 @@ def parse_args():
     parser.add_argument('--port', type=int, default=5000, help='HTTP端口')
     parser.add_argument('--ws-port', type=int, default=8765, help='WebSocket端口')
     parser.add_argument('--debug', action='store_true', help='启用调试模式')
+    parser.add_argument('--no-worker', action='store_true',
+                        default=os.environ.get('EMBEDDED_WORKER', 'true').lower() in ('0', 'false', 'no'),
+                        help='不在API进程内执行检查任务，只负责入队，由独立的worker.py执行')
     return parser.parse_args()
 
 def start_websocket_server():
@@ -1143,7 +1432,13 @@ def start_websocket_server():
         logger.error(f"WebSocket服务器异常: {e}")
         sys.exit(1)
 
+def handle_sigterm(signum, frame):
+    """收到SIGTERM时按正常退出流程处理，确保执行清理逻辑"""
+    logger.info("收到终止信号，正在关闭...")
+    sys.exit(0)
+
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
     try:
         args = parse_args()
 
@@ -1155,6 +1450,12 @@ if __name__ == '__main__':
         ws_thread.daemon = True
         ws_thread.start()
 
+        # 启动任务调度，恢复上次未完成的任务；使用独立worker时API进程只负责入队
+        if args.no_worker:
+            logger.info("已禁用内置worker，检查任务由独立的worker进程执行")
+        else:
+            email_processor.start()
+
         # 启动实时邮件检查
         email_processor.start_real_time_check(check_interval=60)
         logger.info("实时邮件检查已启动")
@@ -1167,7 +1468,8 @@ if __name__ == '__main__':
     except Exception as e:
         logger.error(f"程序启动异常: {e}")
     finally:
-        # 清理资源
+        # 清理资源，等待正在执行的任务完成，未完成的任务留在队列中
+        email_processor.shutdown(drain=True, timeout=30)
         if db:
             db.close()
         logger.info("程序已关闭")
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+ASGI入口，生产环境使用
+在同一个端口上提供 /api/* REST接口和 /ws WebSocket服务，可以用多个worker进程运行:
+
+    uvicorn asgi:application --app-dir backend --host 0.0.0.0 --port 5000 --workers 4
+
+- HTTP请求交给Flask应用，视图在每个进程的线程池（ASGI_THREADS个线程）中并发执行，
+  手动检查等需要等待结果的请求只占用一个线程；每个线程使用自己的SQLite连接，只读到已提交的数据，
+  进程内的写操作由Database.lock串行化
+- WebSocket连接由ASGI服务器的事件循环处理，不再单独启动线程和端口
+- 等待新邮件的长轮询请求 GET /api/emails/<id>/wait 在事件循环中直接处理，
+  等待期间不占用Flask的线程，一个进程可以同时挂起数千个请求
+- 每个进程都会领取检查任务（邮箱租约保证不重复执行），实时检查调度通过数据库租约选出一个进程运行
+- 其他进程执行的任务进度通过job_queue表转发给连接在本进程上的客户端
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+from app import app, db, email_processor, ws_handler
+from ws_server.asgi_adapter import ASGIWebSocket, ThreadPoolWsgiToAsgi
+
+logger = logging.getLogger('FireMail')
+
+# 是否在本进程内执行检查任务，与app.py --no-worker一致
+EMBEDDED_WORKER = os.environ.get('EMBEDDED_WORKER', 'true').lower() not in ('0', 'false', 'no')
+# 实时检查间隔，单位为秒
+REALTIME_CHECK_INTERVAL = int(os.environ.get('REALTIME_CHECK_INTERVAL', '60'))
+# 每个进程执行Flask视图的线程数
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '32'))
+
+http_app = ThreadPoolWsgiToAsgi(app, max_workers=ASGI_THREADS)
+
+WAIT_PATH = re.compile(r'^/api/emails/(\d+)/wait/?$')
+
+
+async def startup():
+    """进程启动时启动WebSocket后台协程、任务调度和实时检查"""
+    ws_handler.start_services(asyncio.get_running_loop())
+    if EMBEDDED_WORKER:
+        email_processor.start()
+    else:
+        logger.info("已禁用内置worker，检查任务由独立的worker进程执行")
+    email_processor.start_real_time_check(check_interval=REALTIME_CHECK_INTERVAL)
+    logger.info(f"ASGI进程已启动 (pid={os.getpid()})")
+
+
+async def shutdown():
+    """进程退出时等待正在执行的任务完成，未完成的任务留在队列中"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lambda: email_processor.shutdown(drain=True, timeout=30))
+    ws_handler.stop_services()
+    http_app.shutdown()
+    db.close()
+    logger.info(f"ASGI进程已关闭 (pid={os.getpid()})")
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+                await send({'type': 'lifespan.startup.complete'})
+            except Exception as e:
+                logger.error(f"ASGI进程启动失败: {str(e)}")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+        elif message['type'] == 'lifespan.shutdown':
+            try:
+                await shutdown()
+            finally:
+                await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def websocket(scope, receive, send):
+    """把 /ws 路径的连接交给WebSocketHandler"""
+    if scope.get('path', '').rstrip('/') != '/ws':
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    connection = ASGIWebSocket(scope, receive, send)
+    if await connection.accept():
+        await ws_handler.websocket_server(connection, connection.path)
+
+
+async def send_json(send, status, data):
+    body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def request_token(scope):
+    """从Authorization请求头或Cookie中读取令牌，与app.token_required一致"""
+    headers = dict(scope.get('headers') or [])
+    auth_header = headers.get(b'authorization', b'').decode('latin-1')
+    if auth_header:
+        return auth_header[7:] if auth_header.startswith('Bearer ') else None
+    cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+    return cookie['token'].value if 'token' in cookie else None
+
+
+async def wait_for_mail(scope, receive, send, email_id):
+    """等待新邮件，参数和返回值与app.wait_for_mail相同；客户端断开连接时取消等待"""
+    user_id = await ws_handler.validate_token(request_token(scope))
+    user = await ws_handler.get_user(user_id) if user_id else None
+    if not user:
+        await send_json(send, 401, {'error': '无效的令牌'})
+        return
+    email_info = await ws_handler.adb.get_email_by_id(email_id, None if user['is_admin'] else user['id'])
+    if not email_info:
+        await send_json(send, 404, {'error': f'邮箱 ID {email_id} 不存在或您没有权限'})
+        return
+    params, error = ws_handler.mail_waiters.parse_params(
+        dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+    )
+    if error:
+        await send_json(send, 400, {'error': error})
+        return
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    waiting = asyncio.ensure_future(ws_handler.mail_waiters.wait(dict(email_info), **params))
+    watching = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({waiting, watching}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watching.cancel()
+        if not waiting.done():
+            # 客户端已断开，取消等待后不再发送响应
+            waiting.cancel()
+            return
+
+    try:
+        mail = waiting.result()
+    except OverflowError as e:
+        await send_json(send, 503, {'error': str(e)})
+        return
+    if mail is None:
+        await send_json(send, 200, {'matched': False, 'email_id': email_id})
+    else:
+        await send_json(send, 200, {'matched': True, 'email_id': email_id, 'mail': mail})
+
+
+async def application(scope, receive, send):
+    """ASGI应用"""
+    if scope['type'] == 'http':
+        match = WAIT_PATH.match(scope.get('path', ''))
+        if match and scope.get('method') == 'GET':
+            await wait_for_mail(scope, receive, send, int(match.group(1)))
+        else:
+            await http_app(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        await websocket(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
@@ -4,14 +4,84 @@ import threading
 import logging
 import hashlib
 import secrets
+import json
+import time
 from typing import List, Dict, Optional, Callable
 from datetime import datetime
+from email.utils import parseaddr
 import traceback
 from utils.email.logger import logger, log_progress
+from utils.auth_cache import auth_cache
+from utils.raw_store import RawMessageStore
+from utils.email._code_extractor import code_extractor
 
 # 配置日志
 logger = logging.getLogger('database')
 
+# 是否保存邮件的原始内容，用于查看源码和重新解析
+RAW_ARCHIVE = os.environ.get('RAW_ARCHIVE', 'true').lower() not in ('0', 'false', 'no')
+
+# 增量同步的邮箱字段，只有这些字段的值变化时才写入变更日志；
+# 检查时间、访问令牌和失败计数每次检查都会更新，不触发增量同步
+EMAIL_SYNC_COLUMNS = ('user_id', 'email', 'password', 'mail_type', 'server', 'port', 'use_ssl',
+                      'client_id', 'refresh_token', 'enable_realtime_check', 'circuit_state')
+EMAIL_CHANGED = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in EMAIL_SYNC_COLUMNS)
+
+# 邮箱列表（GET /api/emails）展示的字段，变化时增加变更计数，使列表的ETag失效；
+# 只有访问令牌（及随之更新的updated_at）的变化不影响列表
+EMAIL_LISTED_COLUMNS = EMAIL_SYNC_COLUMNS + ('last_check_time', 'consecutive_failures', 'last_error',
+                                             'last_failure_at', 'circuit_open_until')
+EMAIL_LISTED_CHANGED = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in EMAIL_LISTED_COLUMNS)
+
+
+def _timestamp(value):
+    """把接收时间转换为Unix时间戳，不带时区的时间按本地时间处理，无法解析时使用当前时间"""
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if isinstance(value, datetime):
+            return value.timestamp()
+    except (ValueError, OverflowError, OSError):
+        pass
+    return time.time()
+
+
+class WriteLock:
+    """串行化本进程内写操作的可重入锁
+
+    每个线程使用自己的连接，写操作出错又没有回滚时，该连接会一直持有数据库的写锁。
+    退出最外层的锁时，如果当前线程的连接还有进入锁之后开始的未结束事务，自动回滚。
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def __enter__(self):
+        self._lock.acquire()
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            conn = self.db.conn
+            self._local.outer_transaction = conn is not None and conn.in_transaction
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._local.depth -= 1
+            if self._local.depth == 0 and not self._local.outer_transaction:
+                conn = self.db.conn
+                if conn is not None and conn.in_transaction:
+                    logger.warning("写操作结束时事务未提交，已回滚")
+                    conn.rollback()
+        except Exception as e:
+            logger.error(f"回滚未结束的事务失败: {str(e)}")
+        finally:
+            self._lock.release()
+        return False
+
+
 class Database:
     _instance = None
     _lock = threading.Lock()
@@ -20,7 +90,9 @@ class Database:
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super(Database, cls).__new__(cls)
-                cls._instance.conn = None
+                cls._instance.db_path = None
+                # 串行化本进程内的写操作（"执行+提交"的组合），减少多个连接之间的写锁等待
+                cls._instance.lock = WriteLock(cls._instance)
 
                 # 检查数据库文件是否存在
                 db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'huohuo_email.db')
@@ -54,6 +126,9 @@ class Database:
                     cls._instance.connect_db(db_path)
                     cls._instance.init_db()
 
+                # 已有数据库不会执行init_db，这里补齐后续版本新增的表结构
+                cls._instance.upgrade_db()
+
                 return cls._instance
             return cls._instance
 
@@ -64,10 +139,55 @@ class Database:
 
         # 保存数据库路径
         self.db_path = db_path
+        # 原始邮件段文件与数据库放在同一目录下
+        self.raw_store = RawMessageStore(os.path.join(os.path.dirname(db_path), 'raw')) if RAW_ARCHIVE else None
 
         logger.info(f"连接数据库: {db_path}")
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+        self._local = threading.local()
+        self._connections = {}  # 线程 -> 连接
+        self._connections_lock = threading.Lock()
+        try:
+            # WAL模式下读写互不阻塞，适合多进程、多连接并发访问；该设置保存在数据库文件中
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        except Exception as e:
+            logger.warning(f"设置数据库WAL模式失败: {str(e)}")
+
+    @property
+    def conn(self):
+        """当前线程的数据库连接，第一次使用时建立，未连接或已关闭时为None
+
+        每个线程使用自己的连接，只能读到其他线程已经提交的数据，
+        不会读到另一个线程执行到一半、之后可能回滚的事务。
+        """
+        if getattr(self, 'db_path', None) is None:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+        return conn
+
+    def _open_connection(self):
+        """为当前线程建立连接，同时关闭已退出线程的连接"""
+        # 多个进程（API进程和独立worker）共享同一个数据库文件，写锁冲突时等待而不是立即报错；
+        # 连接只在建立它的线程中使用，关闭时可能在其他线程，所以不检查线程
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA busy_timeout=30000")
+        except Exception as e:
+            logger.warning(f"设置数据库忙等待时间失败: {str(e)}")
+
+        with self._connections_lock:
+            stale = [thread for thread in self._connections if not thread.is_alive()]
+            closed = [self._connections.pop(thread) for thread in stale]
+            self._connections[threading.current_thread()] = conn
+        for old in closed:
+            try:
+                old.close()
+            except Exception:
+                pass
+        return conn
 
     def init_db(self):
         """初始化数据库连接和表结构"""
@@ -165,6 +285,243 @@ class Database:
             logger.error(f"初始化数据库表结构失败: {str(e)}")
             traceback.print_exc()
 
+    def upgrade_db(self):
+        """升级数据库结构，新增的表和索引在这里创建，对已有数据库同样生效"""
+        try:
+            # 持久化任务队列表
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    user_id INTEGER,
+                    email_id INTEGER,
+                    payload TEXT,
+                    priority INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'queued',
+                    attempts INTEGER DEFAULT 0,
+                    max_attempts INTEGER DEFAULT 3,
+                    lease_owner TEXT,
+                    lease_token TEXT,
+                    lease_expires_at REAL,
+                    heartbeat_at REAL,
+                    available_at REAL DEFAULT 0,
+                    progress INTEGER DEFAULT 0,
+                    message TEXT,
+                    checkpoint TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL,
+                    updated_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_job_queue_claim ON job_queue (status, priority, available_at)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_job_queue_lease ON job_queue (status, lease_expires_at)"
+            )
+            # 同一邮箱同一类型、相同去重键的未完成任务只允许一个；
+            # 去重键默认为空，定向搜索使用搜索条件的摘要，条件不同的搜索各自入队
+            self._check_and_add_column('job_queue', 'dedupe_key', "TEXT NOT NULL DEFAULT ''")
+            self.conn.execute("DROP INDEX IF EXISTS idx_job_queue_active_email")
+            self.conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_job_queue_active_key
+                ON job_queue (kind, email_id, dedupe_key)
+                WHERE email_id IS NOT NULL AND status IN ('queued', 'running')
+            ''')
+
+            # 运行中的任务被请求取消时置1，执行该任务的进程在心跳时发现并中断任务
+            self._check_and_add_column('job_queue', 'cancel_requested', 'INTEGER DEFAULT 0')
+
+            # 邮箱失败统计和熔断状态
+            self._check_and_add_column('emails', 'consecutive_failures', 'INTEGER DEFAULT 0')
+            self._check_and_add_column('emails', 'circuit_state', "TEXT DEFAULT 'closed'")
+            self._check_and_add_column('emails', 'circuit_open_until', 'REAL')
+            self._check_and_add_column('emails', 'last_error', 'TEXT')
+            self._check_and_add_column('emails', 'last_failure_at', 'REAL')
+
+            # 邮箱租约表，保证同一邮箱同一时间只被一个worker处理
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS account_leases (
+                    email_id INTEGER PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    job_id INTEGER,
+                    acquired_at REAL,
+                    expires_at REAL
+                )
+            ''')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_account_leases_owner ON account_leases (owner)"
+            )
+
+            # 调度领导租约表，多进程部署时只有持有租约的进程运行实时检查调度
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS leader_leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    acquired_at REAL,
+                    expires_at REAL
+                )
+            ''')
+
+            # 结束任务的进程，用于把其他进程执行的任务进度转发给本进程的WebSocket客户端
+            self._check_and_add_column('job_queue', 'finished_by', 'TEXT')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_job_queue_updated ON job_queue (updated_at)"
+            )
+
+            # 变更日志表，由触发器维护，客户端凭序号增量同步邮箱和邮件记录
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entity TEXT NOT NULL,
+                    entity_id INTEGER NOT NULL,
+                    user_id INTEGER,
+                    email_id INTEGER,
+                    op TEXT NOT NULL,
+                    created_at REAL
+                )
+            ''')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_change_log_user ON change_log (user_id, seq)"
+            )
+            # 旧版本的邮箱更新触发器对任何更新都生效，重新创建
+            self.conn.execute("DROP TRIGGER IF EXISTS trg_emails_update_log")
+            self.conn.execute("DROP TRIGGER IF EXISTS trg_emails_update_counter")
+            for op, event, row in (('upsert', 'INSERT', 'NEW'), ('upsert', 'UPDATE', 'NEW'), ('delete', 'DELETE', 'OLD')):
+                condition = f"WHEN {EMAIL_CHANGED}" if event == 'UPDATE' else ''
+                self.conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_emails_{event.lower()}_log AFTER {event} ON emails {condition}
+                    BEGIN
+                        INSERT INTO change_log (entity, entity_id, user_id, email_id, op, created_at)
+                        VALUES ('email', {row}.id, {row}.user_id, {row}.id, '{op}', strftime('%s', 'now'));
+                    END
+                ''')
+                self.conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_mail_records_{event.lower()}_log AFTER {event} ON mail_records
+                    BEGIN
+                        INSERT INTO change_log (entity, entity_id, user_id, email_id, op, created_at)
+                        VALUES ('mail_record', {row}.id, (SELECT user_id FROM emails WHERE id = {row}.email_id),
+                                {row}.email_id, '{op}', strftime('%s', 'now'));
+                    END
+                ''')
+
+            # 变更计数表，由触发器维护，用于生成列表接口的ETag
+            # 作用域: emails（所有邮箱，管理员视图）、user:<id>（用户的邮箱）、mailbox:<id>（邮箱的邮件记录）
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS change_counters (
+                    scope TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                condition = f"WHEN {EMAIL_LISTED_CHANGED}" if event == 'UPDATE' else ''
+                self.conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_emails_{event.lower()}_counter AFTER {event} ON emails {condition}
+                    BEGIN
+                        INSERT INTO change_counters (scope, version) VALUES ('emails', 1)
+                            ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+                        INSERT INTO change_counters (scope, version) VALUES ('user:' || {row}.user_id, 1)
+                            ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+                    END
+                ''')
+                self.conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_mail_records_{event.lower()}_counter AFTER {event} ON mail_records
+                    BEGIN
+                        INSERT INTO change_counters (scope, version) VALUES ('mailbox:' || {row}.email_id, 1)
+                            ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+                    END
+                ''')
+
+            # 认证版本号：用户被删除、修改密码或权限变更时递增，各进程据此清空自己的认证缓存
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_users_update_auth AFTER UPDATE ON users
+                WHEN OLD.password_hash IS NOT NEW.password_hash OR OLD.password IS NOT NEW.password
+                  OR OLD.is_admin IS NOT NEW.is_admin OR OLD.username IS NOT NEW.username
+                BEGIN
+                    INSERT INTO change_counters (scope, version) VALUES ('auth', 1)
+                        ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+                END
+            ''')
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_users_delete_auth AFTER DELETE ON users
+                BEGIN
+                    INSERT INTO change_counters (scope, version) VALUES ('auth', 1)
+                        ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+                END
+            ''')
+
+            # 保存和导入邮件前按 (邮箱, 接收时间) 查重，没有索引时每封邮件都要扫描整个邮件表
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_mail_records_email_time ON mail_records (email_id, received_time)"
+            )
+
+            # 原始邮件索引：邮件ID -> 段文件中的位置，邮件记录删除时一并删除（段文件只追加，不回收空间）
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS raw_messages (
+                    mail_id INTEGER PRIMARY KEY,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_mail_records_delete_raw AFTER DELETE ON mail_records
+                BEGIN
+                    DELETE FROM raw_messages WHERE mail_id = OLD.id;
+                END
+            ''')
+
+            # 保存邮件时提取的验证码和操作链接，按 (邮箱, 类型, 接收时间) 索引，查询最新验证码只需一次索引查找
+            # received_at为Unix时间戳，received_time中时区格式不统一，不能直接排序
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS mail_codes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    mail_id INTEGER NOT NULL,
+                    email_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    sender TEXT,
+                    received_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_mail_codes_lookup ON mail_codes (email_id, kind, received_at)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_mail_codes_mail ON mail_codes (mail_id)")
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_mail_records_delete_codes AFTER DELETE ON mail_records
+                BEGIN
+                    DELETE FROM mail_codes WHERE mail_id = OLD.id;
+                END
+            ''')
+
+            # 上次成功同步时各文件夹的STATUS，实时检查前比较，没有变化时跳过同步
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS mailbox_state (
+                    email_id INTEGER NOT NULL,
+                    folder TEXT NOT NULL,
+                    uidvalidity INTEGER,
+                    uidnext INTEGER,
+                    messages INTEGER,
+                    highestmodseq INTEGER,
+                    updated_at REAL,
+                    PRIMARY KEY (email_id, folder)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_emails_delete_mailbox_state AFTER DELETE ON emails
+                BEGIN
+                    DELETE FROM mailbox_state WHERE email_id = OLD.id;
+                END
+            ''')
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"升级数据库结构失败: {str(e)}")
+            traceback.print_exc()
+
     def _check_and_add_column(self, table, column, type_def):
         """检查表中是否存在某列，如果不存在则添加"""
         try:
@@ -186,7 +543,7 @@ class Database:
         if not result:
             logger.info("初始化系统配置: 默认允许注册")
             self.conn.execute(
-                "INSERT INTO system_config (key, value) VALUES ('allow_register', 'true')"
+                "INSERT OR IGNORE INTO system_config (key, value) VALUES ('allow_register', 'true')"
             )
             self.conn.commit()
         else:
@@ -211,11 +568,12 @@ class Database:
     def set_system_config(self, key, value):
         """设置系统配置"""
         try:
-            self.conn.execute(
-                "INSERT OR REPLACE INTO system_config (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                (key, value)
-            )
-            self.conn.commit()
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO system_config (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                    (key, value)
+                )
+                self.conn.commit()
             logger.info(f"系统配置已更新: {key} = {value}")
             return True
         except Exception as e:
@@ -287,11 +645,12 @@ class Database:
             try:
                 salt = secrets.token_hex(16)
                 password_hash = self._hash_password(password, salt)
-                self.conn.execute(
-                    "UPDATE users SET password_hash = ?, salt = ? WHERE id = ?",
-                    (password_hash, salt, user['id'])
-                )
-                self.conn.commit()
+                with self.lock:
+                    self.conn.execute(
+                        "UPDATE users SET password_hash = ?, salt = ? WHERE id = ?",
+                        (password_hash, salt, user['id'])
+                    )
+                    self.conn.commit()
                 logger.info(f"用户 {username} 密码已自动升级到哈希格式")
             except Exception as e:
                 logger.error(f"自动升级密码格式失败: {str(e)}")
@@ -312,21 +671,22 @@ class Database:
     def create_user(self, username, password, is_admin=False):
         """创建新用户"""
         try:
-            # 检查是否需要将此用户设置为管理员（如果是第一个注册的用户）
-            if not is_admin:
-                cursor = self.conn.execute("SELECT COUNT(*) FROM users")
-                if cursor.fetchone()[0] == 0:
-                    is_admin = True
-                    logger.info(f"第一个注册的用户 {username} 将被设置为管理员")
-
             salt = secrets.token_hex(16)
             password_hash = self._hash_password(password, salt)
 
-            self.conn.execute(
-                "INSERT INTO users (username, password, password_hash, salt, is_admin) VALUES (?, ?, ?, ?, ?)",
-                (username, password, password_hash, salt, 1 if is_admin else 0)
-            )
-            self.conn.commit()
+            with self.lock:
+                # 检查是否需要将此用户设置为管理员（如果是第一个注册的用户）
+                if not is_admin:
+                    cursor = self.conn.execute("SELECT COUNT(*) FROM users")
+                    if cursor.fetchone()[0] == 0:
+                        is_admin = True
+                        logger.info(f"第一个注册的用户 {username} 将被设置为管理员")
+
+                self.conn.execute(
+                    "INSERT INTO users (username, password, password_hash, salt, is_admin) VALUES (?, ?, ?, ?, ?)",
+                    (username, password, password_hash, salt, 1 if is_admin else 0)
+                )
+                self.conn.commit()
             logger.info(f"创建用户成功: {username}, 管理员权限: {is_admin}")
             return True, is_admin
         except sqlite3.IntegrityError:
@@ -342,11 +702,13 @@ class Database:
             salt = secrets.token_hex(16)
             password_hash = self._hash_password(new_password, salt)
 
-            self.conn.execute(
-                "UPDATE users SET password = ?, password_hash = ?, salt = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (new_password, password_hash, salt, user_id)
-            )
-            self.conn.commit()
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE users SET password = ?, password_hash = ?, salt = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (new_password, password_hash, salt, user_id)
+                )
+                self.conn.commit()
+            auth_cache.invalidate_user(user_id)
             logger.info(f"用户ID {user_id} 密码更新成功")
             return True
         except Exception as e:
@@ -356,21 +718,27 @@ class Database:
     def delete_user(self, user_id):
         """删除用户"""
         try:
-            # 先获取用户关联的所有邮箱
-            cursor = self.conn.execute("SELECT id FROM emails WHERE user_id = ?", (user_id,))
-            email_ids = [row['id'] for row in cursor.fetchall()]
-
-            # 删除邮件记录
-            if email_ids:
-                placeholders = ','.join(['?'] * len(email_ids))
-                self.conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", email_ids)
-
-            # 删除邮箱
-            self.conn.execute("DELETE FROM emails WHERE user_id = ?", (user_id,))
-
-            # 删除用户
-            self.conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            self.conn.commit()
+            with self.lock:
+                try:
+                    # 先获取用户关联的所有邮箱
+                    cursor = self.conn.execute("SELECT id FROM emails WHERE user_id = ?", (user_id,))
+                    email_ids = [row['id'] for row in cursor.fetchall()]
+
+                    # 删除邮件记录
+                    if email_ids:
+                        placeholders = ','.join(['?'] * len(email_ids))
+                        self.conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", email_ids)
+
+                    # 删除邮箱
+                    self.conn.execute("DELETE FROM emails WHERE user_id = ?", (user_id,))
+
+                    # 删除用户
+                    self.conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+            auth_cache.invalidate_user(user_id)
             logger.info(f"用户ID {user_id} 删除成功")
             return True
         except Exception as e:
@@ -394,24 +762,25 @@ class Database:
             else:
                 logger.info(f"尝试添加邮箱: {email} (用户ID: {user_id}, 类型: {mail_type})")
 
-            # 根据邮箱类型处理SQL，默认启用实时检查
-            if mail_type == 'outlook':
-                cursor = self.conn.execute(
-                    "INSERT INTO emails (user_id, email, password, client_id, refresh_token, mail_type, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, 1)",
-                    (user_id, email, password, client_id, refresh_token, mail_type)
-                )
-            elif mail_type in ['imap', 'gmail', 'qq']:
-                # 将布尔值转换为整数值 (1=True, 0=False)
-                use_ssl_int = 1 if use_ssl else 0
-                cursor = self.conn.execute(
-                    "INSERT INTO emails (user_id, email, password, mail_type, server, port, use_ssl, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
-                    (user_id, email, password, mail_type, server, port, use_ssl_int)
-                )
-            else:
-                logger.error(f"不支持的邮箱类型: {mail_type}")
-                return False
+            with self.lock:
+                # 根据邮箱类型处理SQL，默认启用实时检查
+                if mail_type == 'outlook':
+                    cursor = self.conn.execute(
+                        "INSERT INTO emails (user_id, email, password, client_id, refresh_token, mail_type, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, 1)",
+                        (user_id, email, password, client_id, refresh_token, mail_type)
+                    )
+                elif mail_type in ['imap', 'gmail', 'qq']:
+                    # 将布尔值转换为整数值 (1=True, 0=False)
+                    use_ssl_int = 1 if use_ssl else 0
+                    cursor = self.conn.execute(
+                        "INSERT INTO emails (user_id, email, password, mail_type, server, port, use_ssl, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                        (user_id, email, password, mail_type, server, port, use_ssl_int)
+                    )
+                else:
+                    logger.error(f"不支持的邮箱类型: {mail_type}")
+                    return False
 
-            self.conn.commit()
+                self.conn.commit()
             email_id = cursor.lastrowid
             logger.info(f"邮箱添加成功: {email}, ID: {email_id}, 类型: {mail_type}, 已启用实时检查")
             return email_id
@@ -423,6 +792,46 @@ class Database:
             logger.error(f"添加邮箱失败: {email}, 错误: {str(e)}")
             return False
 
+    def add_emails_bulk(self, user_id, records, mail_type='outlook'):
+        """在一个事务中批量添加邮箱账号，已存在的邮箱跳过
+
+        Args:
+            records: 账号列表，每项包含line、email、password，以及client_id/refresh_token或server/port
+
+        Returns:
+            ({行号: 邮箱ID}, 已存在的行号集合)，失败时整个事务回滚并返回None
+        """
+        inserted = {}
+        conflicts = set()
+        if not records:
+            return inserted, conflicts
+        if mail_type not in ('outlook', 'imap', 'gmail', 'qq'):
+            logger.error(f"不支持的邮箱类型: {mail_type}")
+            return None
+
+        with self.lock:
+            try:
+                for record in records:
+                    cursor = self.conn.execute(
+                        """INSERT OR IGNORE INTO emails
+                           (user_id, email, password, client_id, refresh_token, mail_type, server, port, use_ssl,
+                            enable_realtime_check)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, 1)""",
+                        (user_id, record['email'], record['password'], record.get('client_id'),
+                         record.get('refresh_token'), mail_type, record.get('server'), record.get('port'))
+                    )
+                    if cursor.rowcount > 0:
+                        inserted[record['line']] = cursor.lastrowid
+                    else:
+                        conflicts.add(record['line'])
+                self.conn.commit()
+                logger.info(f"批量添加邮箱完成 (用户ID: {user_id}, 类型: {mail_type})，新增 {len(inserted)} 个，已存在 {len(conflicts)} 个")
+                return inserted, conflicts
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"批量添加邮箱失败: {str(e)}")
+                return None
+
     def get_all_emails(self, user_id=None):
         """获取所有邮箱账号，可以按用户ID过滤"""
         logger.debug(f"获取所有邮箱账号 (用户ID: {user_id if user_id else 'all'})")
@@ -444,6 +853,23 @@ class Database:
         )
         return cursor.fetchall()
 
+    def get_email_owners(self, email_ids):
+        """获取邮箱所属的用户，返回 {用户ID: [邮箱ID]}"""
+        owners = {}
+        if not email_ids:
+            return owners
+        try:
+            placeholders = ','.join(['?'] * len(email_ids))
+            cursor = self.conn.execute(
+                f"SELECT id, user_id FROM emails WHERE id IN ({placeholders})",
+                list(email_ids)
+            )
+            for row in cursor.fetchall():
+                owners.setdefault(row['user_id'], []).append(row['id'])
+        except Exception as e:
+            logger.error(f"获取邮箱所属用户失败: {str(e)}")
+        return owners
+
     def get_email_by_id(self, email_id, user_id=None):
         """根据ID获取邮箱账号，可以验证所有者"""
         logger.debug(f"获取邮箱 ID: {email_id}")
@@ -490,6 +916,12 @@ class Database:
                 update_fields.append(f"{key} = ?")
                 params.append(value)
 
+            # 修改了认证信息时重置熔断状态，下次检查立即生效
+            if any(key in kwargs for key in ('password', 'client_id', 'refresh_token', 'server', 'port', 'use_ssl')):
+                update_fields.append("consecutive_failures = 0")
+                update_fields.append("circuit_state = 'closed'")
+                update_fields.append("circuit_open_until = NULL")
+
             # 添加更新时间
             update_fields.append("updated_at = CURRENT_TIMESTAMP")
 
@@ -509,8 +941,9 @@ class Database:
                 WHERE {where_condition}
             """
 
-            self.conn.execute(sql, params)
-            self.conn.commit()
+            with self.lock:
+                self.conn.execute(sql, params)
+                self.conn.commit()
             logger.info(f"邮箱信息更新成功: ID={email_id}")
             return True
 
@@ -521,21 +954,23 @@ class Database:
     def update_check_time(self, email_id):
         """更新邮箱的最后检查时间"""
         logger.debug(f"更新邮箱最后检查时间, ID: {email_id}")
-        self.conn.execute(
-            "UPDATE emails SET last_check_time = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (email_id,)
-        )
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE emails SET last_check_time = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (email_id,)
+            )
+            self.conn.commit()
 
     def update_email_token(self, email_id, access_token):
         """更新Outlook邮箱的访问令牌"""
         logger.debug(f"更新邮箱访问令牌, ID: {email_id}")
         try:
-            self.conn.execute(
-                "UPDATE emails SET access_token = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (access_token, email_id)
-            )
-            self.conn.commit()
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE emails SET access_token = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (access_token, email_id)
+                )
+                self.conn.commit()
             logger.info(f"成功更新邮箱 ID:{email_id} 的访问令牌")
             return True
         except Exception as e:
@@ -553,12 +988,17 @@ class Database:
             sql_where += " AND user_id = ?"
             params.append(user_id)
 
-        # 先删除相关的邮件记录
-        self.conn.execute("DELETE FROM mail_records WHERE email_id = ?", (email_id,))
+        with self.lock:
+            try:
+                # 先删除相关的邮件记录
+                self.conn.execute("DELETE FROM mail_records WHERE email_id = ?", (email_id,))
 
-        # 再删除邮箱
-        self.conn.execute(f"DELETE FROM emails WHERE {sql_where}", params)
-        self.conn.commit()
+                # 再删除邮箱
+                self.conn.execute(f"DELETE FROM emails WHERE {sql_where}", params)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
 
     def delete_emails(self, email_ids, user_id=None):
         """批量删除邮箱账号，可以验证所有者"""
@@ -584,135 +1024,453 @@ class Database:
             email_ids = valid_ids
 
         placeholders = ','.join(['?'] * len(email_ids))
-        # 先删除相关的邮件记录
-        self.conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", email_ids)
-        # 再删除邮箱
-        self.conn.execute(f"DELETE FROM emails WHERE id IN ({placeholders})", email_ids)
-        self.conn.commit()
-
-    def add_mail_record(self, email_id, subject, sender, received_time, content, folder=None, has_attachments=0):
-        """添加邮件记录"""
+        with self.lock:
+            try:
+                # 先删除相关的邮件记录
+                self.conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", email_ids)
+                # 再删除邮箱
+                self.conn.execute(f"DELETE FROM emails WHERE id IN ({placeholders})", email_ids)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def add_mail_record(self, email_id, subject, sender, received_time, content, folder=None, has_attachments=0, raw=None):
+        """添加邮件记录，raw为邮件的原始内容，保存到原始邮件存储中"""
         logger.debug(f"添加邮件记录, 邮箱ID: {email_id}, 主题: {subject}")
         try:
-            # 先检查邮件是否已存在
-            cursor = self.conn.execute(
-                "SELECT id FROM mail_records WHERE email_id = ? AND sender = ? AND subject = ? AND received_time = ?",
-                (email_id, sender, subject, received_time)
-            )
-            exists = cursor.fetchone() is not None
+            with self.lock:
+                # 先检查邮件是否已存在
+                cursor = self.conn.execute(
+                    "SELECT id FROM mail_records WHERE email_id = ? AND sender = ? AND subject = ? AND received_time = ?",
+                    (email_id, sender, subject, received_time)
+                )
+                exists = cursor.fetchone() is not None
 
-            if exists:
-                logger.debug(f"邮件已存在，跳过: 邮箱ID={email_id}, 主题={subject}")
-                return False, None  # 邮件已存在，返回False表示没有添加新记录
+                if exists:
+                    logger.debug(f"邮件已存在，跳过: 邮箱ID={email_id}, 主题={subject}")
+                    return False, None  # 邮件已存在，返回False表示没有添加新记录
 
-            # 如果content是字典类型，将其转换为JSON字符串
-            if isinstance(content, dict):
-                import json
-                content = json.dumps(content, ensure_ascii=False)
+                # 如果content是字典类型，将其转换为JSON字符串
+                parsed_content = content
+                if isinstance(content, dict):
+                    import json
+                    content = json.dumps(content, ensure_ascii=False)
 
-            # 邮件不存在，添加新记录
-            cursor = self.conn.execute(
-                "INSERT INTO mail_records (email_id, subject, sender, received_time, content, folder, has_attachments) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (email_id, subject, sender, received_time, content, folder, has_attachments)
-            )
-            mail_id = cursor.lastrowid
-            self.conn.commit()
+                # 邮件不存在，添加新记录
+                try:
+                    cursor = self.conn.execute(
+                        "INSERT INTO mail_records (email_id, subject, sender, received_time, content, folder, has_attachments) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (email_id, subject, sender, received_time, content, folder, has_attachments)
+                    )
+                    mail_id = cursor.lastrowid
+                    self._store_raw(mail_id, raw)
+                    self._store_codes(mail_id, email_id, subject, sender, received_time, parsed_content)
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
             return True, mail_id  # 添加了新记录，返回True和邮件ID
         except Exception as e:
             logger.error(f"添加邮件记录失败: {str(e)}")
             return False, None
 
-    def get_mail_records(self, email_id, user_id=None):
-        """获取指定邮箱的所有邮件记录，可以验证所有者"""
-        logger.debug(f"获取邮箱邮件记录, ID: {email_id}")
-
-        # 如果指定了用户ID，先验证邮箱所有权
-        if user_id:
-            email = self.get_email_by_id(email_id, user_id)
-            if not email:
-                logger.warning(f"用户ID {user_id} 没有权限访问邮箱ID {email_id}")
-                return []
-
-        cursor = self.conn.execute(
-            "SELECT * FROM mail_records WHERE email_id = ? ORDER BY received_time DESC",
-            (email_id,)
-        )
+    def import_mail_batch(self, email_id, records, job_id=None, checkpoint=None):
+        """在一个事务中写入一批导入的邮件及其附件，已存在的邮件跳过
 
-        records = []
-        for record in cursor.fetchall():
-            # 将记录转换为字典
-            record_dict = dict(record)
+        Args:
+            records: parse_email_message返回的邮件数据列表
+            job_id: 导入任务ID
+            checkpoint: 函数 checkpoint(新增数, 跳过数)，返回的断点与邮件在同一个事务中写入任务
 
-            # 尝试将content字段从JSON字符串转换为字典
+        Returns:
+            (新增数, 跳过数)，失败时整批回滚并返回None
+        """
+        saved = skipped = 0
+        with self.lock:
             try:
-                if record_dict['content'] and isinstance(record_dict['content'], str):
-                    import json
-                    try:
-                        # 检查是否是JSON格式
-                        if record_dict['content'].startswith('{') and record_dict['content'].endswith('}'):
-                            record_dict['content'] = json.loads(record_dict['content'])
-                    except json.JSONDecodeError:
-                        # 如果不是有效的JSON，保持原样
-                        pass
+                for record in records:
+                    subject = record.get('subject', '(无主题)')
+                    sender = record.get('sender', '(未知发件人)')
+                    received_time = record.get('received_time', datetime.now())
+                    cursor = self.conn.execute(
+                        "SELECT id FROM mail_records WHERE email_id = ? AND sender = ? AND subject = ? AND received_time = ?",
+                        (email_id, sender, subject, received_time)
+                    )
+                    if cursor.fetchone() is not None:
+                        skipped += 1
+                        continue
+
+                    content = record.get('content', '(无内容)')
+                    if isinstance(content, dict):
+                        content = json.dumps(content, ensure_ascii=False)
+                    attachments = [a for a in record.get('full_attachments') or [] if a.get('content')]
+                    cursor = self.conn.execute(
+                        "INSERT INTO mail_records (email_id, subject, sender, received_time, content, folder, has_attachments) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (email_id, subject, sender, received_time, content, record.get('folder', 'IMPORTED'),
+                         1 if attachments else 0)
+                    )
+                    mail_id = cursor.lastrowid
+                    self._store_raw(mail_id, record.get('raw'))
+                    self._store_codes(mail_id, email_id, subject, sender, received_time, record.get('content'))
+                    for attachment in attachments:
+                        self.conn.execute(
+                            "INSERT INTO attachments (mail_id, filename, content_type, size, content) VALUES (?, ?, ?, ?, ?)",
+                            (mail_id, attachment.get('filename') or '未命名',
+                             attachment.get('content_type') or 'application/octet-stream',
+                             attachment.get('size', 0), attachment['content'])
+                        )
+                    saved += 1
+
+                if job_id is not None and checkpoint is not None:
+                    self.conn.execute(
+                        "UPDATE job_queue SET checkpoint = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(checkpoint(saved, skipped), ensure_ascii=False), time.time(), job_id)
+                    )
+                self.conn.commit()
+                return saved, skipped
             except Exception as e:
-                logger.warning(f"解析邮件内容失败: {str(e)}")
-
-            records.append(record_dict)
+                self.conn.rollback()
+                logger.error(f"批量写入导入的邮件失败: 邮箱ID={email_id}, 错误: {str(e)}")
+                return None
 
-        return records
+    def _store_raw(self, mail_id, raw):
+        """把邮件的原始内容追加到段文件并写入索引，在调用方的事务中执行，不提交
 
-    def get_mail_record_by_id(self, mail_id):
-        """根据ID获取邮件记录"""
-        logger.debug(f"获取邮件记录, ID: {mail_id}")
+        保存失败（如磁盘已满）只记录日志，不影响邮件记录的写入。
+        """
+        if not raw or self.raw_store is None:
+            return
         try:
-            cursor = self.conn.execute(
-                "SELECT * FROM mail_records WHERE id = ?",
-                (mail_id,)
+            segment, offset, length = self.raw_store.append(mail_id, raw)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO raw_messages (mail_id, segment, offset, length, size) VALUES (?, ?, ?, ?, ?)",
+                (mail_id, segment, offset, length, len(raw))
             )
-            record = cursor.fetchone()
-
-            if record:
-                # 将记录转换为字典
-                record_dict = dict(record)
+        except Exception as e:
+            logger.error(f"保存原始邮件失败: 邮件ID={mail_id}, 错误: {str(e)}")
 
-                # 尝试将content字段从JSON字符串转换为字典
+    def _store_codes(self, mail_id, email_id, subject, sender, received_time, content):
+        """提取邮件中的验证码和操作链接并写入mail_codes，在调用方的事务中执行，不提交"""
+        try:
+            if isinstance(content, str) and content.startswith('{') and content.endswith('}'):
                 try:
-                    if record_dict['content'] and isinstance(record_dict['content'], str):
-                        import json
-                        try:
-                            # 检查是否是JSON格式
-                            if record_dict['content'].startswith('{') and record_dict['content'].endswith('}'):
-                                record_dict['content'] = json.loads(record_dict['content'])
-                        except json.JSONDecodeError:
-                            # 如果不是有效的JSON，保持原样
-                            pass
-                except Exception as e:
-                    logger.warning(f"解析邮件内容失败: {str(e)}")
+                    content = json.loads(content)
+                except json.JSONDecodeError:
+                    pass
+            found = code_extractor.extract(subject, content)
+            if not found:
+                return
+            address = parseaddr(sender or '')[1].lower() or (sender or '').lower()
+            received_at = _timestamp(received_time)
+            self.conn.executemany(
+                "INSERT INTO mail_codes (mail_id, email_id, kind, value, sender, received_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(mail_id, email_id, kind, value, address, received_at) for kind, value in found]
+            )
+        except Exception as e:
+            logger.error(f"提取验证码失败: 邮件ID={mail_id}, 错误: {str(e)}")
 
-                return record_dict
+    def get_mail_codes(self, email_id, kind='code', since=None, sender=None, limit=1):
+        """查询邮箱最新的验证码或操作链接
 
-            return None
-        except Exception as e:
-            logger.error(f"获取邮件记录失败: {str(e)}")
-            return None
+        Args:
+            kind: 'code' 或 'link'
+            since: Unix时间戳，只返回此时间之后收到的
+            sender: 发件人地址，或以@开头的域名（如 @github.com）
+            limit: 返回的条数，按接收时间从新到旧
 
-    def add_attachment(self, mail_id, filename, content_type, size, content):
-        """添加附件记录"""
-        logger.debug(f"添加附件记录, 邮件ID: {mail_id}, 文件名: {filename}")
+        Returns:
+            [{mail_id, kind, value, sender, received_at}]
+        """
+        conditions, params = ["email_id = ?", "kind = ?"], [email_id, kind]
+        if since is not None:
+            conditions.append("received_at >= ?")
+            params.append(since)
+        if sender:
+            sender = sender.lower()
+            if sender.startswith('@'):
+                conditions.append("sender LIKE ?")
+                params.append('%' + sender)
+            else:
+                conditions.append("sender = ?")
+                params.append(sender)
         try:
             cursor = self.conn.execute(
-                "INSERT INTO attachments (mail_id, filename, content_type, size, content) VALUES (?, ?, ?, ?, ?)",
-                (mail_id, filename, content_type, size, content)
+                f"""SELECT mail_id, kind, value, sender, received_at FROM mail_codes
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY received_at DESC, id DESC LIMIT ?""",
+                params + [limit]
             )
-            attachment_id = cursor.lastrowid
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"查询验证码失败: {str(e)}")
+            return []
 
-            # 更新邮件记录，标记为有附件
-            self.conn.execute(
-                "UPDATE mail_records SET has_attachments = 1 WHERE id = ?",
+    def get_codes_for_mail(self, mail_id):
+        """获取一封邮件中提取到的验证码和链接"""
+        try:
+            cursor = self.conn.execute(
+                "SELECT kind, value FROM mail_codes WHERE mail_id = ? ORDER BY id", (mail_id,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"查询邮件验证码失败: {str(e)}")
+            return []
+
+    def get_max_mail_id(self):
+        """获取当前最大的邮件ID，没有邮件时返回0"""
+        row = self.conn.execute("SELECT MAX(id) FROM mail_records").fetchone()
+        return row[0] or 0
+
+    def get_mail_records_after(self, after_id, upper_id, email_ids):
+        """按ID范围读取指定邮箱新保存的邮件摘要（不含正文），用于等待新邮件
+
+        Returns:
+            [{id, email_id, subject, sender, received_time}]，按ID排序
+        """
+        rows = []
+        for start in range(0, len(email_ids), 500):
+            chunk = email_ids[start:start + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor = self.conn.execute(
+                f"""SELECT id, email_id, subject, sender, received_time FROM mail_records
+                    WHERE id > ? AND id <= ? AND email_id IN ({placeholders})""",
+                [after_id, upper_id] + chunk
+            )
+            rows.extend(dict(row) for row in cursor.fetchall())
+        rows.sort(key=lambda row: row['id'])
+        return rows
+
+    def get_recent_mail_records(self, email_id, created_since, limit=200):
+        """读取邮箱在指定时间之后保存的邮件摘要，从新到旧
+
+        Args:
+            created_since: UTC时间字符串，与created_at的格式相同
+        """
+        cursor = self.conn.execute(
+            """SELECT id, email_id, subject, sender, received_time FROM mail_records
+               WHERE email_id = ? AND created_at >= ? ORDER BY id DESC LIMIT ?""",
+            (email_id, created_since, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_raw_message(self, mail_id):
+        """读取邮件的原始内容，没有保存时返回None"""
+        if self.raw_store is None:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT segment, offset, length FROM raw_messages WHERE mail_id = ?", (mail_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            return self.raw_store.read(row['segment'], row['offset'], row['length'], mail_id)
+        except Exception as e:
+            logger.error(f"读取原始邮件失败: 邮件ID={mail_id}, 错误: {str(e)}")
+            return None
+
+    def _raw_message_filter(self, filters):
+        """把重新解析的筛选条件转换为SQL条件和参数
+
+        Args:
+            filters: email_ids（邮箱ID列表）、folder、since、until（接收时间范围）
+        """
+        filters = filters or {}
+        conditions, params = [], []
+        if filters.get('email_ids'):
+            conditions.append(f"m.email_id IN ({','.join(['?'] * len(filters['email_ids']))})")
+            params.extend(filters['email_ids'])
+        if filters.get('folder'):
+            conditions.append("m.folder = ?")
+            params.append(filters['folder'])
+        if filters.get('since'):
+            conditions.append("m.received_time >= ?")
+            params.append(filters['since'])
+        if filters.get('until'):
+            conditions.append("m.received_time < ?")
+            params.append(filters['until'])
+        return ''.join(f" AND {condition}" for condition in conditions), params
+
+    def count_raw_messages(self, filters=None):
+        """统计符合条件且保存了原始内容的邮件数"""
+        where, params = self._raw_message_filter(filters)
+        try:
+            cursor = self.conn.execute(
+                f"SELECT COUNT(*) FROM raw_messages r JOIN mail_records m ON m.id = r.mail_id WHERE 1 = 1{where}",
+                params
+            )
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"统计原始邮件失败: {str(e)}")
+            return 0
+
+    def get_raw_message_index(self, filters=None, after_id=0, limit=500):
+        """按邮件ID顺序分页读取符合条件的原始邮件位置
+
+        Returns:
+            [(邮件ID, 段号, 偏移, 长度)]
+        """
+        where, params = self._raw_message_filter(filters)
+        cursor = self.conn.execute(
+            f"""SELECT r.mail_id, r.segment, r.offset, r.length
+                FROM raw_messages r JOIN mail_records m ON m.id = r.mail_id
+                WHERE r.mail_id > ?{where}
+                ORDER BY r.mail_id LIMIT ?""",
+            [after_id] + params + [limit]
+        )
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def rewrite_parsed_mails(self, records, job_id=None, checkpoint=None):
+        """在一个事务中用重新解析的结果更新一批邮件记录，并替换其附件
+
+        Args:
+            records: 邮件数据列表，id为邮件ID，其余字段与parse_eml_content的返回值相同；
+                     接收时间和文件夹保持不变
+            job_id: 重新解析任务ID
+            checkpoint: 函数 checkpoint(更新数)，返回的断点与邮件在同一个事务中写入任务
+
+        Returns:
+            更新的邮件数，失败时整批回滚并返回None
+        """
+        updated = 0
+        with self.lock:
+            try:
+                for record in records:
+                    content = record.get('content', '(无内容)')
+                    if isinstance(content, dict):
+                        content = json.dumps(content, ensure_ascii=False)
+                    attachments = [a for a in record.get('full_attachments') or [] if a.get('content')]
+                    cursor = self.conn.execute(
+                        "UPDATE mail_records SET subject = ?, sender = ?, content = ?, has_attachments = ? WHERE id = ?",
+                        (record.get('subject') or '(无主题)', record.get('sender') or '(未知发件人)', content,
+                         1 if attachments else 0, record['id'])
+                    )
+                    if cursor.rowcount == 0:
+                        continue
+                    self.conn.execute("DELETE FROM attachments WHERE mail_id = ?", (record['id'],))
+                    self.conn.execute("DELETE FROM mail_codes WHERE mail_id = ?", (record['id'],))
+                    row = self.conn.execute(
+                        "SELECT email_id, sender, received_time FROM mail_records WHERE id = ?", (record['id'],)
+                    ).fetchone()
+                    self._store_codes(record['id'], row['email_id'], record.get('subject'), row['sender'],
+                                      row['received_time'], record.get('content'))
+                    for attachment in attachments:
+                        self.conn.execute(
+                            "INSERT INTO attachments (mail_id, filename, content_type, size, content) VALUES (?, ?, ?, ?, ?)",
+                            (record['id'], attachment.get('filename') or '未命名',
+                             attachment.get('content_type') or 'application/octet-stream',
+                             attachment.get('size', 0), attachment['content'])
+                        )
+                    updated += 1
+
+                if job_id is not None and checkpoint is not None:
+                    self.conn.execute(
+                        "UPDATE job_queue SET checkpoint = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(checkpoint(updated), ensure_ascii=False), time.time(), job_id)
+                    )
+                self.conn.commit()
+                return updated
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"批量更新重新解析的邮件失败: {str(e)}")
+                return None
+
+    def get_mail_records(self, email_id, user_id=None):
+        """获取指定邮箱的所有邮件记录，可以验证所有者"""
+        logger.debug(f"获取邮箱邮件记录, ID: {email_id}")
+
+        # 如果指定了用户ID，先验证邮箱所有权
+        if user_id:
+            email = self.get_email_by_id(email_id, user_id)
+            if not email:
+                logger.warning(f"用户ID {user_id} 没有权限访问邮箱ID {email_id}")
+                return []
+
+        cursor = self.conn.execute(
+            "SELECT * FROM mail_records WHERE email_id = ? ORDER BY received_time DESC",
+            (email_id,)
+        )
+
+        records = []
+        for record in cursor.fetchall():
+            # 将记录转换为字典
+            record_dict = dict(record)
+
+            # 尝试将content字段从JSON字符串转换为字典
+            try:
+                if record_dict['content'] and isinstance(record_dict['content'], str):
+                    import json
+                    try:
+                        # 检查是否是JSON格式
+                        if record_dict['content'].startswith('{') and record_dict['content'].endswith('}'):
+                            record_dict['content'] = json.loads(record_dict['content'])
+                    except json.JSONDecodeError:
+                        # 如果不是有效的JSON，保持原样
+                        pass
+            except Exception as e:
+                logger.warning(f"解析邮件内容失败: {str(e)}")
+
+            records.append(record_dict)
+
+        return records
+
+    def get_mail_record_by_id(self, mail_id):
+        """根据ID获取邮件记录"""
+        logger.debug(f"获取邮件记录, ID: {mail_id}")
+        try:
+            cursor = self.conn.execute(
+                "SELECT * FROM mail_records WHERE id = ?",
                 (mail_id,)
             )
+            record = cursor.fetchone()
 
-            self.conn.commit()
+            if record:
+                # 将记录转换为字典
+                record_dict = dict(record)
+
+                # 尝试将content字段从JSON字符串转换为字典
+                try:
+                    if record_dict['content'] and isinstance(record_dict['content'], str):
+                        import json
+                        try:
+                            # 检查是否是JSON格式
+                            if record_dict['content'].startswith('{') and record_dict['content'].endswith('}'):
+                                record_dict['content'] = json.loads(record_dict['content'])
+                        except json.JSONDecodeError:
+                            # 如果不是有效的JSON，保持原样
+                            pass
+                except Exception as e:
+                    logger.warning(f"解析邮件内容失败: {str(e)}")
+
+                return record_dict
+
+            return None
+        except Exception as e:
+            logger.error(f"获取邮件记录失败: {str(e)}")
+            return None
+
+    def add_attachment(self, mail_id, filename, content_type, size, content):
+        """添加附件记录"""
+        logger.debug(f"添加附件记录, 邮件ID: {mail_id}, 文件名: {filename}")
+        try:
+            with self.lock:
+                try:
+                    cursor = self.conn.execute(
+                        "INSERT INTO attachments (mail_id, filename, content_type, size, content) VALUES (?, ?, ?, ?, ?)",
+                        (mail_id, filename, content_type, size, content)
+                    )
+                    attachment_id = cursor.lastrowid
+
+                    # 更新邮件记录，标记为有附件
+                    self.conn.execute(
+                        "UPDATE mail_records SET has_attachments = 1 WHERE id = ?",
+                        (mail_id,)
+                    )
+
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
             return attachment_id
         except Exception as e:
             logger.error(f"添加附件记录失败: {str(e)}")
@@ -856,11 +1614,20 @@ class Database:
             return []
 
     def close(self):
-        """关闭数据库连接"""
-        if self.conn:
-            logger.info("关闭数据库连接")
-            self.conn.close()
-            self.conn = None
+        """关闭所有线程的数据库连接"""
+        if getattr(self, 'db_path', None) is None:
+            return
+        logger.info("关闭数据库连接")
+        with self._connections_lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            self.db_path = None
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.warning(f"关闭数据库连接失败: {str(e)}")
 
     def get_mail_record_by_subject_and_sender(self, email_id, subject, sender):
         """根据主题和发件人获取邮件记录"""
@@ -916,7 +1683,8 @@ class Database:
                         sender=sender,
                         content=record.get("content", "(无内容)"),
                         received_time=record.get("received_time", datetime.now()),
-                        folder=record.get("folder", "INBOX")
+                        folder=record.get("folder", "INBOX"),
+                        raw=record.get("raw")
                     )
 
                     if success:
@@ -967,9 +1735,10 @@ class Database:
         """获取用户的所有邮箱"""
         try:
             cursor = self.conn.execute("""
-                SELECT id, email, password, mail_type, server, port,
+                SELECT id, user_id, email, password, mail_type, server, port,
                        use_ssl, client_id, refresh_token, last_check_time,
-                       enable_realtime_check
+                       enable_realtime_check, consecutive_failures, circuit_state,
+                       circuit_open_until
                 FROM emails
                 WHERE user_id = ? AND enable_realtime_check = 1
                 ORDER BY id
@@ -982,14 +1751,734 @@ class Database:
     def set_email_realtime_check(self, email_id: int, enable: bool) -> bool:
         """设置邮箱的实时检查状态"""
         try:
-            self.conn.execute("""
-                UPDATE emails
-                SET enable_realtime_check = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (1 if enable else 0, email_id))
-            self.conn.commit()
+            with self.lock:
+                self.conn.execute("""
+                    UPDATE emails
+                    SET enable_realtime_check = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (1 if enable else 0, email_id))
+                self.conn.commit()
             logger.info(f"已{'启用' if enable else '禁用'}邮箱ID {email_id}的实时检查")
             return True
         except Exception as e:
             logger.error(f"设置邮箱实时检查状态失败: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    # 任务队列相关方法
+    def _job_row_to_dict(self, row):
+        """将任务行转换为字典，并解析JSON字段"""
+        job = dict(row)
+        for key in ('payload', 'checkpoint', 'result'):
+            if job.get(key):
+                try:
+                    job[key] = json.loads(job[key])
+                except (TypeError, ValueError):
+                    pass
+        return job
+
+    def enqueue_job(self, kind, user_id=None, email_id=None, payload=None, priority=0, max_attempts=3, delay=0,
+                    dedupe_key=''):
+        """添加任务到队列，同一邮箱已有去重键相同的未完成同类任务时返回已有任务ID
+
+        Returns:
+            (job_id, created): 任务ID，以及是否新建了任务
+        """
+        now = time.time()
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    """INSERT OR IGNORE INTO job_queue
+                       (kind, user_id, email_id, payload, priority, status, max_attempts,
+                        available_at, created_at, updated_at, dedupe_key)
+                       VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)""",
+                    (kind, user_id, email_id,
+                     json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+                     priority, max_attempts, now + delay, now, now, dedupe_key or '')
+                )
+                self.conn.commit()
+                if cursor.rowcount > 0:
+                    return cursor.lastrowid, True
+
+                # 已存在未完成的任务，提升其优先级后返回
+                cursor = self.conn.execute(
+                    """SELECT id FROM job_queue WHERE kind = ? AND email_id = ? AND dedupe_key = ?
+                       AND status IN ('queued', 'running')""",
+                    (kind, email_id, dedupe_key or '')
+                )
+                row = cursor.fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE job_queue SET priority = MAX(priority, ?), updated_at = ? WHERE id = ?",
+                        (priority, now, row['id'])
+                    )
+                    self.conn.commit()
+                    return row['id'], False
+                return None, False
+        except Exception as e:
+            logger.error(f"添加任务失败: kind={kind}, email_id={email_id}, 错误: {str(e)}")
+            return None, False
+
+    def claim_jobs(self, owner, limit, lease_seconds, kinds=None):
+        """领取可执行的任务并加上租约
+
+        单条UPDATE语句在SQLite中是原子的，多个线程或进程同时领取也不会重复。
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        token = secrets.token_hex(8)
+        kind_filter = ""
+        params = [owner, token, now + lease_seconds, now, now]
+        if kinds:
+            kind_filter = f"AND kind IN ({','.join(['?'] * len(kinds))})"
+            params.extend(kinds)
+        params.extend([now, now, owner, limit])
+        try:
+            with self.lock:
+                self.conn.execute(f"""
+                    UPDATE job_queue
+                    SET status = 'running', lease_owner = ?, lease_token = ?, lease_expires_at = ?,
+                        heartbeat_at = ?, updated_at = ?, attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT id FROM job_queue
+                        WHERE status = 'queued' {kind_filter} AND available_at <= ?
+                          AND (email_id IS NULL OR email_id NOT IN (
+                              SELECT email_id FROM account_leases WHERE expires_at > ? AND owner != ?
+                          ))
+                        ORDER BY priority DESC, id
+                        LIMIT ?
+                    )
+                """, params)
+                self.conn.commit()
+                cursor = self.conn.execute(
+                    "SELECT * FROM job_queue WHERE lease_token = ? AND status = 'running' ORDER BY priority DESC, id",
+                    (token,)
+                )
+                return [self._job_row_to_dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"领取任务失败: {str(e)}")
+            return []
+
+    def heartbeat_jobs(self, owner, job_ids, lease_seconds):
+        """续约正在执行的任务"""
+        if not job_ids:
+            return 0
+        now = time.time()
+        placeholders = ','.join(['?'] * len(job_ids))
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    f"""UPDATE job_queue SET lease_expires_at = ?, heartbeat_at = ?
+                        WHERE lease_owner = ? AND status = 'running' AND id IN ({placeholders})""",
+                    [now + lease_seconds, now, owner] + list(job_ids)
+                )
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"任务续约失败: {str(e)}")
+            return 0
+
+    def update_job_progress(self, job_id, progress, message=None, checkpoint=None):
+        """记录任务进度和断点"""
+        try:
+            with self.lock:
+                if checkpoint is not None:
+                    self.conn.execute(
+                        "UPDATE job_queue SET progress = ?, message = ?, checkpoint = ?, updated_at = ? WHERE id = ?",
+                        (progress, message, json.dumps(checkpoint, ensure_ascii=False), time.time(), job_id)
+                    )
+                else:
+                    self.conn.execute(
+                        "UPDATE job_queue SET progress = ?, message = ?, updated_at = ? WHERE id = ?",
+                        (progress, message, time.time(), job_id)
+                    )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"更新任务进度失败: job_id={job_id}, 错误: {str(e)}")
+            return False
+
+    def finish_job(self, job_id, owner, status, result=None, error=None, clear_payload=False):
+        """结束任务，status为done、failed或cancelled；clear_payload为True时清除任务参数（如导入数据中的凭据）"""
+        now = time.time()
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    """UPDATE job_queue
+                       SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ?, finished_by = ?,
+                           payload = CASE WHEN ? THEN NULL ELSE payload END,
+                           lease_owner = NULL, lease_token = NULL, lease_expires_at = NULL
+                       WHERE id = ? AND (lease_owner = ? OR lease_owner IS NULL)""",
+                    (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                     error, now, now, owner, 1 if clear_payload else 0, job_id, owner)
+                )
+                self.conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"结束任务失败: job_id={job_id}, 错误: {str(e)}")
+            return False
+
+    def retry_job(self, job_id, owner, error, delay):
+        """任务执行异常，若未超过最大尝试次数则延迟后重新排队，否则标记为失败"""
+        now = time.time()
+        try:
+            with self.lock:
+                self.conn.execute(
+                    """UPDATE job_queue
+                       SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                           finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END,
+                           available_at = ?, error = ?, updated_at = ?,
+                           lease_owner = NULL, lease_token = NULL, lease_expires_at = NULL
+                       WHERE id = ? AND lease_owner = ?""",
+                    (now, now + delay, error, now, job_id, owner)
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"任务重新排队失败: job_id={job_id}, 错误: {str(e)}")
+            return False
+
+    def release_jobs(self, owner, job_ids=None, delay=0):
+        """释放租约，将任务放回队列（优雅关闭时使用，不计入尝试次数）"""
+        now = time.time()
+        sql = """UPDATE job_queue
+                 SET status = 'queued', attempts = MAX(attempts - 1, 0), available_at = ?, updated_at = ?,
+                     lease_owner = NULL, lease_token = NULL, lease_expires_at = NULL
+                 WHERE lease_owner = ? AND status = 'running'"""
+        params = [now + delay, now, owner]
+        if job_ids is not None:
+            if not job_ids:
+                return 0
+            sql += f" AND id IN ({','.join(['?'] * len(job_ids))})"
+            params.extend(job_ids)
+        try:
+            with self.lock:
+                cursor = self.conn.execute(sql, params)
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"释放任务租约失败: {str(e)}")
+            return 0
+
+    def reclaim_expired_jobs(self):
+        """回收租约已过期的任务（执行者崩溃或被强制终止），重新放回队列"""
+        now = time.time()
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    """UPDATE job_queue
+                       SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                           finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END,
+                           error = COALESCE(error, '任务租约过期'), available_at = ?, updated_at = ?,
+                           lease_owner = NULL, lease_token = NULL, lease_expires_at = NULL
+                       WHERE status = 'running' AND lease_expires_at < ?""",
+                    (now, now, now, now)
+                )
+                self.conn.commit()
+                if cursor.rowcount:
+                    logger.info(f"回收了 {cursor.rowcount} 个租约过期的任务")
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"回收过期任务失败: {str(e)}")
+            return 0
+
+    def cancel_jobs_for_emails(self, email_ids):
+        """取消指定邮箱尚未开始的任务，正在执行的任务标记为请求取消"""
+        if not email_ids:
+            return 0
+        now = time.time()
+        placeholders = ','.join(['?'] * len(email_ids))
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    f"""UPDATE job_queue SET status = 'cancelled', finished_at = ?, updated_at = ?
+                        WHERE status = 'queued' AND email_id IN ({placeholders})""",
+                    [now, now] + list(email_ids)
+                )
+                self.conn.execute(
+                    f"""UPDATE job_queue SET cancel_requested = 1, updated_at = ?
+                        WHERE status = 'running' AND email_id IN ({placeholders})""",
+                    [now] + list(email_ids)
+                )
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"取消邮箱任务失败: {str(e)}")
+            return 0
+
+    def get_cancel_requested_jobs(self, owner, job_ids):
+        """获取持有者正在执行且被请求取消的任务ID"""
+        if not job_ids:
+            return []
+        placeholders = ','.join(['?'] * len(job_ids))
+        try:
+            cursor = self.conn.execute(
+                f"""SELECT id FROM job_queue
+                    WHERE lease_owner = ? AND cancel_requested = 1 AND id IN ({placeholders})""",
+                [owner] + list(job_ids)
+            )
+            return [row['id'] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"获取被取消的任务失败: {str(e)}")
+            return []
+
+    def get_job(self, job_id):
+        """根据ID获取任务"""
+        try:
+            cursor = self.conn.execute("SELECT * FROM job_queue WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return self._job_row_to_dict(row) if row else None
+        except Exception as e:
+            logger.error(f"获取任务失败: job_id={job_id}, 错误: {str(e)}")
+            return None
+
+    def get_active_job(self, kind, email_id):
+        """获取邮箱未完成的任务"""
+        try:
+            cursor = self.conn.execute(
+                "SELECT * FROM job_queue WHERE kind = ? AND email_id = ? AND status IN ('queued', 'running')",
+                (kind, email_id)
+            )
+            row = cursor.fetchone()
+            return self._job_row_to_dict(row) if row else None
+        except Exception as e:
+            logger.error(f"获取邮箱任务失败: email_id={email_id}, 错误: {str(e)}")
+            return None
+
+    def count_jobs(self, statuses=('queued', 'running')):
+        """统计指定状态的任务数量"""
+        try:
+            placeholders = ','.join(['?'] * len(statuses))
+            cursor = self.conn.execute(
+                f"SELECT COUNT(*) FROM job_queue WHERE status IN ({placeholders})",
+                list(statuses)
+            )
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"统计任务数量失败: {str(e)}")
+            return 0
+
+    def purge_finished_jobs(self, older_than_seconds=7 * 24 * 3600, kinds=None, exclude_kinds=()):
+        """清理已结束的旧任务记录，kinds指定时只清理这些类型的任务，exclude_kinds中的类型不清理"""
+        sql = "DELETE FROM job_queue WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?"
+        params = [time.time() - older_than_seconds]
+        if kinds is not None:
+            if not kinds:
+                return 0
+            sql += f" AND kind IN ({','.join(['?'] * len(kinds))})"
+            params.extend(kinds)
+        if exclude_kinds:
+            sql += f" AND kind NOT IN ({','.join(['?'] * len(exclude_kinds))})"
+            params.extend(exclude_kinds)
+        try:
+            with self.lock:
+                cursor = self.conn.execute(sql, params)
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"清理旧任务失败: {str(e)}")
+            return 0
+
+    def clear_finished_job_payloads(self, kinds):
+        """清除已结束任务的参数，用于参数中含有凭据的任务类型（包括重试耗尽、租约过期和被取消的任务）"""
+        if not kinds:
+            return 0
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    f"""UPDATE job_queue SET payload = NULL
+                        WHERE status IN ('done', 'failed', 'cancelled') AND payload IS NOT NULL
+                          AND kind IN ({','.join(['?'] * len(kinds))})""",
+                    list(kinds)
+                )
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"清除任务参数失败: {str(e)}")
+            return 0
+
+    # 邮箱熔断相关方法
+    def record_email_success(self, email_id):
+        """记录邮箱检查成功，清零失败次数并关闭熔断"""
+        try:
+            with self.lock:
+                self.conn.execute(
+                    """UPDATE emails SET consecutive_failures = 0, circuit_state = 'closed',
+                              circuit_open_until = NULL, last_error = NULL
+                       WHERE id = ? AND (consecutive_failures > 0 OR circuit_state != 'closed')""",
+                    (email_id,)
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"记录邮箱检查成功失败: email_id={email_id}, 错误: {str(e)}")
+            return False
+
+    def record_email_failure(self, email_id, error):
+        """记录邮箱检查失败
+
+        Returns:
+            (连续失败次数, 记录前的熔断状态)，失败时返回(None, None)
+        """
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    "SELECT consecutive_failures, circuit_state FROM emails WHERE id = ?",
+                    (email_id,)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None, None
+                failures = (row['consecutive_failures'] or 0) + 1
+                self.conn.execute(
+                    """UPDATE emails SET consecutive_failures = ?, last_error = ?, last_failure_at = ?
+                       WHERE id = ?""",
+                    (failures, error, time.time(), email_id)
+                )
+                self.conn.commit()
+                return failures, row['circuit_state'] or 'closed'
+        except Exception as e:
+            logger.error(f"记录邮箱检查失败出错: email_id={email_id}, 错误: {str(e)}")
+            return None, None
+
+    def open_email_circuit(self, email_id, open_until):
+        """打开邮箱熔断，在open_until之前不再调度检查"""
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE emails SET circuit_state = 'open', circuit_open_until = ? WHERE id = ?",
+                    (open_until, email_id)
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"打开邮箱熔断失败: email_id={email_id}, 错误: {str(e)}")
+            return False
+
+    def try_half_open_email_circuit(self, email_id, probe_until):
+        """冷却期结束后切换到半开状态，只有一个调用者能获得试探机会"""
+        now = time.time()
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    """UPDATE emails SET circuit_state = 'half_open', circuit_open_until = ?
+                       WHERE id = ? AND circuit_state IN ('open', 'half_open')
+                         AND (circuit_open_until IS NULL OR circuit_open_until <= ?)""",
+                    (probe_until, email_id, now)
+                )
+                self.conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"切换邮箱熔断半开状态失败: email_id={email_id}, 错误: {str(e)}")
+            return False
+
+    # 邮箱状态相关方法
+    def get_mailbox_state(self, email_id):
+        """获取邮箱上次成功同步时保存的文件夹状态
+
+        Returns:
+            {文件夹: {uidvalidity, uidnext, messages, highestmodseq}}
+        """
+        try:
+            cursor = self.conn.execute(
+                "SELECT folder, uidvalidity, uidnext, messages, highestmodseq FROM mailbox_state WHERE email_id = ?",
+                (email_id,)
+            )
+            return {row['folder']: {key: row[key] for key in ('uidvalidity', 'uidnext', 'messages', 'highestmodseq')}
+                    for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"获取邮箱状态失败: {str(e)}")
+            return {}
+
+    def save_mailbox_state(self, email_id, states):
+        """保存邮箱各文件夹的状态，states格式与get_mailbox_state的返回值相同"""
+        now = time.time()
+        try:
+            with self.lock:
+                self.conn.executemany(
+                    """INSERT OR REPLACE INTO mailbox_state
+                       (email_id, folder, uidvalidity, uidnext, messages, highestmodseq, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    [(email_id, folder, state.get('uidvalidity'), state.get('uidnext'), state.get('messages'),
+                      state.get('highestmodseq'), now) for folder, state in states.items()]
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"保存邮箱状态失败: {str(e)}")
+            return False
+
+    # 邮箱租约相关方法
+    def acquire_account_lease(self, email_id, owner, lease_seconds, job_id=None):
+        """获取邮箱租约，租约被其他持有者占用且未过期时返回False"""
+        now = time.time()
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    """INSERT INTO account_leases (email_id, owner, job_id, acquired_at, expires_at)
+                       VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT(email_id) DO UPDATE SET
+                           owner = excluded.owner, job_id = excluded.job_id,
+                           acquired_at = excluded.acquired_at, expires_at = excluded.expires_at
+                       WHERE account_leases.expires_at <= ? OR account_leases.owner = excluded.owner""",
+                    (email_id, owner, job_id, now, now + lease_seconds, now)
+                )
+                self.conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"获取邮箱租约失败: email_id={email_id}, 错误: {str(e)}")
+            return False
+
+    def renew_account_leases(self, owner, lease_seconds):
+        """续约持有者的所有邮箱租约"""
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    "UPDATE account_leases SET expires_at = ? WHERE owner = ?",
+                    (time.time() + lease_seconds, owner)
+                )
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"续约邮箱租约失败: {str(e)}")
+            return 0
+
+    def release_account_lease(self, email_id, owner):
+        """释放邮箱租约"""
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "DELETE FROM account_leases WHERE email_id = ? AND owner = ?",
+                    (email_id, owner)
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"释放邮箱租约失败: email_id={email_id}, 错误: {str(e)}")
+            return False
+
+    def release_account_leases(self, owner):
+        """释放持有者的所有邮箱租约"""
+        try:
+            with self.lock:
+                cursor = self.conn.execute("DELETE FROM account_leases WHERE owner = ?", (owner,))
+                self.conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"释放邮箱租约失败: {str(e)}")
+            return 0
+
+    def get_account_leases(self):
+        """获取所有未过期的邮箱租约"""
+        try:
+            cursor = self.conn.execute(
+                "SELECT * FROM account_leases WHERE expires_at > ? ORDER BY owner, email_id",
+                (time.time(),)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"获取邮箱租约失败: {str(e)}")
+            return []
+
+    def acquire_leader_lease(self, name, owner, lease_seconds):
+        """获取或续约领导租约，租约被其他进程持有且未过期时返回False"""
+        now = time.time()
+        try:
+            with self.lock:
+                cursor = self.conn.execute(
+                    """INSERT INTO leader_leases (name, owner, acquired_at, expires_at)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT(name) DO UPDATE SET
+                           owner = excluded.owner,
+                           acquired_at = CASE WHEN leader_leases.owner = excluded.owner
+                                              THEN leader_leases.acquired_at ELSE excluded.acquired_at END,
+                           expires_at = excluded.expires_at
+                       WHERE leader_leases.expires_at <= ? OR leader_leases.owner = excluded.owner""",
+                    (name, owner, now, now + lease_seconds, now)
+                )
+                self.conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"获取领导租约失败: name={name}, 错误: {str(e)}")
+            return False
+
+    def release_leader_lease(self, name, owner):
+        """释放领导租约"""
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "DELETE FROM leader_leases WHERE name = ? AND owner = ?",
+                    (name, owner)
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"释放领导租约失败: name={name}, 错误: {str(e)}")
+            return False
+
+    def get_leader_lease(self, name):
+        """获取未过期的领导租约"""
+        try:
+            cursor = self.conn.execute(
+                "SELECT * FROM leader_leases WHERE name = ? AND expires_at > ?",
+                (name, time.time())
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"获取领导租约失败: name={name}, 错误: {str(e)}")
+            return None
+
+    def get_job_updates(self, since, owner):
+        """获取其他进程执行的检查和导入任务在指定时间之后的进度变化
+
+        Args:
+            since: 上次读取到的updated_at
+            owner: 本进程的任务租约标识，本进程执行的任务已通过事件总线推送，不再返回
+
+        Returns:
+            任务列表，按updated_at排序
+        """
+        try:
+            cursor = self.conn.execute(
+                """SELECT j.id, j.kind, j.user_id, j.email_id, j.status, j.progress, j.message, j.result,
+                          j.updated_at, e.email
+                   FROM job_queue j LEFT JOIN emails e ON e.id = j.email_id
+                   WHERE j.updated_at > ? AND j.kind IN ('check', 'import', 'mbox_import', 'archive_import', 'reparse')
+                     AND ((j.status = 'running' AND j.lease_owner != ?)
+                          OR (j.status IN ('done', 'failed', 'cancelled') AND j.finished_by != ?))
+                   ORDER BY j.updated_at
+                   LIMIT 1000""",
+                (since, owner, owner)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"获取任务进度变化失败: {str(e)}")
+            return []
+
+    def get_change_counter(self, scope):
+        """获取作用域的变更计数，从未变更过时返回0"""
+        try:
+            cursor = self.conn.execute("SELECT version FROM change_counters WHERE scope = ?", (scope,))
+            row = cursor.fetchone()
+            return row['version'] if row else 0
+        except Exception as e:
+            logger.error(f"获取变更计数失败: scope={scope}, 错误: {str(e)}")
+            return None
+
+    def get_change_cursor(self):
+        """获取当前最新的变更序号，变更日志为空时返回0"""
+        try:
+            cursor = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+            row = cursor.fetchone()
+            return row['seq'] if row else 0
+        except Exception as e:
+            logger.error(f"获取变更序号失败: {str(e)}")
+            return 0
+
+    def get_changes(self, since, user_id=None, email_ids=None, limit=500):
+        """获取指定序号之后的变更，同一对象的多次变更合并为最后一次
+
+        Args:
+            since: 客户端已同步到的变更序号
+            user_id: 只返回该用户的变更，None表示所有用户
+            email_ids: 需要同步邮件记录的邮箱ID，为空时不返回邮件记录
+            limit: 单次返回的变更对象数量上限
+
+        Returns:
+            包含cursor、reset、has_more、emails和mail_records的字典，
+            cursor早于已清理的范围时reset为True，客户端需重新全量获取
+        """
+        with self.lock:
+            try:
+                current = self.get_change_cursor()
+                purged = int(self.get_system_config('change_log_purged_seq') or 0)
+                if since is None or since < purged or since > current:
+                    return {'cursor': current, 'reset': True, 'has_more': False}
+
+                sql = "SELECT entity, entity_id, op, MAX(seq) AS seq FROM change_log WHERE seq > ?"
+                params = [since]
+                if user_id:
+                    sql += " AND user_id = ?"
+                    params.append(user_id)
+                email_ids = [int(i) for i in (email_ids or [])]
+                if email_ids:
+                    placeholders = ','.join(['?'] * len(email_ids))
+                    sql += f" AND (entity = 'email' OR email_id IN ({placeholders}))"
+                    params.extend(email_ids)
+                else:
+                    sql += " AND entity = 'email'"
+                sql += " GROUP BY entity, entity_id ORDER BY seq LIMIT ?"
+                params.append(limit + 1)
+                rows = self.conn.execute(sql, params).fetchall()
+
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                changes = {
+                    'email': {'upsert': [], 'delete': []},
+                    'mail_record': {'upsert': [], 'delete': []}
+                }
+                for row in rows:
+                    changes[row['entity']][row['op']].append(row['entity_id'])
+
+                result = {
+                    'cursor': rows[-1]['seq'] if has_more else current,
+                    'reset': False,
+                    'has_more': has_more,
+                    'emails': {
+                        'upserted': self._fetch_by_ids('emails', changes['email']['upsert']),
+                        'deleted': changes['email']['delete']
+                    },
+                    'mail_records': {
+                        'upserted': [self._parse_mail_record(record) for record in
+                                     self._fetch_by_ids('mail_records', changes['mail_record']['upsert'])],
+                        'deleted': changes['mail_record']['delete']
+                    }
+                }
+                return result
+            except Exception as e:
+                logger.error(f"获取增量变更失败: {str(e)}")
+                return {'cursor': self.get_change_cursor(), 'reset': True, 'has_more': False}
+
+    def _fetch_by_ids(self, table, ids):
+        """按ID批量读取记录，已不存在的记录被忽略"""
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor = self.conn.execute(f"SELECT * FROM {table} WHERE id IN ({placeholders})", chunk)
+            rows.extend(dict(row) for row in cursor.fetchall())
+        return rows
+
+    def _parse_mail_record(self, record_dict):
+        """将JSON格式的邮件内容转换为字典"""
+        content = record_dict.get('content')
+        if content and isinstance(content, str) and content.startswith('{') and content.endswith('}'):
+            try:
+                record_dict['content'] = json.loads(content)
+            except json.JSONDecodeError:
+                pass
+        return record_dict
+
+    def purge_change_log(self, max_age=7 * 24 * 3600):
+        """清理过期的变更日志，并记录已清理到的序号"""
+        with self.lock:
+            try:
+                cursor = self.conn.execute(
+                    "SELECT MAX(seq) AS seq FROM change_log WHERE created_at < ?",
+                    (time.time() - max_age,)
+                )
+                row = cursor.fetchone()
+                if not row or row['seq'] is None:
+                    return 0
+                cursor = self.conn.execute("DELETE FROM change_log WHERE seq <= ?", (row['seq'],))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO system_config (key, value, updated_at) VALUES ('change_log_purged_seq', ?, CURRENT_TIMESTAMP)",
+                    (str(row['seq']),)
+                )
+                self.conn.commit()
+                logger.info(f"清理了 {cursor.rowcount} 条变更日志")
+                return cursor.rowcount
+            except Exception as e:
+                logger.error(f"清理变更日志失败: {str(e)}")
+                return 0
@@ -0,0 +1,94 @@
+"""
+启动导入耗时和内存检查
+在新的解释器中用 -X importtime 导入指定模块，统计总耗时、最慢的模块和进程峰值内存，
+并检查可选的重型解析库（talon、scikit-learn、mailparser等）没有在启动时被导入。
+超过阈值或加载了不应加载的库时以非零状态退出，可以作为回归检查使用:
+
+    python import_benchmark.py --max-ms 600 --max-rss 100
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# 启动时不应导入的模块，只在解析.msg文件或损坏的邮件时才需要
+LAZY_MODULES = ('talon', 'sklearn', 'mailparser', 'eml_parser', 'extract_msg')
+
+# 在子进程中执行：导入目标模块后输出已加载的可选库和峰值内存
+PROBE = """
+import resource, sys
+import {module}
+loaded = sorted(name for name in {lazy!r} if name in sys.modules)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('LOADED=' + ','.join(loaded))
+print('RSS_KB=' + str(rss // 1024 if sys.platform == 'darwin' else rss))
+"""
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='花火邮箱助手 - 启动导入耗时检查')
+    parser.add_argument('--module', default='utils.email', help='要导入的模块')
+    parser.add_argument('--runs', type=int, default=3, help='运行次数，取中位数')
+    parser.add_argument('--top', type=int, default=10, help='显示最慢的模块数')
+    parser.add_argument('--max-ms', type=float, default=None, help='导入耗时上限（毫秒）')
+    parser.add_argument('--max-rss', type=float, default=None, help='进程峰值内存上限（MB）')
+    return parser.parse_args()
+
+
+def run_once(module):
+    """在新的解释器中导入一次模块
+
+    Returns:
+        (总耗时毫秒, {模块: 累计耗时毫秒}, 已加载的可选库, 峰值内存MB)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module, lazy=LAZY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        if cumulative_us.strip().isdigit():
+            cumulative[name.strip()] = int(cumulative_us) / 1000
+
+    values = dict(line.split('=', 1) for line in result.stdout.splitlines() if '=' in line)
+    loaded = [name for name in values.get('LOADED', '').split(',') if name]
+    rss_mb = int(values.get('RSS_KB', 0)) / 1024
+    return cumulative.get(module, 0.0), cumulative, loaded, rss_mb
+
+
+def main():
+    args = parse_args()
+    runs = [run_once(args.module) for _ in range(max(1, args.runs))]
+    runs.sort(key=lambda run: run[0])
+    total_ms, cumulative, loaded, rss_mb = runs[len(runs) // 2]
+
+    print(f"导入 {args.module}: {total_ms:.0f} ms（{len(runs)} 次取中位数），峰值内存 {rss_mb:.1f} MB")
+    print(f"最慢的 {args.top} 个顶层依赖（累计耗时）:")
+    top_level = {name: ms for name, ms in cumulative.items() if '.' not in name and name != args.module}
+    for name, ms in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"错误: 启动时导入了应延迟加载的库: {', '.join(loaded)}")
+        failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"错误: 导入耗时 {total_ms:.0f} ms 超过上限 {args.max_ms:.0f} ms")
+        failed = True
+    if args.max_rss is not None and rss_mb > args.max_rss:
+        print(f"错误: 峰值内存 {rss_mb:.1f} MB 超过上限 {args.max_rss:.1f} MB")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
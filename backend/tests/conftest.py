@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# 测试从backend目录导入模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import Database, WriteLock
+
+
+@pytest.fixture
+def db(tmp_path):
+    """使用临时文件的独立数据库，不影响data目录和全局单例"""
+    instance = object.__new__(Database)
+    instance.lock = WriteLock(instance)
+    instance.connect_db(str(tmp_path / 'test.db'))
+    instance.init_db()
+    instance.upgrade_db()
+    yield instance
+    instance.close()
+
+
+@pytest.fixture
+def email_id(db):
+    """测试用的IMAP邮箱"""
+    db.create_user('tester', 'password')
+    user_id = db.conn.execute("SELECT id FROM users WHERE username = 'tester'").fetchone()[0]
+    return db.add_email(user_id, 'a@example.com', 'secret', mail_type='imap', server='127.0.0.1', port=143, use_ssl=False)
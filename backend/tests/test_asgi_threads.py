@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from ws_server.asgi_adapter import ThreadPoolWsgiToAsgi
+
+
+def wsgi_app(environ, start_response):
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(1)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [environ['PATH_INFO'].encode()]
+
+
+async def request(app, path):
+    """发送一个GET请求，返回 (状态码, 响应体, 耗时)"""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+             'headers': [], 'http_version': '1.1', 'scheme': 'http', 'server': ('test', 80)}
+    messages = []
+    started = time.monotonic()
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    status = messages[0]['status']
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return status, body, time.monotonic() - started
+
+
+def test_blocking_view_does_not_stall_other_requests():
+    app = ThreadPoolWsgiToAsgi(wsgi_app, max_workers=4)
+
+    async def main():
+        slow = asyncio.ensure_future(request(app, '/slow'))
+        await asyncio.sleep(0.1)
+        fast = await request(app, '/health')
+        return fast, await slow
+
+    try:
+        fast, slow = asyncio.run(main())
+    finally:
+        app.shutdown()
+
+    assert fast[:2] == (200, b'/health')
+    assert fast[2] < 0.5
+    assert slow[:2] == (200, b'/slow')
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+
+from ws_server.async_db import AsyncDatabase
+from ws_server.loop_monitor import LoopLagMonitor
+
+
+class SlowDatabase:
+    """模拟慢查询的同步数据库"""
+
+    db_path = 'test.db'
+
+    def __init__(self):
+        self.threads = set()
+
+    def slow_query(self, value, delay=0.3):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(delay)
+        return value * 2
+
+
+def test_slow_queries_do_not_block_event_loop():
+    db = SlowDatabase()
+    adb = AsyncDatabase(db, max_workers=4)
+    monitor = LoopLagMonitor(interval=0.02, warn_threshold=1)
+
+    async def main():
+        sampler = asyncio.ensure_future(monitor.run())
+        results = await asyncio.gather(*(adb.slow_query(i) for i in range(4)))
+        monitor.stop()
+        await sampler
+        return results
+
+    try:
+        assert asyncio.run(main()) == [0, 2, 4, 6]
+    finally:
+        adb.shutdown()
+
+    # 查询在专用线程池中执行，事件循环在查询期间持续采样且没有被阻塞
+    assert all(name.startswith('ws-db') for name in db.threads)
+    assert monitor.stats()['samples'] >= 5
+    assert monitor.max_lag < 0.1
+
+
+def test_blocking_call_on_loop_is_measured():
+    monitor = LoopLagMonitor(interval=0.02, warn_threshold=1)
+
+    async def main():
+        sampler = asyncio.ensure_future(monitor.run())
+        await asyncio.sleep(0.05)
+        time.sleep(0.3)
+        await asyncio.sleep(0.05)
+        monitor.stop()
+        await sampler
+
+    asyncio.run(main())
+    assert monitor.max_lag >= 0.2
+
+
+def test_attributes_are_proxied():
+    adb = AsyncDatabase(SlowDatabase())
+    try:
+        assert adb.db_path == 'test.db'
+    finally:
+        adb.shutdown()
@@ -0,0 +1,90 @@
+import time
+
+import jwt
+import pytest
+
+from utils.auth_cache import AuthCache
+
+SECRET = 'test-secret'
+
+
+def _user_id(db, username='tester'):
+    return db.conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()[0]
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_tokens_and_users_are_cached(db):
+    db.create_user('tester', 'password')
+    user_id = _user_id(db)
+    cache = AuthCache()
+    token = jwt.encode({'user_id': user_id, 'exp': time.time() + 60}, SECRET, algorithm='HS256')
+    loads = []
+
+    def loader(uid):
+        loads.append(uid)
+        return db.get_user_by_id(uid)
+
+    for _ in range(3):
+        assert cache.decode_token(token, SECRET)['user_id'] == user_id
+        assert cache.get_user(user_id, loader)['username'] == 'tester'
+
+    stats = cache.get_stats()
+    assert loads == [user_id]
+    assert stats['token_hits'] == 2 and stats['user_hits'] == 2
+
+
+def test_expired_token_rejected_from_cache():
+    cache = AuthCache()
+    exp = int(time.time()) + 1
+    token = jwt.encode({'user_id': 1, 'exp': exp}, SECRET, algorithm='HS256')
+    cache.decode_token(token, SECRET)
+    time.sleep(exp - time.time() + 0.1)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.decode_token(token, SECRET)
+
+
+def test_changes_in_other_process_invalidate_cache(db):
+    """另一个进程（这里是另一个缓存实例）修改密码或删除用户后，缓存在读取间隔内失效"""
+    db.create_user('tester', 'password')
+    db.create_user('other', 'password')
+    user_id = _user_id(db)
+    other_id = _user_id(db, 'other')
+    cache = AuthCache()
+    cache.watch(lambda: db.get_change_counter('auth'), interval=0.05)
+    try:
+        cache.get_user(user_id, db.get_user_by_id)
+        assert cache.lookup_user(user_id) is not None
+
+        db.update_user_password(user_id, 'changed')
+        assert _wait_for(lambda: user_id not in cache.users)
+
+        cache.get_user(other_id, db.get_user_by_id)
+        db.delete_user(other_id)
+        assert _wait_for(lambda: other_id not in cache.users)
+        assert cache.get_user(other_id, db.get_user_by_id) is None
+        assert cache.get_stats()['remote_invalidations'] == 2
+    finally:
+        cache.unwatch()
+
+
+def test_unrelated_updates_keep_cache(db):
+    db.create_user('tester', 'password')
+    user_id = _user_id(db)
+    cache = AuthCache()
+    cache.watch(lambda: db.get_change_counter('auth'), interval=0.05)
+    try:
+        cache.get_user(user_id, db.get_user_by_id)
+        db.set_system_config('allow_register', 'false')
+        time.sleep(0.2)
+        assert cache.lookup_user(user_id) is not None
+        assert cache.get_stats()['remote_invalidations'] == 0
+    finally:
+        cache.unwatch()
@@ -0,0 +1,48 @@
+def _seq(db):
+    return db.get_change_cursor()
+
+
+def test_check_bookkeeping_does_not_create_changes(db, email_id):
+    cursor = _seq(db)
+
+    db.update_check_time(email_id)
+    db.update_email_token(email_id, 'token')
+    db.record_email_success(email_id)
+    db.record_email_failure(email_id, 'timeout')
+
+    assert _seq(db) == cursor
+    assert db.get_changes(cursor)['emails']['upserted'] == []
+
+
+def test_listed_columns_bump_counter(db, email_id):
+    version = db.get_change_counter('emails')
+    db.update_email_token(email_id, 'token')
+    assert db.get_change_counter('emails') == version
+
+    db.record_email_failure(email_id, 'timeout')
+    assert db.get_change_counter('emails') == version + 1
+    db.update_check_time(email_id)
+    assert db.get_change_counter('emails') == version + 2
+
+
+def test_visible_changes_are_logged(db, email_id):
+    cursor = _seq(db)
+    version = db.get_change_counter('emails')
+
+    db.update_email(email_id, password='new-secret')
+    db.set_email_realtime_check(email_id, False)
+
+    changes = db.get_changes(cursor)
+    assert [row['id'] for row in changes['emails']['upserted']] == [email_id]
+    assert db.get_change_counter('emails') == version + 2
+
+
+def test_circuit_transition_is_logged(db, email_id):
+    cursor = _seq(db)
+    db.open_email_circuit(email_id, 0)
+    assert _seq(db) > cursor
+
+    # 再次打开只更新冷却时间，状态没有变化
+    cursor = _seq(db)
+    db.open_email_circuit(email_id, 100)
+    assert _seq(db) == cursor
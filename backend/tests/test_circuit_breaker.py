@@ -0,0 +1,64 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.email._circuit_breaker import CircuitBreaker
+from utils.email._real_time_check import RealTimeChecker
+
+
+class Processor:
+    """记录提交的检查任务，enqueue_result为None时模拟入队失败"""
+
+    def __init__(self, db, enqueue_result=1):
+        self.circuit_breaker = CircuitBreaker(db)
+        self.job_queue = SimpleNamespace(owner='test:1')
+        self.enqueue_result = enqueue_result
+        self.enqueued = []
+
+    def enqueue_check(self, account, callback=None, is_realtime=False):
+        self.enqueued.append(account['id'])
+        return self.enqueue_result
+
+
+def _open_account(db, email_id, last_check_time=None):
+    db.open_email_circuit(email_id, time.time() - 1)
+    account = dict(db.get_email_by_id(email_id))
+    account['last_check_time'] = last_check_time
+    return account
+
+
+def _circuit_state(db, email_id):
+    return db.get_email_by_id(email_id)['circuit_state']
+
+
+def test_skipped_submission_keeps_probe_available(db, email_id):
+    processor = Processor(db)
+    checker = RealTimeChecker(db, processor)
+    account = _open_account(db, email_id, last_check_time=datetime.now())
+
+    assert processor.circuit_breaker.allow(account)
+    checker._submit_check_task(account, 1)
+
+    # 最近检查过而跳过提交时不占用试探机会
+    assert processor.enqueued == []
+    assert _circuit_state(db, email_id) == 'open'
+
+
+def test_probe_taken_only_when_enqueued(db, email_id):
+    processor = Processor(db)
+    checker = RealTimeChecker(db, processor)
+    checker._submit_check_task(_open_account(db, email_id), 1)
+
+    assert processor.enqueued == [email_id]
+    assert _circuit_state(db, email_id) == 'half_open'
+
+
+def test_probe_released_when_enqueue_fails(db, email_id):
+    processor = Processor(db, enqueue_result=None)
+    checker = RealTimeChecker(db, processor)
+    account = _open_account(db, email_id)
+    checker._submit_check_task(account, 1)
+
+    row = db.get_email_by_id(email_id)
+    assert row['circuit_state'] == 'open'
+    assert processor.circuit_breaker.allow(dict(row))
@@ -0,0 +1,36 @@
+import pytest
+
+from utils.email._code_extractor import CodeExtractor
+
+
+def codes(subject, content=''):
+    return [value for kind, value in CodeExtractor().extract(subject, content) if kind == 'code']
+
+
+@pytest.mark.parametrize('subject, content, expected', [
+    ('Your code is 123456', '', '123456'),
+    ('验证码：123456', '', '123456'),
+    ('您的验证码为842913，10分钟内有效', '', '842913'),
+    ('123456 is your verification code', '', '123456'),
+    ('654321是您的验证码', '', '654321'),
+    ('OTP: 4821', '', '4821'),
+    ('Sign in', 'Your PIN is 7391. Do not share it.', '7391'),
+    ('Verify', 'Enter this code: A7K9Q2', 'A7K9Q2'),
+])
+def test_extracts_codes(subject, content, expected):
+    assert codes(subject, content)[:1] == [expected]
+
+
+@pytest.mark.parametrize('subject, content', [
+    ('Shipping update: order 2024', ''),
+    ('Your order 58213 has shipped', 'Tracking number will follow.'),
+    ('opinion pieces from 2023', ''),
+    ('Barcode 1234', ''),
+    ('Options for 2025 are pinned', ''),
+    ('Receipt', 'Total charged: $1299 with promo code applied'),
+    ('Receipt', 'Use code SAVE at checkout, price 1299.00'),
+    ('Invoice', 'Amount ¥3999 paid. Your passcode was not changed.'),
+    ('Annual report', 'Revenue grew 12% in 2024 compared to 2023.'),
+])
+def test_ignores_years_orders_and_prices(subject, content):
+    assert codes(subject, content) == []
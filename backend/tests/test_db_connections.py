@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+def _insert_mail(db, email_id, subject):
+    db.conn.execute(
+        "INSERT INTO mail_records (email_id, subject, sender, received_time, content) VALUES (?, ?, 's', '2024-01-01', '')",
+        (email_id, subject)
+    )
+
+
+def test_readers_do_not_see_uncommitted_writes(db, email_id):
+    db.add_mail_record(email_id, 'first', 'sender@example.com', '2024-01-01 10:00:00', 'body')
+    max_id = db.get_max_mail_id()
+    inserted = threading.Event()
+    release = threading.Event()
+
+    def batch_that_rolls_back():
+        with db.lock:
+            _insert_mail(db, email_id, 'half')
+            inserted.set()
+            release.wait(5)
+            db.conn.rollback()
+
+    writer = threading.Thread(target=batch_that_rolls_back)
+    writer.start()
+    try:
+        assert inserted.wait(5)
+        # 读操作不等待写锁，也读不到未提交的记录
+        started = time.monotonic()
+        assert db.get_max_mail_id() == max_id
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        writer.join(5)
+    assert db.get_max_mail_id() == max_id
+
+
+def test_unfinished_transaction_is_rolled_back_on_unlock(db, email_id):
+    done = threading.Event()
+    finish = threading.Event()
+
+    def failed_writer():
+        # 写操作出错后既没有提交也没有回滚
+        with db.lock:
+            _insert_mail(db, email_id, 'dangling')
+        done.set()
+        finish.wait(5)
+
+    thread = threading.Thread(target=failed_writer)
+    thread.start()
+    try:
+        assert done.wait(5)
+        started = time.monotonic()
+        db.update_check_time(email_id)
+        assert time.monotonic() - started < 1
+        row = db.conn.execute("SELECT last_check_time FROM emails WHERE id = ?", (email_id,)).fetchone()
+        assert row['last_check_time'] is not None
+        assert db.conn.execute("SELECT COUNT(*) FROM mail_records WHERE subject = 'dangling'").fetchone()[0] == 0
+    finally:
+        finish.set()
+        thread.join(5)
+
+
+def test_each_thread_has_its_own_connection(db):
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(db.conn))
+    thread.start()
+    thread.join()
+    assert connections[0] is not db.conn
+
+    db.close()
+    assert db.conn is None
@@ -0,0 +1,43 @@
+import threading
+import time
+
+
+def test_writers_wait_for_open_transaction(db, email_id):
+    """其他线程的事务未提交时，普通写方法等待锁而不是提交或回滚它的半个事务"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def bulk_transaction():
+        with db.lock:
+            db.conn.execute(
+                "INSERT INTO emails (user_id, email, password, mail_type) VALUES (1, 'half@example.com', 'x', 'imap')"
+            )
+            started.set()
+            release.wait(5)
+            db.conn.rollback()
+
+    holder = threading.Thread(target=bulk_transaction)
+    holder.start()
+    assert started.wait(5)
+
+    writers = [
+        threading.Thread(target=db.update_check_time, args=(email_id,)),
+        threading.Thread(target=db.update_email_token, args=(email_id, 'token')),
+        threading.Thread(target=db.add_mail_record,
+                         args=(email_id, 'subject', 'sender@example.com', '2024-01-01 10:00:00', 'body')),
+    ]
+    for writer in writers:
+        writer.start()
+    time.sleep(0.2)
+    assert all(writer.is_alive() for writer in writers)
+
+    release.set()
+    holder.join(5)
+    for writer in writers:
+        writer.join(5)
+
+    assert db.conn.execute("SELECT COUNT(*) FROM emails WHERE email = 'half@example.com'").fetchone()[0] == 0
+    row = db.conn.execute("SELECT last_check_time, access_token FROM emails WHERE id = ?", (email_id,)).fetchone()
+    assert row['last_check_time'] is not None
+    assert row['access_token'] == 'token'
+    assert db.conn.execute("SELECT COUNT(*) FROM mail_records WHERE email_id = ?", (email_id,)).fetchone()[0] == 1
@@ -0,0 +1,99 @@
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from utils.email._deadline import CancelToken, CheckCancelled, CheckTimeout
+from utils.email.imap import IMAPMailHandler
+
+
+class StallingHandler(socketserver.StreamRequestHandler):
+    """回复登录、选择和搜索，FETCH只发送一半的响应后停止发送"""
+
+    def handle(self):
+        self.server.connections.append(self.connection)
+        self.wfile.write(b'* OK [CAPABILITY IMAP4rev1] stub ready\r\n')
+        for line in self.rfile:
+            tag, _, rest = line.strip().partition(b' ')
+            command = rest.split(b' ', 1)[0].upper()
+            if command == b'SELECT':
+                self.wfile.write(b'* 2 EXISTS\r\n' + tag + b' OK [READ-WRITE] done\r\n')
+            elif command == b'SEARCH':
+                self.wfile.write(b'* SEARCH 1 2\r\n' + tag + b' OK done\r\n')
+            elif command == b'FETCH':
+                self.wfile.write(b'* 1 FETCH (BODY[HEADER.FIELDS (SUBJECT FROM DATE)] {500}\r\nSubject: partial')
+                self.wfile.flush()
+                # 不再发送剩余内容，也不关闭连接，直到客户端断开
+                self.server.stalled.set()
+                self.connection.settimeout(10)
+                try:
+                    while self.connection.recv(1024):
+                        pass
+                except OSError:
+                    pass
+                self.server.closed.set()
+                return
+            else:
+                self.wfile.write(tag + b' OK done\r\n')
+
+
+class StallingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StallingHandler)
+        self.connections = []
+        self.stalled = threading.Event()
+        self.closed = threading.Event()
+
+
+@pytest.fixture
+def server():
+    srv = StallingServer()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _fetch(server, token):
+    return IMAPMailHandler.fetch_emails('a@example.com', 'secret', '127.0.0.1', server.server_address[1],
+                                        use_ssl=False, cancel_token=token)
+
+
+def test_stalled_fetch_fails_within_deadline(server):
+    token = CancelToken(timeout=1, socket_timeout=30)
+    started = time.time()
+    with pytest.raises(CheckTimeout):
+        _fetch(server, token)
+    elapsed = time.time() - started
+
+    assert server.stalled.is_set()
+    # 整体预算为1秒，远小于30秒的socket超时
+    assert elapsed < 3
+    # 客户端关闭了连接，服务器端读到EOF
+    assert server.closed.wait(2)
+    token.release()
+
+
+def test_cancel_interrupts_stalled_fetch(server):
+    token = CancelToken(socket_timeout=30)
+    threading.Thread(target=lambda: server.stalled.wait(5) and token.cancel(), daemon=True).start()
+    started = time.time()
+    with pytest.raises(CheckCancelled) as info:
+        _fetch(server, token)
+
+    assert not isinstance(info.value, CheckTimeout)
+    assert time.time() - started < 3
+    assert server.closed.wait(2)
+
+
+def test_socket_timeout_bounds_each_read(server):
+    token = CancelToken(socket_timeout=0.5)
+    started = time.time()
+    with pytest.raises((socket.timeout, OSError)):
+        _fetch(server, token)
+    assert time.time() - started < 3
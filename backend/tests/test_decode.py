@@ -0,0 +1,58 @@
+from utils.email import common
+from utils.email.common import DETECT_SAMPLE_SIZE, decode_bytes, safe_decode
+
+CHINESE = '您好，这是一封测试邮件，验证码已经发送到您的邮箱，请在十分钟内完成验证。' * 4
+TRADITIONAL = '您好，這是一封測試郵件，驗證碼已經發送到您的郵箱，請在十分鐘內完成驗證。' * 4
+
+
+def no_detection(sample):
+    raise AssertionError('不应进行编码检测')
+
+
+def test_declared_charset_is_used_without_detection(monkeypatch):
+    monkeypatch.setattr(common, '_detect_charset', no_detection)
+    assert decode_bytes(CHINESE.encode('gbk'), 'gb2312') == CHINESE
+    assert decode_bytes(TRADITIONAL.encode('big5'), 'big5') == TRADITIONAL
+    assert decode_bytes(CHINESE.encode('utf-8'), '"UTF-8"') == CHINESE
+
+
+def test_single_byte_declaration_tries_utf8_first(monkeypatch):
+    monkeypatch.setattr(common, '_detect_charset', no_detection)
+    # 误标为iso-8859-1的UTF-8内容
+    assert decode_bytes('Grüße, café'.encode('utf-8'), 'iso-8859-1') == 'Grüße, café'
+    # 真正的latin1内容
+    assert decode_bytes('Grüße, café'.encode('latin1'), 'iso-8859-1') == 'Grüße, café'
+
+
+def test_strict_utf8_before_detection(monkeypatch):
+    monkeypatch.setattr(common, '_detect_charset', no_detection)
+    assert decode_bytes(CHINESE.encode('utf-8')) == CHINESE
+    # 未知的声明编码按未声明处理
+    assert decode_bytes(CHINESE.encode('utf-8'), 'x-unknown') == CHINESE
+
+
+def test_detection_for_undeclared_gbk_and_big5():
+    assert decode_bytes(CHINESE.encode('gbk')) == CHINESE
+    assert decode_bytes(TRADITIONAL.encode('big5')) == TRADITIONAL
+    # 声明错误时也通过检测解码
+    assert decode_bytes(CHINESE.encode('gbk'), 'utf-8') == CHINESE
+
+
+def test_detection_uses_leading_sample_only(monkeypatch):
+    samples = []
+
+    def detect(sample):
+        samples.append(len(sample))
+        return 'gbk'
+
+    monkeypatch.setattr(common, '_detect_charset', detect)
+    content = CHINESE.encode('gbk') * 200
+    assert len(content) > DETECT_SAMPLE_SIZE
+    assert decode_bytes(content) == CHINESE * 200
+    assert samples == [DETECT_SAMPLE_SIZE]
+
+
+def test_safe_decode_never_raises():
+    assert safe_decode(b'') == ''
+    assert safe_decode(None) == ''
+    assert isinstance(safe_decode(bytes(range(256)), 'utf-8'), str)
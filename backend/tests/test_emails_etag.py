@@ -0,0 +1,50 @@
+import importlib
+
+import pytest
+
+from database.db import Database
+
+
+@pytest.fixture
+def client(db, email_id, monkeypatch, tmp_path):
+    """使用临时数据库的Flask测试客户端，登录为测试用户"""
+    # 导入app时在当前目录创建日志文件
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Database, '_instance', db)
+    app_module = importlib.import_module('app')
+    monkeypatch.setattr(app_module, 'db', db)
+    app_module.auth_cache.unwatch()
+    app_module.auth_cache.clear()
+    client = app_module.app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'tester', 'password': 'password'}).get_json()['token']
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    yield client
+    app_module.auth_cache.clear()
+
+
+def _etag(client, etag=None):
+    headers = {'If-None-Match': etag} if etag else {}
+    response = client.get('/api/emails', headers=headers)
+    return response.status_code, response.headers.get('ETag'), response.get_json()
+
+
+def test_failure_and_check_time_change_etag(client, db, email_id):
+    status, etag, emails = _etag(client)
+    assert status == 200 and emails[0]['consecutive_failures'] == 0
+    assert _etag(client, etag)[0] == 304
+
+    db.record_email_failure(email_id, 'timeout')
+    status, new_etag, emails = _etag(client, etag)
+    assert status == 200 and new_etag != etag
+    assert emails[0]['consecutive_failures'] == 1 and emails[0]['last_error'] == 'timeout'
+
+    db.update_check_time(email_id)
+    status, checked_etag, emails = _etag(client, new_etag)
+    assert status == 200 and checked_etag != new_etag
+    assert emails[0]['last_check_time']
+
+
+def test_token_refresh_keeps_etag(client, db, email_id):
+    _, etag, _ = _etag(client)
+    db.update_email_token(email_id, 'new-access-token')
+    assert _etag(client, etag)[0] == 304
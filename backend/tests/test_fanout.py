@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+from ws_server.fanout import FanOut
+from ws_server.handler import WebSocketHandler
+
+
+class FakeSocket:
+    """记录收到的消息，stall为True时发送永远不完成"""
+
+    def __init__(self, stall=False):
+        self.stall = stall
+        self.sent = []
+        self.closed_with = None
+        self.remote_address = ('127.0.0.1', 0)
+
+    async def send(self, payload):
+        if self.stall:
+            await asyncio.Event().wait()
+        self.sent.append(payload)
+
+    async def close(self, code=1000, reason=''):
+        self.closed_with = code
+
+
+def test_slow_consumer_is_dropped_without_delaying_others():
+    async def main():
+        fanout = FanOut(max_queue=10, send_timeout=5)
+        fast, slow = FakeSocket(), FakeSocket(stall=True)
+        fanout.register(fast)
+        fanout.register(slow)
+        for i in range(20):
+            fanout.send_many([fast, slow], {'type': 'tick', 'i': i})
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+        stats = fanout.get_stats()
+        fanout.unregister(fast)
+        fanout.unregister(slow)
+        return fast, slow, stats
+
+    fast, slow, stats = asyncio.run(main())
+    assert [json.loads(payload)['i'] for payload in fast.sent] == list(range(20))
+    assert slow.closed_with == 1013
+    assert stats['slow_consumers'] == 1
+
+
+def test_progress_messages_are_coalesced():
+    async def main():
+        fanout = FanOut()
+        socket = FakeSocket()
+        fanout.register(socket)
+        # 写协程还没有运行，三条进度在队列中合并为最新的一条
+        for progress in (10, 50, 90):
+            fanout.send(socket, {'type': 'check_progress', 'progress': progress}, ('check_progress', 1))
+        fanout.send(socket, {'type': 'done'})
+        await asyncio.sleep(0.01)
+        fanout.unregister(socket)
+        return socket, fanout.get_stats()
+
+    socket, stats = asyncio.run(main())
+    assert [json.loads(payload) for payload in socket.sent] == [
+        {'type': 'check_progress', 'progress': 90}, {'type': 'done'}
+    ]
+    assert stats['coalesced'] == 2
+
+
+def test_message_serialized_once_for_all_connections():
+    async def main():
+        fanout = FanOut()
+        sockets = [FakeSocket() for _ in range(100)]
+        for socket in sockets:
+            fanout.register(socket)
+        assert fanout.send_many(sockets, {'type': 'new_mail'}) == 100
+        await asyncio.sleep(0.01)
+        for socket in sockets:
+            fanout.unregister(socket)
+        return sockets
+
+    sockets = asyncio.run(main())
+    payloads = [socket.sent[0] for socket in sockets]
+    assert all(payload is payloads[0] for payload in payloads)
+
+
+def test_deletions_only_reach_owner():
+    async def main():
+        handler = WebSocketHandler()
+        owner, other = FakeSocket(), FakeSocket()
+        for user_id, socket in ((1, owner), (2, other)):
+            handler.clients[socket] = user_id
+            handler.user_sockets[user_id] = {socket}
+            handler.fanout.register(socket)
+        await handler.broadcast_emails_deleted({1: [5]})
+        await asyncio.sleep(0.01)
+        for socket in (owner, other):
+            handler.fanout.unregister(socket)
+        return owner, other
+
+    owner, other = asyncio.run(main())
+    assert [json.loads(payload) for payload in owner.sent] == [{'type': 'emails_deleted', 'email_ids': [5]}]
+    assert other.sent == []
@@ -0,0 +1,45 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from utils.email._html_text import detect_vendors, html_to_text
+from utils.email.common import strip_html
+
+SAMPLES = [
+    '<p>Hello <b>world</b></p>',
+    '<html><head><title>标题</title><style>p {color: red}</style></head>'
+    '<body><p>验证码：<b>123456</b></p><script>var a = "<p>x</p>";</script></body></html>',
+    '<div>A &amp; B &lt;tag&gt; &nbsp;&#x4e2d;&#25991;</div><!-- 注释 --><br/>end',
+    '<table><tr><td>一</td><td>二</td></tr></table>\n<p>line1<br>line2</p>',
+    '<p>unclosed <i>italic <b>bold',
+    '<template><p>hidden</p></template><p>shown</p>',
+]
+
+
+@pytest.mark.parametrize('html', SAMPLES)
+def test_text_matches_beautifulsoup(html):
+    assert html_to_text(html)['text'] == BeautifulSoup(html, 'html.parser').get_text()
+    assert strip_html(html) == BeautifulSoup(html, 'html.parser').get_text()
+
+
+def test_preview_collapses_whitespace_and_is_truncated():
+    result = html_to_text('<p>Hello\n\n   <b>world</b></p>\n<p>' + 'x' * 300 + '</p>', preview_length=20)
+    assert result['preview'] == 'Hello world xxxxxxxx'
+    assert html_to_text('<script>hidden</script><p> shown </p>')['preview'] == 'shown'
+
+
+def test_vendor_signatures():
+    microsoft = html_to_text('<p class="MsoNormal">Hi</p>')
+    assert microsoft['is_microsoft_email'] and not microsoft['is_github_email']
+    # 特征在属性、注释和被跳过的标签中也能识别
+    assert html_to_text('<a href="https://github.com/x">repo</a>')['is_github_email']
+    assert html_to_text('<div data-block-id="1"></div>')['is_notion_email']
+    assert html_to_text('<!-- sent via outlook.com -->')['is_microsoft_email']
+    plain = html_to_text('<p>nothing special</p>')
+    assert not any(plain[key] for key in ('is_microsoft_email', 'is_notion_email', 'is_github_email'))
+    assert detect_vendors('<p STYLE="MSO-line-height">x</p>') == {
+        'is_microsoft_email': True, 'is_notion_email': False, 'is_github_email': False}
+
+
+def test_strip_html_empty_and_non_string():
+    assert strip_html('') == ''
+    assert strip_html(None) == ''
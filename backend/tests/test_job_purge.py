@@ -0,0 +1,59 @@
+import time
+
+from utils.email._importer import parse_import_data
+from utils.email._job_queue import JobQueue
+
+
+def _finish(db, kind, age, payload=None):
+    job_id, _ = db.enqueue_job(kind, payload=payload)
+    db.conn.execute(
+        "UPDATE job_queue SET status = 'done', finished_at = ? WHERE id = ?",
+        (time.time() - age, job_id)
+    )
+    db.conn.commit()
+    return job_id
+
+
+def _exists(db, job_id):
+    return db.get_job(job_id) is not None
+
+
+def test_purge_uses_per_kind_retention(db):
+    queue = JobQueue(db)
+    queue.register('check', lambda job, ctx: {}, None, retention=3600)
+    queue.register('import', lambda job, ctx: {}, None)
+
+    old_check = _finish(db, 'check', 2 * 3600)
+    new_check = _finish(db, 'check', 60)
+    recent_import = _finish(db, 'import', 2 * 3600)
+    old_import = _finish(db, 'import', 8 * 24 * 3600)
+
+    assert queue.purge() == 2
+    assert not _exists(db, old_check)
+    assert _exists(db, new_check)
+    assert _exists(db, recent_import)
+    assert not _exists(db, old_import)
+
+
+def test_sensitive_payload_cleared(db):
+    queue = JobQueue(db)
+    queue.register('import', lambda job, ctx: {'success': True}, None, sensitive=True)
+    queue.register('reparse', lambda job, ctx: {'success': True}, None)
+
+    # 正常结束的任务在结束时清除参数
+    job_id, _ = db.enqueue_job('import', payload={'data': 'a@example.com----secret'})
+    job = db.claim_jobs(queue.owner, 1, 60, kinds=['import'])[0]
+    queue._run_job(job, lambda job, ctx: {'success': True})
+    assert db.get_job(job_id)['payload'] is None
+
+    # 重试耗尽或被取消的任务由定期清理清除参数，其他类型的参数保留
+    failed_id = _finish(db, 'import', 60, payload={'data': 'b@example.com----secret'})
+    reparse_id = _finish(db, 'reparse', 60, payload={'filters': {}})
+    queue.purge()
+    assert db.get_job(failed_id)['payload'] is None
+    assert db.get_job(reparse_id)['payload'] == {'filters': {}}
+
+
+def test_import_failures_do_not_keep_credentials():
+    _, failed = parse_import_data('a@example.com----secret----only-three\nb@example.com----secret----  ----token')
+    assert [item['content'] for item in failed] == ['a@example.com', 'b@example.com']
@@ -0,0 +1,40 @@
+from utils.email.mail_processor import EmailBatchProcessor
+
+
+def _processor(db):
+    processor = EmailBatchProcessor(db, max_workers=1)
+    processor.status_checker = None
+    return processor
+
+
+def test_searches_with_different_criteria_are_separate_jobs(db, email_id):
+    processor = _processor(db)
+    try:
+        info = db.get_email_by_id(email_id)
+        first = processor.enqueue_search(info, sender='a@example.com', limit=5)
+        # 第一个搜索已在执行
+        db.conn.execute("UPDATE job_queue SET status = 'running' WHERE id = ?", (first,))
+        db.conn.commit()
+        by_subject = processor.enqueue_search(info, subject='验证码', limit=5)
+        by_limit = processor.enqueue_search(info, sender='a@example.com', limit=20)
+        assert len({first, by_subject, by_limit}) == 3
+        assert db.get_job(by_subject)['payload']['subject'] == '验证码'
+        assert db.get_job(by_limit)['payload']['limit'] == 20
+
+        # 条件相同的搜索合并到未完成的任务
+        assert processor.enqueue_search(info, sender='a@example.com', limit=5) == first
+        assert processor.enqueue_search(info, subject='验证码', limit=5) == by_subject
+    finally:
+        processor.shutdown(drain=False, timeout=0)
+
+
+def test_checks_still_merge_per_mailbox(db, email_id):
+    processor = _processor(db)
+    try:
+        info = db.get_email_by_id(email_id)
+        assert processor.enqueue_check(info) == processor.enqueue_check(info)
+        # 重复升级不会丢失去重索引
+        db.upgrade_db()
+        assert processor.enqueue_check(info) == processor.enqueue_check(info)
+    finally:
+        processor.shutdown(drain=False, timeout=0)
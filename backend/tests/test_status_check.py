@@ -0,0 +1,93 @@
+import socketserver
+import threading
+
+import pytest
+
+from utils.email._deadline import CancelToken
+from utils.email._status_check import SessionPool, StatusChecker
+
+
+class StatusHandler(socketserver.StreamRequestHandler):
+    """只支持LOGIN、STATUS、LOGOUT，密码不对时拒绝登录"""
+
+    def handle(self):
+        self.wfile.write(b'* OK [CAPABILITY IMAP4rev1] stub ready\r\n')
+        for line in self.rfile:
+            tag, _, rest = line.strip().partition(b' ')
+            command = rest.split(b' ', 1)[0].upper()
+            if command == b'LOGIN':
+                password = rest.split(b' ')[2].strip(b'"').decode()
+                if password != self.server.password:
+                    self.wfile.write(tag + b' NO bad credentials\r\n')
+                    continue
+                self.server.logins.append(password)
+                self.wfile.write(tag + b' OK logged in\r\n')
+            elif command == b'STATUS':
+                self.wfile.write(b'* STATUS INBOX (UIDNEXT 5 MESSAGES 4 UIDVALIDITY 7)\r\n' + tag + b' OK done\r\n')
+            elif command == b'LOGOUT':
+                self.server.logouts += 1
+                self.wfile.write(b'* BYE\r\n' + tag + b' OK bye\r\n')
+                return
+            else:
+                self.wfile.write(tag + b' OK done\r\n')
+
+
+class StatusServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StatusHandler)
+        self.password = 'old'
+        self.logins = []
+        self.logouts = 0
+
+
+@pytest.fixture
+def server():
+    srv = StatusServer()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def checker():
+    checker = StatusChecker(db=None, pool=SessionPool())
+    yield checker
+    checker.pool.close_all()
+
+
+def _info(server, password):
+    return {'id': 1, 'email': 'a@example.com', 'password': password, 'mail_type': 'imap',
+            'server': '127.0.0.1', 'port': server.server_address[1], 'use_ssl': False}
+
+
+def test_session_is_reused_with_unchanged_credentials(server, checker):
+    info = _info(server, 'old')
+    assert checker.snapshot(info)['INBOX']['uidnext'] == 5
+    assert checker.snapshot(info)['INBOX']['uidnext'] == 5
+    assert server.logins == ['old']
+    assert checker.get_stats()['reused_sessions'] == 1
+
+
+def test_password_change_drops_pooled_session(server, checker):
+    assert checker.snapshot(_info(server, 'old')) is not None
+    server.password = 'new'
+    # 旧连接在服务器上仍然有效，但不能继续用旧密码的会话
+    assert checker.snapshot(_info(server, 'new')) is not None
+    assert server.logins == ['old', 'new']
+    assert server.logouts == 1
+    assert len(checker.pool) == 1
+    assert checker.get_stats()['reused_sessions'] == 0
+
+
+def test_reused_session_uses_current_timeout(server, checker):
+    info = _info(server, 'old')
+    assert checker.snapshot(info, CancelToken(socket_timeout=30)) is not None
+    mail = checker.pool.sessions[1][0]
+    assert mail.sock.gettimeout() == 30
+    assert checker.snapshot(info, CancelToken(timeout=2, socket_timeout=30)) is not None
+    assert checker.pool.sessions[1][0] is mail
+    assert mail.sock.gettimeout() <= 2
@@ -0,0 +1,183 @@
+"""
+认证缓存
+REST接口的token_required和WebSocket的validate_token每次都要解码JWT并查询用户，
+这里缓存解码后的令牌和用户信息（带过期时间和数量上限的LRU），
+用户被删除、修改密码或权限变更时由Database主动失效本进程中对应的缓存；
+多进程部署时，各进程定期读取数据库中的认证版本号（users表的触发器维护），
+版本号变化说明其他进程修改了用户，清空本进程的缓存，失效延迟不超过读取间隔（默认2秒）。
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class AuthCache:
+    """线程安全的令牌和用户信息缓存"""
+
+    def __init__(self, ttl=60, max_size=4096):
+        """初始化缓存
+
+        Args:
+            ttl: 用户信息的缓存时间，单位为秒，0表示不缓存
+            max_size: 令牌和用户各自最多缓存的条目数
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()  # 令牌 -> 解码后的内容
+        self.users = OrderedDict()  # 用户ID -> (用户信息, 缓存时间)
+        self.version = 0  # 每次失效加一，避免失效前读取的旧数据在失效后写回
+        self.stats = {
+            'token_hits': 0, 'token_misses': 0,
+            'user_hits': 0, 'user_misses': 0,
+            'invalidations': 0, 'remote_invalidations': 0
+        }
+        self.watcher = None
+        self.watching = False
+
+    def decode_token(self, token, secret):
+        """解码JWT令牌，已缓存的令牌只检查过期时间
+
+        Raises:
+            jwt.ExpiredSignatureError: 令牌已过期
+            jwt.InvalidTokenError: 令牌无效
+        """
+        now = time.time()
+        with self.lock:
+            payload = self.tokens.get(token)
+            if payload is not None:
+                self.tokens.move_to_end(token)
+                self.stats['token_hits'] += 1
+            else:
+                self.stats['token_misses'] += 1
+
+        if payload is not None:
+            if payload.get('exp') is not None and payload['exp'] <= now:
+                with self.lock:
+                    self.tokens.pop(token, None)
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            return payload
+
+        payload = jwt.decode(token, secret, algorithms=["HS256"])
+        if self.ttl > 0:
+            with self.lock:
+                self.tokens[token] = payload
+                self._trim(self.tokens)
+        return payload
+
+    def lookup_user(self, user_id):
+        """读取缓存的用户信息，未缓存或已过期时返回None"""
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                self.users.move_to_end(user_id)
+                self.stats['user_hits'] += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self.users[user_id]
+            self.stats['user_misses'] += 1
+            return None
+
+    def store_user(self, user_id, user, version):
+        """缓存用户信息，读取之后发生过失效时放弃写入
+
+        Args:
+            version: 读取数据库之前的self.version
+        """
+        if user is None or self.ttl <= 0:
+            return
+        with self.lock:
+            if version != self.version:
+                return
+            self.users[user_id] = (dict(user), time.time())
+            self._trim(self.users)
+
+    def get_user(self, user_id, loader):
+        """获取用户信息，未命中时调用loader(user_id)从数据库读取"""
+        user = self.lookup_user(user_id)
+        if user is not None:
+            return user
+        version = self.version
+        user = loader(user_id)
+        self.store_user(user_id, user, version)
+        return dict(user) if user is not None else None
+
+    def invalidate_user(self, user_id):
+        """用户被删除、修改密码或权限变更时失效缓存，该用户的令牌也一并清除"""
+        with self.lock:
+            self.version += 1
+            self.users.pop(user_id, None)
+            for token in [t for t, payload in self.tokens.items() if payload.get('user_id') == user_id]:
+                del self.tokens[token]
+            self.stats['invalidations'] += 1
+        logger.debug(f"已失效用户ID {user_id} 的认证缓存")
+
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.version += 1
+            self.tokens.clear()
+            self.users.clear()
+
+    def watch(self, loader, interval=2.0):
+        """启动后台线程定期读取认证版本号，变化时清空缓存
+
+        Args:
+            loader: 返回当前认证版本号的函数，读取失败时返回None
+            interval: 读取间隔，单位为秒，即其他进程修改用户后本进程缓存的最长失效延迟
+        """
+        if self.watching:
+            return
+        self.watching = True
+        self.watcher = threading.Thread(target=self._watch_loop, args=(loader, interval),
+                                        name='auth-cache-watch', daemon=True)
+        self.watcher.start()
+
+    def unwatch(self):
+        """停止读取认证版本号"""
+        self.watching = False
+        if self.watcher is not None:
+            self.watcher.join(timeout=5)
+            self.watcher = None
+
+    def _watch_loop(self, loader, interval):
+        last = loader()
+        while self.watching:
+            time.sleep(interval)
+            if not self.watching:
+                break
+            epoch = loader()
+            if epoch is None:
+                continue
+            if last is not None and epoch != last:
+                self.clear()
+                with self.lock:
+                    self.stats['remote_invalidations'] += 1
+                logger.debug(f"认证版本号变化 {last} -> {epoch}，已清空认证缓存")
+            last = epoch
+
+    def get_stats(self):
+        """获取命中统计"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['tokens'] = len(self.tokens)
+            stats['users'] = len(self.users)
+        for kind in ('token', 'user'):
+            total = stats[f'{kind}_hits'] + stats[f'{kind}_misses']
+            stats[f'{kind}_hit_rate'] = round(stats[f'{kind}_hits'] / total, 4) if total else 0
+        return stats
+
+    def _trim(self, cache):
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+
+# 进程内共享的认证缓存
+auth_cache = AuthCache()
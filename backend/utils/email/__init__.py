@@ -15,6 +15,10 @@ from .outlook import OutlookMailHandler
 from .imap import IMAPMailHandler
 from .mail_processor import MailProcessor, EmailBatchProcessor
 from .file_parser import EmailFileParser
+from ._importer import import_report
+from ._mbox_import import save_stream
+from ._html_text import html_to_text
+from ._parse_cache import parse_cache
 
 # 保持原有API兼容性
 __all__ = [
@@ -29,4 +33,8 @@ __all__ = [
     'MailProcessor',
     'EmailBatchProcessor',
     'EmailFileParser',
+    'import_report',
+    'save_stream',
+    'html_to_text',
+    'parse_cache',
 ]
\ No newline at end of file
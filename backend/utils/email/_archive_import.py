@@ -0,0 +1,257 @@
+"""
+邮件文件批量导入
+从zip归档或服务器上的目录中批量导入 .eml/.emlx/.txt/.msg 邮件文件。
+文件解析在进程池中并行执行（解析主要消耗CPU，线程受GIL限制），主进程按文件顺序收集结果，
+每批与断点（已处理的文件数）在同一个事务中写入数据库；单个文件解析失败只记录原因，不中止导入。
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .file_parser import EmailFileParser
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 支持导入的邮件文件扩展名
+MAIL_EXTENSIONS = ('.eml', '.emlx', '.txt', '.msg')
+
+# 单个文件的大小上限，超过的文件记为失败，避免异常的归档条目占满内存
+MAX_FILE_SIZE = 50 * 1024 * 1024
+
+# 结果中保留的失败详情数
+MAX_FAILURES = 1000
+
+# 每个工作进程排队的文件数，限制等待写入的解析结果占用的内存
+QUEUE_PER_WORKER = 8
+
+# 工作进程中缓存已打开的zip归档: (路径, ZipFile)
+_archive = None
+
+
+def list_entries(source, path):
+    """按确定的顺序列出要导入的文件，断点续传依赖这个顺序
+
+    Args:
+        source: 'zip' 或 'dir'
+        path: zip文件路径或目录路径
+
+    Returns:
+        文件名列表，zip中为条目名，目录中为相对路径
+    """
+    names = []
+    if source == 'zip':
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                    continue
+                if os.path.splitext(name)[1].lower() in MAIL_EXTENSIONS:
+                    names.append(name)
+    else:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in files:
+                if filename.startswith('.') or os.path.splitext(filename)[1].lower() not in MAIL_EXTENSIONS:
+                    continue
+                names.append(os.path.relpath(os.path.join(root, filename), path))
+    names.sort()
+    return names
+
+
+def _init_worker():
+    """工作进程初始化，解析器的逐封日志在批量导入时没有意义"""
+    logging.disable(logging.INFO)
+
+
+def _open_archive(path):
+    global _archive
+    if _archive is None or _archive[0] != path:
+        if _archive is not None:
+            _archive[1].close()
+        _archive = (path, zipfile.ZipFile(path))
+    return _archive[1]
+
+
+def _normalize(record):
+    """保证写入数据库的字段类型正确，避免一封异常邮件导致整批回滚"""
+    for key, default in (('subject', '(无主题)'), ('sender', '(未知发件人)')):
+        value = record.get(key)
+        record[key] = str(value) if value else default
+    record['folder'] = 'IMPORTED'
+    return record
+
+
+def parse_entry(source, path, name):
+    """解析一个邮件文件，在工作进程中执行
+
+    Returns:
+        (文件名, 邮件数据, 失败原因)，成功时失败原因为None
+    """
+    try:
+        is_msg = os.path.splitext(name)[1].lower() == '.msg'
+        if source == 'zip':
+            archive = _open_archive(path)
+            size = archive.getinfo(name).file_size
+            if not size or size > MAX_FILE_SIZE:
+                return name, None, '文件为空' if not size else '文件过大'
+            data = archive.read(name)
+            if is_msg:
+                # extract_msg只能从文件读取
+                with tempfile.NamedTemporaryFile(suffix='.msg', delete=False) as tmp:
+                    tmp.write(data)
+                try:
+                    record = EmailFileParser.parse_msg_file(tmp.name)
+                finally:
+                    os.remove(tmp.name)
+            else:
+                record = EmailFileParser.parse_eml_content(data)
+        else:
+            file_path = os.path.join(path, name)
+            size = os.path.getsize(file_path)
+            if not size or size > MAX_FILE_SIZE:
+                return name, None, '文件为空' if not size else '文件过大'
+            if is_msg:
+                record = EmailFileParser.parse_msg_file(file_path)
+            else:
+                with open(file_path, 'rb') as f:
+                    record = EmailFileParser.parse_eml_content(f.read())
+
+        if not record:
+            return name, None, '无法解析邮件文件'
+        return name, _normalize(record), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+def _create_pool(workers):
+    """创建解析进程池，不支持fork的平台返回None，在当前进程中解析"""
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    # 使用fork：spawn会在子进程中重新导入主模块（app.py），重新初始化数据库和服务
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('fork'),
+        initializer=_init_worker
+    )
+
+
+def _parse_all(pool, func, items, workers):
+    """按顺序产出 func(*item) 的结果，进程池中最多排队 workers * QUEUE_PER_WORKER 个任务"""
+    if pool is None:
+        for item in items:
+            yield func(*item)
+        return
+
+    pending = deque()
+    remaining = iter(items)
+    for item in remaining:
+        pending.append(pool.submit(func, *item))
+        if len(pending) >= workers * QUEUE_PER_WORKER:
+            break
+    while pending:
+        yield pending.popleft().result()
+        for item in remaining:
+            pending.append(pool.submit(func, *item))
+            break
+
+
+def import_files(db, email_id, source, path, job_id=None, state=None, workers=None, batch_size=200,
+                 cancel_token=None, progress=None):
+    """批量导入zip归档或目录中的邮件文件
+
+    Args:
+        source: 'zip' 或 'dir'
+        job_id: 任务ID，断点与邮件在同一个事务中写入该任务
+        state: 上次提交的断点，包含index、imported、skipped、failed、failures
+        workers: 解析进程数，默认为CPU核数
+        batch_size: 每个事务处理的文件数
+        progress: 进度回调 progress(百分比, 消息)
+
+    Returns:
+        结果字典: files、imported、skipped、failed、failures，以及本次运行的耗时和吞吐量
+    """
+    state = dict(state or {})
+    for key in ('index', 'imported', 'skipped', 'failed'):
+        state.setdefault(key, 0)
+    state['failures'] = list(state.get('failures') or [])
+
+    names = list_entries(source, path)
+    total = len(names)
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(workers or cpu_count, cpu_count))
+    resumed_from = min(state['index'], total)
+    started = time.time()
+    batch = []
+    pending = dict(state, failures=list(state['failures']))
+
+    def checkpoint(saved, skipped):
+        return dict(pending, imported=pending['imported'] + saved, skipped=pending['skipped'] + skipped)
+
+    def commit():
+        """提交一批邮件和对应的断点"""
+        outcome = db.import_mail_batch(email_id, batch, job_id=job_id, checkpoint=checkpoint)
+        if outcome is None:
+            raise RuntimeError('写入邮件记录失败')
+        state.update(checkpoint(*outcome))
+        pending.update(state, failures=list(state['failures']))
+        batch.clear()
+        elapsed = max(time.time() - started, 0.001)
+        if progress:
+            progress(
+                int(state['index'] * 100 / total) if total else 100,
+                f"已处理 {state['index']}/{total} 个文件，新增 {state['imported']} 封，"
+                f"失败 {state['failed']} 个，{(state['index'] - resumed_from) / elapsed:.0f} 个/秒"
+            )
+
+    if progress:
+        progress(int(resumed_from * 100 / total) if total else 0,
+                 f'共 {total} 个邮件文件，使用 {workers} 个解析进程' if not resumed_from else '从断点继续导入')
+
+    pool = _create_pool(workers) if total - resumed_from > batch_size else None
+    try:
+        entries = ((source, path, name) for name in names[resumed_from:])
+        for name, record, error in _parse_all(pool, parse_entry, entries, workers):
+            if cancel_token is not None:
+                cancel_token.check()
+
+            pending['index'] += 1
+            if record is None:
+                pending['failed'] += 1
+                if len(pending['failures']) < MAX_FAILURES:
+                    pending['failures'].append({'file': name, 'reason': error})
+            else:
+                batch.append(record)
+
+            if pending['index'] - state['index'] >= batch_size:
+                commit()
+
+        if pending['index'] != state['index']:
+            commit()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = max(time.time() - started, 0.001)
+    result = {
+        'success': True,
+        'email_id': email_id,
+        'files': total,
+        'imported': state['imported'],
+        'skipped': state['skipped'],
+        'failed': state['failed'],
+        'failures': state['failures'],
+        'workers': workers if pool is not None else 1,
+        'elapsed': round(elapsed, 3),
+        'files_per_second': round((state['index'] - resumed_from) / elapsed, 1)
+    }
+    result['message'] = (f"文件导入完成，共 {total} 个文件，新增 {result['imported']} 封，"
+                         f"已存在 {result['skipped']} 封，解析失败 {result['failed']} 个")
+    logger.info(f"邮箱ID {email_id} {result['message']}，{result['files_per_second']} 个/秒")
+    return result
@@ -0,0 +1,87 @@
+"""
+邮箱熔断器
+连续失败达到阈值的邮箱（如刷新令牌失效、密码错误）进入熔断状态，冷却期内不再调度实时检查，
+冷却时间按失败次数指数增长；冷却期结束后放行一次试探检查（半开），成功则恢复，失败则继续熔断。
+熔断状态保存在emails表中，多个进程共享。
+"""
+
+import logging
+import time
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """基于数据库的邮箱熔断器"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, db, failure_threshold=3, base_cooldown=60, max_cooldown=6 * 3600, probe_timeout=600):
+        """初始化熔断器
+
+        Args:
+            db: 数据库对象
+            failure_threshold: 连续失败多少次后打开熔断
+            base_cooldown: 首次熔断的冷却时间，单位为秒
+            max_cooldown: 冷却时间上限，单位为秒
+            probe_timeout: 半开试探的最长时间，超时未出结果时允许再次试探
+        """
+        self.db = db
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+
+    def cooldown_for(self, failures):
+        """根据连续失败次数计算冷却时间"""
+        exponent = max(failures - self.failure_threshold, 0)
+        return min(self.base_cooldown * (2 ** min(exponent, 20)), self.max_cooldown)
+
+    def allow(self, email_info):
+        """判断是否允许调度该邮箱的检查，不改变熔断状态
+
+        冷却期已过的邮箱返回True，但提交检查前还需要通过acquire_probe取得唯一的试探机会。
+
+        Args:
+            email_info: 邮箱信息，需包含id、circuit_state和circuit_open_until
+
+        Returns:
+            允许调度时返回True
+        """
+        state = email_info.get('circuit_state') or self.CLOSED
+        if state == self.CLOSED:
+            return True
+        return time.time() >= (email_info.get('circuit_open_until') or 0)
+
+    def needs_probe(self, email_info):
+        """邮箱处于熔断状态，本次检查是一次试探"""
+        return (email_info.get('circuit_state') or self.CLOSED) != self.CLOSED
+
+    def acquire_probe(self, email_info):
+        """冷却期已过时尝试获得唯一的试探机会，应在确定提交检查任务之前调用"""
+        if self.db.try_half_open_email_circuit(email_info['id'], time.time() + self.probe_timeout):
+            logger.info(f"邮箱 {email_info.get('email', email_info['id'])} 熔断冷却结束，发起试探检查")
+            return True
+        return False
+
+    def release_probe(self, email_info):
+        """试探任务没有提交成功时归还试探机会，下一轮调度可以重新试探"""
+        self.db.open_email_circuit(email_info['id'], email_info.get('circuit_open_until') or 0)
+
+    def record_success(self, email_id):
+        """记录检查成功"""
+        self.db.record_email_success(email_id)
+
+    def record_failure(self, email_id, error):
+        """记录检查失败，达到阈值或试探失败时打开熔断"""
+        failures, previous_state = self.db.record_email_failure(email_id, error)
+        if failures is None:
+            return
+
+        if previous_state == self.HALF_OPEN or failures >= self.failure_threshold:
+            cooldown = self.cooldown_for(failures)
+            self.db.open_email_circuit(email_id, time.time() + cooldown)
+            logger.warning(f"邮箱 ID {email_id} 连续失败 {failures} 次，熔断 {int(cooldown)} 秒，最后错误: {error}")
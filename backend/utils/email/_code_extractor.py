@@ -0,0 +1,129 @@
+"""
+验证码和操作链接提取
+保存邮件时从主题和纯文本中提取一次性验证码和确认/登录/重置链接，写入mail_codes表，
+客户端查询最新验证码时只需一次索引查找，不必拉取整个邮件列表再自行匹配。
+匹配规则在启动时编译，可以通过CODE_PATTERNS_FILE指定的JSON文件替换:
+
+    {"codes": ["验证码\\D{0,10}(\\d{6})"], "links": ["/verify", "token="]}
+
+codes中的每个正则用第一个分组作为验证码；links中的正则用于筛选邮件中的链接，任一规则匹配即保留。
+"""
+
+import html
+import json
+import logging
+import os
+import re
+
+from ._html_text import html_to_text
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 验证码前后的关键词
+CODE_KEYWORDS = (r'验证码|校验码|确认码|动态码|动态密码|安全码|激活码|登录码|verification code|security code|'
+                 r'one-time code|login code|passcode|code|otp|pin')
+
+# 关键词前后不能紧跟英文字母，避免匹配Barcode、Shipping、opinion中的code、pin；
+# 不使用\b，因为中文字符也算单词字符，“您的验证码为”中的验证码没有\b边界
+KEYWORD = rf'(?<![A-Za-z])(?:{CODE_KEYWORDS})(?![A-Za-z])'
+
+# 验证码本身：4-8位字母或数字，至少包含一个数字，前后不能紧跟字母或数字；
+# 前面是货币符号或后面是小数部分、千分位时是金额
+CODE_VALUE = r'(?<![A-Za-z0-9$¥€£])((?=[A-Za-z]*\d)[A-Za-z0-9]{4,8})(?![A-Za-z0-9])(?![.,]\d)'
+
+DEFAULT_CODE_PATTERNS = (
+    # 验证码：123456、Your code is 123456
+    rf'{KEYWORD}[^\d\n]{{0,30}}?{CODE_VALUE}',
+    # 123456 is your verification code、123456是您的验证码
+    rf'(?<![A-Za-z0-9$¥€£])(\d{{4,8}})(?![A-Za-z0-9])(?![.,]\d)[^\n]{{0,20}}?(?:is your|是您的|为您的|是你的|为你的|{KEYWORD})',
+)
+
+DEFAULT_LINK_PATTERNS = (
+    r'verif|confirm|activat|validat|reset|magic|login|log-in|signin|sign-in|sign_in|auth|token|unlock|approve|invite',
+)
+
+# 不属于操作链接的地址
+EXCLUDED_LINKS = re.compile(r'unsubscribe|optout|opt-out|\.(?:png|jpe?g|gif|css|js)(?:\?|$)', re.IGNORECASE)
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'()\[\]{}]+', re.IGNORECASE)
+HREF_PATTERN = re.compile(r'href\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
+# 每封邮件最多保存的验证码和链接数
+MAX_CODES = 3
+MAX_LINKS = 5
+
+
+class CodeExtractor:
+    """用预编译的规则从邮件中提取验证码和操作链接"""
+
+    def __init__(self, code_patterns=DEFAULT_CODE_PATTERNS, link_patterns=DEFAULT_LINK_PATTERNS):
+        self.code_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in code_patterns]
+        self.link_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in link_patterns]
+
+    @classmethod
+    def from_file(cls, path):
+        """从JSON文件加载规则，文件缺失或规则无效时使用默认规则"""
+        if not path:
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            extractor = cls(config.get('codes') or DEFAULT_CODE_PATTERNS, config.get('links') or DEFAULT_LINK_PATTERNS)
+            logger.info(f"已从 {path} 加载验证码规则 {len(extractor.code_patterns)} 条，链接规则 {len(extractor.link_patterns)} 条")
+            return extractor
+        except Exception as e:
+            logger.error(f"加载验证码规则失败，使用默认规则: {str(e)}")
+            return cls()
+
+    @staticmethod
+    def _text(content):
+        """取邮件的纯文本和HTML，content为extract_email_content的返回值或字符串"""
+        if isinstance(content, str):
+            return content, None
+        if not isinstance(content, dict):
+            return '', None
+        body = content.get('content') or ''
+        if content.get('content_type') != 'text/html':
+            return body, None
+        return content.get('plain_text') or html_to_text(body)['text'], body
+
+    def extract(self, subject, content):
+        """提取验证码和链接
+
+        Returns:
+            [(类型, 值)]，类型为 'code' 或 'link'，按在邮件中出现的顺序排列
+        """
+        text, html_body = self._text(content)
+        results = []
+
+        codes = []
+        for source in (subject or '', text):
+            for pattern in self.code_patterns:
+                for match in pattern.finditer(source):
+                    value = match.group(1)
+                    if value and value not in codes:
+                        codes.append(value)
+            if codes:
+                # 主题中已有验证码时不再匹配正文，避免把正文中的其他数字当作验证码
+                break
+        results.extend(('code', value) for value in codes[:MAX_CODES])
+
+        links = []
+        candidates = URL_PATTERN.findall(text)
+        if html_body:
+            candidates += [html.unescape(href) for href in HREF_PATTERN.findall(html_body)]
+        for url in candidates:
+            url = url.rstrip('.,;:!?，。')
+            if (url.lower().startswith(('http://', 'https://')) and url not in links
+                    and not EXCLUDED_LINKS.search(url)
+                    and any(pattern.search(url) for pattern in self.link_patterns)):
+                links.append(url)
+                if len(links) >= MAX_LINKS:
+                    break
+        results.extend(('link', url) for url in links)
+        return results
+
+
+# 进程内共享的提取器
+code_extractor = CodeExtractor.from_file(os.environ.get('CODE_PATTERNS_FILE'))
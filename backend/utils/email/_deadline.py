@@ -0,0 +1,135 @@
+"""
+邮件检查的取消令牌和截止时间
+每次检查持有一个令牌：用户停止检查或超过整体时间预算时令牌被取消，
+取消时会关闭已注册的连接，使阻塞在网络读写上的线程立即返回线程池。
+"""
+
+import logging
+import socket
+import threading
+import time
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class CheckCancelled(Exception):
+    """检查被取消"""
+
+
+class CheckTimeout(CheckCancelled):
+    """检查超过时间预算"""
+
+
+class CancelToken:
+    """协作式取消令牌，带可选的整体截止时间"""
+
+    def __init__(self, timeout=None, socket_timeout=30):
+        """初始化令牌
+
+        Args:
+            timeout: 整体时间预算，单位为秒，None表示不限制
+            socket_timeout: 单次网络操作的超时时间，单位为秒
+        """
+        self.deadline = time.time() + timeout if timeout else None
+        self.socket_timeout = socket_timeout
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._closers = []
+        self._timer = None
+
+        # 到达截止时间时自动取消，关闭阻塞中的连接
+        if timeout:
+            self._timer = threading.Timer(timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    @property
+    def timed_out(self):
+        return self.reason == 'timeout'
+
+    def remaining(self):
+        """剩余时间，单位为秒，不限制时返回None"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0)
+
+    def timeout_for(self, default=None):
+        """单次网络操作可用的超时时间，不超过剩余的整体预算"""
+        default = default or self.socket_timeout
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(min(default, remaining), 0.1)
+
+    def check(self):
+        """已取消或超时时抛出异常，在每批网络操作之间调用"""
+        if not self.cancelled and self.deadline is not None and time.time() >= self.deadline:
+            self._expire()
+        if self.cancelled:
+            if self.timed_out:
+                raise CheckTimeout("检查超时")
+            raise CheckCancelled("检查已取消")
+
+    def cancel(self, reason='cancelled'):
+        """取消令牌并关闭已注册的连接"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            closers = list(self._closers)
+            self._closers.clear()
+
+        for closer in closers:
+            try:
+                closer()
+            except Exception as e:
+                logger.debug(f"取消时关闭连接失败: {str(e)}")
+        return True
+
+    def on_cancel(self, closer):
+        """注册取消时要执行的关闭函数，已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._closers.append(closer)
+                return
+        try:
+            closer()
+        except Exception as e:
+            logger.debug(f"取消时关闭连接失败: {str(e)}")
+
+    def remove_closer(self, closer):
+        """连接正常关闭后注销关闭函数"""
+        with self._lock:
+            if closer in self._closers:
+                self._closers.remove(closer)
+
+    def release(self):
+        """检查结束后释放定时器"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        with self._lock:
+            self._closers.clear()
+
+    def _expire(self):
+        if self.cancel('timeout'):
+            logger.warning("检查超过时间预算，已取消")
+
+
+def close_imap_connection(mail):
+    """强制关闭IMAP连接的底层socket，用于中断阻塞中的读写
+
+    不能调用mail.shutdown()：它会先关闭读缓冲区，而缓冲区的锁被阻塞中的读线程持有
+    """
+    def closer():
+        sock = getattr(mail, 'sock', None)
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    return closer
@@ -0,0 +1,124 @@
+"""
+HTML转纯文本
+基于标准库html.parser的事件回调逐个处理标记，不构建文档树；
+在同一次遍历中生成纯文本、预览摘要，并检测Microsoft/Notion/GitHub邮件的特征。
+文本结果与BeautifulSoup(content, "html.parser").get_text()一致：不包含script、style、template的内容和注释。
+"""
+
+from html.parser import HTMLParser
+
+# 预览摘要的最大长度
+PREVIEW_LENGTH = 200
+
+# 内容不计入文本的标签
+SKIP_TAGS = ('script', 'style', 'template')
+
+# 各厂商邮件的特征（小写），任一特征出现即认为是该厂商的邮件
+VENDOR_SIGNATURES = (
+    ('is_microsoft_email', ('class="msonormal"', 'style="mso-', 'microsoft.com', 'outlook.com')),
+    ('is_notion_email', ('notion.so', 'data-block-id', 'notion-')),
+    ('is_github_email', ('github.com', 'github-')),
+)
+
+
+def _match_vendors(lowered, found):
+    for key, signatures in VENDOR_SIGNATURES:
+        if not found[key] and any(signature in lowered for signature in signatures):
+            found[key] = True
+
+
+def detect_vendors(html):
+    """检测HTML中的厂商特征，只生成一次小写副本
+
+    子串查找比大小写不敏感的正则快得多，所以这里不使用正则。
+    """
+    found = {key: False for key, _ in VENDOR_SIGNATURES}
+    if html:
+        _match_vendors(html.lower(), found)
+    return found
+
+
+class HTMLTextExtractor(HTMLParser):
+    """流式HTML文本提取器，可以多次feed，最后调用result"""
+
+    def __init__(self, preview_length=PREVIEW_LENGTH):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.preview = []
+        self.preview_size = 0
+        self.preview_length = preview_length
+        self.skip_depth = 0
+        self.vendors = {key: False for key, _ in VENDOR_SIGNATURES}
+        self.pending_vendors = len(VENDOR_SIGNATURES)
+
+    def _scan(self, text):
+        if self.pending_vendors and text:
+            _match_vendors(text.lower(), self.vendors)
+            self.pending_vendors = list(self.vendors.values()).count(False)
+
+    def _add_text(self, data):
+        self.parts.append(data)
+        if self.preview_size < self.preview_length:
+            words = data.split()
+            if words:
+                chunk = ' '.join(words)
+                # 文本片段之间原本有空白时保留一个空格
+                if self.preview and data[:1].isspace() and not self.preview[-1].endswith(' '):
+                    chunk = ' ' + chunk
+                if data[-1:].isspace():
+                    chunk += ' '
+                self.preview.append(chunk)
+                self.preview_size += len(chunk)
+            elif data and self.preview and not self.preview[-1].endswith(' '):
+                # 只有空白的片段（如标签之间的换行）也作为分隔
+                self.preview.append(' ')
+                self.preview_size += 1
+
+    def handle_starttag(self, tag, attrs):
+        self._scan(self.get_starttag_text() or '')
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._scan(self.get_starttag_text() or '')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        self._scan(data)
+        if not self.skip_depth:
+            self._add_text(data)
+
+    def handle_comment(self, data):
+        self._scan(data)
+
+    def handle_decl(self, decl):
+        self._scan(decl)
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]> 的内容作为文本
+        if data.startswith('CDATA[') and not self.skip_depth:
+            self._add_text(data[6:])
+
+    def result(self):
+        """结束解析，返回text、preview和厂商特征"""
+        self.close()
+        result = {
+            'text': ''.join(self.parts),
+            'preview': ''.join(self.preview).strip()[:self.preview_length]
+        }
+        result.update(self.vendors)
+        return result
+
+
+def html_to_text(html, preview_length=PREVIEW_LENGTH):
+    """把HTML转换为纯文本
+
+    Returns:
+        dict: text、preview，以及is_microsoft_email、is_notion_email、is_github_email
+    """
+    extractor = HTMLTextExtractor(preview_length)
+    extractor.feed(html or '')
+    return extractor.result()
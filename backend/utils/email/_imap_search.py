@@ -0,0 +1,186 @@
+"""
+IMAP服务器端定向搜索
+只需要某个发件人或主题的邮件时，把FROM/SUBJECT/SINCE条件交给服务器的UID SEARCH，
+只拉取匹配的最新几封邮件，不同步整个文件夹：一次搜索加一次批量FETCH。
+
+非ASCII的搜索词（中文主题等）按以下顺序处理:
+- 服务器支持UTF8=ACCEPT时启用UTF-8模式，所有条件直接作为带引号的字符串发送
+- 否则使用CHARSET UTF-8，第一个非ASCII的搜索词作为literal发送（imaplib每条命令只支持一个literal），
+  其余非ASCII的搜索词在客户端按解码后的头部过滤
+- 服务器拒绝UTF-8字符集时只发送ASCII条件，非ASCII的搜索词都在客户端过滤
+"""
+
+import email
+import imaplib
+import logging
+import re
+from datetime import timedelta
+
+from .common import decode_mime_words, format_date_for_imap_search
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 需要在客户端过滤时最多检查的候选邮件数（从最新的开始）
+MAX_CANDIDATES = 500
+
+UID_PATTERN = re.compile(rb'UID (\d+)')
+
+
+def quote(value):
+    """把搜索词转为IMAP的带引号字符串"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def build_search(sender=None, subject=None, since=None, utf8=False, literal=True):
+    """生成UID SEARCH的参数
+
+    Args:
+        since: datetime，服务器只按日期比较，这里提前一天，多拉取的邮件在保存时去重
+        utf8: 连接已启用UTF8=ACCEPT
+        literal: 是否允许用literal发送一个非ASCII的搜索词
+
+    Returns:
+        (字符集, 条件列表, literal字节串, 需要在客户端过滤的条件 {'FROM'/'SUBJECT': 文本})
+    """
+    criteria = []
+    client_filters = {}
+    literal_term = None
+    if since:
+        date_str = format_date_for_imap_search(since - timedelta(days=1))
+        if date_str:
+            criteria.append(f'SINCE {date_str}')
+    for key, value in (('FROM', sender), ('SUBJECT', subject)):
+        if not value:
+            continue
+        if utf8 or value.isascii():
+            criteria.append(f'{key} {quote(value)}')
+        elif literal and literal_term is None:
+            literal_term = (key, value.encode('utf-8'))
+        else:
+            client_filters[key] = value
+    if literal_term is not None:
+        # imaplib把literal追加在命令末尾，对应的搜索键必须放在最后
+        criteria.append(literal_term[0])
+        return 'UTF-8', criteria, literal_term[1], client_filters
+    return None, criteria or ['ALL'], None, client_filters
+
+
+def enable_utf8(mail, sender=None, subject=None):
+    """有非ASCII的搜索词且服务器支持时启用UTF8=ACCEPT，必须在SELECT之前调用"""
+    if all(not value or value.isascii() for value in (sender, subject)):
+        return False
+    try:
+        # 登录后的能力列表可能与问候时不同，imaplib只记录了问候时的能力
+        typ, data = mail.capability()
+        if typ == 'OK' and data and data[-1]:
+            mail.capabilities = tuple(data[-1].decode('ascii', 'ignore').upper().split())
+        if 'UTF8=ACCEPT' not in mail.capabilities or 'ENABLE' not in mail.capabilities:
+            return False
+        typ, _ = mail.enable('UTF8=ACCEPT')
+        return typ == 'OK'
+    except imaplib.IMAP4.error as e:
+        logger.info(f"服务器未启用UTF8=ACCEPT: {str(e)}")
+        return False
+
+
+def search_uids(mail, sender=None, subject=None, since=None, utf8=False):
+    """在已选择的文件夹中执行UID SEARCH
+
+    Returns:
+        (UID列表（从旧到新）, 需要在客户端过滤的条件)
+    """
+    charset, criteria, literal, client_filters = build_search(sender, subject, since, utf8)
+    try:
+        mail.literal = literal
+        typ, data = mail.uid('SEARCH', *(['CHARSET', charset] if charset else []), *criteria)
+    except imaplib.IMAP4.error as e:
+        if charset is None:
+            raise
+        typ, data = 'BAD', [str(e).encode()]
+    if typ != 'OK' and charset is not None:
+        # 服务器不支持UTF-8字符集（NO [BADCHARSET]），只发送ASCII条件
+        logger.info(f"服务器不支持CHARSET UTF-8搜索，非ASCII条件改为在客户端过滤: {data}")
+        mail.literal = None
+        _, criteria, _, client_filters = build_search(sender, subject, since, utf8, literal=False)
+        typ, data = mail.uid('SEARCH', *criteria)
+    if typ != 'OK':
+        raise RuntimeError(f"搜索邮件失败: {typ}")
+    uids = sorted({int(uid) for uid in (data[0] or b'').split()})
+    return uids, client_filters
+
+
+def _fetch(mail, uids, items):
+    """一次UID FETCH多封邮件，返回 {UID: 数据}"""
+    if not uids:
+        return {}
+    typ, data = mail.uid('FETCH', ','.join(str(uid) for uid in uids), items)
+    if typ != 'OK':
+        raise RuntimeError(f"获取邮件失败: {typ}")
+    results = {}
+    pending = None
+    for item in data:
+        if isinstance(item, tuple):
+            match = UID_PATTERN.search(item[0])
+            if match:
+                results[int(match.group(1))] = item[1]
+                pending = None
+            else:
+                pending = item[1]
+        elif isinstance(item, bytes) and pending is not None:
+            # 部分服务器把UID放在数据之后返回
+            match = UID_PATTERN.search(item)
+            if match:
+                results[int(match.group(1))] = pending
+                pending = None
+    return results
+
+
+def _matches(header, client_filters):
+    """按解码后的头部检查客户端过滤条件，不区分大小写"""
+    msg = email.message_from_bytes(header or b'')
+    for key, value in client_filters.items():
+        text = decode_mime_words(str(msg.get(key.lower(), '') or ''))
+        if value.casefold() not in text.casefold():
+            return False
+    return True
+
+
+def search_mailbox(mail, folder, sender=None, subject=None, since=None, limit=10, cancel_token=None):
+    """在已登录的连接上定向搜索并拉取最新的匹配邮件
+
+    Args:
+        sender: 发件人包含的文本
+        subject: 主题包含的文本
+        since: datetime，只搜索这个日期之后的邮件
+        limit: 最多拉取的邮件数
+
+    Returns:
+        [(UID, 原始邮件)]，从新到旧
+    """
+    utf8 = enable_utf8(mail, sender, subject)
+    if cancel_token is not None:
+        cancel_token.check()
+    typ, _ = mail.select(folder, readonly=True)
+    if typ != 'OK':
+        raise RuntimeError(f"选择文件夹 {folder} 失败: {typ}")
+
+    if cancel_token is not None:
+        cancel_token.check()
+    uids, client_filters = search_uids(mail, sender, subject, since, utf8)
+    uids.reverse()
+    logger.info(f"定向搜索 {folder} 找到 {len(uids)} 封邮件")
+
+    if client_filters:
+        # 只检查最新的候选邮件的头部，一次FETCH完成
+        candidates = uids[:MAX_CANDIDATES]
+        if cancel_token is not None:
+            cancel_token.check()
+        headers = _fetch(mail, candidates, '(UID BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)])')
+        uids = [uid for uid in candidates if uid in headers and _matches(headers[uid], client_filters)]
+
+    uids = uids[:max(1, limit)]
+    if cancel_token is not None:
+        cancel_token.check()
+    messages = _fetch(mail, uids, '(UID BODY.PEEK[])')
+    return [(uid, messages[uid]) for uid in uids if uid in messages]
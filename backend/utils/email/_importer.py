@@ -0,0 +1,253 @@
+"""
+邮箱批量导入
+导入作为后台任务执行：先在内存中解析和校验全部数据，再在一个事务中批量写入并报告冲突，
+需要时以有限的并发测试账号凭据，只有通过测试的账号才会写入。
+"""
+
+import concurrent.futures
+import imaplib
+import logging
+import re
+
+from .outlook import OutlookMailHandler
+from .imap import IMAPMailHandler
+from ._deadline import close_imap_connection
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+EMAIL_PATTERN = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
+
+# 各邮箱类型的导入格式
+IMPORT_FORMATS = {
+    'outlook': '邮箱----密码----客户端ID----RefreshToken',
+    'imap': '邮箱----密码[----服务器[----端口]]',
+    'gmail': '邮箱----密码',
+    'qq': '邮箱----密码',
+}
+
+# 失败详情中保留的原始内容长度
+CONTENT_PREVIEW = 200
+
+
+def _failure(line_no, content, reason):
+    return {'line': line_no, 'content': content[:CONTENT_PREVIEW], 'reason': reason}
+
+
+def parse_import_data(text, mail_type='outlook'):
+    """解析导入数据，每行一个账号
+
+    Returns:
+        (records, failed_details): 通过校验的账号列表，以及格式错误、重复等失败的行
+    """
+    if mail_type not in IMPORT_FORMATS:
+        raise ValueError(f"不支持的邮箱类型: {mail_type}")
+
+    records = []
+    failed = []
+    seen = set()
+
+    for line_no, raw in enumerate(text.strip().split('\n'), 1):
+        line = raw.strip()
+        if not line:
+            continue
+
+        # 失败记录只保留第一个字段（邮箱地址），不保存密码和令牌
+        parts = [part.strip() for part in line.split('----')]
+        if mail_type == 'outlook':
+            if len(parts) != 4:
+                failed.append(_failure(line_no, parts[0], '格式错误，需要4个字段'))
+                continue
+        elif not 2 <= len(parts) <= (4 if mail_type == 'imap' else 2):
+            failed.append(_failure(line_no, parts[0], f"格式错误，应为 {IMPORT_FORMATS[mail_type]}"))
+            continue
+
+        if not all(parts):
+            failed.append(_failure(line_no, parts[0], '有空白字段'))
+            continue
+
+        email = parts[0]
+        if not EMAIL_PATTERN.match(email):
+            failed.append(_failure(line_no, email, '邮箱格式不正确'))
+            continue
+        if email in seen:
+            failed.append(_failure(line_no, email, '导入数据中重复'))
+            continue
+
+        record = {'line': line_no, 'email': email, 'password': parts[1]}
+        if mail_type == 'outlook':
+            record['client_id'], record['refresh_token'] = parts[2], parts[3]
+        elif mail_type == 'imap':
+            record['server'] = parts[2] if len(parts) > 2 else None
+            if len(parts) > 3:
+                if not parts[3].isdigit():
+                    failed.append(_failure(line_no, email, '端口必须是数字'))
+                    continue
+                record['port'] = int(parts[3])
+
+        seen.add(email)
+        records.append(record)
+
+    return records, failed
+
+
+def verify_account(record, mail_type, cancel_token=None):
+    """测试单个账号的凭据，成功返回None，失败返回原因"""
+    timeout = cancel_token.timeout_for() if cancel_token else 30
+
+    if mail_type == 'outlook':
+        token = OutlookMailHandler.get_new_access_token(record['refresh_token'], record['client_id'], cancel_token)
+        return None if token else '刷新令牌无效或已过期'
+
+    # IMAP类邮箱只做登录测试，服务器地址与检查邮件时的推断规则一致
+    server = {'gmail': 'imap.gmail.com', 'qq': 'imap.qq.com'}.get(mail_type)
+    handler = IMAPMailHandler(server or record.get('server'), record['email'], record['password'], port=record.get('port'))
+    if not handler.server:
+        return '无法推断IMAP服务器，请填写服务器地址'
+
+    mail = None
+    closer = None
+    try:
+        mail = imaplib.IMAP4_SSL(handler.server, handler.port, timeout=timeout)
+        if cancel_token is not None:
+            closer = close_imap_connection(mail)
+            cancel_token.on_cancel(closer)
+        mail.login(handler.username, handler.password)
+        return None
+    except Exception as e:
+        return f'登录失败: {str(e)}'
+    finally:
+        if cancel_token is not None and closer is not None:
+            cancel_token.remove_closer(closer)
+        if mail is not None:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+
+def verify_accounts(records, mail_type, concurrency=8, cancel_token=None, progress=None):
+    """以有限的并发测试账号凭据
+
+    Args:
+        concurrency: 同时测试的账号数
+        progress: 进度回调 progress(已完成数, 总数)
+
+    Returns:
+        {行号: 失败原因}
+
+    Raises:
+        CheckCancelled: 任务被取消或超时
+    """
+    failures = {}
+    total = len(records)
+    if total == 0:
+        return failures
+
+    pending = iter(records)
+    done_count = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='import-verify') as executor:
+        # 只保持concurrency个测试在执行，取消后不再提交新的测试
+        running = {}
+        for record in pending:
+            running[executor.submit(verify_account, record, mail_type, cancel_token)] = record
+            if len(running) >= concurrency:
+                break
+
+        while running:
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                record = running.pop(future)
+                try:
+                    reason = future.result()
+                except Exception as e:
+                    reason = f'测试失败: {str(e)}'
+                if reason:
+                    failures[record['line']] = reason
+                done_count += 1
+
+            if cancel_token is not None and cancel_token.cancelled:
+                for future in running:
+                    future.cancel()
+                cancel_token.check()
+
+            for record in pending:
+                running[executor.submit(verify_account, record, mail_type, cancel_token)] = record
+                if len(running) >= concurrency:
+                    break
+
+            if progress:
+                progress(done_count, total)
+
+    return failures
+
+
+def import_accounts(db, user_id, text, mail_type='outlook', verify=False, concurrency=8,
+                    cancel_token=None, progress=None):
+    """执行一次批量导入
+
+    Args:
+        verify: 是否先测试凭据，测试失败的账号不写入
+        progress: 进度回调 progress(百分比, 消息)
+
+    Returns:
+        结果字典: total, imported, failed, failed_details, email_ids
+    """
+    def report(value, message):
+        if progress:
+            progress(value, message)
+
+    report(0, '正在解析导入数据')
+    records, failed = parse_import_data(text, mail_type)
+    total = len(records) + len(failed)
+    report(5, f'解析完成，有效 {len(records)} 条，格式错误 {len(failed)} 条')
+
+    if verify and records:
+        def verify_progress(done, count):
+            report(5 + int(done * 85 / count), f'正在测试账号凭据 {done}/{count}')
+
+        failures = verify_accounts(records, mail_type, concurrency, cancel_token, verify_progress)
+        if failures:
+            failed.extend(_failure(r['line'], r['email'], failures[r['line']]) for r in records if r['line'] in failures)
+            records = [r for r in records if r['line'] not in failures]
+
+    if cancel_token is not None:
+        cancel_token.check()
+
+    report(90, f'正在写入 {len(records)} 个邮箱')
+    outcome = db.add_emails_bulk(user_id, records, mail_type)
+    if outcome is None:
+        raise RuntimeError('批量写入邮箱失败')
+    inserted, conflicts = outcome
+    failed.extend(_failure(r['line'], r['email'], '邮箱地址已存在') for r in records if r['line'] in conflicts)
+    failed.sort(key=lambda item: item['line'])
+
+    message = f'导入完成，成功 {len(inserted)} 个，失败 {len(failed)} 个'
+    report(100, message)
+    logger.info(f"用户ID {user_id} {message}")
+    return {
+        'success': True,
+        'message': message,
+        'total': total,
+        'imported': len(inserted),
+        'failed': len(failed),
+        'failed_details': failed,
+        'email_ids': list(inserted.values())
+    }
+
+
+def import_report(result, job_id=None):
+    """把导入任务的结果转换为接口返回的格式（与同步导入接口的返回值相同）"""
+    result = result or {}
+    report = {
+        'total': result.get('total', 0),
+        'success': result.get('imported', 0),
+        'failed': result.get('failed', 0),
+        'failed_details': result.get('failed_details', [])
+    }
+    if job_id is not None:
+        report['job_id'] = job_id
+    if result.get('success') is False:
+        report['error'] = result.get('message')
+    return report
+
@@ -0,0 +1,401 @@
+"""
+基于SQLite的持久化任务队列
+任务保存在job_queue表中，执行时持有带过期时间的租约并定期续约（心跳），
+进程重启或崩溃后，过期的租约会被回收，任务重新排队继续执行。
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import concurrent.futures
+
+from ._deadline import CancelToken
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    """传递给任务处理函数的上下文，用于上报进度和保存断点"""
+
+    def __init__(self, queue, job, callback=None, timeout=None):
+        self.queue = queue
+        self.job = job
+        self.job_id = job['id']
+        self.callback = callback
+        # 取消令牌，任务被取消、超时或进程关闭时取消
+        self.cancel_token = CancelToken(timeout)
+        self._last_progress = None
+        self._last_write = 0
+
+    def progress(self, progress, message=None):
+        """上报进度，本地回调每次都会调用，数据库按节流频率写入"""
+        if self.callback:
+            try:
+                self.callback(progress, message)
+            except Exception as e:
+                logger.error(f"任务 {self.job_id} 进度回调失败: {str(e)}")
+
+        now = time.time()
+        if (progress in (0, 100) or self._last_progress is None or
+                abs(progress - self._last_progress) >= 10 or
+                now - self._last_write >= self.queue.progress_interval):
+            self._last_progress = progress
+            self._last_write = now
+            self.queue.db.update_job_progress(self.job_id, progress, message)
+
+    def checkpoint(self, value, progress=None, message=None):
+        """保存断点，任务被回收后可从断点继续"""
+        self.job['checkpoint'] = value
+        self.queue.db.update_job_progress(
+            self.job_id,
+            progress if progress is not None else (self._last_progress or 0),
+            message,
+            checkpoint=value
+        )
+
+
+class JobQueue:
+    """持久化任务队列调度器，负责领取任务、续约租约和优雅关闭"""
+
+    def __init__(self, db, owner=None, max_concurrency=10, lease_seconds=60, poll_interval=1.0):
+        """初始化任务队列
+
+        Args:
+            db: 数据库对象
+            owner: 租约持有者标识，默认为 主机名:进程号
+            max_concurrency: 同时执行的最大任务数
+            lease_seconds: 租约时长，超过该时间未续约的任务会被回收
+            poll_interval: 没有新任务时轮询数据库的间隔
+        """
+        self.db = db
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.max_concurrency = max_concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.progress_interval = 2.0  # 进度写库的最小间隔，单位为秒
+        self.reclaim_interval = 15  # 回收过期租约的间隔，单位为秒
+        self.retry_delay = 30  # 任务异常后重新排队的延迟，单位为秒
+        self.purge_interval = 600  # 清理已结束任务的间隔，单位为秒
+        self.job_retention = 7 * 24 * 3600  # 已结束任务的默认保留时间，单位为秒
+
+        self.handlers = {}  # kind -> (处理函数, 执行器, 超时时间)
+        self.retentions = {}  # kind -> 已结束任务的保留时间，未设置的使用job_retention
+        self.sensitive_kinds = set()  # 参数中含有凭据的任务类型，结束后清除参数
+        self.callbacks = {}  # job_id -> 本地进度回调
+        self.futures = {}  # job_id -> 本地等待者的Future
+        self.running_jobs = {}  # job_id -> 正在执行的任务
+        self.contexts = {}  # job_id -> 正在执行任务的上下文
+        self.lock = threading.Lock()
+
+        self.running = False
+        self.accepting = False
+        self.wakeup = threading.Event()
+        self.dispatch_thread = None
+        self.heartbeat_thread = None
+
+    def register(self, kind, func, executor, timeout=None, retention=None, sensitive=False):
+        """注册任务处理函数
+
+        Args:
+            kind: 任务类型
+            func: 处理函数，签名为 func(job, ctx)，返回结果字典
+            executor: 执行任务的线程池，或者根据任务返回线程池的函数
+            timeout: 单个任务的时间预算，超时后ctx.cancel_token被取消
+            retention: 已结束任务的保留时间，单位为秒，默认为job_retention
+            sensitive: 任务参数中含有凭据，任务结束后清除参数
+        """
+        self.handlers[kind] = (func, executor, timeout)
+        if retention is not None:
+            self.retentions[kind] = retention
+        if sensitive:
+            self.sensitive_kinds.add(kind)
+
+    def enqueue(self, kind, user_id=None, email_id=None, payload=None, priority=0, callback=None, max_attempts=3,
+                dedupe_key=''):
+        """添加任务到队列
+
+        Args:
+            dedupe_key: 去重键，同一邮箱只有去重键相同的未完成同类任务才会合并
+
+        Returns:
+            任务ID，失败时返回None
+        """
+        job_id, created = self.db.enqueue_job(
+            kind,
+            user_id=user_id,
+            email_id=email_id,
+            payload=payload,
+            priority=priority,
+            max_attempts=max_attempts,
+            dedupe_key=dedupe_key
+        )
+        if job_id is None:
+            return None
+
+        if callback:
+            with self.lock:
+                # 已有相同任务时不覆盖原回调
+                self.callbacks.setdefault(job_id, callback)
+
+        if created:
+            logger.debug(f"任务已入队: id={job_id}, kind={kind}, email_id={email_id}")
+        else:
+            logger.debug(f"已存在未完成的任务: id={job_id}, kind={kind}, email_id={email_id}")
+
+        self.wakeup.set()
+        return job_id
+
+    def submit(self, kind, user_id=None, email_id=None, payload=None, priority=0, callback=None):
+        """添加任务并返回Future，任务结束（无论在哪个进程执行）时得到结果"""
+        future = concurrent.futures.Future()
+        job_id = self.enqueue(kind, user_id, email_id, payload, priority, callback)
+        if job_id is None:
+            future.set_exception(RuntimeError("任务入队失败"))
+            return future
+
+        future.job_id = job_id
+        with self.lock:
+            existing = self.futures.get(job_id)
+            if existing is not None:
+                return existing
+            self.futures[job_id] = future
+
+        # 任务可能由其他进程领取执行，由后台线程轮询任务状态兜底
+        threading.Thread(target=self._poll_job_result, args=(job_id,), daemon=True).start()
+        return future
+
+    def start(self):
+        """启动调度：先回收过期租约，再开始领取任务"""
+        if self.running:
+            return False
+
+        recovered = self.db.reclaim_expired_jobs()
+        pending = self.db.count_jobs(('queued',))
+        logger.info(f"任务队列启动 (owner={self.owner})，回收任务 {recovered} 个，待执行任务 {pending} 个")
+
+        self.running = True
+        self.accepting = True
+        self.dispatch_thread = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        self.dispatch_thread.start()
+        self.heartbeat_thread.start()
+        return True
+
+    def shutdown(self, drain=True, timeout=30):
+        """优雅关闭
+
+        Args:
+            drain: 是否等待正在执行的任务完成
+            timeout: 等待的最长时间，超时后未完成的任务释放租约，下次启动时继续执行
+        """
+        if not self.running:
+            return
+
+        # 停止领取新任务，已排队的任务保留在数据库中
+        self.accepting = False
+        self.wakeup.set()
+
+        if drain:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                with self.lock:
+                    remaining = len(self.running_jobs)
+                if remaining == 0:
+                    break
+                time.sleep(0.2)
+
+        with self.lock:
+            unfinished = list(self.running_jobs.keys())
+            contexts = list(self.contexts.values())
+
+        # 超时仍未完成的任务立即中断，释放线程，任务放回队列
+        for ctx in contexts:
+            ctx.cancel_token.cancel('shutdown')
+
+        self.running = False
+        self.wakeup.set()
+
+        released = self.db.release_jobs(self.owner)
+        self.db.release_account_leases(self.owner)
+        logger.info(f"任务队列已关闭，未完成任务 {len(unfinished)} 个，释放租约 {released} 个")
+
+    def cancel(self, job_id, reason='cancelled'):
+        """取消本进程正在执行的任务"""
+        with self.lock:
+            ctx = self.contexts.get(job_id)
+        if ctx is None:
+            return False
+        return ctx.cancel_token.cancel(reason)
+
+    def active_count(self):
+        """正在执行的任务数"""
+        with self.lock:
+            return len(self.running_jobs)
+
+    def _dispatch_loop(self):
+        """调度循环，按空闲容量领取任务"""
+        last_reclaim = time.time()
+        last_purge = 0
+
+        while self.running:
+            try:
+                if time.time() - last_reclaim >= self.reclaim_interval:
+                    self.db.reclaim_expired_jobs()
+                    last_reclaim = time.time()
+
+                if time.time() - last_purge >= self.purge_interval:
+                    self.purge()
+                    last_purge = time.time()
+
+                if self.accepting:
+                    capacity = self.max_concurrency - self.active_count()
+                    jobs = self.db.claim_jobs(
+                        self.owner,
+                        capacity,
+                        self.lease_seconds,
+                        kinds=list(self.handlers.keys())
+                    )
+                    for job in jobs:
+                        self._start_job(job)
+
+                    # 领满了就立即继续，否则等待唤醒或下一个轮询周期
+                    if jobs and len(jobs) >= capacity:
+                        continue
+
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+            except Exception as e:
+                logger.error(f"任务调度出错: {str(e)}")
+                time.sleep(self.poll_interval)
+
+    def purge(self):
+        """清除敏感任务的参数，删除超过保留时间的已结束任务"""
+        self.db.clear_finished_job_payloads(list(self.sensitive_kinds))
+        purged = self.db.purge_finished_jobs(self.job_retention, exclude_kinds=list(self.retentions))
+        for kind, retention in self.retentions.items():
+            purged += self.db.purge_finished_jobs(retention, kinds=[kind])
+        if purged:
+            logger.info(f"清理了 {purged} 个已结束的任务")
+        return purged
+
+    def _start_job(self, job):
+        """将领取到的任务提交到线程池"""
+        func, executor, timeout = self.handlers[job['kind']]
+        if callable(executor) and not isinstance(executor, concurrent.futures.Executor):
+            executor = executor(job)
+
+        # 邮箱相关的任务需要先取得邮箱租约，避免多个worker同时拉取同一个邮箱
+        if job.get('email_id') is not None:
+            if not self.db.acquire_account_lease(job['email_id'], self.owner, self.lease_seconds, job['id']):
+                logger.info(f"邮箱 ID {job['email_id']} 正由其他worker处理，任务 {job['id']} 稍后重试")
+                self.db.release_jobs(self.owner, [job['id']], delay=self.lease_seconds / 2)
+                return
+
+        with self.lock:
+            self.running_jobs[job['id']] = job
+
+        try:
+            executor.submit(self._run_job, job, func, timeout)
+        except Exception as e:
+            # 线程池已关闭，释放任务，延迟后再领取，避免反复领取失败
+            logger.error(f"提交任务 {job['id']} 失败: {str(e)}")
+            with self.lock:
+                self.running_jobs.pop(job['id'], None)
+            self.db.release_jobs(self.owner, [job['id']], delay=self.retry_delay)
+            if job.get('email_id') is not None:
+                self.db.release_account_lease(job['email_id'], self.owner)
+
+    def _run_job(self, job, func, timeout=None):
+        """执行单个任务并记录结果"""
+        job_id = job['id']
+        with self.lock:
+            callback = self.callbacks.get(job_id)
+
+        ctx = JobContext(self, job, callback, timeout)
+        with self.lock:
+            self.contexts[job_id] = ctx
+        result = None
+        error = None
+
+        try:
+            result = func(job, ctx)
+            token = ctx.cancel_token
+            if token.reason == 'shutdown':
+                # 进程关闭时中断的任务放回队列，下次启动继续执行
+                self.db.release_jobs(self.owner, [job_id])
+                logger.info(f"任务被中断，已放回队列: id={job_id}, kind={job['kind']}")
+            else:
+                success = not isinstance(result, dict) or result.get('success', True)
+                status = 'done' if success else 'failed'
+                if not success:
+                    error = result.get('message')
+                    if token.cancelled and not token.timed_out:
+                        status = 'cancelled'
+                self.db.finish_job(job_id, self.owner, status, result=result, error=error,
+                                   clear_payload=job['kind'] in self.sensitive_kinds)
+                logger.info(f"任务完成: id={job_id}, kind={job['kind']}, 状态={status}")
+        except Exception as e:
+            error = str(e)
+            logger.error(f"任务执行异常: id={job_id}, kind={job['kind']}, 错误: {error}")
+            traceback.print_exc()
+            if ctx.cancel_token.reason == 'shutdown':
+                self.db.release_jobs(self.owner, [job_id])
+            else:
+                self.db.retry_job(job_id, self.owner, error, self.retry_delay)
+            result = {'success': False, 'message': error}
+        finally:
+            ctx.cancel_token.release()
+            if job.get('email_id') is not None:
+                self.db.release_account_lease(job['email_id'], self.owner)
+            with self.lock:
+                self.running_jobs.pop(job_id, None)
+                self.contexts.pop(job_id, None)
+                self.callbacks.pop(job_id, None)
+                future = self.futures.pop(job_id, None)
+            self.wakeup.set()
+
+        if future is not None and not future.done():
+            future.set_result(result)
+        return result
+
+    def _heartbeat_loop(self):
+        """定期续约正在执行的任务，并中断被其他进程请求取消的任务"""
+        interval = max(self.lease_seconds / 3, 1)
+        while self.running:
+            time.sleep(interval)
+            with self.lock:
+                job_ids = list(self.running_jobs.keys())
+            if job_ids:
+                self.db.heartbeat_jobs(self.owner, job_ids, self.lease_seconds)
+                self.db.renew_account_leases(self.owner, self.lease_seconds)
+                for job_id in self.db.get_cancel_requested_jobs(self.owner, job_ids):
+                    if self.cancel(job_id):
+                        logger.info(f"任务 {job_id} 被请求取消，已中断")
+
+    def _poll_job_result(self, job_id, interval=1.0):
+        """轮询数据库中的任务状态，用于任务由其他进程执行的情况"""
+        while True:
+            with self.lock:
+                future = self.futures.get(job_id)
+            if future is None or future.done():
+                return
+
+            job = self.db.get_job(job_id)
+            if job is None or job['status'] in ('done', 'failed', 'cancelled'):
+                with self.lock:
+                    # 本进程执行的任务结束时已取走Future并设置结果
+                    if self.futures.pop(job_id, None) is None:
+                        return
+                if job is None:
+                    future.set_result({'success': False, 'message': '任务不存在'})
+                else:
+                    result = job.get('result')
+                    if not isinstance(result, dict):
+                        result = {'success': job['status'] == 'done', 'message': job.get('error') or job['status']}
+                    future.set_result(result)
+                return
+            time.sleep(interval)
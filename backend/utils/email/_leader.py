@@ -0,0 +1,69 @@
+"""
+基于数据库租约的领导选举
+多进程部署时（多个ASGI worker或多个app.py实例），实时检查调度只应在一个进程中运行。
+各进程定期尝试获取同名租约，持有者续约，持有者退出或崩溃后租约过期，由其他进程接手。
+"""
+
+import logging
+import os
+import socket
+import threading
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """通过leader_leases表选出唯一的调度进程"""
+
+    def __init__(self, db, name, owner=None, lease_seconds=30):
+        """初始化领导选举
+
+        Args:
+            db: 数据库对象
+            name: 租约名称，同名租约同一时间只有一个持有者
+            owner: 本进程标识，默认为 主机名:进程号
+            lease_seconds: 租约有效期，持有者每三分之一有效期续约一次
+        """
+        self.db = db
+        self.name = name
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.leader = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def is_leader(self):
+        return self.leader
+
+    def start(self):
+        """立即尝试一次选举，然后在后台线程中定期续约或竞选"""
+        self.stop_event.clear()
+        self._elect()
+        self.thread = threading.Thread(target=self._loop, name=f"leader-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止选举并释放租约，其他进程可立即接手"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.leader:
+            self.db.release_leader_lease(self.name, self.owner)
+            self.leader = False
+            logger.info(f"已释放 {self.name} 领导租约 (owner={self.owner})")
+
+    def _loop(self):
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            self._elect()
+
+    def _elect(self):
+        acquired = self.db.acquire_leader_lease(self.name, self.owner, self.lease_seconds)
+        if acquired != self.leader:
+            if acquired:
+                logger.info(f"成为 {self.name} 的领导进程 (owner={self.owner})")
+            else:
+                logger.warning(f"失去 {self.name} 的领导租约 (owner={self.owner})")
+        self.leader = acquired
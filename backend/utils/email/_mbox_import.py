@@ -0,0 +1,150 @@
+"""
+MBOX归档流式导入
+上传的文件按块写入磁盘，导入时通过mmap逐封定位和解析邮件，不把整个归档读入内存；
+解析结果按批写入数据库，每批与断点（已提交到的文件偏移）在同一个事务中提交，
+任务中断后从最后提交的偏移继续，不会重复导入。
+"""
+
+import logging
+import mmap
+import os
+import time
+
+from .file_parser import EmailFileParser
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 上传文件写入磁盘的块大小
+CHUNK_SIZE = 1024 * 1024
+
+# mbox中每封邮件以 "From " 开头的分隔行开始
+SEPARATOR = b'\nFrom '
+
+
+def save_stream(stream, path, chunk_size=CHUNK_SIZE):
+    """把上传的数据流按块写入文件，返回写入的字节数"""
+    written = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def iter_mbox(path, offset=0):
+    """从指定偏移开始逐封读取mbox中的邮件
+
+    Yields:
+        (邮件结束处的偏移, 邮件的原始字节，不含分隔行)
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            # 偏移总是落在分隔行的开头（或文件开头）
+            start = offset
+            if start == 0 and mm[:5] != b'From ':
+                # 不以分隔行开头的文件当作单封邮件的开头部分处理
+                body_start = 0
+            else:
+                line_end = mm.find(b'\n', start)
+                body_start = size if line_end == -1 else line_end + 1
+
+            while body_start < size:
+                separator = mm.find(SEPARATOR, body_start)
+                end = size if separator == -1 else separator + 1
+                yield end, mm[body_start:end]
+                if separator == -1:
+                    break
+                line_end = mm.find(b'\n', end)
+                body_start = size if line_end == -1 else line_end + 1
+
+
+def import_mbox(db, email_id, path, job_id=None, state=None, batch_size=200,
+                cancel_token=None, progress=None):
+    """流式导入mbox归档到邮箱
+
+    Args:
+        job_id: 任务ID，断点与邮件在同一个事务中写入该任务
+        state: 上次提交的断点，包含offset、imported、skipped、failed
+        batch_size: 每个事务写入的邮件数
+        progress: 进度回调 progress(百分比, 消息)
+
+    Returns:
+        结果字典: imported、skipped、failed，以及本次运行的耗时和吞吐量
+    """
+    state = dict(state or {})
+    state.setdefault('offset', 0)
+    for key in ('imported', 'skipped', 'failed'):
+        state.setdefault(key, 0)
+
+    size = os.path.getsize(path)
+    resumed_from = state['offset']
+    started = time.time()
+    processed = 0
+    batch = []
+    pending = dict(state)
+
+    def checkpoint(saved, skipped):
+        return dict(pending, imported=pending['imported'] + saved, skipped=pending['skipped'] + skipped)
+
+    def commit():
+        """提交一批邮件和对应的断点"""
+        outcome = db.import_mail_batch(email_id, batch, job_id=job_id, checkpoint=checkpoint)
+        if outcome is None:
+            raise RuntimeError('写入邮件记录失败')
+        state.update(checkpoint(*outcome))
+        pending.update(state)
+        batch.clear()
+        elapsed = max(time.time() - started, 0.001)
+        done_bytes = state['offset'] - resumed_from
+        if progress:
+            progress(
+                int(state['offset'] * 100 / size) if size else 100,
+                f"已导入 {state['imported']} 封，跳过 {state['skipped']} 封，"
+                f"{processed / elapsed:.0f} 封/秒，{done_bytes / elapsed / 1048576:.1f} MB/秒"
+            )
+
+    if progress:
+        progress(int(resumed_from * 100 / size) if size else 0, '开始导入邮件归档' if not resumed_from else '从断点继续导入')
+
+    for end, raw in iter_mbox(path, resumed_from):
+        if cancel_token is not None:
+            cancel_token.check()
+
+        record = EmailFileParser.parse_eml_content(raw, 'IMPORTED')
+
+        processed += 1
+        pending['offset'] = end
+        if record is None:
+            pending['failed'] += 1
+        else:
+            batch.append(record)
+
+        if len(batch) >= batch_size:
+            commit()
+
+    if batch or pending['offset'] != state['offset']:
+        commit()
+
+    elapsed = max(time.time() - started, 0.001)
+    result = {
+        'success': True,
+        'email_id': email_id,
+        'imported': state['imported'],
+        'skipped': state['skipped'],
+        'failed': state['failed'],
+        'bytes': size,
+        'elapsed': round(elapsed, 3),
+        'messages_per_second': round(processed / elapsed, 1),
+        'bytes_per_second': int((state['offset'] - resumed_from) / elapsed)
+    }
+    result['message'] = (f"归档导入完成，新增 {result['imported']} 封，已存在 {result['skipped']} 封，"
+                         f"解析失败 {result['failed']} 封")
+    logger.info(f"邮箱ID {email_id} {result['message']}，{result['messages_per_second']} 封/秒")
+    return result
@@ -0,0 +1,261 @@
+"""
+邮件解析缓存
+同一封群发邮件会投递到很多账户，各账户收到的原始邮件通常只有收件人、Received等头部不同。
+这里以顶层MIME头部（Content-Type、Content-Transfer-Encoding、Content-Disposition）加正文的哈希为键，
+缓存正文和附件的提取结果；命中时只需解析各账户自己的头部（主题、发件人、日期）。
+内存中按LRU淘汰并限制总大小，可选的磁盘缓存在多个进程之间共享（批量导入的解析进程、ASGI的worker）。
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 正文小于这个大小的邮件解析很快，不缓存
+MIN_BODY_SIZE = 1024
+
+# 缓存格式版本，修改正文或附件的提取逻辑后加一，避免磁盘缓存返回旧解析器的结果
+CACHE_VERSION = 1
+
+# 每写入多少个磁盘缓存文件检查一次磁盘缓存的总大小
+PRUNE_INTERVAL = 100
+
+# 决定正文解析方式的顶层头部，参与缓存键的计算
+MIME_HEADERS = re.compile(
+    rb'^(content-type|content-transfer-encoding|content-disposition)[ \t]*:(.*(?:\r?\n[ \t].*)*)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def split_message(content):
+    """在第一个空行处把原始邮件分为头部和正文，找不到空行时返回None"""
+    crlf = content.find(b'\r\n\r\n')
+    lf = content.find(b'\n\n')
+    if lf == -1 and crlf == -1:
+        return None
+    if crlf != -1 and (lf == -1 or crlf < lf):
+        return content[:crlf + 2], content[crlf + 4:]
+    return content[:lf + 1], content[lf + 2:]
+
+
+def cache_key(head, body):
+    """计算原始邮件的缓存键，正文太小时返回None
+
+    正文统一换行符后参与计算，同一封邮件经过不同服务器转发（CRLF/LF）也能命中。
+    """
+    if len(body) < MIN_BODY_SIZE:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(b'v%d\n' % CACHE_VERSION)
+    for name, value in sorted((name.lower(), b' '.join(value.split())) for name, value in MIME_HEADERS.findall(head)):
+        digest.update(name + b':' + value + b'\n')
+    digest.update(b'\n')
+    digest.update(body.replace(b'\r\n', b'\n'))
+    return digest.hexdigest()
+
+
+def _entry_size(content_data, attachments):
+    """估算缓存条目占用的内存"""
+    size = 256
+    for value in content_data.values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+    for attachment in attachments:
+        size += 128 + len(attachment.get('content') or b'') + len(attachment.get('filename') or '')
+    return size
+
+
+class ParseCache:
+    """线程安全的邮件解析结果缓存"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        """初始化缓存
+
+        Args:
+            max_bytes: 内存缓存的大小上限，0表示不使用内存缓存
+            disk_dir: 磁盘缓存目录，None表示不使用磁盘缓存
+            max_disk_bytes: 磁盘缓存的大小上限
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 缓存键 -> (正文数据, 附件列表, 解析耗时, 大小)
+        self.bytes = 0
+        self.disk_writes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+                      'saved_seconds': 0.0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    def get(self, key):
+        """读取缓存的解析结果
+
+        Returns:
+            (正文数据, 附件列表, 当初的解析耗时)，正文数据和附件为副本，未命中时返回None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+
+        if entry is None and self.disk_dir:
+            entry = self._load(key)
+            if entry is not None:
+                with self.lock:
+                    self.stats['disk_hits'] += 1
+                self._remember(key, entry)
+
+        if entry is None:
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+        content_data, attachments = entry[0], entry[1]
+        return dict(content_data), [dict(attachment) for attachment in attachments], entry[2]
+
+    def record_saved(self, seconds):
+        """累计命中缓存节省的解析时间（当初的解析耗时减去这次只解析头部的耗时）"""
+        with self.lock:
+            self.stats['saved_seconds'] += max(seconds, 0.0)
+
+    def put(self, key, content_data, attachments, seconds):
+        """缓存一封邮件的正文和附件提取结果
+
+        Args:
+            seconds: 这次解析的耗时，用于计算命中时节省的时间
+        """
+        entry = (dict(content_data), [dict(attachment) for attachment in attachments], seconds,
+                 _entry_size(content_data, attachments))
+        with self.lock:
+            self.stats['stores'] += 1
+        self._remember(key, entry)
+        if self.disk_dir:
+            self._save(key, entry)
+
+    def _remember(self, key, entry):
+        """写入内存缓存，超过大小上限时淘汰最久未使用的条目"""
+        if entry[3] > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[3]
+            self.entries[key] = entry
+            self.bytes += entry[3]
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[3]
+                self.stats['evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.pkl')
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            # 更新修改时间，清理磁盘缓存时按修改时间淘汰
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取解析缓存文件失败: {str(e)}")
+            return None
+
+    def _save(self, key, entry):
+        """原子地写入磁盘缓存，多个进程同时写入同一个键时后写入的覆盖先写入的"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"写入解析缓存文件失败: {str(e)}")
+            return
+
+        with self.lock:
+            self.disk_writes += 1
+            prune = self.disk_writes % PRUNE_INTERVAL == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """磁盘缓存超过大小上限时删除最久未使用的文件"""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith('.pkl'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_disk_bytes:
+            return
+        files.sort()
+        removed = 0
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        logger.info(f"已清理 {removed} 个解析缓存文件，剩余 {total / 1048576:.1f} MB")
+
+    def get_stats(self):
+        """返回命中统计"""
+        with self.lock:
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            lookups = hits + self.stats['misses']
+            stats = dict(self.stats)
+            stats.update({
+                'hits': hits,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'saved_seconds': round(self.stats['saved_seconds'], 3),
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'disk_dir': self.disk_dir
+            })
+            return stats
+
+    def clear(self):
+        """清空内存缓存"""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+# 进程内共享的解析缓存
+parse_cache = ParseCache(
+    max_bytes=int(float(os.environ.get('PARSE_CACHE_MB', '64')) * 1024 * 1024),
+    disk_dir=os.environ.get('PARSE_CACHE_DIR') or None,
+    max_disk_bytes=int(float(os.environ.get('PARSE_CACHE_DISK_MB', '512')) * 1024 * 1024)
+)
@@ -8,6 +8,7 @@ import threading
 import concurrent.futures
 from datetime import datetime, timedelta
 from .common import normalize_check_time
+from ._leader import LeaderElection
 
 # 创建日志记录器
 logger = logging.getLogger(__name__)
@@ -29,6 +30,8 @@ class RealTimeChecker:
         self.check_interval = 60  # 默认检查间隔为60秒
         self.last_check_time = {}  # 记录每个邮箱的最后检查时间
         self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+        # 多进程部署时只有领导进程调度实时检查
+        self.leader = LeaderElection(db, 'realtime_checker', owner=email_processor.job_queue.owner)
     
     def start(self, check_interval=60):
         """启动实时邮件检查
@@ -45,6 +48,7 @@ class RealTimeChecker:
         
         self.check_interval = max(check_interval, 30)  # 最小检查间隔为30秒
         self.running = True
+        self.leader.start()
         self.thread = threading.Thread(
             target=self._check_loop,
             daemon=True
@@ -67,6 +71,7 @@ class RealTimeChecker:
         if self.thread:
             self.thread.join(timeout=5)
             logger.info("实时邮件检查已停止")
+        self.leader.stop()
         return True
     
     def _check_loop(self):
@@ -74,6 +79,11 @@ class RealTimeChecker:
         batch_size = 10  # 每批处理的邮箱数量
         
         while self.running:
+            # 其他进程持有调度租约时只等待，租约过期后本进程会接手
+            if not self.leader.is_leader:
+                time.sleep(5)
+                continue
+
             try:
                 # 获取所有需要实时检查的邮箱
                 users = self.db.get_users_with_realtime_check()
@@ -93,7 +103,14 @@ class RealTimeChecker:
                         
                         # 处理每个邮箱
                         for account in email_accounts:
-                            if not self.running or self.email_processor.is_email_being_processed(account['id']):
+                            if not self.running or not self.leader.is_leader:
+                                break
+                            if self.email_processor.is_email_being_processed(account['id']):
+                                continue
+
+                            # 跳过处于熔断冷却期的邮箱，把资源留给正常的邮箱
+                            if not self.email_processor.circuit_breaker.allow(account):
+                                logger.debug(f"邮箱 {account['email']} 处于熔断状态，跳过本次检查")
                                 continue
                             
                             # 提交检查任务
@@ -142,17 +159,24 @@ class RealTimeChecker:
                 logger.debug(f"邮箱 {account['email']} 最近已检查，跳过本次检查")
                 return
             
-            # 创建进度回调
+            # 熔断冷却期已过的邮箱在确定提交时才占用试探机会，跳过提交时不会占用
+            circuit_breaker = self.email_processor.circuit_breaker
+            probing = circuit_breaker.needs_probe(account)
+            if probing and not circuit_breaker.acquire_probe(account):
+                return
+            
+            # 创建进度回调，WebSocket推送由邮件处理器通过事件总线完成
             def progress_callback(progress, message):
                 logger.info(f"邮箱 ID {account_id} 处理进度: {progress}%, 消息: {message}")
-                # 在这里可以添加WebSocket推送进度的代码
             
-            # 提交到实时线程池
-            future = self.email_processor.realtime_thread_pool.submit(
-                self.email_processor._check_email_task,
-                account,
-                progress_callback
-            )
+            # 写入持久化任务队列，由调度线程交给实时线程池执行；已有未完成的检查任务时队列返回该任务，由它完成试探
+            account.setdefault('user_id', user_id)
+            job_id = self.email_processor.enqueue_check(account, progress_callback, is_realtime=True)
+            if job_id is None:
+                if probing:
+                    circuit_breaker.release_probe(account)
+                logger.warning(f"邮箱 {account['email']} 检查任务入队失败")
+                return
             
             # 更新内存中的最后检查时间
             self.last_check_time[account_id] = current_time
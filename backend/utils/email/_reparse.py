@@ -0,0 +1,155 @@
+"""
+重新解析已保存的原始邮件
+改进正文或附件的提取逻辑后，用当前的解析器重新解析原始邮件存储中的邮件，更新邮件记录和附件。
+原始邮件在进程池中读取和解析，主进程按邮件ID顺序收集结果，
+每批与断点（已处理到的邮件ID）在同一个事务中写入数据库，任务中断后从断点继续。
+"""
+
+import logging
+import os
+import time
+
+from utils.raw_store import RawMessageStore
+
+from ._archive_import import MAX_FAILURES, _create_pool, _parse_all
+from ._parse_cache import ParseCache
+from .file_parser import EmailFileParser
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 每次从数据库读取的索引条数
+PAGE_SIZE = 1000
+
+# 工作进程中的原始邮件存储和解析缓存: (目录, RawMessageStore, ParseCache)
+_worker_state = None
+
+
+def parse_stored(base_dir, mail_id, segment, offset, length):
+    """读取并解析一封原始邮件，在工作进程中执行
+
+    使用不带磁盘缓存的解析缓存，保证结果来自当前的解析器，同时避免重复解析群发邮件。
+
+    Returns:
+        (邮件ID, 邮件数据, 失败原因)，成功时失败原因为None
+    """
+    global _worker_state
+    try:
+        if _worker_state is None or _worker_state[0] != base_dir:
+            _worker_state = (base_dir, RawMessageStore(base_dir), ParseCache())
+        raw = _worker_state[1].read(segment, offset, length, mail_id)
+        record = EmailFileParser.parse_eml_content(raw, cache=_worker_state[2])
+        if not record:
+            return mail_id, None, '无法解析邮件'
+        record.pop('raw', None)
+        record['id'] = mail_id
+        return mail_id, record, None
+    except Exception as e:
+        return mail_id, None, str(e)
+
+
+def reparse_messages(db, filters=None, job_id=None, state=None, workers=None, batch_size=200,
+                     cancel_token=None, progress=None):
+    """用当前的解析器重新解析符合条件的原始邮件
+
+    Args:
+        filters: email_ids、folder、since、until，见Database.count_raw_messages
+        job_id: 任务ID，断点与邮件在同一个事务中写入该任务
+        state: 上次提交的断点，包含last_id、processed、updated、failed、failures
+        workers: 解析进程数，默认为CPU核数
+        batch_size: 每个事务更新的邮件数
+        progress: 进度回调 progress(百分比, 消息)
+
+    Returns:
+        结果字典: total、processed、updated、failed、failures，以及本次运行的耗时和吞吐量
+    """
+    global _worker_state
+    state = dict(state or {})
+    for key in ('last_id', 'processed', 'updated', 'failed'):
+        state.setdefault(key, 0)
+    state['failures'] = list(state.get('failures') or [])
+
+    base_dir = db.raw_store.base_dir
+    total = db.count_raw_messages(filters)
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(workers or cpu_count, cpu_count))
+    resumed_from = state['processed']
+    started = time.time()
+    batch = []
+    pending = dict(state, failures=list(state['failures']))
+
+    def entries():
+        """按邮件ID顺序分页读取索引，边读取边提交给进程池"""
+        after_id = state['last_id']
+        while True:
+            rows = db.get_raw_message_index(filters, after_id, PAGE_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield (base_dir,) + row
+            after_id = rows[-1][0]
+
+    def checkpoint(updated):
+        return dict(pending, updated=pending['updated'] + updated)
+
+    def commit():
+        """提交一批邮件和对应的断点"""
+        updated = db.rewrite_parsed_mails(batch, job_id=job_id, checkpoint=checkpoint)
+        if updated is None:
+            raise RuntimeError('更新邮件记录失败')
+        state.update(checkpoint(updated))
+        pending.update(state, failures=list(state['failures']))
+        batch.clear()
+        elapsed = max(time.time() - started, 0.001)
+        if progress:
+            progress(
+                int(state['processed'] * 100 / total) if total else 100,
+                f"已重新解析 {state['processed']}/{total} 封，失败 {state['failed']} 封，"
+                f"{(state['processed'] - resumed_from) / elapsed:.0f} 封/秒"
+            )
+
+    if progress:
+        progress(int(resumed_from * 100 / total) if total else 0,
+                 f'共 {total} 封邮件，使用 {workers} 个解析进程' if not resumed_from else '从断点继续重新解析')
+
+    pool = _create_pool(workers) if total - resumed_from > batch_size else None
+    try:
+        for mail_id, record, error in _parse_all(pool, parse_stored, entries(), workers):
+            if cancel_token is not None:
+                cancel_token.check()
+
+            pending['processed'] += 1
+            pending['last_id'] = mail_id
+            if record is None:
+                pending['failed'] += 1
+                if len(pending['failures']) < MAX_FAILURES:
+                    pending['failures'].append({'mail_id': mail_id, 'reason': error})
+            else:
+                batch.append(record)
+
+            if pending['processed'] - state['processed'] >= batch_size:
+                commit()
+
+        if pending['processed'] != state['processed']:
+            commit()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        # 不在进程池中解析时缓存留在当前进程，任务结束后释放
+        _worker_state = None
+
+    elapsed = max(time.time() - started, 0.001)
+    result = {
+        'success': True,
+        'total': total,
+        'processed': state['processed'],
+        'updated': state['updated'],
+        'failed': state['failed'],
+        'failures': state['failures'],
+        'workers': workers if pool is not None else 1,
+        'elapsed': round(elapsed, 3),
+        'messages_per_second': round((state['processed'] - resumed_from) / elapsed, 1)
+    }
+    result['message'] = f"重新解析完成，共 {total} 封，更新 {result['updated']} 封，解析失败 {result['failed']} 封"
+    logger.info(f"{result['message']}，{result['messages_per_second']} 封/秒")
+    return result
@@ -0,0 +1,278 @@
+"""
+实时检查前的邮箱状态预检
+实时检查每次都要登录、SELECT、SEARCH再FETCH，即使邮箱没有任何变化。
+预检对关注的文件夹各发送一条 STATUS (UIDNEXT MESSAGES UIDVALIDITY [HIGHESTMODSEQ])，
+与上次成功同步时保存的状态（mailbox_state表）相同时跳过本次同步。
+登录后的连接按邮箱保留在会话池中，下次预检直接复用，大多数轮询只需要一条短命令。
+预检出错时按有变化处理，照常同步。
+"""
+
+import hashlib
+import imaplib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from ._deadline import close_imap_connection
+from .gmail import GmailHandler
+from .outlook import OutlookMailHandler
+from .qq import QQMailHandler
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 各类邮箱同步的文件夹，与fetch_emails一致
+WATCHED_FOLDERS = {'outlook': ('inbox',)}
+DEFAULT_FOLDERS = ('INBOX',)
+
+# 比较的状态项，HIGHESTMODSEQ只在服务器支持CONDSTORE时查询
+STATUS_KEYS = ('uidvalidity', 'uidnext', 'messages', 'highestmodseq')
+# 没有检查期限时单次网络操作的超时，单位为秒
+DEFAULT_TIMEOUT = 30
+
+STATUS_PATTERN = re.compile(rb'(UIDNEXT|MESSAGES|UIDVALIDITY|HIGHESTMODSEQ) (\d+)', re.IGNORECASE)
+
+
+class SessionPool:
+    """按邮箱保留已登录的IMAP连接，超过空闲时间或数量上限的连接被关闭
+
+    每个连接记录登录时的凭据指纹，邮箱修改密码、令牌或服务器后，旧连接在下次取出时被关闭。
+    """
+
+    def __init__(self, max_sessions=200, max_idle=300):
+        """初始化会话池
+
+        Args:
+            max_sessions: 最多保留的连接数，0表示不保留
+            max_idle: 连接的最长空闲时间，单位为秒，应小于服务器的空闲超时（通常30分钟）
+        """
+        self.max_sessions = max_sessions
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # 邮箱ID -> (连接, 归还时间, 凭据指纹)
+
+    def acquire(self, key, fingerprint=None):
+        """取出邮箱的空闲连接，没有、已过期或凭据已变化时返回None"""
+        with self.lock:
+            session = self.sessions.pop(key, None)
+        if session is None:
+            return None
+        mail, released_at, session_fingerprint = session
+        if session_fingerprint != fingerprint or time.time() - released_at > self.max_idle:
+            self.discard(mail)
+            return None
+        return mail
+
+    def release(self, key, mail, fingerprint=None):
+        """归还连接，超过数量上限时关闭最久未使用的连接"""
+        evicted = []
+        with self.lock:
+            old = self.sessions.pop(key, None)
+            if old is not None:
+                evicted.append(old[0])
+            if self.max_sessions > 0:
+                self.sessions[key] = (mail, time.time(), fingerprint)
+            else:
+                evicted.append(mail)
+            while len(self.sessions) > self.max_sessions:
+                evicted.append(self.sessions.popitem(last=False)[1][0])
+        for session in evicted:
+            self.discard(session)
+
+    @staticmethod
+    def discard(mail):
+        """关闭连接，忽略错误"""
+        try:
+            mail.logout()
+        except Exception:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
+
+    def close_all(self):
+        """关闭所有连接"""
+        with self.lock:
+            sessions = [session[0] for session in self.sessions.values()]
+            self.sessions.clear()
+        for mail in sessions:
+            self.discard(mail)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class StatusChecker:
+    """用STATUS命令判断邮箱自上次同步后是否有变化"""
+
+    def __init__(self, db, pool=None):
+        self.db = db
+        self.pool = pool if pool is not None else SessionPool()
+        self.lock = threading.Lock()
+        self.stats = {'checks': 0, 'unchanged': 0, 'changed': 0, 'first_sync': 0, 'errors': 0,
+                      'logins': 0, 'reused_sessions': 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def folders(email_info):
+        return WATCHED_FOLDERS.get(email_info.get('mail_type'), DEFAULT_FOLDERS)
+
+    @staticmethod
+    def _fingerprint(email_info):
+        """登录凭据的指纹，任一项变化后不再复用旧连接
+
+        不包含Outlook的access_token，它在每次刷新时都会变化，而旧连接仍然有效。
+        """
+        parts = [email_info.get(name) for name in
+                 ('email', 'mail_type', 'server', 'port', 'use_ssl', 'password', 'client_id', 'refresh_token')]
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def _connect(self, email_info, cancel_token):
+        """登录邮箱，Outlook优先使用保存的访问令牌，失效时刷新"""
+        timeout = cancel_token.timeout_for() if cancel_token is not None else DEFAULT_TIMEOUT
+        mail_type = email_info.get('mail_type')
+        self._count('logins')
+
+        if mail_type == 'outlook':
+            access_token = email_info.get('access_token')
+            for attempt in range(2):
+                if not access_token:
+                    access_token = OutlookMailHandler.get_new_access_token(
+                        email_info.get('refresh_token'), email_info.get('client_id'), cancel_token
+                    )
+                    if not access_token:
+                        raise RuntimeError('获取访问令牌失败')
+                    self.db.update_email_token(email_info['id'], access_token)
+                mail = imaplib.IMAP4_SSL('outlook.live.com', timeout=timeout)
+                auth_string = OutlookMailHandler.generate_auth_string(email_info['email'], access_token)
+                try:
+                    mail.authenticate('XOAUTH2', lambda x: auth_string)
+                    return mail
+                except imaplib.IMAP4.error:
+                    self.pool.discard(mail)
+                    if attempt:
+                        raise
+                    # 保存的令牌已过期，刷新后重试一次
+                    access_token = None
+
+        if mail_type in ('gmail', 'qq'):
+            handler = GmailHandler if mail_type == 'gmail' else QQMailHandler
+            server, port, use_ssl = handler.SERVER, handler.PORT, handler.USE_SSL
+        else:
+            server = email_info.get('server')
+            use_ssl = email_info.get('use_ssl', True)
+            port = email_info.get('port') or (993 if use_ssl else 143)
+        if use_ssl:
+            mail = imaplib.IMAP4_SSL(server, port, timeout=timeout)
+        else:
+            mail = imaplib.IMAP4(server, port, timeout=timeout)
+        mail.login(email_info['email'], email_info['password'])
+        return mail
+
+    @staticmethod
+    def _status(mail, folders):
+        """查询各文件夹的状态"""
+        items = 'UIDNEXT MESSAGES UIDVALIDITY'
+        if 'CONDSTORE' in mail.capabilities:
+            items += ' HIGHESTMODSEQ'
+        states = {}
+        for folder in folders:
+            typ, data = mail.status(folder, f'({items})')
+            if typ != 'OK' or not data or not isinstance(data[0], bytes):
+                raise RuntimeError(f"查询文件夹 {folder} 状态失败: {typ}")
+            values = {name.decode().lower(): int(value) for name, value in STATUS_PATTERN.findall(data[0])}
+            states[folder] = {key: values.get(key) for key in STATUS_KEYS}
+        return states
+
+    def snapshot(self, email_info, cancel_token=None):
+        """查询邮箱关注的文件夹的当前状态，优先复用会话池中的连接
+
+        Returns:
+            {文件夹: 状态}，出错时返回None
+        """
+        key = email_info['id']
+        fingerprint = self._fingerprint(email_info)
+        folders = self.folders(email_info)
+        mail = self.pool.acquire(key, fingerprint)
+        reused = mail is not None
+        closer = None
+        for attempt in range(2):
+            try:
+                if mail is None:
+                    mail = self._connect(email_info, cancel_token)
+                else:
+                    # 复用的连接使用本次检查的超时，而不是登录时的超时
+                    mail.sock.settimeout(cancel_token.timeout_for() if cancel_token is not None else DEFAULT_TIMEOUT)
+                if cancel_token is not None:
+                    closer = close_imap_connection(mail)
+                    cancel_token.on_cancel(closer)
+                states = self._status(mail, folders)
+                if reused:
+                    self._count('reused_sessions')
+                self.pool.release(key, mail, fingerprint)
+                return states
+            except Exception as e:
+                if mail is not None:
+                    self.pool.discard(mail)
+                mail = None
+                if cancel_token is not None and cancel_token.cancelled:
+                    return None
+                if not reused or attempt:
+                    logger.warning(f"查询邮箱 {email_info['email']} 状态失败: {str(e)}")
+                    return None
+                # 池中的连接可能已被服务器关闭，重新登录后重试一次
+                reused = False
+            finally:
+                if closer is not None:
+                    cancel_token.remove_closer(closer)
+                    closer = None
+        return None
+
+    def precheck(self, email_info, cancel_token=None):
+        """判断邮箱自上次成功同步后是否有变化
+
+        Returns:
+            (是否没有变化, 当前状态)，当前状态在同步成功后传给commit；出错时返回 (False, None)
+        """
+        self._count('checks')
+        states = self.snapshot(email_info, cancel_token)
+        if states is None:
+            self._count('errors')
+            return False, None
+
+        saved = self.db.get_mailbox_state(email_info['id'])
+        if not saved:
+            self._count('first_sync')
+            return False, states
+        unchanged = all(saved.get(folder) == state for folder, state in states.items())
+        self._count('unchanged' if unchanged else 'changed')
+        return unchanged, states
+
+    def commit(self, email_id, states):
+        """同步成功后保存同步前查询到的状态；同步期间到达的邮件会使下次预检发现变化"""
+        if states:
+            self.db.save_mailbox_state(email_id, states)
+
+    def get_stats(self):
+        """返回预检统计，skip_ratio为没有变化而跳过同步的比例"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['skip_ratio'] = round(stats['unchanged'] / stats['checks'], 4) if stats['checks'] else 0.0
+        stats['pooled_sessions'] = len(self.pool)
+        return stats
+
+
+def create_status_checker(db):
+    """按环境变量创建预检器，STATUS_PRECHECK=false时返回None"""
+    if os.environ.get('STATUS_PRECHECK', 'true').lower() in ('0', 'false', 'no'):
+        return None
+    return StatusChecker(db, SessionPool(
+        max_sessions=int(os.environ.get('STATUS_POOL_SIZE', '200')),
+        max_idle=int(os.environ.get('STATUS_POOL_IDLE', '300'))
+    ))
@@ -2,10 +2,9 @@
 通用邮件处理工具函数
 """
 
-from bs4 import BeautifulSoup
 from email.header import decode_header
 from email.message import Message
-import chardet
+import codecs
 from datetime import datetime
 import email.utils
 import time
@@ -16,6 +15,41 @@ import re
 
 # 导入日志
 from .logger import logger, timing_decorator
+from ._html_text import detect_vendors, html_to_text
+
+# 编码检测库，第一次需要检测时才导入
+_charset_detector = None
+
+def _detect_charset(sample):
+    """检测编码，优先使用C实现的cchardet"""
+    global _charset_detector
+    if _charset_detector is None:
+        try:
+            import cchardet as detector
+        except ImportError:
+            import chardet as detector
+        _charset_detector = detector
+    return _charset_detector.detect(sample).get('encoding')
+
+# 编码检测只使用内容开头的这部分字节
+DETECT_SAMPLE_SIZE = 16 * 1024
+
+# 常见的声明编码替换为兼容的超集，避免部分字符无法解码
+CHARSET_ALIASES = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'x-gbk': 'gb18030',
+    'big5': 'big5hkscs',
+    'ks_c_5601-1987': 'cp949',
+    'us-ascii': 'utf-8',
+    'ascii': 'utf-8',
+}
+
+# 单字节编码的Python编码名前缀
+SINGLE_BYTE_PREFIXES = ('iso8859', 'latin', 'cp125', 'cp437', 'cp850', 'koi8', 'mac-')
+
+# 检测失败时依次尝试的编码，latin1总能解码成功
+FALLBACK_ENCODINGS = ['utf-8', 'gb18030', 'big5hkscs', 'latin1']
 
 def decode_mime_words(s):
     """解码邮件标题"""
@@ -50,7 +84,7 @@ def decode_mime_words(s):
 def strip_html(content):
     """去除 HTML 标签"""
     try:
-        # 避免content为文件路径引起BeautifulSoup警告
+        # content可能被误传为文件路径
         if not content or not isinstance(content, str):
             return content if content else ""
 
@@ -62,31 +96,79 @@ def strip_html(content):
             logger.warning(f"content可能是文件路径，而非HTML内容: {content[:50]}")
             return f"错误的内容格式: {content}"
 
-        soup = BeautifulSoup(content, "html.parser")
-        return soup.get_text()
+        return html_to_text(content)['text']
     except Exception as e:
         logger.error(f"去除HTML标签失败: {str(e)}")
         return content
 
-def safe_decode(byte_content):
-    """自动检测并解码字节数据"""
+def _normalize_charset(charset):
+    """把声明的编码转换为可用的Python编码名，无法识别时返回None"""
+    if not charset:
+        return None
+    charset = str(charset).strip().strip('"\'').lower()
+    charset = CHARSET_ALIASES.get(charset, charset)
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+def decode_bytes(byte_content, charset=None):
+    """解码字节数据
+
+    依次尝试：声明的编码、严格的UTF-8、对开头DETECT_SAMPLE_SIZE字节做编码检测，最后使用常见编码。
+    声明为单字节编码（如iso-8859-1）的内容几乎总能解码成功，先尝试UTF-8，避免误标的UTF-8邮件出现乱码。
+
+    Args:
+        charset: MIME部分声明的编码，没有时为None
+    """
     if not byte_content:
         return ""
-    try:
-        result = chardet.detect(byte_content)
-        encoding = result['encoding']
-        if encoding is not None:
+    tried = set()
+
+    declared = _normalize_charset(charset)
+    if declared and declared.startswith(SINGLE_BYTE_PREFIXES):
+        tried.add('utf-8')
+        try:
+            return byte_content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+
+    if declared and declared not in tried:
+        tried.add(declared)
+        try:
+            return byte_content.decode(declared)
+        except UnicodeDecodeError:
+            pass
+
+    if 'utf-8' not in tried:
+        tried.add('utf-8')
+        try:
+            return byte_content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+
+    detected = _normalize_charset(_detect_charset(byte_content[:DETECT_SAMPLE_SIZE]))
+    if detected and detected not in tried:
+        tried.add(detected)
+        try:
+            return byte_content.decode(detected)
+        except UnicodeDecodeError:
+            pass
+
+    for enc in FALLBACK_ENCODINGS:
+        if enc not in tried:
             try:
-                return byte_content.decode(encoding)
+                return byte_content.decode(enc)
             except UnicodeDecodeError:
-                # 如果使用检测到的编码失败，尝试其他常见编码
-                for enc in ['utf-8', 'gbk', 'gb18030', 'latin1', 'windows-1252']:
-                    try:
-                        return byte_content.decode(enc)
-                    except:
-                        continue
-        # 如果所有尝试都失败，返回原始内容的字符串表示
-        return str(byte_content)
+                continue
+    return byte_content.decode('utf-8', errors='replace')
+
+def safe_decode(byte_content, charset=None):
+    """自动检测并解码字节数据，charset为声明的编码"""
+    if not byte_content:
+        return ""
+    try:
+        return decode_bytes(byte_content, charset)
     except Exception as e:
         logger.error(f"解码字节数据失败: {str(e)}")
         return str(byte_content)
@@ -108,25 +190,12 @@ def parse_email_date(date_str):
         logger.error(f"解析邮件日期失败: {str(e)}")
         return datetime.now()
 
-def decode_email_content(byte_content):
-    """解码邮件内容"""
+def decode_email_content(byte_content, charset=None):
+    """解码邮件内容，charset为声明的编码"""
     if not byte_content:
         return ""
     try:
-        result = chardet.detect(byte_content)
-        encoding = result['encoding']
-        if encoding is not None:
-            try:
-                return byte_content.decode(encoding)
-            except UnicodeDecodeError:
-                # 如果使用检测到的编码失败，尝试其他常见编码
-                for enc in ['utf-8', 'gbk', 'gb18030', 'latin1', 'windows-1252']:
-                    try:
-                        return byte_content.decode(enc)
-                    except:
-                        continue
-        # 如果所有尝试都失败，返回原始内容的字符串表示
-        return str(byte_content)
+        return decode_bytes(byte_content, charset)
     except Exception as e:
         logger.error(f"解码邮件内容失败: {str(e)}")
         return str(byte_content)
@@ -245,33 +314,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 content_type = 'text/html' if has_html else 'text/plain'
 
                 # 检测特殊邮件格式
-                is_microsoft_email = False
-                is_notion_email = False
-                is_github_email = False
-
-                if has_html and html_body:
-                    html_content = html_body.lower()
-
-                    # 检测Microsoft邮件
-                    if ('class="msonormal"' in html_content or
-                        'style="mso-' in html_content or
-                        'microsoft.com' in html_content or
-                        'outlook.com' in html_content):
-                        is_microsoft_email = True
-                        logger.debug("检测到Microsoft格式邮件")
-
-                    # 检测Notion邮件
-                    if ('notion.so' in html_content or
-                        'data-block-id' in html_content or
-                        'notion-' in html_content):
-                        is_notion_email = True
-                        logger.debug("检测到Notion格式邮件")
-
-                    # 检测GitHub邮件
-                    if ('github.com' in html_content or
-                        'github-' in html_content):
-                        is_github_email = True
-                        logger.debug("检测到GitHub格式邮件")
+                vendors = detect_vendors(html_body if has_html else None)
 
                 # 创建内容对象
                 return {
@@ -279,9 +322,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                     'content_type': content_type,
                     'has_html': has_html,
                     'plain_text': plain_body if has_html else None,
-                    'is_microsoft_email': is_microsoft_email,
-                    'is_notion_email': is_notion_email,
-                    'is_github_email': is_github_email
+                    **vendors
                 }
             except Exception as e:
                 logger.warning(f"处理extract_msg对象失败: {str(e)}")
@@ -297,33 +338,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 content_type = 'text/html' if has_html else 'text/plain'
 
                 # 检测特殊邮件格式
-                is_microsoft_email = False
-                is_notion_email = False
-                is_github_email = False
-
-                if has_html and msg.text_html:
-                    html_content = msg.text_html.lower()
-
-                    # 检测Microsoft邮件
-                    if ('class="msonormal"' in html_content or
-                        'style="mso-' in html_content or
-                        'microsoft.com' in html_content or
-                        'outlook.com' in html_content):
-                        is_microsoft_email = True
-                        logger.debug("检测到Microsoft格式邮件")
-
-                    # 检测Notion邮件
-                    if ('notion.so' in html_content or
-                        'data-block-id' in html_content or
-                        'notion-' in html_content):
-                        is_notion_email = True
-                        logger.debug("检测到Notion格式邮件")
-
-                    # 检测GitHub邮件
-                    if ('github.com' in html_content or
-                        'github-' in html_content):
-                        is_github_email = True
-                        logger.debug("检测到GitHub格式邮件")
+                vendors = detect_vendors(msg.text_html if has_html else None)
 
                 # 创建内容对象
                 return {
@@ -331,9 +346,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                     'content_type': content_type,
                     'has_html': has_html,
                     'plain_text': msg.text_plain if has_html else None,
-                    'is_microsoft_email': is_microsoft_email,
-                    'is_notion_email': is_notion_email,
-                    'is_github_email': is_github_email
+                    **vendors
                 }
             except Exception as e:
                 logger.warning(f"处理mail_parser对象失败: {str(e)}")
@@ -428,7 +441,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                         try:
                             payload = part.get_payload(decode=True)
                             if payload:
-                                decoded_content = safe_decode(payload)
+                                decoded_content = safe_decode(payload, part.get_content_charset())
                                 plain_content += decoded_content + "\n\n"
                         except Exception as e:
                             logger.warning(f"解码纯文本内容失败: {str(e)}")
@@ -441,7 +454,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                         try:
                             payload = part.get_payload(decode=True)
                             if payload:
-                                html_content += safe_decode(payload)
+                                html_content += safe_decode(payload, part.get_content_charset())
                         except Exception as e:
                             logger.warning(f"解码HTML内容失败: {str(e)}")
 
@@ -453,7 +466,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                         try:
                             payload = part.get_payload(decode=True)
                             if payload:
-                                rtf_content = safe_decode(payload)
+                                rtf_content = safe_decode(payload, part.get_content_charset())
                                 # 简单处理RTF内容，提取纯文本
                                 plain_content = rtf_content.replace('\\par', '\n').replace('\\tab', '\t')
                                 # 去除RTF控制字符
@@ -470,7 +483,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 try:
                     payload = msg.get_payload(decode=True)
                     if payload:
-                        plain_content = safe_decode(payload)
+                        plain_content = safe_decode(payload, msg.get_content_charset())
                 except Exception as e:
                     logger.warning(f"解码纯文本内容失败: {str(e)}")
             elif content_type == "text/html":
@@ -478,7 +491,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 try:
                     payload = msg.get_payload(decode=True)
                     if payload:
-                        html_content = safe_decode(payload)
+                        html_content = safe_decode(payload, msg.get_content_charset())
                 except Exception as e:
                     logger.warning(f"解码HTML内容失败: {str(e)}")
             elif content_type == "application/rtf":
@@ -486,7 +499,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 try:
                     payload = msg.get_payload(decode=True)
                     if payload:
-                        rtf_content = safe_decode(payload)
+                        rtf_content = safe_decode(payload, msg.get_content_charset())
                         # 简单处理RTF内容，提取纯文本
                         plain_content = rtf_content.replace('\\par', '\n').replace('\\tab', '\t')
                         # 去除RTF控制字符
@@ -500,41 +513,15 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                     # 尝试作为纯文本处理
                     payload = msg.get_payload(decode=True)
                     if payload:
-                        plain_content = safe_decode(payload)
+                        plain_content = safe_decode(payload, msg.get_content_charset())
                 except Exception as e:
                     logger.warning(f"解码未知类型内容失败: {str(e)}")
 
         # 构建结果
         result = {}
 
-        # 检测特殊邮件格式
-        is_microsoft_email = False
-        is_notion_email = False
-        is_github_email = False
-
-        if html_content:
-            html_lower = html_content.lower()
-
-            # 检测Microsoft邮件
-            if ('class="msonormal"' in html_lower or
-                'style="mso-' in html_lower or
-                'microsoft.com' in html_lower or
-                'outlook.com' in html_lower):
-                is_microsoft_email = True
-                logger.debug("检测到Microsoft格式邮件")
-
-            # 检测Notion邮件
-            if ('notion.so' in html_lower or
-                'data-block-id' in html_lower or
-                'notion-' in html_lower):
-                is_notion_email = True
-                logger.debug("检测到Notion格式邮件")
-
-            # 检测GitHub邮件
-            if ('github.com' in html_lower or
-                'github-' in html_lower):
-                is_github_email = True
-                logger.debug("检测到GitHub格式邮件")
+        # 检测特殊邮件格式，一次扫描完成
+        vendors = detect_vendors(html_content)
 
         # 如果有HTML内容，优先使用HTML
         if html_content:
@@ -544,9 +531,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 'content': html_content,
                 'content_type': 'text/html',
                 'has_html': True,
-                'is_microsoft_email': is_microsoft_email,
-                'is_notion_email': is_notion_email,
-                'is_github_email': is_github_email
+                **vendors
             }
 
             # 如果也有纯文本，添加到结果中
@@ -560,9 +545,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 'content': plain_content,
                 'content_type': 'text/plain',
                 'has_html': False,
-                'is_microsoft_email': is_microsoft_email,
-                'is_notion_email': is_notion_email,
-                'is_github_email': is_github_email
+                **vendors
             }
         # 如果有RTF内容但没有其他内容
         elif rtf_content:
@@ -571,9 +554,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 'content': rtf_content,
                 'content_type': 'text/plain',
                 'has_html': False,
-                'is_microsoft_email': is_microsoft_email,
-                'is_notion_email': is_notion_email,
-                'is_github_email': is_github_email
+                **vendors
             }
         else:
             # 如果内容为空，添加一个提示
@@ -582,9 +563,7 @@ def extract_email_content(msg: Union[Message, Dict]) -> dict:
                 'content': "(邮件内容为空)",
                 'content_type': 'text/plain',
                 'has_html': False,
-                'is_microsoft_email': is_microsoft_email,
-                'is_notion_email': is_notion_email,
-                'is_github_email': is_github_email
+                **vendors
             }
 
         return result
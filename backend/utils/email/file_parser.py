@@ -5,47 +5,20 @@
 
 import os
 import email
+import importlib
 import logging
+import threading
+import time
 import traceback
-from email import policy
+from email import errors
 from email.parser import BytesParser, Parser
 from email.message import Message
 from typing import Dict, List, Optional, Union, BinaryIO, TextIO, Any
 from datetime import datetime
-import chardet
 import io
 import mailbox
 import base64
 
-# 导入第三方库
-try:
-    import extract_msg  # 用于解析Outlook MSG文件
-    EXTRACT_MSG_AVAILABLE = True
-except ImportError:
-    EXTRACT_MSG_AVAILABLE = False
-    logging.warning("extract_msg库未安装，无法解析MSG文件")
-
-try:
-    import mailparser  # 增强的邮件解析库
-    MAIL_PARSER_AVAILABLE = True
-except ImportError:
-    MAIL_PARSER_AVAILABLE = False
-    logging.warning("mailparser库未安装，将使用标准库解析邮件")
-
-try:
-    import eml_parser  # EML解析库
-    EML_PARSER_AVAILABLE = True
-except ImportError:
-    EML_PARSER_AVAILABLE = False
-    logging.warning("eml_parser库未安装，将使用标准库解析EML文件")
-
-try:
-    from talon import quotations  # 用于解析邮件回复和签名
-    TALON_AVAILABLE = True
-except ImportError:
-    TALON_AVAILABLE = False
-    logging.warning("talon库未安装，无法解析邮件回复和签名")
-
 from .common import (
     decode_mime_words,
     parse_email_date,
@@ -53,10 +26,179 @@ from .common import (
     extract_email_attachments,
     safe_decode
 )
+from ._parse_cache import ParseCache, cache_key, parse_cache, split_message
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 可选的第三方解析库及未安装时的影响。这些库导入很慢（talon会加载scikit-learn），
+# 只在第一次使用时导入，没有导入.msg文件或损坏邮件的进程不需要加载
+OPTIONAL_MODULES = {
+    'extract_msg': '无法解析MSG文件',
+    'mailparser': '结构损坏的邮件不能使用mailparser解析',
+    'eml_parser': '结构损坏的邮件不能使用eml-parser解析',
+    'talon.quotations': '使用简单规则提取邮件回复和签名',
+}
+
+_optional_modules = {}
+_optional_lock = threading.Lock()
+
+
+def optional_module(name):
+    """第一次使用时导入可选的第三方库，未安装时返回None并只记录一次警告"""
+    if name not in _optional_modules:
+        with _optional_lock:
+            if name not in _optional_modules:
+                try:
+                    _optional_modules[name] = importlib.import_module(name)
+                except ImportError:
+                    logger.warning(f"{name.split('.')[0]}库未安装，{OPTIONAL_MODULES[name]}")
+                    _optional_modules[name] = None
+    return _optional_modules[name]
+
+# extract_email_content在没有取到正文时返回的占位内容
+EMPTY_CONTENT = ("(邮件内容为空)", "(无法提取邮件内容)", "(无法解析邮件内容)")
+
+# 表示MIME结构损坏的缺陷，只有出现这些缺陷且正文为空时才尝试其他解析器
+STRUCTURAL_DEFECTS = (
+    errors.StartBoundaryNotFoundDefect,
+    errors.CloseBoundaryNotFoundDefect,
+    errors.NoBoundaryInMultipartDefect,
+    errors.MultipartInvariantViolationDefect,
+    errors.MissingHeaderBodySeparatorDefect,
+    errors.FirstHeaderLineIsContinuationDefect,
+)
+
+
+class ParseStats:
+    """统计各解析器的调用次数、失败次数和耗时，以及需要回退的邮件比例"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.failed = 0
+        self.parsers = {}
+        self.fallbacks = {}
+
+    def record(self, parser, seconds, ok):
+        """记录一次解析器调用"""
+        with self.lock:
+            item = self.parsers.setdefault(parser, {'calls': 0, 'failures': 0, 'seconds': 0.0})
+            item['calls'] += 1
+            item['seconds'] += seconds
+            if not ok:
+                item['failures'] += 1
+
+    def record_message(self, ok, fallback=None):
+        """记录一封邮件的解析结果，fallback为触发回退的原因"""
+        with self.lock:
+            self.messages += 1
+            if not ok:
+                self.failed += 1
+            if fallback:
+                self.fallbacks[fallback] = self.fallbacks.get(fallback, 0) + 1
+
+    def report(self):
+        """返回统计报告"""
+        with self.lock:
+            fallback_count = sum(self.fallbacks.values())
+            return {
+                'messages': self.messages,
+                'failed': self.failed,
+                'fallbacks': dict(self.fallbacks),
+                'fallback_rate': round(fallback_count / self.messages, 4) if self.messages else 0.0,
+                'parsers': {
+                    name: {
+                        'calls': item['calls'],
+                        'failures': item['failures'],
+                        'total_ms': round(item['seconds'] * 1000, 1),
+                        'avg_ms': round(item['seconds'] * 1000 / item['calls'], 3) if item['calls'] else 0.0
+                    }
+                    for name, item in self.parsers.items()
+                }
+            }
+
+
+# 进程内所有EML解析的累计统计
+parse_stats = ParseStats()
+
+
+def _message_headers(msg: Message):
+    """读取并解码主题、发件人和日期"""
+    subject = msg.get("subject", "")
+    sender = msg.get("from", "")
+    date_str = msg.get("date", "")
+    subject = decode_mime_words(subject) if subject else "(无主题)"
+    sender = decode_mime_words(sender) if sender else "(未知发件人)"
+    received_time = parse_email_date(date_str) if date_str else datetime.now()
+    return subject, sender, received_time
+
+
+def _has_structural_defects(msg: Message) -> bool:
+    """邮件或其中任一部分存在MIME结构缺陷"""
+    return any(isinstance(defect, STRUCTURAL_DEFECTS) for part in msg.walk() for defect in part.defects)
+
+
+def _content_data(html, plain):
+    has_html = bool(html)
+    return {
+        'content': (html if has_html else plain) or '(无内容)',
+        'content_type': 'text/html' if has_html else 'text/plain',
+        'has_html': has_html,
+        'plain_text': plain if has_html else None
+    }
+
+
+def _parse_with_mailparser(content: bytes):
+    """使用mailparser解析正文和附件，库不可用时返回False"""
+    mailparser = optional_module('mailparser')
+    if mailparser is None:
+        return False
+    parsed_mail = mailparser.parse_from_bytes(content)
+    if not parsed_mail.text_html and not parsed_mail.text_plain:
+        return None
+
+    attachments = []
+    for att in parsed_mail.attachments:
+        payload = att.get('payload') or ''
+        data = base64.b64decode(payload) if att.get('binary') else payload.encode('utf-8')
+        attachments.append({
+            'filename': att.get('filename') or "unnamed_attachment",
+            'content_type': att.get('mail_content_type') or "application/octet-stream",
+            'size': len(data),
+            'content': data
+        })
+    return _content_data(''.join(parsed_mail.text_html), ''.join(parsed_mail.text_plain)), attachments
+
+
+def _parse_with_eml_parser(content: bytes):
+    """使用eml-parser解析正文和附件，库不可用时返回False"""
+    eml_parser = optional_module('eml_parser')
+    if eml_parser is None:
+        return False
+    parsed_eml = eml_parser.EmlParser(include_raw_body=True, include_attachment_data=True).decode_email_bytes(content)
+
+    html_content = plain_content = None
+    for part in parsed_eml.get('body', []):
+        content_type = (part.get('content_type') or '').lower()
+        if 'html' in content_type and not html_content:
+            html_content = part.get('content', '')
+        elif 'plain' in content_type and not plain_content:
+            plain_content = part.get('content', '')
+    if not html_content and not plain_content:
+        return None
+
+    attachments = []
+    for att in parsed_eml.get('attachment', []):
+        data = base64.b64decode(att['raw']) if att.get('raw') else b''
+        attachments.append({
+            'filename': att.get('filename') or "unnamed_attachment",
+            'content_type': att.get('content_header', {}).get('content-type', ["application/octet-stream"])[0].split(';')[0],
+            'size': len(data),
+            'content': data
+        })
+    return _content_data(html_content, plain_content), attachments
+
 class EmailFileParser:
     """邮件文件解析类"""
 
@@ -89,269 +231,126 @@ class EmailFileParser:
             return None
 
     @staticmethod
-    def parse_eml_content(content: bytes) -> Dict:
+    def parse_eml_content(content: bytes, folder: str = "IMPORTED", stats: 'ParseStats' = None,
+                          cache=None) -> Dict:
         """
-        解析.eml格式的邮件内容，支持多种解析方法
+        解析.eml格式的邮件内容
+
+        只用BytesParser解析一次，从同一个消息对象中取得头部、正文和附件；
+        只有邮件结构损坏导致正文为空时才尝试mailparser/eml-parser。
+        正文和MIME结构相同的邮件（群发到多个账户）命中解析缓存时只解析头部。
 
         Args:
             content: 邮件内容的二进制数据
+            folder: 邮件所在文件夹
+            stats: 记录解析耗时和回退次数的ParseStats，默认为模块级的parse_stats
+            cache: 正文和附件的ParseCache，默认为模块级的parse_cache
 
         Returns:
             Dict: 解析后的邮件数据
         """
+        stats = stats or parse_stats
+        fallback = None
         try:
-            logger.info(f"开始解析EML内容，大小: {len(content)} 字节")
-            mail_record = None
-
-            # 尝试使用mail-parser库解析
-            if MAIL_PARSER_AVAILABLE:
-                try:
-                    logger.debug("尝试使用mailparser库解析EML内容")
-                    parsed_mail = mailparser.parse_from_bytes(content)
-
-                    # 提取基本信息
-                    subject = parsed_mail.subject or "(无主题)"
-                    sender = parsed_mail.from_ or "(未知发件人)"
-                    received_time = parsed_mail.date or datetime.now()
-
-                    # 提取内容
-                    has_html = parsed_mail.text_html is not None and len(parsed_mail.text_html) > 0
-                    mail_content = parsed_mail.text_html if has_html else parsed_mail.text_plain
-                    content_type = 'text/html' if has_html else 'text/plain'
-
-                    # 创建内容对象
-                    content_data = {
-                        'content': mail_content or '(无内容)',
-                        'content_type': content_type,
-                        'has_html': has_html
-                    }
-
-                    # 提取附件
-                    attachments = []
-                    for att in parsed_mail.attachments:
-                        try:
-                            filename = att.filename or "unnamed_attachment"
-                            content_type = att.mail_content_type or "application/octet-stream"
-                            content = att.payload
-                            size = len(content) if content else 0
-
-                            attachments.append({
-                                'filename': filename,
-                                'content_type': content_type,
-                                'size': size,
-                                'content': content
-                            })
-                        except Exception as e:
-                            logger.warning(f"处理mail-parser附件失败: {str(e)}")
-                            continue
-
-                    # 构建附件信息（不包含内容）
-                    attachments_info = []
-                    for attachment in attachments:
-                        attachments_info.append({
-                            'filename': attachment['filename'],
-                            'content_type': attachment['content_type'],
-                            'size': attachment['size']
-                        })
-
-                    # 构建邮件记录
-                    mail_record = {
-                        "subject": subject,
-                        "sender": sender,
-                        "received_time": received_time,
-                        "content": content_data,
-                        "folder": "IMPORTED",
-                        "attachments": attachments_info,
-                        "has_attachments": len(attachments) > 0,
-                        "full_attachments": attachments
-                    }
-
-                    logger.info(f"使用mail-parser成功解析EML内容: {subject[:30]}...")
-                    return mail_record
-
-                except Exception as e:
-                    logger.warning(f"使用mail-parser解析失败: {str(e)}，尝试使用其他方法")
-
-            # 尝试使用eml-parser库解析
-            if EML_PARSER_AVAILABLE and not mail_record:
-                try:
-                    logger.debug("尝试使用eml-parser库解析EML内容")
-                    ep = eml_parser.EmlParser()
-                    parsed_eml = ep.decode_email_bytes(content)
-
-                    # 提取基本信息
-                    header = parsed_eml.get('header', {})
-                    subject = header.get('subject', "(无主题)")
-
-                    # 处理发件人
-                    from_data = header.get('from', "")
-                    if isinstance(from_data, list) and len(from_data) > 0:
-                        sender = from_data[0].get('name', '') or from_data[0].get('email', '')
-                    else:
-                        sender = "(未知发件人)"
-
-                    # 处理日期
-                    date_str = header.get('date', "")
-                    try:
-                        received_time = datetime.fromtimestamp(date_str) if isinstance(date_str, (int, float)) else datetime.now()
-                    except:
-                        received_time = datetime.now()
-
-                    # 提取内容
-                    body = parsed_eml.get('body', [])
-                    html_content = None
-                    plain_content = None
-
-                    for part in body:
-                        content_type = part.get('content_type', '').lower()
-                        if 'html' in content_type and not html_content:
-                            html_content = part.get('content', '')
-                        elif 'plain' in content_type and not plain_content:
-                            plain_content = part.get('content', '')
-
-                    has_html = html_content is not None
-                    content = html_content if has_html else plain_content
-                    content_type = 'text/html' if has_html else 'text/plain'
-
-                    # 创建内容对象
-                    content_data = {
-                        'content': content or '(无内容)',
-                        'content_type': content_type,
-                        'has_html': has_html
-                    }
-
-                    # 提取附件
-                    attachments = []
-                    for att in parsed_eml.get('attachment', []):
-                        try:
-                            filename = att.get('filename', "unnamed_attachment")
-                            content_type = att.get('content_type', "application/octet-stream")
-                            content = base64.b64decode(att.get('raw', '')) if att.get('raw') else b''
-                            size = len(content) if content else 0
-
-                            attachments.append({
-                                'filename': filename,
-                                'content_type': content_type,
-                                'size': size,
-                                'content': content
-                            })
-                        except Exception as e:
-                            logger.warning(f"处理eml-parser附件失败: {str(e)}")
-                            continue
-
-                    # 构建附件信息（不包含内容）
-                    attachments_info = []
-                    for attachment in attachments:
-                        attachments_info.append({
-                            'filename': attachment['filename'],
-                            'content_type': attachment['content_type'],
-                            'size': attachment['size']
-                        })
-
-                    # 构建邮件记录
-                    mail_record = {
-                        "subject": subject,
-                        "sender": sender,
-                        "received_time": received_time,
-                        "content": content_data,
-                        "folder": "IMPORTED",
-                        "attachments": attachments_info,
-                        "has_attachments": len(attachments) > 0,
-                        "full_attachments": attachments
-                    }
-
-                    logger.info(f"使用eml-parser成功解析EML内容: {subject[:30]}...")
-                    return mail_record
-
-                except Exception as e:
-                    logger.warning(f"使用eml-parser解析失败: {str(e)}，尝试使用标准库")
-
-            # 使用标准库解析
-            if not mail_record:
-                logger.debug("尝试使用标准库解析EML内容")
-                # 使用BytesParser解析邮件内容
-                try:
-                    parser = BytesParser(policy=policy.default)
-                    msg = parser.parsebytes(content)
-                except Exception as e:
-                    logger.warning(f"使用BytesParser解析失败: {str(e)}，尝试使用其他方法")
+            logger.debug(f"开始解析EML内容，大小: {len(content)} 字节")
+
+            cache = cache or parse_cache
+            parts = split_message(content) if cache.enabled else None
+            key = cache_key(*parts) if parts else None
+            cached = cache.get(key) if key else None
+
+            started = time.perf_counter()
+            if cached is not None:
+                # 命中缓存，只解析头部
+                msg = BytesParser().parsebytes(parts[0], headersonly=True)
+                subject, sender, received_time = _message_headers(msg)
+                content_data, attachments, parse_seconds = cached
+                broken = False
+                seconds = time.perf_counter() - started
+                stats.record('cache', seconds, True)
+                cache.record_saved(parse_seconds - seconds)
+            else:
+                msg = BytesParser().parsebytes(content)
+                subject, sender, received_time = _message_headers(msg)
+                content_data = extract_email_content(msg)
+                attachments = extract_email_attachments(msg)
+                # 只有邮件结构损坏导致正文为空时才使用其他解析器
+                broken = content_data.get('content') in EMPTY_CONTENT and _has_structural_defects(msg)
+                seconds = time.perf_counter() - started
+                stats.record('email', seconds, not broken)
+                if key and not broken:
+                    cache.put(key, content_data, attachments, seconds)
+
+            if broken:
+                fallback = 'body'
+                for name, parse in (('mailparser', _parse_with_mailparser), ('eml_parser', _parse_with_eml_parser)):
+                    started = time.perf_counter()
                     try:
-                        # 尝试使用标准email模块解析
-                        msg = email.message_from_bytes(content)
-                    except Exception as e2:
-                        logger.error(f"所有解析方法都失败: {str(e2)}")
-                        return None
-
-                # 提取基本信息
-                subject = msg.get("subject", "")
-                sender = msg.get("from", "")
-                date_str = msg.get("date", "")
-                message_id = msg.get("message-id", "")
-
-                # 解码主题和发件人
-                try:
-                    subject = decode_mime_words(subject) if subject else "(无主题)"
-                    sender = decode_mime_words(sender) if sender else "(未知发件人)"
-                except Exception as e:
-                    logger.warning(f"解码邮件信息失败: {str(e)}")
-                    subject = str(subject) or "(无主题)"
-                    sender = str(sender) or "(未知发件人)"
-
-                # 解析日期
-                try:
-                    received_time = parse_email_date(date_str) if date_str else datetime.now()
-                except Exception as e:
-                    logger.warning(f"解析日期失败: {str(e)}, 使用当前时间")
-                    received_time = datetime.now()
+                        result = parse(content)
+                    except Exception as e:
+                        logger.warning(f"使用{name}解析失败: {str(e)}")
+                        result = None
+                    if result is False:
+                        continue
+                    stats.record(name, time.perf_counter() - started, result is not None)
+                    if result is not None:
+                        content_data, fallback_attachments = result
+                        attachments = attachments or fallback_attachments
+                        break
 
-                # 提取邮件内容
-                try:
-                    content_data = extract_email_content(msg)
-                except Exception as e:
-                    logger.warning(f"提取邮件内容失败: {str(e)}")
-                    # 如果提取失败，创建一个基本的内容对象
-                    content_data = {
-                        'content': '(无法解析邮件内容)',
-                        'content_type': 'text/plain',
-                        'has_html': False
-                    }
+            # 构建附件信息（不包含内容）
+            attachments_info = [{
+                'filename': attachment['filename'],
+                'content_type': attachment['content_type'],
+                'size': attachment['size']
+            } for attachment in attachments]
 
-                # 提取附件
-                try:
-                    attachments = extract_email_attachments(msg)
-                except Exception as e:
-                    logger.warning(f"提取附件失败: {str(e)}")
-                    attachments = []
-
-                # 构建附件信息（不包含内容）
-                attachments_info = []
-                for attachment in attachments:
-                    attachments_info.append({
-                        'filename': attachment['filename'],
-                        'content_type': attachment['content_type'],
-                        'size': attachment['size']
-                    })
-
-                # 构建邮件记录
-                mail_record = {
-                    "subject": subject,
-                    "sender": sender,
-                    "received_time": received_time,
-                    "content": content_data,
-                    "folder": "IMPORTED",
-                    "attachments": attachments_info,
-                    "has_attachments": len(attachments) > 0,
-                    "full_attachments": attachments  # 包含完整附件内容，用于保存到数据库
-                }
+            # 构建邮件记录
+            mail_record = {
+                "subject": subject,
+                "sender": sender,
+                "received_time": received_time,
+                "content": content_data,
+                "folder": folder,
+                "attachments": attachments_info,
+                "has_attachments": len(attachments) > 0,
+                "full_attachments": attachments,  # 包含完整附件内容，用于保存到数据库
+                "raw": content  # 原始内容，保存到原始邮件存储
+            }
 
-                logger.info(f"使用标准库成功解析EML内容: {subject[:30]}...")
-                return mail_record
+            stats.record_message(True, fallback)
+            logger.debug(f"成功解析EML内容: {subject[:30]}...")
+            return mail_record
 
         except Exception as e:
+            stats.record_message(False, fallback)
             logger.error(f"解析EML内容失败: {str(e)}")
             traceback.print_exc()
             return None
 
+    @staticmethod
+    def parse_corpus(paths: List[str]) -> Dict:
+        """
+        解析一组邮件文件并返回各解析器的耗时和回退比例，用于评估解析路径，不使用解析缓存
+
+        Args:
+            paths: .eml等邮件文件路径列表
+
+        Returns:
+            Dict: 见ParseStats.report
+        """
+        stats = ParseStats()
+        no_cache = ParseCache(max_bytes=0)
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except OSError as e:
+                logger.warning(f"读取邮件文件失败: {path}, 错误: {str(e)}")
+                continue
+            EmailFileParser.parse_eml_content(content, stats=stats, cache=no_cache)
+        return stats.report()
+
     @staticmethod
     def parse_msg_file(file_path: str) -> Dict:
         """
@@ -372,7 +371,8 @@ class EmailFileParser:
                 return None
 
             # 检查extract_msg库是否可用
-            if not EXTRACT_MSG_AVAILABLE:
+            extract_msg = optional_module('extract_msg')
+            if extract_msg is None:
                 logger.error("extract_msg库未安装，无法解析MSG文件")
                 return None
 
@@ -550,7 +550,8 @@ class EmailFileParser:
                 }
 
             # 检查talon库是否可用
-            if TALON_AVAILABLE:
+            quotations = optional_module('talon.quotations')
+            if quotations is not None:
                 try:
                     # 提取回复内容（去除引用）
                     reply = quotations.extract_from(content, 'text/plain')
@@ -21,11 +21,13 @@ from .common import (
     decode_mime_words,
     parse_email_date,
     decode_email_content,
-    parse_email_message,
     extract_email_content,
     normalize_check_time,
     format_date_for_imap_search
 )
+from .file_parser import EmailFileParser
+from ._deadline import CancelToken, CheckCancelled, close_imap_connection
+from ._imap_search import search_mailbox
 from .logger import (
     logger,
     log_email_start,
@@ -144,10 +146,7 @@ class IMAPMailHandler:
             for num in message_numbers:
                 try:
                     _, msg_data = self.mail.fetch(num, '(RFC822)')
-                    email_body = msg_data[0][1]
-                    msg = email.message_from_bytes(email_body)
-
-                    mail_record = parse_email_message(msg, folder)
+                    mail_record = EmailFileParser.parse_eml_content(msg_data[0][1], folder)
                     if mail_record:
                         mail_list.append(mail_record)
                 except Exception as e:
@@ -171,10 +170,18 @@ class IMAPMailHandler:
 
     @staticmethod
     @timing_decorator
-    def fetch_emails(email_address, password, server, port=993, use_ssl=True, folder="INBOX", callback=None, last_check_time=None):
-        """获取邮箱中的邮件"""
+    def fetch_emails(email_address, password, server, port=993, use_ssl=True, folder="INBOX", callback=None, last_check_time=None, cancel_token=None):
+        """获取邮箱中的邮件
+
+        cancel_token用于取消检查和限制整体耗时，每次网络操作都带有超时
+        """
         mail_records = []
         mail = None
+        closer = None
+
+        # 没有传入令牌时只限制单次网络操作的超时
+        if cancel_token is None:
+            cancel_token = CancelToken()
 
         try:
             # 创建回调函数
@@ -194,16 +201,22 @@ class IMAPMailHandler:
             if callback:
                 callback(0, "正在连接邮箱服务器")
 
+            cancel_token.check()
             if use_ssl:
-                mail = imaplib.IMAP4_SSL(server, port)
+                mail = imaplib.IMAP4_SSL(server, port, timeout=cancel_token.timeout_for())
             else:
-                mail = imaplib.IMAP4(server, port)
+                mail = imaplib.IMAP4(server, port, timeout=cancel_token.timeout_for())
+
+            # 取消或超时时直接关闭socket，中断阻塞中的读写
+            closer = close_imap_connection(mail)
+            cancel_token.on_cancel(closer)
 
             # 登录
             logger.info(f"登录邮箱 {email_address}")
             if callback:
                 callback(10, "正在登录邮箱")
 
+            cancel_token.check()
             mail.login(email_address, password)
 
             # 选择邮件文件夹
@@ -211,6 +224,7 @@ class IMAPMailHandler:
             if callback:
                 callback(20, f"正在选择文件夹 {folder}")
 
+            cancel_token.check()
             mail.select(folder)
 
             # 搜索邮件
@@ -224,6 +238,7 @@ class IMAPMailHandler:
                     search_criteria = f'SINCE {date_str}'
                     logger.info(f"获取自 {date_str} 以来的新邮件")
 
+            cancel_token.check()
             _, messages = mail.search(None, search_criteria)
             message_numbers = messages[0].split()
             total_messages = len(message_numbers)
@@ -233,6 +248,9 @@ class IMAPMailHandler:
             # 处理每封邮件
             for i, num in enumerate(message_numbers):
                 try:
+                    # 每封邮件之间检查是否已取消
+                    cancel_token.check()
+
                     # 更新进度
                     progress = int((i + 1) / total_messages * 100)
                     if callback:
@@ -258,26 +276,8 @@ class IMAPMailHandler:
                     _, msg_data = mail.fetch(num, '(RFC822)')
                     email_body = msg_data[0][1]
 
-                    # 尝试使用标准方式解析邮件
-                    try:
-                        msg = email.message_from_bytes(email_body)
-                        mail_record = parse_email_message(msg, folder)
-                    except Exception as e:
-                        logger.warning(f"标准方式解析邮件失败，尝试使用EML解析器: {str(e)}")
-                        mail_record = None
-
-                    # 如果标准解析失败，尝试使用EML解析器
-                    if not mail_record:
-                        try:
-                            from .file_parser import EmailFileParser
-                            logger.info("使用EML解析器解析邮件")
-                            mail_record = EmailFileParser.parse_eml_content(email_body)
-                            if mail_record:
-                                # 设置文件夹信息
-                                mail_record['folder'] = folder
-                        except Exception as e:
-                            logger.error(f"EML解析器解析邮件失败: {str(e)}")
-                            mail_record = None
+                    # 只解析一次，解析器内部只在检测到具体问题时才使用其他解析器
+                    mail_record = EmailFileParser.parse_eml_content(email_body, folder)
 
                     if mail_record:
                         # 添加一些额外信息用于去重判断
@@ -289,13 +289,19 @@ class IMAPMailHandler:
                     else:
                         logger.error(f"无法解析邮件: {mail_key}")
 
+                except (CheckCancelled, OSError, imaplib.IMAP4.abort):
+                    # 取消、超时或连接断开时不再继续处理剩余邮件
+                    raise
                 except Exception as e:
+                    # 连接被取消操作关闭时不再继续处理剩余邮件
+                    cancel_token.check()
                     logger.error(f"处理邮件失败: {str(e)}")
                     message_id = 'unknown'
                     log_message_error(message_id, str(e))
                     continue
 
             # 关闭连接
+            cancel_token.remove_closer(closer)
             mail.close()
             mail.logout()
 
@@ -307,17 +313,68 @@ class IMAPMailHandler:
         except Exception as e:
             logger.error(f"获取邮件失败: {str(e)}")
             log_email_error(email_address, "未知", str(e))
-            if mail:
+            if closer:
+                cancel_token.remove_closer(closer)
+            if mail and not cancel_token.cancelled:
                 try:
                     mail.close()
                     mail.logout()
                 except:
                     pass
-            return []
+            # 连接被取消操作关闭导致的异常统一报告为取消或超时
+            cancel_token.check()
+            # 连接、登录等失败需要让调用方感知，不能当作没有新邮件
+            raise
+
+    @staticmethod
+    @timing_decorator
+    def search_emails(email_address, password, server, port=993, use_ssl=True, folder="INBOX",
+                      sender=None, subject=None, since=None, limit=10, cancel_token=None):
+        """定向搜索邮件：FROM/SUBJECT/SINCE条件由服务器执行，只拉取最新的limit封匹配邮件
+
+        Returns:
+            邮件记录列表，从新到旧
+        """
+        if cancel_token is None:
+            cancel_token = CancelToken()
+        mail = None
+        closer = None
+        try:
+            cancel_token.check()
+            if use_ssl:
+                mail = imaplib.IMAP4_SSL(server, port, timeout=cancel_token.timeout_for())
+            else:
+                mail = imaplib.IMAP4(server, port, timeout=cancel_token.timeout_for())
+            closer = close_imap_connection(mail)
+            cancel_token.on_cancel(closer)
+
+            cancel_token.check()
+            mail.login(email_address, password)
+
+            mail_records = []
+            for uid, raw in search_mailbox(mail, folder, sender, subject, normalize_check_time(since), limit, cancel_token):
+                mail_record = EmailFileParser.parse_eml_content(raw, folder)
+                if mail_record:
+                    mail_records.append(mail_record)
+                else:
+                    logger.error(f"无法解析邮件: UID {uid}")
+            return mail_records
+        except Exception as e:
+            logger.error(f"定向搜索邮件失败: {str(e)}")
+            cancel_token.check()
+            raise
+        finally:
+            if closer:
+                cancel_token.remove_closer(closer)
+            if mail and not cancel_token.cancelled:
+                try:
+                    mail.logout()
+                except:
+                    pass
 
     @staticmethod
     @timing_decorator
-    def check_mail(email_info, db, progress_callback=None):
+    def check_mail(email_info, db, progress_callback=None, cancel_token=None):
         """检查邮箱中的新邮件"""
         try:
             email_address = email_info['email']
@@ -338,13 +395,14 @@ class IMAPMailHandler:
                 server=server,
                 port=port,
                 use_ssl=use_ssl,
-                callback=folder_progress_callback
+                callback=folder_progress_callback,
+                cancel_token=cancel_token
             )
 
             if not mail_records:
                 if progress_callback:
-                    progress_callback(0, "没有找到新邮件")
-                return {'success': False, 'message': '没有找到新邮件'}
+                    progress_callback(100, "没有找到新邮件")
+                return {'success': True, 'message': '没有找到新邮件'}
 
             # 保存邮件记录
             saved_count = db.save_mail_records(email_info['id'], mail_records, progress_callback)
@@ -354,9 +412,13 @@ class IMAPMailHandler:
 
             return {
                 'success': True,
-                'message': f'成功获取 {len(mail_records)} 封邮件，新增 {saved_count} 封'
+                'message': f'成功获取 {len(mail_records)} 封邮件，新增 {saved_count} 封',
+                'total': len(mail_records),
+                'saved': saved_count
             }
 
+        except CheckCancelled:
+            raise
         except Exception as e:
             logger.error(f"检查邮件失败: {str(e)}")
             if progress_callback:
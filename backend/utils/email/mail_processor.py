@@ -12,6 +12,10 @@ import time
 import traceback
 import concurrent.futures
 import queue
+import hashlib
+import json
+import os
+import zipfile
 
 from .common import (
     decode_mime_words,
@@ -39,6 +43,14 @@ from .imap import IMAPMailHandler
 from .gmail import GmailHandler
 from .qq import QQMailHandler
 from ._real_time_check import RealTimeChecker
+from ._job_queue import JobQueue
+from ._circuit_breaker import CircuitBreaker
+from ._deadline import CancelToken, CheckCancelled
+from ._importer import import_accounts, import_report
+from ._mbox_import import import_mbox
+from ._archive_import import import_files
+from ._reparse import reparse_messages
+from ._status_check import create_status_checker
 
 class MailProcessor:
     """统一的邮件处理类"""
@@ -111,7 +123,8 @@ class MailProcessor:
                         content=record.get("content", "(无内容)"),
                         received_time=record.get("received_time", datetime.now()),
                         folder=record.get("folder", "INBOX"),
-                        has_attachments=1 if has_attachments else 0
+                        has_attachments=1 if has_attachments else 0,
+                        raw=record.get("raw")
                     )
 
                     if success and mail_id:
@@ -175,17 +188,60 @@ class MailProcessor:
 class EmailBatchProcessor:
     """批量邮件处理类"""
 
+    # 手动检查的任务优先于实时检查
+    MANUAL_PRIORITY = 10
+    REALTIME_PRIORITY = 0
+
+    # 单次检查的整体时间预算，单位为秒，需小于接口等待检查结果的时间
+    CHECK_TIMEOUT = 240
+
+    # 已结束的检查和搜索任务的保留时间，单位为秒
+    CHECK_JOB_RETENTION = 3600
+
+    # 批量导入任务的时间预算和测试凭据的默认并发数，单位为秒
+    IMPORT_TIMEOUT = 3600
+    IMPORT_VERIFY_CONCURRENCY = 8
+    IMPORT_MAX_VERIFY_CONCURRENCY = 32
+    # 邮件文件批量导入的解析进程数，0表示使用全部CPU核
+    IMPORT_PARSE_WORKERS = int(os.environ.get('IMPORT_PARSE_WORKERS', '0'))
+
     def __init__(self, db, max_workers=5):
         self.db = db
-        self.processing_emails = {}
+        self.processing_emails = {}  # email_id -> 取消令牌
         self.lock = threading.Lock()
         # 创建两个独立的线程池
         self.manual_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
         self.realtime_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        # 批量导入使用单独的线程池，大批量导入不占用检查邮件的线程
+        self.import_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
         self.real_time_running = False
         self.real_time_thread = None
 
-        # 创建实时检查器
+        # 进度事件总线，由set_event_bus注入，用于把进度和新邮件通知推送给WebSocket客户端
+        self.event_bus = None
+
+        # 邮箱熔断器，连续失败的邮箱暂停实时检查
+        self.circuit_breaker = CircuitBreaker(db)
+
+        # 实时检查前的STATUS预检，邮箱没有变化时跳过同步；STATUS_PRECHECK=false时为None
+        self.status_checker = create_status_checker(db)
+
+        # 持久化任务队列，检查任务先写入数据库再由调度线程领取执行
+        self.job_queue = JobQueue(db, max_concurrency=max_workers * 2)
+        # 实时检查每分钟为每个邮箱产生一条任务记录，结束后只保留一小时
+        self.job_queue.register('check', self._run_check_job, self._select_thread_pool, timeout=self.CHECK_TIMEOUT,
+                                retention=self.CHECK_JOB_RETENTION)
+        self.job_queue.register('search', self._run_search_job, self.manual_thread_pool, timeout=self.CHECK_TIMEOUT,
+                                retention=self.CHECK_JOB_RETENTION)
+        # 导入数据中含有账号密码和刷新令牌，任务结束后清除
+        self.job_queue.register('import', self._run_import_job, self.import_thread_pool, timeout=self.IMPORT_TIMEOUT,
+                                sensitive=True)
+        # 归档导入按断点续传，不限制整体时间
+        self.job_queue.register('mbox_import', self._run_mbox_import_job, self.import_thread_pool)
+        self.job_queue.register('archive_import', self._run_archive_import_job, self.import_thread_pool)
+        self.job_queue.register('reparse', self._run_reparse_job, self.import_thread_pool)
+
+        # 创建实时检查器，调度租约与任务队列使用相同的进程标识
         self.real_time_checker = RealTimeChecker(db, self)
 
         # 邮箱类型处理器映射
@@ -196,24 +252,42 @@ class EmailBatchProcessor:
             'qq': QQMailHandler
         }
 
-    def __del__(self):
-        """析构函数，确保线程池被正确关闭"""
-        self.stop_real_time_check()
-        self.manual_thread_pool.shutdown(wait=True)
-        self.realtime_thread_pool.shutdown(wait=True)
+    def set_event_bus(self, event_bus):
+        """设置进度事件总线"""
+        self.event_bus = event_bus
+
+    def start(self):
+        """启动任务调度，恢复上次未完成的任务"""
+        return self.job_queue.start()
+
+    def shutdown(self, drain=True, timeout=30):
+        """优雅关闭：停止实时检查，等待正在执行的任务完成，未完成的任务留在队列中待下次启动继续"""
+        if self.real_time_checker.running:
+            self.stop_real_time_check()
+        self.job_queue.shutdown(drain=drain, timeout=timeout)
+        self.manual_thread_pool.shutdown(wait=False)
+        self.realtime_thread_pool.shutdown(wait=False)
+        self.import_thread_pool.shutdown(wait=False)
+        if self.status_checker is not None:
+            self.status_checker.pool.close_all()
 
     def is_email_being_processed(self, email_id: int) -> bool:
         """检查邮箱是否正在处理中"""
         with self.lock:
-            return email_id in self.processing_emails
+            if email_id in self.processing_emails:
+                return True
+        job = self.db.get_active_job('check', email_id)
+        return job is not None and job['status'] == 'running'
 
     def stop_processing(self, email_id: int) -> bool:
-        """停止处理指定邮箱"""
+        """停止处理指定邮箱，正在执行的检查会立即中断并释放线程"""
+        self.db.cancel_jobs_for_emails([email_id])
         with self.lock:
-            if email_id in self.processing_emails:
-                self.processing_emails[email_id] = False
-                return True
-            return False
+            token = self.processing_emails.get(email_id)
+        if token is not None:
+            token.cancel()
+            return True
+        return False
 
     def parse_email_message(self, msg: Dict, folder: str = "INBOX") -> Dict:
         """解析邮件消息对象为结构化数据"""
@@ -228,7 +302,7 @@ class EmailBatchProcessor:
         return MailProcessor.save_mail_records(db, email_id, mail_records, progress_callback)
 
     def check_emails(self, email_ids: List[int], progress_callback: Optional[Callable] = None, is_realtime: bool = False) -> bool:
-        """批量检查邮箱邮件"""
+        """批量检查邮箱邮件，任务写入持久化队列后立即返回"""
         if not email_ids:
             logger.warning("没有提供邮箱ID")
             return False
@@ -246,11 +320,6 @@ class EmailBatchProcessor:
                     progress_callback(email_id, progress, message)
             return callback
 
-        # 选择对应的线程池
-        thread_pool = self.realtime_thread_pool if is_realtime else self.manual_thread_pool
-
-        # 提交任务到线程池
-        futures = []
         for email_info in emails:
             if self.is_email_being_processed(email_info['id']):
                 logger.warning(f"邮箱 {email_info['email']} 正在处理中，跳过")
@@ -258,45 +327,423 @@ class EmailBatchProcessor:
 
             # 获取对应的处理器
             mail_type = email_info.get('mail_type', 'outlook')
-            handler = self.handlers.get(mail_type)
-
-            if not handler:
+            if mail_type not in self.handlers:
                 logger.error(f"不支持的邮箱类型: {mail_type}")
                 continue
 
-            # 标记为正在处理
-            with self.lock:
-                self.processing_emails[email_info['id']] = True
-
-            # 提交任务到线程池
-            future = thread_pool.submit(
-                self._check_email_task,
+            self.enqueue_check(
                 email_info,
-                create_email_progress_callback(email_info['id'])
+                create_email_progress_callback(email_info['id']),
+                is_realtime=is_realtime
             )
-            futures.append(future)
-
-        # 启动监控线程，处理完成的任务
-        threading.Thread(target=self._monitor_futures, args=(futures,), daemon=True).start()
 
         return True
 
-    def _monitor_futures(self, futures):
-        """监控线程池中的任务完成情况"""
-        for future in concurrent.futures.as_completed(futures):
+    def enqueue_check(self, email_info, callback=None, is_realtime=False):
+        """将单个邮箱的检查任务加入队列，返回任务ID"""
+        return self.job_queue.enqueue(
+            'check',
+            user_id=email_info.get('user_id'),
+            email_id=email_info['id'],
+            payload={'source': 'realtime' if is_realtime else 'manual'},
+            priority=self.REALTIME_PRIORITY if is_realtime else self.MANUAL_PRIORITY,
+            callback=callback
+        )
+
+    def submit_check(self, email_info, callback=None):
+        """将单个邮箱的检查任务加入队列，返回可等待结果的Future"""
+        return self.job_queue.submit(
+            'check',
+            user_id=email_info.get('user_id'),
+            email_id=email_info['id'],
+            payload={'source': 'manual'},
+            priority=self.MANUAL_PRIORITY,
+            callback=callback
+        )
+
+    def _import_payload(self, data, mail_type, verify, concurrency):
+        concurrency = concurrency or self.IMPORT_VERIFY_CONCURRENCY
+        return {
+            'data': data,
+            'mail_type': mail_type,
+            'verify': bool(verify),
+            'concurrency': max(1, min(int(concurrency), self.IMPORT_MAX_VERIFY_CONCURRENCY))
+        }
+
+    def enqueue_import(self, user_id, data, mail_type='outlook', verify=False, concurrency=None):
+        """将批量导入加入队列，返回任务ID"""
+        return self.job_queue.enqueue(
+            'import',
+            user_id=user_id,
+            payload=self._import_payload(data, mail_type, verify, concurrency),
+            priority=self.MANUAL_PRIORITY
+        )
+
+    def submit_import(self, user_id, data, mail_type='outlook', verify=False, concurrency=None):
+        """将批量导入加入队列，返回可等待结果的Future"""
+        return self.job_queue.submit(
+            'import',
+            user_id=user_id,
+            payload=self._import_payload(data, mail_type, verify, concurrency),
+            priority=self.MANUAL_PRIORITY
+        )
+
+    def enqueue_mbox_import(self, user_id, email_id, path, filename=None):
+        """将已保存到磁盘的mbox归档加入导入队列，返回任务ID"""
+        return self.job_queue.enqueue(
+            'mbox_import',
+            user_id=user_id,
+            payload={'email_id': email_id, 'path': path, 'filename': filename},
+            priority=self.MANUAL_PRIORITY
+        )
+
+    def enqueue_archive_import(self, user_id, email_id, source, path, filename=None):
+        """将zip归档或服务器目录中的邮件文件加入导入队列，返回任务ID
+
+        Args:
+            source: 'zip' 为上传的归档，导入结束后删除；'dir' 为服务器上的目录，不会删除
+        """
+        return self.job_queue.enqueue(
+            'archive_import',
+            user_id=user_id,
+            payload={'email_id': email_id, 'source': source, 'path': path, 'filename': filename},
+            priority=self.MANUAL_PRIORITY
+        )
+
+    def enqueue_search(self, email_info, sender=None, subject=None, since=None, limit=10, callback=None):
+        """将定向搜索任务加入队列，返回任务ID
+
+        服务器按发件人、主题和日期搜索，只拉取最新的limit封匹配邮件；不更新邮箱的检查时间。
+        同一邮箱条件完全相同的未完成搜索只保留一个任务，条件不同的搜索各自入队。
+
+        Args:
+            since: ISO格式时间，只搜索这个日期之后的邮件
+        """
+        payload = {'sender': sender or None, 'subject': subject or None, 'since': since, 'limit': limit}
+        dedupe_key = hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+        return self.job_queue.enqueue(
+            'search',
+            user_id=email_info.get('user_id'),
+            email_id=email_info['id'],
+            payload=payload,
+            priority=self.MANUAL_PRIORITY,
+            callback=callback,
+            dedupe_key=dedupe_key
+        )
+
+    def enqueue_reparse(self, user_id, filters=None):
+        """将重新解析已保存的原始邮件加入队列，返回任务ID
+
+        Args:
+            filters: email_ids、folder、since、until，为空时重新解析所有邮件
+        """
+        return self.job_queue.enqueue(
+            'reparse',
+            user_id=user_id,
+            payload={'filters': filters or {}}
+        )
+
+    def _select_thread_pool(self, job):
+        """根据任务来源选择线程池"""
+        payload = job.get('payload') or {}
+        if payload.get('source') == 'realtime':
+            return self.realtime_thread_pool
+        return self.manual_thread_pool
+
+    def _run_check_job(self, job, ctx):
+        """执行队列中的检查任务，每次执行时从数据库读取最新的邮箱信息"""
+        email_info = self.db.get_email_by_id(job['email_id'])
+        if not email_info:
+            return {'success': False, 'message': f"邮箱ID {job['email_id']} 不存在"}
+
+        user_id = email_info.get('user_id') or job.get('user_id')
+        event_bus = self.event_bus
+
+        def progress(value, message):
+            ctx.progress(value, message)
+            if event_bus is not None:
+                event_bus.publish_progress(user_id, email_info['id'], value, message, ctx.job_id)
+
+        # 实时检查先用STATUS预检，邮箱自上次同步后没有变化时跳过同步
+        states = None
+        if self.status_checker is not None and (job.get('payload') or {}).get('source') == 'realtime':
+            unchanged, states = self.status_checker.precheck(email_info, ctx.cancel_token)
+            if unchanged:
+                self.update_check_time(self.db, email_info['id'])
+                self.circuit_breaker.record_success(email_info['id'])
+                progress(100, "邮箱没有变化，跳过同步")
+                return {'success': True, 'message': '邮箱没有变化，跳过同步', 'skipped': True}
+
+        result = self._check_email_task(email_info, progress, ctx.cancel_token)
+        if states and result.get('success', False):
+            self.status_checker.commit(email_info['id'], states)
+
+        # 有新邮件时通知邮箱所属用户
+        if event_bus is not None and result.get('saved'):
+            event_bus.publish_new_mail(user_id, email_info['id'], email_info['email'], result['saved'])
+
+        # 记录检查结果，连续失败的邮箱进入熔断；主动取消不计入失败，超时计入
+        if result.get('success', False):
+            self.circuit_breaker.record_success(email_info['id'])
+        elif not result.get('cancelled') or result.get('timeout'):
+            self.circuit_breaker.record_failure(email_info['id'], result.get('message'))
+        return result
+
+    def _run_import_job(self, job, ctx):
+        """执行队列中的批量导入任务，进度和结果推送给发起导入的用户"""
+        payload = job.get('payload') or {}
+        user_id = job.get('user_id')
+        event_bus = self.event_bus
+
+        # 写入完成后进程崩溃时，任务被回收重新执行，直接返回已保存的结果，避免把已导入的邮箱报告为冲突
+        if isinstance(job.get('checkpoint'), dict) and 'result' in job['checkpoint']:
+            result = job['checkpoint']['result']
+        else:
+            def progress(value, message):
+                ctx.progress(value, message)
+                if event_bus is not None:
+                    event_bus.publish_import_progress(user_id, ctx.job_id, value, message)
+
             try:
-                result = future.result()
-                logger.info(f"任务完成: {result}")
-            except Exception as e:
-                logger.error(f"任务执行失败: {str(e)}")
+                result = import_accounts(
+                    self.db, user_id, payload.get('data', ''),
+                    mail_type=payload.get('mail_type', 'outlook'),
+                    verify=payload.get('verify', False),
+                    concurrency=payload.get('concurrency', self.IMPORT_VERIFY_CONCURRENCY),
+                    cancel_token=ctx.cancel_token,
+                    progress=progress
+                )
+            except CheckCancelled as e:
+                result = {'success': False, 'cancelled': True, 'message': f'导入已中止: {str(e)}'}
+            except ValueError as e:
+                result = {'success': False, 'message': str(e)}
+            else:
+                ctx.checkpoint({'result': result}, 100)
+
+        if event_bus is not None:
+            event_bus.publish_import_result(user_id, ctx.job_id, import_report(result, ctx.job_id))
+        return result
+
+    def _run_mbox_import_job(self, job, ctx):
+        """执行队列中的归档导入任务，从上次提交的断点继续，结束后删除归档文件"""
+        payload = job.get('payload') or {}
+        path = payload.get('path')
+        email_id = payload.get('email_id')
+        user_id = job.get('user_id')
+        event_bus = self.event_bus
+
+        if not path or not os.path.exists(path):
+            result = {'success': False, 'email_id': email_id, 'message': '归档文件不存在'}
+        elif not self.db.get_email_by_id(email_id):
+            result = {'success': False, 'email_id': email_id, 'message': f"邮箱ID {email_id} 不存在"}
+        else:
+            def progress(value, message):
+                ctx.progress(value, message)
+                if event_bus is not None:
+                    event_bus.publish_import_progress(user_id, ctx.job_id, value, message)
+
+            checkpoint = job.get('checkpoint')
+            try:
+                result = import_mbox(
+                    self.db, email_id, path,
+                    job_id=ctx.job_id,
+                    state=checkpoint if isinstance(checkpoint, dict) else None,
+                    cancel_token=ctx.cancel_token,
+                    progress=progress
+                )
+            except CheckCancelled as e:
+                if ctx.cancel_token.reason == 'shutdown':
+                    # 任务放回队列，保留归档文件，下次从断点继续
+                    return {'success': False, 'cancelled': True, 'message': '导入被中断，将从断点继续'}
+                result = {'success': False, 'cancelled': True, 'email_id': email_id, 'message': f'导入已中止: {str(e)}'}
+
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除归档文件失败: {path}, 错误: {str(e)}")
+
+        if event_bus is not None:
+            event_bus.publish_mail_import_result(user_id, ctx.job_id, result)
+        return result
+
+    def _run_archive_import_job(self, job, ctx):
+        """执行队列中的邮件文件导入任务，从上次提交的断点继续，上传的zip归档在结束后删除"""
+        payload = job.get('payload') or {}
+        source = payload.get('source')
+        path = payload.get('path')
+        email_id = payload.get('email_id')
+        user_id = job.get('user_id')
+        event_bus = self.event_bus
+
+        if not path or not os.path.exists(path):
+            result = {'success': False, 'email_id': email_id, 'message': '导入的文件或目录不存在'}
+        elif not self.db.get_email_by_id(email_id):
+            result = {'success': False, 'email_id': email_id, 'message': f"邮箱ID {email_id} 不存在"}
+        else:
+            def progress(value, message):
+                ctx.progress(value, message)
+                if event_bus is not None:
+                    event_bus.publish_import_progress(user_id, ctx.job_id, value, message)
+
+            checkpoint = job.get('checkpoint')
+            try:
+                result = import_files(
+                    self.db, email_id, source, path,
+                    job_id=ctx.job_id,
+                    state=checkpoint if isinstance(checkpoint, dict) else None,
+                    workers=self.IMPORT_PARSE_WORKERS or None,
+                    cancel_token=ctx.cancel_token,
+                    progress=progress
+                )
+            except CheckCancelled as e:
+                if ctx.cancel_token.reason == 'shutdown':
+                    return {'success': False, 'cancelled': True, 'message': '导入被中断，将从断点继续'}
+                result = {'success': False, 'cancelled': True, 'email_id': email_id, 'message': f'导入已中止: {str(e)}'}
+            except zipfile.BadZipFile as e:
+                result = {'success': False, 'email_id': email_id, 'message': f'无效的zip文件: {str(e)}'}
+
+        if source == 'zip':
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"删除归档文件失败: {path}, 错误: {str(e)}")
+
+        if event_bus is not None:
+            event_bus.publish_mail_import_result(user_id, ctx.job_id, result)
+        return result
+
+    def _run_reparse_job(self, job, ctx):
+        """执行队列中的重新解析任务，从上次提交的断点继续"""
+        payload = job.get('payload') or {}
+        user_id = job.get('user_id')
+        event_bus = self.event_bus
+
+        if self.db.raw_store is None:
+            result = {'success': False, 'message': '未开启原始邮件存储（RAW_ARCHIVE）'}
+        else:
+            def progress(value, message):
+                ctx.progress(value, message)
+                if event_bus is not None:
+                    event_bus.publish_import_progress(user_id, ctx.job_id, value, message)
+
+            checkpoint = job.get('checkpoint')
+            try:
+                result = reparse_messages(
+                    self.db, payload.get('filters'),
+                    job_id=ctx.job_id,
+                    state=checkpoint if isinstance(checkpoint, dict) else None,
+                    workers=self.IMPORT_PARSE_WORKERS or None,
+                    cancel_token=ctx.cancel_token,
+                    progress=progress
+                )
+            except CheckCancelled as e:
+                if ctx.cancel_token.reason == 'shutdown':
+                    return {'success': False, 'cancelled': True, 'message': '重新解析被中断，将从断点继续'}
+                result = {'success': False, 'cancelled': True, 'message': f'重新解析已中止: {str(e)}'}
 
-    def _check_email_task(self, email_info, callback=None):
+        if event_bus is not None:
+            event_bus.publish_reparse_result(user_id, ctx.job_id, result)
+        return result
+
+    def _run_search_job(self, job, ctx):
+        """执行队列中的定向搜索任务"""
+        email_info = self.db.get_email_by_id(job['email_id'])
+        if not email_info:
+            return {'success': False, 'message': f"邮箱ID {job['email_id']} 不存在"}
+
+        user_id = email_info.get('user_id') or job.get('user_id')
+        event_bus = self.event_bus
+
+        def progress(value, message):
+            ctx.progress(value, message)
+            if event_bus is not None:
+                event_bus.publish_progress(user_id, email_info['id'], value, message, ctx.job_id)
+
+        try:
+            result = self._search_email_task(email_info, job.get('payload') or {}, progress, ctx.cancel_token)
+        except CheckCancelled as e:
+            return {'success': False, 'message': str(e), 'cancelled': True, 'timeout': ctx.cancel_token.timed_out}
+
+        if event_bus is not None and result.get('saved'):
+            event_bus.publish_new_mail(user_id, email_info['id'], email_info['email'], result['saved'])
+        return result
+
+    def _search_email_task(self, email_info, search, callback=None, cancel_token=None):
+        """定向搜索单个邮箱并保存匹配的邮件，不更新检查时间，避免下次增量检查跳过其他邮件"""
+        email_id = email_info['id']
+        mail_type = email_info.get('mail_type', '')
+        options = {
+            'sender': search.get('sender'),
+            'subject': search.get('subject'),
+            'since': search.get('since'),
+            'limit': search.get('limit') or 10,
+            'cancel_token': cancel_token
+        }
+        if callback:
+            callback(10, "正在搜索邮件")
+
+        try:
+            if mail_type == 'outlook':
+                refresh_token = email_info.get('refresh_token')
+                client_id = email_info.get('client_id')
+                if not refresh_token or not client_id:
+                    return {'success': False, 'message': "缺少OAuth2.0认证信息"}
+                access_token = OutlookMailHandler.get_new_access_token(refresh_token, client_id, cancel_token)
+                cancel_token.check()
+                if not access_token:
+                    return {'success': False, 'message': "获取访问令牌失败"}
+                self.db.update_email_token(email_id, access_token)
+                mail_records = OutlookMailHandler.search_emails(email_info['email'], access_token, **options)
+            elif mail_type in ('gmail', 'qq'):
+                mail_records = self.handlers[mail_type].search_emails(
+                    email_info['email'], email_info['password'], **options
+                )
+            else:
+                mail_records = IMAPMailHandler.search_emails(
+                    email_info['email'],
+                    email_info['password'],
+                    server=email_info.get('server'),
+                    port=email_info.get('port'),
+                    use_ssl=email_info.get('use_ssl', True),
+                    **options
+                )
+        except CheckCancelled:
+            raise
+        except Exception as e:
+            error_msg = f"定向搜索邮件失败: {str(e)}"
+            log_email_error(email_info['email'], email_id, error_msg)
+            if callback:
+                callback(0, error_msg)
+            return {'success': False, 'message': error_msg}
+
+        saved_count = self.save_mail_records(self.db, email_id, mail_records) if mail_records else 0
+        message = f'搜索到 {len(mail_records)} 封邮件，新增 {saved_count} 封'
+        if callback:
+            callback(100, message)
+        return {
+            'success': True,
+            'message': message,
+            'total': len(mail_records),
+            'saved': saved_count,
+            'mails': [
+                {'subject': record.get('subject'), 'sender': record.get('sender'),
+                 'received_time': record.get('received_time')}
+                for record in mail_records
+            ]
+        }
+
+    def _check_email_task(self, email_info, callback=None, cancel_token=None):
         """检查单个邮箱的邮件"""
         email_id = email_info['id']
+        own_token = cancel_token is None
+        if own_token:
+            cancel_token = CancelToken(self.CHECK_TIMEOUT)
         try:
-            # 标记为正在处理
+            # 标记为正在处理，记录取消令牌
             with self.lock:
-                self.processing_emails[email_id] = True
+                self.processing_emails[email_id] = cancel_token
 
             # 获取上次检查时间，用于仅获取新邮件
             last_check_time = email_info.get('last_check_time')
@@ -319,7 +766,8 @@ class EmailBatchProcessor:
 
                 # 获取新的访问令牌
                 try:
-                    access_token = OutlookMailHandler.get_new_access_token(refresh_token, client_id)
+                    access_token = OutlookMailHandler.get_new_access_token(refresh_token, client_id, cancel_token)
+                    cancel_token.check()
                     if not access_token:
                         error_msg = "获取访问令牌失败"
                         if callback:
@@ -339,7 +787,8 @@ class EmailBatchProcessor:
                         access_token,
                         folder="inbox",
                         callback=callback,
-                        last_check_time=last_check_time
+                        last_check_time=last_check_time,
+                        cancel_token=cancel_token
                     )
 
                     if not mail_records:
@@ -363,9 +812,13 @@ class EmailBatchProcessor:
 
                     return {
                         'success': True,
-                        'message': f'成功获取{len(mail_records)}封邮件，新增{saved_count}封'
+                        'message': f'成功获取{len(mail_records)}封邮件，新增{saved_count}封',
+                        'total': len(mail_records),
+                        'saved': saved_count
                     }
 
+                except CheckCancelled:
+                    raise
                 except Exception as e:
                     error_msg = f"处理Outlook邮箱失败: {str(e)}"
                     log_email_error(email_info['email'], email_id, error_msg)
@@ -375,7 +828,7 @@ class EmailBatchProcessor:
 
             elif mail_type == 'gmail':
                 # 处理Gmail邮箱
-                result = GmailHandler.check_mail(email_info, self.db, callback)
+                result = GmailHandler.check_mail(email_info, self.db, callback, cancel_token)
                 # 只有在成功时更新检查时间
                 if result.get('success', False):
                     self.update_check_time(self.db, email_id)
@@ -383,7 +836,7 @@ class EmailBatchProcessor:
 
             elif mail_type == 'qq':
                 # 处理QQ邮箱
-                result = QQMailHandler.check_mail(email_info, self.db, callback)
+                result = QQMailHandler.check_mail(email_info, self.db, callback, cancel_token)
                 # 只有在成功时更新检查时间
                 if result.get('success', False):
                     self.update_check_time(self.db, email_id)
@@ -403,7 +856,8 @@ class EmailBatchProcessor:
                         port=email_info.get('port'),
                         use_ssl=email_info.get('use_ssl', True),
                         callback=callback,
-                        last_check_time=last_check_time
+                        last_check_time=last_check_time,
+                        cancel_token=cancel_token
                     )
 
                     if not mail_records:
@@ -426,9 +880,13 @@ class EmailBatchProcessor:
 
                     return {
                         'success': True,
-                        'message': f'成功获取 {len(mail_records)} 封邮件，新增 {saved_count} 封'
+                        'message': f'成功获取 {len(mail_records)} 封邮件，新增 {saved_count} 封',
+                        'total': len(mail_records),
+                        'saved': saved_count
                     }
 
+                except CheckCancelled:
+                    raise
                 except Exception as e:
                     error_msg = f"处理IMAP邮箱失败: {str(e)}"
                     log_email_error(email_info['email'], email_id, error_msg)
@@ -436,6 +894,14 @@ class EmailBatchProcessor:
                         callback(0, error_msg)
                     return {'success': False, 'message': error_msg}
 
+        except CheckCancelled as e:
+            # 取消或超时，不更新检查时间，线程立即返回线程池
+            error_msg = str(e)
+            logger.warning(f"邮箱 ID {email_id} {error_msg}")
+            if callback:
+                callback(0, error_msg)
+            return {'success': False, 'message': error_msg, 'cancelled': True, 'timeout': cancel_token.timed_out}
+
         except Exception as e:
             error_msg = f"处理邮箱失败: {str(e)}"
             log_email_error(email_info['email'], email_id, error_msg)
@@ -444,10 +910,12 @@ class EmailBatchProcessor:
             return {'success': False, 'message': error_msg}
 
         finally:
+            if own_token:
+                cancel_token.release()
             # 标记处理完成，释放资源
             try:
                 with self.lock:
-                    if email_id in self.processing_emails:
+                    if self.processing_emails.get(email_id) is cancel_token:
                         del self.processing_emails[email_id]
                         logger.info(f"邮箱 ID {email_id} 处理完成，已从处理队列中移除")
             except Exception as e:
@@ -12,6 +12,9 @@ from .common import (
     normalize_check_time,
     format_date_for_imap_search,
 )
+from ._deadline import CancelToken, CheckCancelled, close_imap_connection
+from ._imap_search import search_mailbox
+from .file_parser import EmailFileParser
 from .logger import logger
 
 class OutlookMailHandler:
@@ -149,7 +152,7 @@ class OutlookMailHandler:
             self.mail = None
 
     @staticmethod
-    def get_new_access_token(refresh_token, client_id):
+    def get_new_access_token(refresh_token, client_id, cancel_token=None):
         """刷新获取新的access_token"""
         url = 'https://login.microsoftonline.com/common/oauth2/v2.0/token'
         data = {
@@ -158,7 +161,8 @@ class OutlookMailHandler:
             'refresh_token': refresh_token,
         }
         try:
-            response = requests.post(url, data=data)
+            timeout = cancel_token.timeout_for() if cancel_token else 30
+            response = requests.post(url, data=data, timeout=timeout)
             result_status = response.json().get('error')
             if result_status is not None:
                 logger.error(f"获取访问令牌失败: {result_status}")
@@ -177,7 +181,7 @@ class OutlookMailHandler:
         return f"user={user}\1auth=Bearer {token}\1\1"
 
     @staticmethod
-    def fetch_emails(email_address, access_token, folder="inbox", callback=None, last_check_time=None):
+    def fetch_emails(email_address, access_token, folder="inbox", callback=None, last_check_time=None, cancel_token=None):
         """
         通过IMAP协议获取Outlook/Hotmail邮箱中的邮件
 
@@ -187,6 +191,7 @@ class OutlookMailHandler:
             folder: 邮件文件夹，默认为收件箱
             callback: 进度回调函数
             last_check_time: 上次检查时间，如果提供，只获取该时间之后的邮件
+            cancel_token: 取消令牌，用于取消检查和限制整体耗时
 
         Returns:
             list: 邮件记录列表
@@ -197,6 +202,10 @@ class OutlookMailHandler:
         if callback is None:
             callback = lambda progress, folder: None
 
+        # 没有传入令牌时只限制单次网络操作的超时
+        if cancel_token is None:
+            cancel_token = CancelToken()
+
         # 标准化处理last_check_time
         last_check_time = normalize_check_time(last_check_time)
 
@@ -208,20 +217,27 @@ class OutlookMailHandler:
 
         # 尝试连接次数
         max_retries = 3
+        last_error = None
 
         for retry in range(max_retries):
+            mail = None
+            closer = None
             try:
+                cancel_token.check()
                 logger.info(f"尝试连接Outlook邮箱 (尝试 {retry+1}/{max_retries})")
                 callback(10, folder)
 
-                # 创建IMAP连接
-                mail = imaplib.IMAP4_SSL('outlook.live.com')
+                # 创建IMAP连接，取消或超时时直接关闭socket
+                mail = imaplib.IMAP4_SSL('outlook.live.com', timeout=cancel_token.timeout_for())
+                closer = close_imap_connection(mail)
+                cancel_token.on_cancel(closer)
 
                 # 使用OAuth2登录
                 auth_string = OutlookMailHandler.generate_auth_string(email_address, access_token)
                 mail.authenticate('XOAUTH2', lambda x: auth_string)
 
                 # 选择文件夹
+                cancel_token.check()
                 mail.select('inbox')
                 callback(20, folder)
 
@@ -238,6 +254,7 @@ class OutlookMailHandler:
 
                 if status != 'OK':
                     logger.error(f"搜索邮件失败: {status}")
+                    last_error = RuntimeError(f"搜索邮件失败: {status}")
                     continue
 
                 # 获取所有邮件ID
@@ -251,6 +268,9 @@ class OutlookMailHandler:
 
                 # 处理每封邮件
                 for i, mail_id in enumerate(mail_ids):
+                    # 每封邮件之间检查是否已取消
+                    cancel_token.check()
+
                     # 更新进度
                     progress = int(20 + (i / total_mails) * 70) if total_mails > 0 else 90
                     callback(progress, folder)
@@ -299,33 +319,95 @@ class OutlookMailHandler:
                             'sender': sender,
                             'received_time': received_time,
                             'content': content,
-                            'mail_key': mail_key  # 添加唯一标识，用于后续去重
+                            'mail_key': mail_key,  # 添加唯一标识，用于后续去重
+                            'raw': mail_data[0][1]
                         })
 
+                    except (CheckCancelled, OSError, imaplib.IMAP4.abort):
+                        # 取消、超时或连接断开时不再继续处理剩余邮件
+                        raise
                     except Exception as e:
+                        # 连接被取消操作关闭时不再继续处理剩余邮件
+                        cancel_token.check()
                         logger.error(f"处理邮件ID {mail_id} 时出错: {str(e)}")
 
                 # 成功获取邮件，跳出重试循环
                 callback(90, folder)
                 break
 
+            except CheckCancelled:
+                raise
+
             except imaplib.IMAP4.error as e:
+                cancel_token.check()
                 logger.error(f"IMAP错误: {str(e)}")
+                last_error = e
                 time.sleep(1)  # 等待一秒再重试
 
             except Exception as e:
+                cancel_token.check()
                 logger.error(f"获取邮件异常: {str(e)}")
+                last_error = e
                 time.sleep(1)  # 等待一秒再重试
 
             finally:
-                # 确保关闭连接
+                # 确保关闭连接，已取消时连接已被强制关闭
+                if closer:
+                    cancel_token.remove_closer(closer)
+                if not cancel_token.cancelled:
+                    try:
+                        mail.logout()
+                    except:
+                        pass
+        else:
+            # 多次重试都失败，抛出最后一次的错误，由调用方记录失败
+            if last_error is not None:
+                raise last_error
+
+        return mail_records
+
+    @staticmethod
+    def search_emails(email_address, access_token, folder="inbox", sender=None, subject=None, since=None,
+                      limit=10, cancel_token=None):
+        """定向搜索Outlook邮件：FROM/SUBJECT/SINCE条件由服务器执行，只拉取最新的limit封匹配邮件
+
+        Returns:
+            邮件记录列表，从新到旧
+        """
+        if cancel_token is None:
+            cancel_token = CancelToken()
+        mail = None
+        closer = None
+        try:
+            cancel_token.check()
+            mail = imaplib.IMAP4_SSL('outlook.live.com', timeout=cancel_token.timeout_for())
+            closer = close_imap_connection(mail)
+            cancel_token.on_cancel(closer)
+
+            auth_string = OutlookMailHandler.generate_auth_string(email_address, access_token)
+            mail.authenticate('XOAUTH2', lambda x: auth_string)
+
+            mail_records = []
+            for uid, raw in search_mailbox(mail, folder, sender, subject, normalize_check_time(since), limit, cancel_token):
+                mail_record = EmailFileParser.parse_eml_content(raw, folder)
+                if mail_record:
+                    mail_records.append(mail_record)
+                else:
+                    logger.error(f"无法解析邮件: UID {uid}")
+            return mail_records
+        except Exception as e:
+            logger.error(f"定向搜索Outlook邮件失败: {str(e)}")
+            cancel_token.check()
+            raise
+        finally:
+            if closer:
+                cancel_token.remove_closer(closer)
+            if mail and not cancel_token.cancelled:
                 try:
                     mail.logout()
                 except:
                     pass
 
-        return mail_records
-
     @staticmethod
     def check_mail(email_info, db, progress_callback=None):
         """检查Outlook/Hotmail邮箱中的邮件并存储到数据库"""
@@ -389,7 +471,8 @@ class OutlookMailHandler:
                             record['subject'],
                             record['sender'],
                             record['received_time'],
-                            record['content']
+                            record['content'],
+                            raw=record.get('raw')
                         )
                         if success:
                             saved_count += 1
@@ -22,7 +22,7 @@ class QQMailHandler(IMAPMailHandler):
         super().__init__(self.SERVER, username, password, self.USE_SSL, port or self.PORT)
 
     @classmethod
-    def fetch_emails(cls, email_address, password, folder="INBOX", callback=None, last_check_time=None):
+    def fetch_emails(cls, email_address, password, folder="INBOX", callback=None, last_check_time=None, cancel_token=None):
         """获取QQ邮箱中的邮件"""
         return super().fetch_emails(
             email_address=email_address,
@@ -32,11 +32,30 @@ class QQMailHandler(IMAPMailHandler):
             use_ssl=cls.USE_SSL,
             folder=folder,
             callback=callback,
-            last_check_time=last_check_time
+            last_check_time=last_check_time,
+            cancel_token=cancel_token
         )
 
     @classmethod
-    def check_mail(cls, email_info, db, progress_callback=None):
+    def search_emails(cls, email_address, password, folder="INBOX", sender=None, subject=None, since=None,
+                      limit=10, cancel_token=None):
+        """定向搜索QQ邮箱中的邮件"""
+        return super().search_emails(
+            email_address=email_address,
+            password=password,
+            server=cls.SERVER,
+            port=cls.PORT,
+            use_ssl=cls.USE_SSL,
+            folder=folder,
+            sender=sender,
+            subject=subject,
+            since=since,
+            limit=limit,
+            cancel_token=cancel_token
+        )
+
+    @classmethod
+    def check_mail(cls, email_info, db, progress_callback=None, cancel_token=None):
         """检查QQ邮箱的邮件"""
         # 更新邮箱信息为QQ邮箱特定配置
         email_info['server'] = cls.SERVER
@@ -44,4 +63,4 @@ class QQMailHandler(IMAPMailHandler):
         email_info['use_ssl'] = cls.USE_SSL
 
         # 调用父类的检查方法
-        return super().check_mail(email_info, db, progress_callback)
\ No newline at end of file
+        return super().check_mail(email_info, db, progress_callback, cancel_token)
\ No newline at end of file
@@ -8,6 +8,7 @@ import traceback
 import time
 from . import database as db
 from ..ws_server.handler import WebSocketHandler as ws_handler
+from ..ws_server.event_bus import event_bus
 
 # 配置基本日志
 logging.basicConfig(
@@ -171,12 +172,11 @@ def check_realtime_emails():
 def broadcast_to_user_sync(user_id, message):
     """
     同步版本的broadcast_to_user函数
-    由于原函数是异步的，但我们在同步环境中调用，使用此函数转发
+    通过事件总线把消息投递到WebSocket服务器的事件循环中发送，可在任意线程中调用
     """
     try:
         logger.info(f"通过同步方式向用户 {user_id} 发送消息: {message['type']}")
-        # 实际无法直接调用异步方法，这里只记录一个消息
-        # 在实际生产环境中，可以通过其他方式实现，如消息队列或回调机制
+        return event_bus.publish(user_id, message)
     except Exception as e:
         logger.error(f"向用户 {user_id} 发送消息失败: {str(e)}")
 
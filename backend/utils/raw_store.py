@@ -0,0 +1,103 @@
+"""
+原始邮件存储
+保存邮件的原始RFC822字节，提取逻辑改进后可以重新解析已保存的邮件，不需要从服务器重新下载。
+每封邮件单独压缩后追加到段文件（data/raw/segment-000001.dat ...）末尾，段文件只追加不修改，
+超过大小上限后写入下一个段文件；邮件ID到 (段号, 偏移, 长度) 的索引保存在数据库的raw_messages表中。
+每条记录带有头部（魔数、邮件ID、长度），读取时校验记录与索引一致。
+"""
+
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 记录头部: 魔数、邮件ID、压缩后的长度
+RECORD_HEADER = struct.Struct('>4sQI')
+RECORD_MAGIC = b'FMRW'
+
+# 单个段文件的大小上限
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+# zlib压缩级别，邮件以文本为主，6级在速度和压缩率之间比较均衡
+COMPRESS_LEVEL = 6
+
+
+class RawMessageStore:
+    """只追加的原始邮件段文件存储，多个进程可以同时写入"""
+
+    def __init__(self, base_dir, segment_size=SEGMENT_SIZE):
+        self.base_dir = base_dir
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.segment = None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.base_dir, f'segment-{segment:06d}.dat')
+
+    def _current_segment(self):
+        """返回当前写入的段号，当前段写满时切换到下一个段"""
+        if self.segment is None:
+            os.makedirs(self.base_dir, exist_ok=True)
+            segments = [int(name[8:14]) for name in os.listdir(self.base_dir)
+                        if name.startswith('segment-') and name.endswith('.dat') and name[8:14].isdigit()]
+            self.segment = max(segments) if segments else 1
+        # 其他进程可能已经切换到了新的段
+        while os.path.exists(self._segment_path(self.segment + 1)):
+            self.segment += 1
+        try:
+            if os.path.getsize(self._segment_path(self.segment)) >= self.segment_size:
+                self.segment += 1
+        except FileNotFoundError:
+            pass
+        return self.segment
+
+    def append(self, mail_id, raw):
+        """压缩并追加一封邮件
+
+        Returns:
+            (段号, 记录在段文件中的偏移, 记录长度)
+        """
+        data = zlib.compress(raw, COMPRESS_LEVEL)
+        record = RECORD_HEADER.pack(RECORD_MAGIC, mail_id, len(data)) + data
+        with self.lock:
+            segment = self._current_segment()
+            fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                offset = os.lseek(fd, 0, os.SEEK_END)
+                written = 0
+                while written < len(record):
+                    written += os.write(fd, record[written:])
+            finally:
+                os.close(fd)
+        return segment, offset, len(record)
+
+    def read(self, segment, offset, length, mail_id=None):
+        """读取并解压一封邮件，记录损坏或与邮件ID不符时抛出ValueError"""
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            record = f.read(length)
+        if len(record) < RECORD_HEADER.size:
+            raise ValueError('原始邮件记录不完整')
+        magic, stored_id, size = RECORD_HEADER.unpack_from(record)
+        if magic != RECORD_MAGIC or size != len(record) - RECORD_HEADER.size:
+            raise ValueError('原始邮件记录已损坏')
+        if mail_id is not None and stored_id != mail_id:
+            raise ValueError(f'原始邮件记录属于邮件 {stored_id}')
+        return zlib.decompress(record[RECORD_HEADER.size:])
+
+    def get_stats(self):
+        """返回段文件数和总大小"""
+        segments = total = 0
+        if os.path.isdir(self.base_dir):
+            for name in os.listdir(self.base_dir):
+                if name.startswith('segment-') and name.endswith('.dat'):
+                    segments += 1
+                    total += os.path.getsize(os.path.join(self.base_dir, name))
+        return {'segments': segments, 'bytes': total}
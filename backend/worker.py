@@ -0,0 +1,82 @@
+"""
+独立的邮件检查worker
+从共享数据库的任务队列中领取检查任务并执行，可以在一台或多台主机上启动多个worker，
+通过邮箱租约保证同一邮箱同一时间只被一个worker拉取。
+多主机部署时各主机需挂载同一个数据目录。
+"""
+
+import os
+import sys
+import signal
+import logging
+import argparse
+import socket
+import threading
+
+from database.db import Database
+from utils.email import EmailBatchProcessor
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("FireMail-worker.log", encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger('FireMail.worker')
+
+# 确保数据目录存在
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+os.makedirs(data_dir, exist_ok=True)
+
+stop_event = threading.Event()
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='花火邮箱助手 - 邮件检查worker')
+    parser.add_argument('--worker-id', default=os.environ.get('WORKER_ID'),
+                        help='worker标识，默认为 主机名:进程号')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WORKER_CONCURRENCY', 5)),
+                        help='每个线程池的最大线程数')
+    parser.add_argument('--lease-seconds', type=int, default=60, help='任务和邮箱租约时长（秒）')
+    parser.add_argument('--drain-timeout', type=int, default=30, help='退出时等待正在执行任务的最长时间（秒）')
+    return parser.parse_args()
+
+
+def handle_signal(signum, frame):
+    """收到终止信号时停止领取任务"""
+    logger.info(f"收到信号 {signum}，正在关闭worker...")
+    stop_event.set()
+
+
+def main():
+    args = parse_args()
+    worker_id = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+    db = Database()
+    processor = EmailBatchProcessor(db, max_workers=args.concurrency)
+    processor.job_queue.owner = worker_id
+    processor.job_queue.lease_seconds = args.lease_seconds
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    try:
+        processor.start()
+        logger.info(f"worker {worker_id} 已启动，并发数 {processor.job_queue.max_concurrency}")
+        while not stop_event.is_set():
+            stop_event.wait(1)
+    except Exception as e:
+        logger.error(f"worker运行异常: {e}")
+    finally:
+        # 等待正在执行的任务完成，未完成的任务释放租约由其他worker接手
+        processor.shutdown(drain=True, timeout=args.drain_timeout)
+        db.close()
+        logger.info(f"worker {worker_id} 已关闭")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
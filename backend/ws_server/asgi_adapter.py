@@ -0,0 +1,113 @@
+"""
+ASGI适配器
+- ASGIWebSocket: 把ASGI的websocket连接包装成与websockets库连接对象相同的接口（recv、send、close、异步迭代），
+  使WebSocketHandler无需修改即可在ASGI服务器中处理连接
+- ThreadPoolWsgiToAsgi: 在线程池中执行Flask视图，一个阻塞的视图不影响同一进程的其他请求
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
+from websockets.frames import Close
+
+
+class ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """单个HTTP请求，WSGI应用在指定的线程池中执行"""
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # asgiref默认把所有请求放到同一个线程中串行执行（thread_sensitive=True）
+        run = WsgiToAsgiInstance.run_wsgi_app.__wrapped__
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(self, body)
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi的线程池版本
+
+    Flask视图在最多max_workers个线程中并发执行，与开发服务器的多线程模式相同；
+    手动检查、批量导入等需要等待结果的接口只占用一个线程，不会阻塞其他请求。
+    """
+
+    def __init__(self, wsgi_application, max_workers=32):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+    def shutdown(self):
+        """关闭线程池，不等待执行中的请求"""
+        self.executor.shutdown(wait=False)
+
+
+class ASGIWebSocket:
+    """ASGI websocket连接的websockets风格包装"""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self._receive = receive
+        self._send = send
+        self.closed = False
+        self.close_code = None
+        client = scope.get('client')
+        self.remote_address = tuple(client) if client else None
+        self.path = scope.get('path', '')
+
+    async def accept(self):
+        """完成握手，客户端断开时返回False"""
+        message = await self._receive()
+        if message['type'] != 'websocket.connect':
+            self.closed = True
+            return False
+        await self._send({'type': 'websocket.accept'})
+        return True
+
+    async def recv(self):
+        """接收一条消息，连接关闭时抛出ConnectionClosed"""
+        if self.closed:
+            raise self._closed_error()
+        message = await self._receive()
+        if message['type'] == 'websocket.disconnect':
+            self.closed = True
+            self.close_code = message.get('code', 1000)
+            raise self._closed_error()
+        if message.get('text') is not None:
+            return message['text']
+        return message.get('bytes')
+
+    async def send(self, data):
+        """发送一条文本或二进制消息"""
+        if self.closed:
+            raise self._closed_error()
+        if isinstance(data, (bytes, bytearray)):
+            await self._send({'type': 'websocket.send', 'bytes': bytes(data)})
+        else:
+            await self._send({'type': 'websocket.send', 'text': data})
+
+    async def close(self, code=1000, reason=''):
+        """关闭连接"""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_code = code
+        await self._send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ConnectionClosedOK:
+            raise StopAsyncIteration
+
+    def _closed_error(self):
+        close = Close(self.close_code or 1000, '')
+        if close.code in (1000, 1001):
+            return ConnectionClosedOK(close, None)
+        return ConnectionClosedError(close, None)
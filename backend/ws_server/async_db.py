@@ -0,0 +1,47 @@
+"""
+WebSocket服务器使用的异步数据库访问层
+Database是同步的，直接在事件循环中调用会阻塞所有连接；
+这里把所有调用放到专用线程池中执行，协程通过await等待结果。
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# 配置日志
+logger = logging.getLogger('websocket')
+
+
+class AsyncDatabase:
+    """Database的异步代理，await adb.方法名(...) 在专用线程池中执行对应的同步方法"""
+
+    def __init__(self, db, max_workers=4):
+        """初始化异步数据库代理
+
+        Args:
+            db: 同步数据库对象
+            max_workers: 专用线程池的线程数，SQLite写操作是串行的，线程数不宜过多
+        """
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ws-db')
+
+    async def run(self, func, *args, **kwargs):
+        """在专用线程池中执行任意同步函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        wrapper.__name__ = name
+        return wrapper
+
+    def shutdown(self):
+        """关闭线程池"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,214 @@
+"""
+进度事件总线
+检查任务在线程池中执行，进度回调和新邮件通知从工作线程发布到总线，
+总线按 (用户, 邮箱) 合并进度事件并限制发送频率，再通过 run_coroutine_threadsafe
+投递到WebSocket服务器正在运行的事件循环中发送。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+
+# 配置日志
+logger = logging.getLogger('websocket')
+
+
+class ProgressEventBus:
+    """线程安全的事件总线，进度事件按 (用户, 邮箱) 合并"""
+
+    def __init__(self, min_interval=0.5):
+        """初始化事件总线
+
+        Args:
+            min_interval: 同一邮箱两次进度推送的最小间隔，单位为秒
+        """
+        self.min_interval = min_interval
+        self.loop = None
+        self.sender = None  # 协程函数 sender(user_id, message)
+        self.lock = threading.Lock()
+        self.pending = {}  # (user_id, email_id) -> 待发送的最新进度消息
+        self.last_sent = {}  # (user_id, email_id) -> 上次发送时间
+        self.scheduled = set()  # 已安排延迟发送的键
+        self.stats = {'published': 0, 'delivered': 0, 'coalesced': 0, 'dropped': 0}
+        self.new_mail_listener = None  # 函数 listener(email_id)，保存新邮件后调用，用于唤醒等待新邮件的请求
+
+    def bind(self, loop, sender):
+        """绑定WebSocket服务器的事件循环和发送函数，在事件循环线程中调用"""
+        with self.lock:
+            self.loop = loop
+            self.sender = sender
+        logger.info("进度事件总线已绑定到WebSocket事件循环")
+
+    def unbind(self):
+        """解除绑定，之后发布的事件被丢弃"""
+        with self.lock:
+            self.loop = None
+            self.sender = None
+            self.pending.clear()
+            self.last_sent.clear()
+            self.scheduled.clear()
+
+    @property
+    def bound(self):
+        return self.loop is not None and not self.loop.is_closed()
+
+    def publish(self, user_id, message):
+        """发布一条不合并的消息，如新邮件通知"""
+        if user_id is None:
+            return False
+        with self.lock:
+            self.stats['published'] += 1
+        return self._deliver(user_id, message)
+
+    def publish_progress(self, user_id, email_id, progress, message, job_id=None):
+        """发布检查进度，开始和结束立即发送，中间进度按最小间隔合并"""
+        if user_id is None:
+            return
+        progress = max(0, min(100, progress))
+        key = (user_id, email_id)
+        event = {
+            'type': 'check_progress',
+            'email_id': email_id,
+            'progress': progress,
+            'message': message,
+            'timestamp': datetime.now().isoformat()
+        }
+        if job_id is not None:
+            event['job_id'] = job_id
+        self._publish_coalesced(user_id, key, event)
+
+    def publish_import_progress(self, user_id, job_id, progress, message):
+        """发布批量导入进度，与检查进度一样按任务合并"""
+        if user_id is None:
+            return
+        self._publish_coalesced(user_id, (user_id, ('import', job_id)), {
+            'type': 'import_progress',
+            'job_id': job_id,
+            'progress': max(0, min(100, progress)),
+            'message': message,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def publish_import_result(self, user_id, job_id, report):
+        """发布批量导入结果，有新导入的邮箱时通知刷新邮箱列表
+
+        Args:
+            report: 导入结果，格式与导入接口的返回值相同
+        """
+        self.publish(user_id, dict(report, type='import_result', timestamp=datetime.now().isoformat()))
+        if report['success'] > 0:
+            self.publish(user_id, {'type': 'emails_imported', 'job_id': job_id, 'count': report['success']})
+
+    def publish_mail_import_result(self, user_id, job_id, result):
+        """发布归档导入结果"""
+        self.publish(user_id, dict(result, type='mail_import_result', job_id=job_id,
+                                   timestamp=datetime.now().isoformat()))
+
+    def publish_reparse_result(self, user_id, job_id, result):
+        """发布重新解析结果"""
+        self.publish(user_id, dict(result, type='reparse_result', job_id=job_id,
+                                   timestamp=datetime.now().isoformat()))
+
+    def _publish_coalesced(self, user_id, key, event):
+        """按键合并进度事件，开始和结束立即发送，中间进度按最小间隔发送最新的一条"""
+        progress = event['progress']
+        now = time.time()
+        delay = None
+        with self.lock:
+            self.stats['published'] += 1
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            self.pending[key] = event
+
+            if progress in (0, 100) or now - self.last_sent.get(key, 0) >= self.min_interval:
+                # 立即发送最新的进度，已安排的延迟发送会发现没有待发送的消息
+                self.pending.pop(key, None)
+                if progress == 100:
+                    self.last_sent.pop(key, None)
+                else:
+                    self.last_sent[key] = now
+            elif key not in self.scheduled:
+                self.scheduled.add(key)
+                delay = self.last_sent.get(key, 0) + self.min_interval - now
+                event = None
+            else:
+                # 已有延迟发送，最新进度会在那时发出
+                return
+
+        if event is not None:
+            self._deliver(user_id, event)
+        elif delay is not None:
+            self._schedule_flush(key, delay)
+
+    def publish_new_mail(self, user_id, email_id, email_address, count):
+        """发布新邮件通知"""
+        listener = self.new_mail_listener
+        if listener is not None:
+            try:
+                listener(email_id)
+            except Exception as e:
+                logger.error(f"通知新邮件监听器失败: {str(e)}")
+        return self.publish(user_id, {
+            'type': 'new_mail',
+            'email_id': email_id,
+            'email': email_address,
+            'count': count,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def _deliver(self, user_id, message):
+        """将消息投递到事件循环，未绑定时丢弃"""
+        loop, sender = self.loop, self.sender
+        if loop is None or sender is None or loop.is_closed():
+            with self.lock:
+                self.stats['dropped'] += 1
+            return False
+        try:
+            asyncio.run_coroutine_threadsafe(self._send(sender, user_id, message), loop)
+            return True
+        except RuntimeError as e:
+            # 事件循环已关闭
+            logger.debug(f"投递事件失败: {str(e)}")
+            with self.lock:
+                self.stats['dropped'] += 1
+            return False
+
+    def _schedule_flush(self, key, delay):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            with self.lock:
+                self.scheduled.discard(key)
+                self.pending.pop(key, None)
+                self.stats['dropped'] += 1
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._flush_later(key, delay), loop)
+        except RuntimeError:
+            with self.lock:
+                self.scheduled.discard(key)
+
+    async def _flush_later(self, key, delay):
+        """延迟后发送合并后的最新进度"""
+        await asyncio.sleep(max(delay, 0))
+        with self.lock:
+            self.scheduled.discard(key)
+            event = self.pending.pop(key, None)
+            if event is not None:
+                self.last_sent[key] = time.time()
+            sender = self.sender
+        if event is not None and sender is not None:
+            await self._send(sender, key[0], event)
+
+    async def _send(self, sender, user_id, message):
+        try:
+            await sender(user_id, message)
+            with self.lock:
+                self.stats['delivered'] += 1
+        except Exception as e:
+            logger.error(f"向用户 {user_id} 推送事件失败: {str(e)}")
+
+
+# 进程内共享的事件总线
+event_bus = ProgressEventBus()
@@ -0,0 +1,167 @@
+"""
+WebSocket消息扇出
+每个连接有一个有界发送队列和一个写协程，广播时消息只序列化一次，放入各连接的队列后立即返回，
+一个慢客户端不会拖慢其他客户端。带合并键的消息（如进度）在队列中只保留最新一条；
+队列满或单次发送超时的连接被判定为慢消费者并断开，客户端重连后通过增量同步补齐数据。
+"""
+
+import asyncio
+import json
+import logging
+from collections import deque
+
+# 配置日志
+logger = logging.getLogger('websocket')
+
+
+class ClientChannel:
+    """单个连接的发送队列"""
+
+    def __init__(self, websocket, max_queue, send_timeout, stats):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.stats = stats
+        self.queue = deque()  # [合并键, 消息] 列表
+        self.keyed = {}  # 合并键 -> 队列中的条目
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = None
+
+    def put(self, payload, coalesce_key=None):
+        """放入一条已序列化的消息，返回是否成功入队"""
+        if self.closed:
+            return False
+
+        if coalesce_key is not None:
+            entry = self.keyed.get(coalesce_key)
+            if entry is not None:
+                # 队列中还有未发送的同类消息，原位替换为最新内容
+                entry[1] = payload
+                self.stats['coalesced'] += 1
+                return True
+
+        if len(self.queue) >= self.max_queue:
+            self.stats['slow_consumers'] += 1
+            logger.warning(f"WebSocket客户端 {self._address()} 发送队列已满，断开慢连接")
+            self.close(1013, 'slow consumer')
+            return False
+
+        entry = [coalesce_key, payload]
+        self.queue.append(entry)
+        if coalesce_key is not None:
+            self.keyed[coalesce_key] = entry
+        self.stats['queued'] += 1
+        self.ready.set()
+        return True
+
+    async def writer(self):
+        """写协程，按顺序发送队列中的消息"""
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue and not self.closed:
+                    entry = self.queue.popleft()
+                    key, payload = entry
+                    if key is not None and self.keyed.get(key) is entry:
+                        del self.keyed[key]
+                    try:
+                        await asyncio.wait_for(self.websocket.send(payload), self.send_timeout)
+                        self.stats['sent'] += 1
+                    except asyncio.TimeoutError:
+                        self.stats['slow_consumers'] += 1
+                        logger.warning(f"WebSocket客户端 {self._address()} 发送超时，断开慢连接")
+                        self.close(1013, 'slow consumer')
+                    except Exception as e:
+                        # 连接已关闭，由连接处理协程负责注销
+                        logger.debug(f"发送消息失败: {str(e)}")
+                        self.closed = True
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.queue.clear()
+            self.keyed.clear()
+
+    def close(self, code=1000, reason=''):
+        """丢弃未发送的消息并关闭连接"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.keyed.clear()
+        self.ready.set()
+        self.stats['dropped'] += 1
+        asyncio.ensure_future(self._close(code, reason))
+
+    async def _close(self, code, reason):
+        try:
+            await asyncio.wait_for(self.websocket.close(code, reason), self.send_timeout)
+        except Exception as e:
+            logger.debug(f"关闭连接失败: {str(e)}")
+
+    def _address(self):
+        return getattr(self.websocket, 'remote_address', None)
+
+
+class FanOut:
+    """管理所有连接的发送队列，只能在WebSocket服务器的事件循环中使用"""
+
+    def __init__(self, max_queue=1000, send_timeout=10):
+        """初始化扇出层
+
+        Args:
+            max_queue: 每个连接最多积压的消息数，超过后断开该连接
+            send_timeout: 单条消息的发送超时时间，单位为秒
+        """
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.channels = {}  # websocket -> ClientChannel
+        self.stats = {'queued': 0, 'sent': 0, 'coalesced': 0, 'slow_consumers': 0, 'dropped': 0}
+
+    def register(self, websocket):
+        """为连接创建发送队列和写协程"""
+        channel = self.channels.get(websocket)
+        if channel is None:
+            channel = ClientChannel(websocket, self.max_queue, self.send_timeout, self.stats)
+            channel.task = asyncio.ensure_future(channel.writer())
+            self.channels[websocket] = channel
+        return channel
+
+    def unregister(self, websocket):
+        """连接断开时停止写协程"""
+        channel = self.channels.pop(websocket, None)
+        if channel is not None:
+            channel.closed = True
+            if channel.task is not None:
+                channel.task.cancel()
+
+    def is_registered(self, websocket):
+        return websocket in self.channels
+
+    def send(self, websocket, message, coalesce_key=None):
+        """向单个连接发送消息，message可以是字典或已序列化的字符串"""
+        channel = self.channels.get(websocket)
+        if channel is None:
+            return False
+        payload = message if isinstance(message, str) else json.dumps(message)
+        return channel.put(payload, coalesce_key)
+
+    def send_many(self, websockets, message, coalesce_key=None):
+        """向多个连接发送同一条消息，只序列化一次，返回成功入队的连接数"""
+        if not websockets:
+            return 0
+        payload = message if isinstance(message, str) else json.dumps(message)
+        count = 0
+        for websocket in websockets:
+            channel = self.channels.get(websocket)
+            if channel is not None and channel.put(payload, coalesce_key):
+                count += 1
+        return count
+
+    def get_stats(self):
+        """获取扇出统计"""
+        stats = dict(self.stats)
+        stats['connections'] = len(self.channels)
+        stats['backlog'] = sum(len(channel.queue) for channel in self.channels.values())
+        return stats
@@ -1,11 +1,19 @@
 import os
 import json
+import time
 import asyncio
 import logging
 import websockets
 import jwt
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from .event_bus import event_bus
+from .async_db import AsyncDatabase
+from .loop_monitor import LoopLagMonitor
+from .fanout import FanOut
+from .subscriptions import SubscriptionRegistry
+from .mail_waiter import MailWaiters
+from utils.auth_cache import auth_cache
+from utils.email import import_report
 
 # 配置日志
 logger = logging.getLogger('websocket')
@@ -13,7 +21,12 @@ logger = logging.getLogger('websocket')
 class WebSocketHandler:
     def __init__(self):
         self.db = None
+        self.adb = None  # 异步数据库代理，协程中的数据库访问都通过它进行
         self.email_processor = None
+        self.lag_monitor = LoopLagMonitor()
+        self.fanout = FanOut()
+        self.subscriptions = SubscriptionRegistry()
+        self.mail_waiters = MailWaiters()
         self.port = 8765
         self.clients = {}  # 连接的客户端 {websocket: user_id}
         self.user_sockets = {}  # 用户的连接 {user_id: set(websockets)}
@@ -21,6 +34,10 @@ class WebSocketHandler:
         self.client_handlers = {}  # 存储每个客户端的处理函数
         self.active_users = {}  # 用户ID -> websocket连接
         self.user_counters = {}  # 用户ID -> 连接数
+        self.sync_page_size = 500  # 增量同步单次返回的变更对象数量
+        self.change_log_retention = 7 * 24 * 3600  # 变更日志保留时间，单位为秒
+        self.relay_interval = 1.0  # 转发其他进程任务进度的轮询间隔，单位为秒
+        self.background_tasks = []
         
         # JWT密钥，与app.py保持一致
         self.jwt_secret = os.environ.get('JWT_SECRET_KEY', 'huohuo_email_secret_key')
@@ -28,6 +45,7 @@ class WebSocketHandler:
     def set_dependencies(self, db, email_processor):
         """设置依赖"""
         self.db = db
+        self.adb = AsyncDatabase(db)
         self.email_processor = email_processor
         
         # 注册消息处理函数
@@ -38,6 +56,9 @@ class WebSocketHandler:
             'add_email': self.handle_add_email_message,
             'delete_emails': self.handle_delete_emails_message,
             'import_emails': self.handle_import_emails_message,
+            'sync': self.handle_sync_message,
+            'subscribe': self.handle_subscribe_message,
+            'unsubscribe': self.handle_unsubscribe_message,
         }
     
     async def register_client(self, websocket, path):
@@ -48,12 +69,12 @@ class WebSocketHandler:
             auth_data = json.loads(auth_message)
             
             # 验证token
-            user_id = self.validate_token(auth_data.get('token'))
+            user_id = await self.validate_token(auth_data.get('token'))
             if not user_id:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '无效的认证令牌，请重新登录'
-                }))
+                })
                 return
             
             # 注册客户端
@@ -66,14 +87,15 @@ class WebSocketHandler:
             if user_id not in self.user_sockets:
                 self.user_sockets[user_id] = set()
             self.user_sockets[user_id].add(websocket)
+            self.fanout.register(websocket)
             
             logger.info(f"WebSocket客户端已连接，用户ID: {user_id}")
             
             # 发送连接成功消息
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'connection_established',
                 'message': '连接已建立'
-            }))
+            })
             
             # 处理来自客户端的消息
             await self.handle_messages(websocket, user_id)
@@ -85,6 +107,8 @@ class WebSocketHandler:
     
     async def unregister_client(self, websocket):
         """注销客户端连接"""
+        self.fanout.unregister(websocket)
+        self.subscriptions.remove(websocket)
         if websocket in self.clients:
             user_id = self.clients[websocket]
             logger.info(f"WebSocket客户端已断开连接，用户ID: {user_id}")
@@ -102,17 +126,17 @@ class WebSocketHandler:
             if websocket in self.client_tokens:
                 del self.client_tokens[websocket]
     
-    def validate_token(self, token):
+    async def validate_token(self, token):
         """验证JWT令牌并提取用户ID"""
         if not token:
             return None
         
         try:
-            # 解码JWT令牌
-            data = jwt.decode(token, self.jwt_secret, algorithms=["HS256"])
+            # 解码JWT令牌，重连时令牌通常已在缓存中
+            data = auth_cache.decode_token(token, self.jwt_secret)
             
             # 检查用户是否存在
-            user = self.db.get_user_by_id(data['user_id'])
+            user = await self.get_user(data['user_id'])
             if not user:
                 return None
             
@@ -124,6 +148,16 @@ class WebSocketHandler:
             logger.error(f"令牌验证失败: {str(e)}")
             return None
     
+    async def get_user(self, user_id):
+        """获取用户信息，优先读取认证缓存，未命中时在线程池中查询数据库"""
+        user = auth_cache.lookup_user(user_id)
+        if user is None:
+            version = auth_cache.version
+            user = await self.adb.get_user_by_id(user_id)
+            auth_cache.store_user(user_id, user, version)
+            user = dict(user) if user is not None else None
+        return user
+    
     async def handle_messages(self, websocket, user_id):
         """处理从客户端接收的消息"""
         async for message in websocket:
@@ -144,58 +178,67 @@ class WebSocketHandler:
                     await self.handle_delete_emails(websocket, user_id, data)
                 elif message_type == 'import_emails':
                     await self.handle_import_emails(websocket, user_id, data)
+                elif message_type == 'sync':
+                    await self.handle_sync(websocket, user_id, data)
+                elif message_type == 'subscribe':
+                    await self.handle_subscribe(websocket, user_id, data)
+                elif message_type == 'unsubscribe':
+                    await self.handle_unsubscribe(websocket, user_id, data)
                 else:
-                    await websocket.send(json.dumps({
+                    await self.send_message(websocket, {
                         'type': 'error',
                         'message': f'未知消息类型: {message_type}'
-                    }))
+                    })
             except json.JSONDecodeError:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '无效的JSON消息'
-                }))
+                })
             except Exception as e:
                 logger.error(f"处理消息时出错: {str(e)}")
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': f'处理消息时出错: {str(e)}'
-                }))
+                })
     
     async def handle_get_all_emails(self, websocket, user_id):
         """处理获取所有邮箱的请求"""
         try:
             # 获取用户信息
-            user = self.db.get_user_by_id(user_id)
+            user = await self.get_user(user_id)
             if not user:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '用户不存在'
-                }))
+                })
                 return
             
             # 管理员可以获取所有邮箱，普通用户只能获取自己的邮箱
             is_admin = user['is_admin'] if 'is_admin' in user else False
+            # 先读取变更序号再查询数据，之后的变更会在下次同步时返回
+            cursor = await self.adb.get_change_cursor()
             if is_admin:
-                emails = self.db.get_all_emails()
+                emails = await self.adb.get_all_emails()
             else:
-                emails = self.db.get_all_emails(user_id)
+                emails = await self.adb.get_all_emails(user_id)
             
             # 将邮箱记录转换为字典列表
             emails_list = [dict(email) for email in emails]
             
             # 发送响应
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'emails_list',
+                'cursor': cursor,
                 'data': emails_list
-            }))
+            })
             
             logger.info(f"发送邮箱列表给用户ID: {user_id}")
         except Exception as e:
             logger.error(f"获取邮箱列表失败: {str(e)}")
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': f'获取邮箱列表失败: {str(e)}'
-            }))
+            })
     
     async def handle_check_emails(self, websocket, user_id, data):
         """处理检查邮箱邮件的请求"""
@@ -203,36 +246,36 @@ class WebSocketHandler:
             # 获取请求数据
             email_ids = data.get('email_ids', [])
             if not email_ids:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '未提供邮箱ID'
-                }))
+                })
                 return
             
             # 获取用户信息
-            user = self.db.get_user_by_id(user_id)
+            user = await self.get_user(user_id)
             if not user:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '用户不存在'
-                }))
+                })
                 return
             
             # 验证邮箱所有权
             is_admin = user['is_admin'] if 'is_admin' in user else False
             if not is_admin:
                 # 获取用户拥有的邮箱
-                owned_emails = self.db.get_all_emails(user_id)
+                owned_emails = await self.adb.get_all_emails(user_id)
                 owned_ids = [email['id'] for email in owned_emails]
                 
                 # 过滤出用户有权限的邮箱ID
                 valid_ids = [id for id in email_ids if id in owned_ids]
                 
                 if not valid_ids:
-                    await websocket.send(json.dumps({
+                    await self.send_message(websocket, {
                         'type': 'error',
                         'message': '您没有权限检查任何指定的邮箱'
-                    }))
+                    })
                     return
                 
                 email_ids = valid_ids
@@ -242,58 +285,40 @@ class WebSocketHandler:
             valid_ids = []
             
             for email_id in email_ids:
-                if self.email_processor.is_email_being_processed(email_id):
+                if await self.adb.run(self.email_processor.is_email_being_processed, email_id):
                     processing_ids.append(email_id)
                 else:
                     valid_ids.append(email_id)
             
             if processing_ids:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'info',
                     'message': f'跳过已经在处理中的 {len(processing_ids)} 个邮箱'
-                }))
+                })
             
             if not valid_ids:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'warning',
                     'message': '所有邮箱都在处理中，请稍后再试'
-                }))
+                })
                 return
             
-            # 定义详细的进度回调函数
-            def progress_callback(email_id, progress, message):
-                # 获取邮箱信息用于更详细的日志
-                email_info = self.db.get_email_by_id(email_id)
-                email_address = email_info['email'] if email_info else f"ID:{email_id}"
-                
-                # 记录进度日志
-                if progress == 0:
-                    logger.info(f"开始检查邮箱 {email_address}")
-                elif progress == 100:
-                    logger.info(f"完成检查邮箱 {email_address}")
-                else:
-                    logger.info(f"邮箱 {email_address} 检查进度: {progress}% - {message}")
-                
-                # 发送进度更新到WebSocket
-                asyncio.run(self.send_progress_update(user_id, email_id, progress, message))
-            
-            # 启动检查邮箱任务
-            with ThreadPoolExecutor() as executor:
-                executor.submit(self.email_processor.check_emails, valid_ids, progress_callback)
+            # 启动检查邮箱任务，进度由邮件处理器发布到事件总线推送给邮箱所属用户
+            await self.adb.run(self.email_processor.check_emails, valid_ids)
             
             # 发送开始检查的消息
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'success',
                 'message': f'开始检查 {len(valid_ids)} 个邮箱'
-            }))
+            })
             
             logger.info(f"开始检查邮箱: {valid_ids} (用户ID: {user_id})")
         except Exception as e:
             logger.error(f"检查邮箱失败: {str(e)}")
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': f'检查邮箱失败: {str(e)}'
-            }))
+            })
     
     async def handle_get_mail_records(self, websocket, user_id, data):
         """处理获取邮件记录的请求"""
@@ -301,48 +326,211 @@ class WebSocketHandler:
             # 获取请求数据
             email_id = data.get('email_id')
             if not email_id:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '未提供邮箱ID'
-                }))
+                })
                 return
             
             # 获取用户信息
-            user = self.db.get_user_by_id(user_id)
+            user = await self.get_user(user_id)
             if not user:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '用户不存在'
-                }))
+                })
                 return
             
             # 验证邮箱所有权
             is_admin = user['is_admin'] if 'is_admin' in user else False
-            email_info = self.db.get_email_by_id(email_id, None if is_admin else user_id)
+            email_info = await self.adb.get_email_by_id(email_id, None if is_admin else user_id)
             if not email_info:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': f'邮箱ID {email_id} 不存在或您没有权限'
-                }))
+                })
                 return
             
             # 获取邮件记录
-            mail_records = self.db.get_mail_records(email_id)
+            mail_records = await self.adb.get_mail_records(email_id)
             
             # 发送响应
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'mail_records',
                 'email_id': email_id,
                 'data': [dict(record) for record in mail_records]
-            }))
+            })
             
             logger.info(f"发送邮件记录给用户ID: {user_id}, 邮箱ID: {email_id}")
         except Exception as e:
             logger.error(f"获取邮件记录失败: {str(e)}")
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': f'获取邮件记录失败: {str(e)}'
-            }))
+            })
+    
+    async def handle_sync(self, websocket, user_id, data):
+        """处理增量同步请求，返回客户端序号之后新增、修改和删除的邮箱与邮件记录"""
+        try:
+            user = await self.get_user(user_id)
+            if not user:
+                await self.send_error(websocket, '用户不存在')
+                return
+            
+            is_admin = user['is_admin'] if 'is_admin' in user else False
+            since = data.get('cursor')
+            try:
+                since = int(since) if since is not None else None
+            except (TypeError, ValueError):
+                since = None
+            
+            changes = await self.adb.get_changes(
+                since,
+                None if is_admin else user_id,
+                email_ids=data.get('email_ids') or [],
+                limit=self.sync_page_size
+            )
+            changes['type'] = 'sync'
+            await self.send_message(websocket, changes)
+            
+            logger.debug(f"向用户ID: {user_id} 发送增量同步, 序号 {since} -> {changes['cursor']}, 重置: {changes['reset']}")
+        except Exception as e:
+            logger.error(f"增量同步失败: {str(e)}")
+            await self.send_error(websocket, f'增量同步失败: {str(e)}')
+    
+    async def handle_subscribe(self, websocket, user_id, data):
+        """处理订阅主题的请求，订阅后只接收所订阅主题的推送"""
+        topics = data.get('topics') or []
+        if not isinstance(topics, list):
+            await self.send_error(websocket, '主题列表格式错误')
+            return
+        
+        current, invalid = self.subscriptions.subscribe(websocket, topics)
+        await self.send_message(websocket, {
+            'type': 'subscribed',
+            'topics': sorted(current),
+            'invalid': invalid
+        })
+        logger.debug(f"用户ID {user_id} 订阅主题: {topics}")
+    
+    async def handle_unsubscribe(self, websocket, user_id, data):
+        """处理取消订阅的请求，未提供主题时取消全部订阅"""
+        topics = data.get('topics') or []
+        if not isinstance(topics, list):
+            await self.send_error(websocket, '主题列表格式错误')
+            return
+        
+        current = self.subscriptions.unsubscribe(websocket, topics)
+        await self.send_message(websocket, {
+            'type': 'subscribed',
+            'topics': sorted(current),
+            'invalid': []
+        })
+        logger.debug(f"用户ID {user_id} 取消订阅主题: {topics or '全部'}")
+    
+    async def purge_change_log_loop(self):
+        """定期清理过期的变更日志，客户端序号早于清理范围时会收到重置响应"""
+        while True:
+            try:
+                await self.adb.purge_change_log(self.change_log_retention)
+            except Exception as e:
+                logger.error(f"清理变更日志失败: {str(e)}")
+            await asyncio.sleep(3600)
+    
+    async def relay_job_progress_loop(self):
+        """转发其他进程（独立worker或其他ASGI worker）执行的检查任务进度
+        
+        导入任务的进度也一并转发。本进程执行的任务已通过事件总线推送；其他进程的任务进度写在job_queue表中，
+        这里定期读取并推送给连接在本进程上的客户端。
+        """
+        owner = self.email_processor.job_queue.owner
+        since = time.time()
+        while True:
+            await asyncio.sleep(self.relay_interval)
+            if not self.user_sockets:
+                since = time.time()
+                continue
+            try:
+                for job in await self.adb.get_job_updates(since, owner):
+                    since = max(since, job['updated_at'] or since)
+                    await self._relay_job(job)
+            except Exception as e:
+                logger.error(f"转发任务进度失败: {str(e)}")
+    
+    async def _relay_job(self, job):
+        """把一条任务状态转换为进度或新邮件消息推送给邮箱所属用户"""
+        if job['user_id'] not in self.user_sockets:
+            return
+        
+        if job['kind'] in ('import', 'mbox_import', 'archive_import', 'reparse'):
+            await self._relay_import_job(job)
+            return
+        
+        if job['status'] == 'running':
+            progress, message = job['progress'] or 0, job['message'] or ''
+        else:
+            progress = 100
+            message = {'done': '检查完成', 'failed': '检查失败', 'cancelled': '检查已取消'}[job['status']]
+        
+        await self.broadcast_to_user(job['user_id'], {
+            'type': 'check_progress',
+            'email_id': job['email_id'],
+            'job_id': job['id'],
+            'progress': progress,
+            'message': message,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+        if job['status'] == 'done' and job['result']:
+            try:
+                saved = json.loads(job['result']).get('saved')
+            except (ValueError, AttributeError):
+                saved = None
+            if saved:
+                await self.broadcast_to_user(job['user_id'], {
+                    'type': 'new_mail',
+                    'email_id': job['email_id'],
+                    'email': job['email'],
+                    'count': saved,
+                    'timestamp': datetime.now().isoformat()
+                })
+    
+    async def _relay_import_job(self, job):
+        """转发其他进程执行的账号导入、邮件导入和重新解析任务的进度和结果"""
+        if job['status'] == 'running':
+            await self.broadcast_to_user(job['user_id'], {
+                'type': 'import_progress',
+                'job_id': job['id'],
+                'progress': job['progress'] or 0,
+                'message': job['message'] or '',
+                'timestamp': datetime.now().isoformat()
+            })
+            return
+        
+        try:
+            result = json.loads(job['result']) if job['result'] else None
+        except ValueError:
+            result = None
+        if result is None:
+            result = {'success': False, 'message': job['message'] or job['status']}
+        if job['kind'] in ('mbox_import', 'archive_import'):
+            await self.broadcast_to_user(job['user_id'], dict(
+                result, type='mail_import_result', job_id=job['id'], timestamp=datetime.now().isoformat()
+            ))
+            return
+        if job['kind'] == 'reparse':
+            await self.broadcast_to_user(job['user_id'], dict(
+                result, type='reparse_result', job_id=job['id'], timestamp=datetime.now().isoformat()
+            ))
+            return
+        report = import_report(result, job['id'])
+        await self.broadcast_to_user(job['user_id'], dict(report, type='import_result', timestamp=datetime.now().isoformat()))
+        if report['success'] > 0:
+            await self.broadcast_to_user(job['user_id'], {
+                'type': 'emails_imported',
+                'job_id': job['id'],
+                'count': report['success']
+            })
     
     async def handle_add_email(self, websocket, user_id, data):
         """处理添加邮箱的请求"""
@@ -358,23 +546,23 @@ class WebSocketHandler:
             use_ssl = data.get('use_ssl', True)
             
             if not email or not password:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '邮箱地址和密码不能为空'
-                }))
+                })
                 return
             
             # 根据不同邮箱类型处理
             if mail_type == 'outlook':
                 if not client_id or not refresh_token:
-                    await websocket.send(json.dumps({
+                    await self.send_message(websocket, {
                         'type': 'error',
                         'message': 'Outlook邮箱需要提供Client ID和Refresh Token'
-                    }))
+                    })
                     return
-                email_id = self.db.add_email(user_id, email, password, client_id, refresh_token, mail_type)
+                email_id = await self.adb.add_email(user_id, email, password, client_id, refresh_token, mail_type)
             else:  # imap类型
-                email_id = self.db.add_email(
+                email_id = await self.adb.add_email(
                     user_id, 
                     email, 
                     password, 
@@ -386,24 +574,24 @@ class WebSocketHandler:
             
             if email_id:
                 # 发送成功消息
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'email_added',
                     'message': f'邮箱 {email} 添加成功'
-                }))
+                })
                 
                 logger.info(f"用户ID {user_id} 添加了邮箱: {email}, 类型: {mail_type}")
             else:
                 # 发送错误消息
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': f'邮箱 {email} 添加失败，可能已存在'
-                }))
+                })
         except Exception as e:
             logger.error(f"添加邮箱失败: {str(e)}")
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': f'添加邮箱失败: {str(e)}'
-            }))
+            })
     
     async def handle_delete_emails(self, websocket, user_id, data):
         """处理删除邮箱的请求"""
@@ -411,208 +599,159 @@ class WebSocketHandler:
             # 获取请求数据
             email_ids = data.get('email_ids', [])
             if not email_ids:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '未提供邮箱ID'
-                }))
+                })
                 return
             
             # 获取用户信息
-            user = self.db.get_user_by_id(user_id)
+            user = await self.get_user(user_id)
             if not user:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '用户不存在'
-                }))
+                })
                 return
             
-            # 验证邮箱所有权并删除
+            # 验证邮箱所有权并删除，删除前记录邮箱所属用户用于通知
             is_admin = user['is_admin'] if 'is_admin' in user else False
+            owners = await self.adb.get_email_owners(email_ids)
+            if not is_admin:
+                owners = {user_id: owners[user_id]} if user_id in owners else {}
             if is_admin:
                 # 管理员可以删除任何邮箱
-                self.db.delete_emails(email_ids)
+                await self.adb.delete_emails(email_ids)
             else:
                 # 普通用户只能删除自己的邮箱
-                self.db.delete_emails(email_ids, user_id)
+                await self.adb.delete_emails(email_ids, user_id)
             
             # 发送成功消息
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'emails_deleted',
                 'email_ids': email_ids,
                 'message': f'已删除 {len(email_ids)} 个邮箱'
-            }))
+            })
             
-            # 向所有客户端广播邮箱已删除的消息
-            await self.broadcast_emails_deleted(email_ids)
+            # 只通知邮箱所属用户的其他连接
+            await self.broadcast_emails_deleted(owners)
             
             logger.info(f"用户ID {user_id} 删除了邮箱: {email_ids}")
         except Exception as e:
             logger.error(f"删除邮箱失败: {str(e)}")
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': f'删除邮箱失败: {str(e)}'
-            }))
+            })
     
     async def send_progress_update(self, user_id, email_id, progress, message):
         """发送进度更新给用户"""
-        if user_id not in self.user_sockets:
-            logger.warning(f"找不到用户ID: {user_id}的WebSocket连接，无法发送进度更新")
-            return
-        
         # 确保进度在0-100范围内
         progress = max(0, min(100, progress))
         
-        # 构建进度消息
-        progress_message = json.dumps({
+        await self.broadcast_to_user(user_id, {
             'type': 'check_progress',
             'email_id': email_id,
             'progress': progress,
             'message': message,
             'timestamp': datetime.now().isoformat()
         })
-        
-        # 发送给该用户的所有WebSocket连接
-        websockets_copy = self.user_sockets[user_id].copy()
-        success_count = 0
-        
-        for websocket in websockets_copy:
-            try:
-                await websocket.send(progress_message)
-                success_count += 1
-            except Exception as e:
-                logger.error(f"向用户 {user_id} 发送进度更新失败: {str(e)}")
-                # 这里不需要删除连接，因为错误会导致连接关闭，unregister_client会处理
-        
-        if success_count > 0:
-            logger.debug(f"成功向用户 {user_id} 的 {success_count} 个连接发送进度更新: {email_id} - {progress}% - {message}")
     
     # 添加广播到特定用户的所有连接的方法
     async def broadcast_to_user(self, user_id, message):
-        """向特定用户的所有连接广播消息"""
+        """向特定用户的所有连接广播消息，消息只序列化一次并放入各连接的发送队列"""
         if user_id not in self.user_sockets:
-            logger.warning(f"找不到用户ID: {user_id}的WebSocket连接，无法发送消息")
-            return
+            logger.debug(f"找不到用户ID: {user_id}的WebSocket连接，无法发送消息")
+            return False
         
-        # 将消息转换为JSON字符串
-        message_str = json.dumps(message)
+        # 按订阅的主题过滤，没有连接关心的消息不做序列化
+        recipients = self.subscriptions.filter(self.user_sockets[user_id], message)
+        if not recipients:
+            return False
         
-        # 发送给该用户的所有WebSocket连接
-        websockets_copy = self.user_sockets[user_id].copy()
-        success_count = 0
+        # 进度消息在发送队列中按邮箱合并，只保留最新进度
+        coalesce_key = None
+        if message.get('type') == 'check_progress':
+            coalesce_key = ('check_progress', message.get('email_id'))
+        elif message.get('type') == 'import_progress':
+            coalesce_key = ('import_progress', message.get('job_id'))
         
-        for websocket in websockets_copy:
-            try:
-                await websocket.send(message_str)
-                success_count += 1
-            except Exception as e:
-                logger.error(f"向用户 {user_id} 广播消息失败: {str(e)}")
-                # 错误会由unregister_client处理
+        success_count = self.fanout.send_many(recipients, message, coalesce_key)
         
         if success_count > 0:
             logger.debug(f"成功向用户 {user_id} 的 {success_count} 个连接广播消息: {message['type']}")
         
         return success_count > 0
     
-    async def broadcast_emails_deleted(self, email_ids):
-        """向所有连接的客户端广播邮箱已删除的消息"""
-        message = json.dumps({
-            'type': 'emails_deleted',
-            'email_ids': email_ids
-        })
-        
-        # 复制客户端字典，避免在迭代过程中修改
-        clients_copy = list(self.clients.keys())
-        for websocket in clients_copy:
-            try:
-                await websocket.send(message)
-            except Exception as e:
-                logger.error(f"广播邮箱删除消息失败: {str(e)}")
-                # 这里不需要删除连接，因为错误会导致连接关闭，unregister_client会处理
+    async def broadcast_emails_deleted(self, owners):
+        """向邮箱所属用户的连接广播邮箱已删除的消息
+
+        Args:
+            owners: {用户ID: [邮箱ID]}
+        """
+        for user_id, email_ids in owners.items():
+            await self.broadcast_to_user(user_id, {
+                'type': 'emails_deleted',
+                'email_ids': email_ids
+            })
     
     async def handle_import_emails(self, websocket, user_id, data):
-        """处理导入邮箱的请求"""
+        """处理导入邮箱的请求，导入作为后台任务执行，进度和结果通过import_progress、import_result推送"""
         try:
             # 获取请求数据
             import_data = data.get('data', '')
             if not import_data:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '未提供要导入的邮箱数据'
-                }))
+                })
+                return
+            
+            mail_type = data.get('mail_type', 'outlook')
+            if mail_type not in self.email_processor.handlers:
+                await self.send_message(websocket, {
+                    'type': 'error',
+                    'message': f'不支持的邮箱类型: {mail_type}'
+                })
                 return
             
             # 获取用户信息
-            user = self.db.get_user_by_id(user_id)
+            user = await self.get_user(user_id)
             if not user:
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     'type': 'error',
                     'message': '用户不存在'
-                }))
+                })
                 return
             
-            # 处理导入邮箱的逻辑
-            # 解析导入数据，预期格式: 一行一条，每条格式为 email----password----client_id----refresh_token
-            lines = import_data.strip().split('\n')
-            imported_count = 0
-            errors = []
-            
-            for line in lines:
-                try:
-                    parts = line.strip().split('----')
-                    
-                    if len(parts) < 2:
-                        errors.append(f"格式错误: {line}")
-                        continue
-                    
-                    email = parts[0]
-                    password = parts[1]
-                    client_id = parts[2] if len(parts) > 2 else None
-                    refresh_token = parts[3] if len(parts) > 3 else None
-                    
-                    # 添加邮箱到数据库 - 确保参数顺序正确：user_id, email, password, client_id, refresh_token
-                    email_id = self.db.add_email(user_id, email, password, client_id, refresh_token)
-                    if email_id:
-                        imported_count += 1
-                    else:
-                        errors.append(f"添加失败: {email}")
-                except Exception as e:
-                    errors.append(f"处理失败: {line} ({str(e)})")
-            
-            # 发送导入结果消息
-            if imported_count > 0:
-                await websocket.send(json.dumps({
-                    'type': 'success',
-                    'message': f'成功导入 {imported_count} 个邮箱'
-                }))
-                
-                # 广播邮箱列表更新
-                await websocket.send(json.dumps({
-                    'type': 'emails_imported'
-                }))
-            else:
-                await websocket.send(json.dumps({
-                    'type': 'warning',
-                    'message': '没有成功导入任何邮箱'
-                }))
-            
-            # 如果有错误，也发送错误详情
-            if errors:
-                error_message = '\n'.join(errors[:10])
-                if len(errors) > 10:
-                    error_message += f"\n...以及其他 {len(errors) - 10} 个错误"
-                
-                await websocket.send(json.dumps({
+            concurrency = data.get('concurrency')
+            job_id = await self.adb.run(
+                self.email_processor.enqueue_import,
+                user_id,
+                import_data,
+                mail_type,
+                bool(data.get('verify', False)),
+                concurrency if isinstance(concurrency, int) else None
+            )
+            if job_id is None:
+                await self.send_message(websocket, {
                     'type': 'error',
-                    'message': f'导入过程中出现以下错误:\n{error_message}'
-                }))
+                    'message': '创建导入任务失败'
+                })
+                return
             
-            logger.info(f"用户ID {user_id} 完成邮箱批量导入，成功: {imported_count}，失败: {len(errors)}")
+            await self.send_message(websocket, {
+                'type': 'import_started',
+                'job_id': job_id,
+                'message': '导入任务已开始'
+            })
+            logger.info(f"用户ID {user_id} 提交邮箱批量导入任务: job_id={job_id}")
         except Exception as e:
             logger.error(f"导入邮箱失败: {str(e)}")
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': f'导入邮箱失败: {str(e)}'
-            }))
+            })
     
     async def handle_message(self, websocket, message_text):
         """处理WebSocket消息"""
@@ -637,7 +776,7 @@ class WebSocketHandler:
                         await self.send_error(websocket, "无效的认证消息")
                         return
                     
-                    user_id = self.validate_token(token)
+                    user_id = await self.validate_token(token)
                     if not user_id:
                         await self.send_error(websocket, "无效的认证令牌，请重新登录")
                         return
@@ -704,7 +843,7 @@ class WebSocketHandler:
                 await self.send_error(websocket, "请发送有效的认证消息")
                 return
             
-            user_id = self.validate_token(token)
+            user_id = await self.validate_token(token)
             if not user_id:
                 await self.send_error(websocket, "无效的认证令牌，请重新登录")
                 return
@@ -719,6 +858,7 @@ class WebSocketHandler:
             if user_id not in self.user_sockets:
                 self.user_sockets[user_id] = set()
             self.user_sockets[user_id].add(websocket)
+            self.fanout.register(websocket)
             
             logger.info(f"WebSocket客户端已认证，用户ID: {user_id}")
             
@@ -747,17 +887,20 @@ class WebSocketHandler:
     async def send_error(self, websocket, message):
         """发送错误消息"""
         try:
-            await websocket.send(json.dumps({
+            await self.send_message(websocket, {
                 'type': 'error',
                 'message': message
-            }))
+            })
         except:
             pass
     
     async def send_message(self, websocket, message):
-        """发送消息"""
+        """发送消息，已注册的连接通过发送队列发送，保证与广播消息的顺序一致"""
         try:
-            await websocket.send(json.dumps(message))
+            if self.fanout.is_registered(websocket):
+                self.fanout.send(websocket, message)
+            else:
+                await websocket.send(json.dumps(message))
         except Exception as e:
             logger.error(f"发送消息失败: {str(e)}")
     
@@ -776,9 +919,48 @@ class WebSocketHandler:
         
         logger.info(f"WebSocket服务器启动于端口 {self.port}")
         
-        # 运行事件循环
+        # 运行事件循环，工作线程的进度事件通过事件总线投递到该循环
         loop.run_until_complete(start_server)
-        loop.run_forever()
+        self.start_services(loop)
+        try:
+            loop.run_forever()
+        finally:
+            self.stop_services()
+
+    def start_services(self, loop):
+        """在服务器的事件循环中启动后台协程，独立运行和ASGI模式共用"""
+        event_bus.bind(loop, self.broadcast_to_user)
+        self.mail_waiters.bind(loop, self.adb, self.email_processor)
+        event_bus.new_mail_listener = self.mail_waiters.wake
+        self.background_tasks = [
+            loop.create_task(self.lag_monitor.run()),
+            loop.create_task(self.purge_change_log_loop()),
+            loop.create_task(self.relay_job_progress_loop()),
+            loop.create_task(self.mail_waiters.run()),
+        ]
+
+    def stop_services(self):
+        """停止后台协程并解除事件总线绑定"""
+        self.lag_monitor.stop()
+        for task in self.background_tasks:
+            task.cancel()
+        self.background_tasks = []
+        event_bus.new_mail_listener = None
+        event_bus.unbind()
+        if self.adb:
+            self.adb.shutdown()
+
+    def get_stats(self):
+        """获取WebSocket服务器的运行统计"""
+        return {
+            'clients': len(self.clients),
+            'users': len(self.user_sockets),
+            'loop_lag': self.lag_monitor.stats(),
+            'event_bus': dict(event_bus.stats),
+            'fanout': self.fanout.get_stats(),
+            'subscriptions': self.subscriptions.get_stats(),
+            'mail_waiters': self.mail_waiters.get_stats()
+        }
 
     async def handle_get_all_emails_message(self, websocket, message):
         """处理获取所有邮箱的WebSocket消息"""
@@ -826,4 +1008,28 @@ class WebSocketHandler:
         if not user_id:
             await self.send_error(websocket, "未找到用户信息")
             return
-        await self.handle_import_emails(websocket, user_id, message) 
\ No newline at end of file
+        await self.handle_import_emails(websocket, user_id, message)
+    
+    async def handle_sync_message(self, websocket, message):
+        """处理增量同步的WebSocket消息"""
+        user_id = self.clients.get(websocket)
+        if not user_id:
+            await self.send_error(websocket, "未找到用户信息")
+            return
+        await self.handle_sync(websocket, user_id, message)
+    
+    async def handle_subscribe_message(self, websocket, message):
+        """处理订阅主题的WebSocket消息"""
+        user_id = self.clients.get(websocket)
+        if not user_id:
+            await self.send_error(websocket, "未找到用户信息")
+            return
+        await self.handle_subscribe(websocket, user_id, message)
+    
+    async def handle_unsubscribe_message(self, websocket, message):
+        """处理取消订阅的WebSocket消息"""
+        user_id = self.clients.get(websocket)
+        if not user_id:
+            await self.send_error(websocket, "未找到用户信息")
+            return
+        await self.handle_unsubscribe(websocket, user_id, message) 
\ No newline at end of file
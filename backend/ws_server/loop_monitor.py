@@ -0,0 +1,71 @@
+"""
+事件循环延迟监控
+定期安排一个定时回调，实际执行时间与预期时间之差即为事件循环被阻塞的时长。
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+# 配置日志
+logger = logging.getLogger('websocket')
+
+
+class LoopLagMonitor:
+    """事件循环延迟监控器"""
+
+    def __init__(self, interval=0.5, warn_threshold=0.1, window=600, report_interval=300):
+        """初始化监控器
+
+        Args:
+            interval: 采样间隔，单位为秒
+            warn_threshold: 单次延迟超过该值时记录警告，单位为秒
+            window: 计算统计值时保留的最近采样数
+            report_interval: 定期输出统计日志的间隔，单位为秒
+        """
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.report_interval = report_interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.running = False
+
+    async def run(self):
+        """采样循环，作为任务运行在被监控的事件循环中"""
+        self.running = True
+        last_report = time.monotonic()
+        while self.running:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - expected, 0.0)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag >= self.warn_threshold:
+                logger.warning(f"WebSocket事件循环阻塞 {lag * 1000:.0f}ms")
+
+            if time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                stats = self.stats()
+                logger.info(f"WebSocket事件循环延迟: p50={stats['p50_ms']}ms, p99={stats['p99_ms']}ms, max={stats['max_ms']}ms")
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        """返回最近采样窗口的延迟统计，单位为毫秒"""
+        samples = sorted(self.samples)
+        if not samples:
+            return {'samples': 0, 'p50_ms': 0, 'p99_ms': 0, 'max_ms': round(self.max_lag * 1000, 1)}
+
+        def percentile(p):
+            index = min(int(len(samples) * p), len(samples) - 1)
+            return round(samples[index] * 1000, 1)
+
+        return {
+            'samples': len(samples),
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(self.max_lag * 1000, 1)
+        }
@@ -0,0 +1,249 @@
+"""
+等待新邮件
+自动化脚本等待某封邮件时，不再循环调用检查接口和读取邮件列表，而是请求 GET /api/emails/<id>/wait:
+请求注册为一个等待者，匹配的邮件保存后立即返回，超时返回未匹配。
+
+- 每个进程只有一个后台协程读取新邮件：按邮件ID增量查询有等待者的邮箱新保存的邮件摘要，
+  所有等待者共用这一次查询，再在内存中按发件人和主题分发，等待者数量不影响数据库负载
+- 本进程保存新邮件时通过事件总线立即唤醒后台协程，其他进程保存的邮件在下一次轮询时读取
+- 有等待者的邮箱定期加入手动优先级的检查任务（队列会合并重复的任务），新邮件尽快被收取；
+  等待者的条件都相同时改为服务器端定向搜索，只拉取匹配的邮件
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+# 配置日志
+logger = logging.getLogger('websocket')
+
+# 默认和最长等待时间，单位为秒
+DEFAULT_TIMEOUT = 30
+MAX_TIMEOUT = 300
+
+
+class MailWaiter:
+    """一个等待新邮件的请求"""
+
+    __slots__ = ('email_id', 'sender', 'subject', 'future')
+
+    def __init__(self, email_id, sender, subject, future):
+        self.email_id = email_id
+        self.sender = sender
+        self.subject = subject
+        self.future = future
+
+    def matches(self, mail):
+        """发件人和主题按不区分大小写的子串匹配，未指定的条件不限制"""
+        if self.sender and self.sender not in (mail.get('sender') or '').lower():
+            return False
+        if self.subject and self.subject not in (mail.get('subject') or '').lower():
+            return False
+        return True
+
+
+class MailWaiters:
+    """按邮箱索引的等待者，在WebSocket服务器的事件循环中运行"""
+
+    def __init__(self, poll_interval=1.0, boost_interval=15.0, max_waiters=10000):
+        """初始化等待者表
+
+        Args:
+            poll_interval: 没有被唤醒时读取新邮件的间隔，单位为秒
+            boost_interval: 同一邮箱两次加入检查任务的最小间隔，单位为秒
+            max_waiters: 同时等待的请求数上限
+        """
+        self.poll_interval = poll_interval
+        self.boost_interval = boost_interval
+        self.max_waiters = max_waiters
+        self.loop = None
+        self.adb = None
+        self.email_processor = None
+        self.wakeup = None
+        self.waiters = {}  # 邮箱ID -> set(MailWaiter)
+        self.boosts = {}  # 邮箱ID -> (邮箱信息, 上次加入检查任务的时间)
+        self.last_mail_id = None  # 已分发到的最大邮件ID
+        self.stats = {'registered': 0, 'matched': 0, 'timeouts': 0, 'rejected': 0, 'polls': 0, 'boosts': 0}
+
+    def bind(self, loop, adb, email_processor):
+        """绑定事件循环和依赖，在事件循环线程中调用"""
+        self.loop = loop
+        self.adb = adb
+        self.email_processor = email_processor
+        self.wakeup = asyncio.Event()
+
+    @property
+    def bound(self):
+        return self.loop is not None and not self.loop.is_closed()
+
+    @property
+    def count(self):
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    @staticmethod
+    def parse_params(args):
+        """解析请求参数
+
+        Args:
+            args: 查询参数字典，支持sender、subject、timeout、since
+
+        Returns:
+            (参数字典, 错误信息)，参数有效时错误信息为None
+        """
+        try:
+            timeout = float(args.get('timeout') or DEFAULT_TIMEOUT)
+            since = args.get('since')
+            since = float(since) if since not in (None, '') else None
+        except (TypeError, ValueError):
+            return None, 'timeout和since必须是数字'
+        if timeout <= 0:
+            return None, 'timeout必须大于0'
+        return {
+            'sender': (args.get('sender') or '').strip().lower(),
+            'subject': (args.get('subject') or '').strip().lower(),
+            'timeout': min(timeout, MAX_TIMEOUT),
+            'since': since
+        }, None
+
+    async def wait(self, email_info, sender='', subject='', timeout=DEFAULT_TIMEOUT, since=None):
+        """等待邮箱收到匹配的邮件
+
+        Args:
+            email_info: 邮箱信息，调用方已验证权限
+            sender: 发件人包含的文本（小写）
+            subject: 主题包含的文本（小写）
+            since: Unix时间戳，指定时先查找这个时间之后已经保存的匹配邮件
+
+        Returns:
+            匹配的邮件摘要 {id, email_id, subject, sender, received_time, codes}，超时返回None
+
+        Raises:
+            OverflowError: 等待的请求数已达上限
+        """
+        if self.count >= self.max_waiters:
+            self.stats['rejected'] += 1
+            raise OverflowError('等待新邮件的请求过多，请稍后重试')
+
+        email_id = email_info['id']
+        if self.last_mail_id is None:
+            self.last_mail_id = await self.adb.get_max_mail_id()
+
+        # 先注册再查找已保存的邮件，查找期间保存的邮件由后台协程分发，不会遗漏
+        waiter = MailWaiter(email_id, sender, subject, self.loop.create_future())
+        self.waiters.setdefault(email_id, set()).add(waiter)
+        self.stats['registered'] += 1
+        try:
+            if since is not None:
+                created_since = datetime.fromtimestamp(since, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                for mail in reversed(await self.adb.get_recent_mail_records(email_id, created_since)):
+                    if waiter.matches(mail):
+                        codes = await self.adb.get_codes_for_mail(mail['id'])
+                        if not waiter.future.done():
+                            waiter.future.set_result(dict(mail, codes=codes))
+                        break
+
+            if not waiter.future.done():
+                await self._boost(email_info)
+                self.wakeup.set()
+            mail = await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            return None
+        finally:
+            waiters = self.waiters.get(email_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self.waiters[email_id]
+                    self.boosts.pop(email_id, None)
+
+        self.stats['matched'] += 1
+        return mail
+
+    def wait_threadsafe(self, email_info, sender='', subject='', timeout=DEFAULT_TIMEOUT, since=None):
+        """在其他线程中等待，供Flask开发服务器使用，事件循环未运行时抛出RuntimeError"""
+        if not self.bound:
+            raise RuntimeError('WebSocket服务器未运行')
+        future = asyncio.run_coroutine_threadsafe(
+            self.wait(email_info, sender, subject, timeout, since), self.loop
+        )
+        return future.result(timeout + 30)
+
+    def wake(self, email_id=None):
+        """有新邮件保存时唤醒后台协程，可以在任意线程中调用"""
+        if email_id is not None and email_id not in self.waiters:
+            return
+        if self.bound and self.wakeup is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        """后台协程：读取新保存的邮件并分发给等待者，定期为等待中的邮箱加入检查任务"""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            if not self.waiters:
+                # 没有等待者时不读取数据库，下一个等待者注册时重新取当前最大ID
+                self.last_mail_id = None
+                continue
+            try:
+                await self._poll()
+                for email_info, boosted_at in list(self.boosts.values()):
+                    if time.monotonic() - boosted_at >= self.boost_interval:
+                        await self._boost(email_info)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"读取新邮件失败: {str(e)}")
+
+    async def _poll(self):
+        """读取上次分发之后保存的邮件"""
+        if self.last_mail_id is None:
+            self.last_mail_id = await self.adb.get_max_mail_id()
+            return
+        upper_id = await self.adb.get_max_mail_id()
+        if upper_id <= self.last_mail_id:
+            return
+        self.stats['polls'] += 1
+        mails = await self.adb.get_mail_records_after(self.last_mail_id, upper_id, list(self.waiters))
+        self.last_mail_id = upper_id
+        for mail in mails:
+            matched = [waiter for waiter in self.waiters.get(mail['email_id'], ())
+                       if not waiter.future.done() and waiter.matches(mail)]
+            if not matched:
+                continue
+            # 每封邮件只查询一次验证码，所有匹配的等待者共用
+            result = dict(mail, codes=await self.adb.get_codes_for_mail(mail['id']))
+            for waiter in matched:
+                if not waiter.future.done():
+                    waiter.future.set_result(result)
+
+    async def _boost(self, email_info):
+        """为邮箱加入手动优先级的检查或定向搜索任务，间隔太短时跳过，已有排队或执行中的同类任务时由队列合并"""
+        email_id = email_info['id']
+        boost = self.boosts.get(email_id)
+        if boost is not None and time.monotonic() - boost[1] < self.boost_interval:
+            return
+        self.boosts[email_id] = (email_info, time.monotonic())
+        if self.email_processor is None:
+            return
+        try:
+            filters = {(waiter.sender, waiter.subject) for waiter in self.waiters.get(email_id, ())}
+            if len(filters) == 1 and any(next(iter(filters))):
+                # 所有等待者的条件相同时只在服务器上搜索匹配的邮件，不同步整个文件夹；
+                # 服务器只按日期比较，传入当天日期，同一天的重复提升与未完成的搜索任务合并
+                sender, subject = filters.pop()
+                await self.adb.run(self.email_processor.enqueue_search, email_info, sender, subject,
+                                   datetime.now().strftime('%Y-%m-%d'), 5)
+            else:
+                await self.adb.run(self.email_processor.enqueue_check, email_info)
+            self.stats['boosts'] += 1
+        except Exception as e:
+            logger.error(f"为等待中的邮箱 {email_id} 加入检查任务失败: {str(e)}")
+
+    def get_stats(self):
+        """返回等待者统计"""
+        return dict(self.stats, waiters=self.count, mailboxes=len(self.waiters), max_waiters=self.max_waiters)
@@ -0,0 +1,92 @@
+"""
+WebSocket主题订阅
+客户端通过subscribe/unsubscribe消息声明关心的主题，推送前按主题在服务端过滤，
+没有订阅者的消息不会被序列化。从未发送过订阅消息的连接接收全部消息，兼容旧客户端。
+
+主题格式:
+    account_list    邮箱列表级别的事件（删除、导入及导入进度、新邮件）
+    account:<id>    指定邮箱的检查进度和新邮件，account:* 表示所有邮箱
+    job:<id>        指定任务的进度
+"""
+
+import logging
+import re
+
+# 配置日志
+logger = logging.getLogger('websocket')
+
+TOPIC_PATTERN = re.compile(r'^(account_list|account:(\d+|\*)|job:\d+)$')
+
+# 影响邮箱列表的消息类型
+LIST_EVENTS = {'emails_deleted', 'emails_imported', 'email_added', 'new_mail', 'import_progress', 'import_result'}
+
+
+def message_topics(message):
+    """计算消息所属的主题，返回空集合表示不属于任何主题，发送给所有连接"""
+    topics = set()
+    if message.get('type') in LIST_EVENTS:
+        topics.add('account_list')
+    if message.get('email_id') is not None:
+        topics.add(f"account:{message['email_id']}")
+        topics.add('account:*')
+    if message.get('job_id') is not None:
+        topics.add(f"job:{message['job_id']}")
+    return topics
+
+
+class SubscriptionRegistry:
+    """记录每个连接订阅的主题"""
+
+    def __init__(self, max_topics=10000):
+        """初始化订阅表
+
+        Args:
+            max_topics: 单个连接最多订阅的主题数
+        """
+        self.max_topics = max_topics
+        self.subscriptions = {}  # websocket -> set(主题)
+        self.stats = {'delivered': 0, 'filtered': 0}
+
+    def subscribe(self, websocket, topics):
+        """订阅主题，返回 (当前订阅的主题, 无效的主题)"""
+        current = self.subscriptions.setdefault(websocket, set())
+        invalid = []
+        for topic in topics:
+            topic = str(topic)
+            if not TOPIC_PATTERN.match(topic):
+                invalid.append(topic)
+            elif topic not in current and len(current) < self.max_topics:
+                current.add(topic)
+        return current, invalid
+
+    def unsubscribe(self, websocket, topics):
+        """取消订阅，topics为空时取消全部主题，返回当前订阅的主题"""
+        current = self.subscriptions.setdefault(websocket, set())
+        if topics:
+            current.difference_update(str(topic) for topic in topics)
+        else:
+            current.clear()
+        return current
+
+    def remove(self, websocket):
+        """连接断开时清除订阅"""
+        self.subscriptions.pop(websocket, None)
+
+    def filter(self, websockets, message):
+        """从连接中筛选出应该收到该消息的连接"""
+        topics = message_topics(message)
+        recipients = []
+        for websocket in websockets:
+            subscribed = self.subscriptions.get(websocket)
+            if subscribed is None or not topics or not subscribed.isdisjoint(topics):
+                recipients.append(websocket)
+        self.stats['delivered'] += len(recipients)
+        self.stats['filtered'] += len(websockets) - len(recipients)
+        return recipients
+
+    def get_stats(self):
+        """获取订阅统计"""
+        stats = dict(self.stats)
+        stats['subscribers'] = len(self.subscriptions)
+        stats['topics'] = sum(len(topics) for topics in self.subscriptions.values())
+        return stats
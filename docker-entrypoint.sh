@@ -10,6 +10,13 @@ export WS_PORT="${WS_PORT:-8765}"
 export FRONTEND_PORT="${FRONTEND_PORT:-3000}"
 export JWT_SECRET_KEY="${JWT_SECRET_KEY:-huohuo_email_secret_key}"
 export TZ="${TZ:-Asia/Shanghai}"
+# 服务模式：dev 使用Flask开发服务器和独立的WebSocket端口，asgi 使用uvicorn在同一端口提供REST和WebSocket
+export SERVER_MODE="${SERVER_MODE:-dev}"
+export ASGI_WORKERS="${ASGI_WORKERS:-2}"
+if [ "$SERVER_MODE" = "asgi" ]; then
+    # WebSocket与REST共用端口，Caddy把 /ws 转发到同一端口
+    export WS_PORT="$FLASK_PORT"
+fi
 
 echo "花火邮箱助手正在启动..."
 echo "后端API地址: http://$HOST:$FLASK_PORT"
@@ -44,5 +51,22 @@ caddy run --config /app/Caddyfile &
 
 # 启动Python后端应用
 cd /app
+
+# 启动独立的邮件检查worker，API进程只负责入队
+WORKER_PROCESSES="${WORKER_PROCESSES:-0}"
+if [ "$WORKER_PROCESSES" -gt 0 ]; then
+    echo "启动 $WORKER_PROCESSES 个邮件检查worker..."
+    for i in $(seq 1 "$WORKER_PROCESSES"); do
+        python3 ./backend/worker.py &
+    done
+    export EMBEDDED_WORKER=false
+fi
+
 echo "启动后端服务..."
+if [ "$SERVER_MODE" = "asgi" ]; then
+    # 先在单个进程中完成数据库初始化和升级，避免多个worker同时建表
+    (cd ./backend && python3 -c "from database.db import Database; Database().close()")
+    echo "使用ASGI模式，worker进程数: $ASGI_WORKERS"
+    exec python3 -m uvicorn asgi:application --app-dir ./backend --host "$HOST" --port "$FLASK_PORT" --workers "$ASGI_WORKERS"
+fi
 exec python3 ./backend/app.py --host "$HOST" --port "$FLASK_PORT" --ws-port "$WS_PORT"
@@ -287,7 +287,7 @@ const apiMethods = {
         return api.post('/emails/batch_delete', { email_ids: emailIds });
       }
     },
-    import: (data) => api.post('/emails/import', data)
+    import: (data) => api.post('/emails/import', data).then(res => res.data)
   },
 
   // 工具方法
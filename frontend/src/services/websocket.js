@@ -15,13 +15,24 @@ const MessageTypes = {
   // 批量导入
   IMPORT_EMAILS: 'import_emails',       // 批量导入邮箱
 
+  // 增量同步和主题订阅
+  SYNC: 'sync',                         // 增量同步
+  SUBSCRIBE: 'subscribe',               // 订阅主题
+  UNSUBSCRIBE: 'unsubscribe',           // 取消订阅
+  SUBSCRIBED: 'subscribed',             // 当前订阅的主题
+
   // 响应消息
   EMAILS_LIST: 'emails_list',          // 邮箱列表
   CHECK_PROGRESS: 'check_progress',    // 检查进度
   EMAILS_IMPORTED: 'emails_imported',  // 邮箱已导入
+  IMPORT_STARTED: 'import_started',    // 导入任务已开始
+  IMPORT_PROGRESS: 'import_progress',  // 导入进度
+  IMPORT_RESULT: 'import_result',      // 导入结果
+  MAIL_IMPORT_RESULT: 'mail_import_result', // 邮件归档导入结果
   EMAILS_DELETED: 'emails_deleted',    // 邮箱已删除
   EMAIL_ADDED: 'email_added',          // 邮箱已添加
   MAIL_RECORDS: 'mail_records',        // 邮件记录
+  NEW_MAIL: 'new_mail',                // 收到新邮件
 
   // 通知消息
   INFO: 'info',                        // 信息通知
@@ -472,7 +483,8 @@ class WebSocketService {
       // 确保有mailType字段，默认为outlook
       const payload = {
         data: data.data,
-        mail_type: data.mailType || 'outlook'
+        mail_type: data.mailType || 'outlook',
+        verify: !!data.verify
       };
 
       return this.send(MessageTypes.IMPORT_EMAILS, payload);
@@ -2,6 +2,16 @@ import { defineStore } from 'pinia';
 import api from '@/services/api';
 import websocket from '@/services/websocket';
 
+// 确保每条邮件记录都有必要的字段
+const normalizeMailRecord = (record) => ({
+  id: record.id || Date.now() + Math.random().toString(36).substring(2, 10),
+  subject: record.subject || '(无主题)',
+  sender: record.sender || '(未知发件人)',
+  received_time: record.received_time || new Date().toISOString(),
+  content: record.content || '(无内容)',
+  folder: record.folder || 'INBOX'
+});
+
 export const useEmailsStore = defineStore('emails', {
   state: () => ({
     emails: [],
@@ -11,7 +21,13 @@ export const useEmailsStore = defineStore('emails', {
     processingEmails: {},
     currentMailRecords: [],
     currentEmailId: null,
-    isConnected: false
+    isConnected: false,
+    // 已同步到的变更序号，重连后凭它增量同步，为null时需要全量获取
+    syncCursor: null,
+    // 正在检查的邮箱，订阅它们的进度推送
+    watchedEmailIds: [],
+    // 已向服务器订阅的主题
+    subscribedTopics: []
   }),
 
   getters: {
@@ -43,7 +59,10 @@ export const useEmailsStore = defineStore('emails', {
       // 连接状态
       websocket.onConnect(() => {
         this.isConnected = true;
-        this.fetchEmails();
+        // 新连接上没有任何订阅，重新订阅当前关心的主题
+        this.subscribedTopics = [];
+        this.updateSubscriptions();
+        this.syncEmails();
       });
 
       websocket.onDisconnect(() => {
@@ -55,13 +74,16 @@ export const useEmailsStore = defineStore('emails', {
         console.log('接收到邮箱列表：', data);
         if (data && Array.isArray(data.data)) {
           this.emails = data.data || [];
+          if (data.cursor !== undefined) {
+            this.syncCursor = data.cursor;
+          }
         }
       });
 
       // 新增邮箱
       websocket.onMessage('email_added', (data) => {
         console.log('邮箱添加成功：', data);
-        this.fetchEmails();
+        this.syncEmails();
       });
 
       // 删除邮箱
@@ -75,7 +97,12 @@ export const useEmailsStore = defineStore('emails', {
 
       // 邮箱导入
       websocket.onMessage('emails_imported', () => {
-        this.fetchEmails();
+        this.syncEmails();
+      });
+
+      // 增量同步结果
+      websocket.onMessage('sync', (data) => {
+        this.applySync(data);
       });
 
       // 处理进度更新
@@ -85,31 +112,31 @@ export const useEmailsStore = defineStore('emails', {
 
         // 进度完成后刷新邮箱列表
         if (progress === 100) {
+          this.unwatchEmails([email_id]);
           // 延迟刷新，确保服务器已完成处理
           setTimeout(() => {
-            this.fetchEmails();
-            // 如果正在查看此邮箱的邮件，也刷新邮件列表
-            if (this.currentEmailId === email_id) {
-              this.fetchMailRecords(email_id);
-            }
+            // 增量同步会同时带回正在查看的邮箱的新邮件
+            this.syncEmails();
           }, 1000);
         }
       });
 
+      // 新邮件通知（实时检查和后台任务获取到新邮件时推送）
+      websocket.onMessage('new_mail', () => {
+        this.syncEmails();
+      });
+
+      // 邮件归档导入完成
+      websocket.onMessage('mail_import_result', () => {
+        this.syncEmails();
+      });
+
       // 邮件记录
       websocket.onMessage('mail_records', (data) => {
         if (data.email_id === this.currentEmailId) {
           // 添加数据验证和清理
           if (Array.isArray(data.data)) {
-            // 确保每条记录都有必要的字段
-            this.currentMailRecords = data.data.map(record => ({
-              id: record.id || Date.now() + Math.random().toString(36).substring(2, 10),
-              subject: record.subject || '(无主题)',
-              sender: record.sender || '(未知发件人)',
-              received_time: record.received_time || new Date().toISOString(),
-              content: record.content || '(无内容)',
-              folder: record.folder || 'INBOX'
-            }));
+            this.currentMailRecords = data.data.map(normalizeMailRecord);
           } else {
             this.currentMailRecords = [];
             console.error('收到的邮件记录数据不是数组格式:', data);
@@ -157,7 +184,11 @@ export const useEmailsStore = defineStore('emails', {
       try {
         console.log('导入邮箱：', importData);
         if (!websocket.isConnected) {
-          await api.emails.import(importData);
+          return await api.emails.import({
+            data: importData.data,
+            mail_type: importData.mailType || importData.mail_type,
+            verify: importData.verify
+          });
         } else {
           websocket.send('import_emails', importData);
         }
@@ -190,6 +221,111 @@ export const useEmailsStore = defineStore('emails', {
       }
     },
 
+    // 根据正在查看和正在检查的邮箱更新订阅，服务器只推送这些邮箱的进度
+    updateSubscriptions() {
+      if (!websocket.isConnected) {
+        return;
+      }
+      const wanted = new Set(['account_list']);
+      if (this.currentEmailId) {
+        wanted.add(`account:${this.currentEmailId}`);
+      }
+      this.watchedEmailIds.forEach(id => wanted.add(`account:${id}`));
+
+      const current = new Set(this.subscribedTopics);
+      const added = [...wanted].filter(topic => !current.has(topic));
+      const removed = [...current].filter(topic => !wanted.has(topic));
+      if (added.length > 0) {
+        websocket.send('subscribe', { topics: added });
+      }
+      if (removed.length > 0) {
+        websocket.send('unsubscribe', { topics: removed });
+      }
+      this.subscribedTopics = [...wanted];
+    },
+
+    watchEmails(emailIds) {
+      this.watchedEmailIds = [...new Set([...this.watchedEmailIds, ...emailIds])];
+      this.updateSubscriptions();
+    },
+
+    unwatchEmails(emailIds) {
+      this.watchedEmailIds = this.watchedEmailIds.filter(id => !emailIds.includes(id));
+      this.updateSubscriptions();
+    },
+
+    // 增量同步邮箱和当前查看的邮件记录，没有序号或未连接时全量获取
+    syncEmails() {
+      if (!websocket.isConnected || this.syncCursor === null) {
+        this.fetchEmails();
+        if (websocket.isConnected && this.currentEmailId) {
+          this.fetchMailRecords(this.currentEmailId);
+        }
+        return;
+      }
+      websocket.send('sync', {
+        cursor: this.syncCursor,
+        email_ids: this.currentEmailId ? [this.currentEmailId] : []
+      });
+    },
+
+    // 合并增量同步结果
+    applySync(data) {
+      if (!data) {
+        return;
+      }
+
+      // 序号已过期，回退到全量获取
+      if (data.reset) {
+        this.syncCursor = null;
+        this.syncEmails();
+        return;
+      }
+
+      const { emails, mail_records: mailRecords } = data;
+      if (emails) {
+        const deleted = new Set(emails.deleted || []);
+        const updated = new Map((emails.upserted || []).map(email => [email.id, email]));
+        let list = this.emails
+          .filter(email => !deleted.has(email.id))
+          .map(email => {
+            const fresh = updated.get(email.id);
+            if (fresh) {
+              updated.delete(email.id);
+              return { ...email, ...fresh };
+            }
+            return email;
+          });
+        // 新增的邮箱排在前面，与列表按创建时间倒序一致
+        list = [...updated.values(), ...list];
+        this.emails = list;
+        if (deleted.size > 0 && Array.isArray(this.selectedEmails)) {
+          this.selectedEmails = this.selectedEmails.filter(id => !deleted.has(id));
+        }
+      }
+
+      if (mailRecords && this.currentEmailId) {
+        const deleted = new Set(mailRecords.deleted || []);
+        const upserted = (mailRecords.upserted || [])
+          .filter(record => record.email_id === this.currentEmailId)
+          .map(normalizeMailRecord);
+        if (deleted.size > 0 || upserted.length > 0) {
+          const ids = new Set(upserted.map(record => record.id));
+          this.currentMailRecords = [
+            ...upserted,
+            ...this.currentMailRecords.filter(record => !deleted.has(record.id) && !ids.has(record.id))
+          ].sort((a, b) => String(b.received_time).localeCompare(String(a.received_time)));
+        }
+      }
+
+      this.syncCursor = data.cursor;
+
+      // 变更较多时分页返回，继续拉取剩余部分
+      if (data.has_more) {
+        this.syncEmails();
+      }
+    },
+
     // 删除单个邮箱
     async deleteEmail(emailId) {
       this.loading = true;
@@ -249,6 +385,7 @@ export const useEmailsStore = defineStore('emails', {
       try {
         // 使用api对象调用，确保使用正确的基础URL
         console.log(`检查邮箱 ID:${emailId}`);
+        this.watchEmails([emailId]);
         const response = await api.emails.check([emailId]);
 
         // 处理响应
@@ -281,6 +418,7 @@ export const useEmailsStore = defineStore('emails', {
       this.error = null;
 
       try {
+        this.watchEmails(emailIds);
         if (!websocket.isConnected) {
           await api.emails.check(emailIds);
         } else {
@@ -305,14 +443,7 @@ export const useEmailsStore = defineStore('emails', {
 
           // 确保返回数据是数组且每条记录格式正确
           if (Array.isArray(response)) {
-            this.currentMailRecords = response.map(record => ({
-              id: record.id || Date.now() + Math.random().toString(36).substring(2, 10),
-              subject: record.subject || '(无主题)',
-              sender: record.sender || '(未知发件人)',
-              received_time: record.received_time || new Date().toISOString(),
-              content: record.content || '(无内容)',
-              folder: record.folder || 'INBOX'
-            }));
+            this.currentMailRecords = response.map(normalizeMailRecord);
           } else {
             this.currentMailRecords = [];
             console.error('API返回的邮件记录数据不是数组格式:', response);
@@ -321,6 +452,7 @@ export const useEmailsStore = defineStore('emails', {
           this.currentEmailId = emailId;
         } else {
           this.currentEmailId = emailId;
+          this.updateSubscriptions();
           websocket.send('get_mail_records', { email_id: emailId });
         }
       } catch (error) {
@@ -374,6 +506,9 @@ export const useEmailsStore = defineStore('emails', {
       this.currentMailRecords = [];
       this.currentEmailId = null;
       this.isConnected = false;
+      this.syncCursor = null;
+      this.watchedEmailIds = [];
+      this.subscribedTopics = [];
     },
 
     // 更新邮箱